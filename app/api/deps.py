@@ -0,0 +1,54 @@
+import secrets
+from typing import Optional
+
+from fastapi import Depends, Header, HTTPException, Request
+
+from app.core.config import Settings, get_settings
+from app.core.container import ServiceContainer
+from app.core.diagnostics import LoopDiagnostics
+from app.services.delivery_tracker import DeliveryTracker
+from app.services.journal import Journal
+from app.services.meta_service import MetaService
+from app.services.shared_state import SharedState
+from app.services.webhook_dispatcher import WebhookDispatcher
+
+# Dependencias de FastAPI: cada endpoint pide solo lo que usa y el servicio se construye
+# (una vez por worker) la primera vez que alguien lo pide. Los tests pueden reemplazar
+# cualquiera con `app.dependency_overrides`.
+
+def get_services(request: Request) -> ServiceContainer:
+    """Contenedor de servicios del worker, creado en el lifespan de la app."""
+    return request.app.state.services
+
+def get_meta_service(services: ServiceContainer = Depends(get_services)) -> MetaService:
+    return services.meta_service
+
+def get_webhook_dispatcher(services: ServiceContainer = Depends(get_services)) -> WebhookDispatcher:
+    return services.webhook_dispatcher
+
+def get_webhook_route(services: ServiceContainer = Depends(get_services)):
+    """Resuelve la cola (y el tenant) de cada webhook según el número que recibió los mensajes."""
+    return services.dispatcher_for
+
+def get_shared_state(services: ServiceContainer = Depends(get_services)) -> SharedState:
+    return services.state
+
+def get_delivery_tracker(services: ServiceContainer = Depends(get_services)) -> DeliveryTracker:
+    return services.delivery_tracker
+
+def get_journal(services: ServiceContainer = Depends(get_services)) -> Optional[Journal]:
+    """Journal de webhooks aceptados; None si JOURNAL_ENABLED está desactivado."""
+    return services.journal
+
+def require_admin(
+    x_admin_token: Optional[str] = Header(None),
+    settings: Settings = Depends(get_settings),
+) -> None:
+    """Endpoints de administración: sin ADMIN_TOKEN configurado no existen; con él, exigen la cabecera."""
+    if not settings.ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if x_admin_token is None or not secrets.compare_digest(x_admin_token, settings.ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Token de administración inválido.")
+
+def get_diagnostics(services: ServiceContainer = Depends(get_services)) -> LoopDiagnostics:
+    return services.diagnostics
@@ -0,0 +1,113 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+from app.api.deps import get_diagnostics, get_services, require_admin
+from app.core.config import Settings, get_settings
+from app.core.container import ServiceContainer
+from app.core.diagnostics import LoopDiagnostics
+from app.services.tenants import DEFAULT_TENANT
+from typing import Literal, Optional
+import logging
+
+# Diagnóstico del event loop de este worker (con WORKERS > 1 cada petición cae en un proceso distinto)
+router = APIRouter(dependencies=[Depends(require_admin)])
+logger = logging.getLogger(__name__)
+
+@router.post("/profile")
+async def profile_event_loop(
+    seconds: float = Query(5.0, gt=0, description="Duración del muestreo"),
+    interval_ms: float = Query(5.0, ge=1, le=1000, description="Intervalo entre muestras"),
+    format: Literal["collapsed", "json"] = Query("collapsed"),
+    diagnostics: LoopDiagnostics = Depends(get_diagnostics),
+    settings: Settings = Depends(get_settings),
+):
+    """
+    Profiling por muestreo del hilo del event loop durante `seconds`. La respuesta llega al terminar.
+    `collapsed` devuelve una pila por línea con su número de muestras (entrada directa de flamegraph.pl,
+    speedscope o inferno); `json` agrega las funciones con más muestras.
+    """
+    if seconds > settings.ADMIN_PROFILE_MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"Máximo {settings.ADMIN_PROFILE_MAX_SECONDS} segundos.")
+    if diagnostics.profiling:
+        raise HTTPException(status_code=409, detail="Ya hay un profiling en curso.")
+    logger.info("Profiling del event loop iniciado (%.1f s, cada %.0f ms)", seconds, interval_ms)
+    profiler = await diagnostics.profile(seconds, interval_ms / 1000)
+    if format == "collapsed":
+        return PlainTextResponse(profiler.collapsed(), headers={"X-Profile-Samples": str(profiler.sample_count)})
+    return {
+        "samples": profiler.sample_count,
+        "duration_seconds": round(profiler.duration, 3),
+        "interval_ms": interval_ms,
+        "top": profiler.top_functions(),
+        "stacks": dict(profiler.samples.most_common()),
+    }
+
+@router.get("/loop/stalls")
+async def get_loop_stalls(diagnostics: LoopDiagnostics = Depends(get_diagnostics)):
+    """Bloqueos del event loop registrados desde que se activó la detección, con la pila de cada uno."""
+    if diagnostics.watchdog is None:
+        return {"enabled": False}
+    return {"enabled": True, **diagnostics.watchdog.report()}
+
+@router.post("/loop/stalls")
+async def enable_loop_stall_detection(
+    threshold_ms: Optional[float] = Query(None, ge=1, description="Por defecto LOOP_STALL_THRESHOLD_SECONDS"),
+    diagnostics: LoopDiagnostics = Depends(get_diagnostics),
+    settings: Settings = Depends(get_settings),
+):
+    """Activa (o reinicia con otro umbral) la detección de callbacks que bloquean el loop."""
+    threshold = threshold_ms / 1000 if threshold_ms is not None else settings.LOOP_STALL_THRESHOLD_SECONDS
+    await diagnostics.enable_stall_detection(threshold)
+    return {"enabled": True, "threshold_ms": threshold * 1000}
+
+@router.delete("/loop/stalls")
+async def disable_loop_stall_detection(diagnostics: LoopDiagnostics = Depends(get_diagnostics)):
+    await diagnostics.disable_stall_detection()
+    return {"enabled": False}
+
+@router.get("/tasks")
+async def get_pending_tasks(
+    limit: int = Query(20, ge=1, le=1000, description="Tareas más antiguas a listar"),
+    diagnostics: LoopDiagnostics = Depends(get_diagnostics),
+):
+    """
+    Tareas pendientes del loop agrupadas por corrutina y las más antiguas con dónde están esperando.
+    Las edades solo se conocen para las tareas creadas con el registro de tareas activo.
+    """
+    return diagnostics.tasks(limit)
+
+@router.post("/tasks/tracking")
+async def enable_task_tracking(diagnostics: LoopDiagnostics = Depends(get_diagnostics)):
+    diagnostics.enable_task_tracking()
+    return {"tracking": True}
+
+@router.delete("/tasks/tracking")
+async def disable_task_tracking(diagnostics: LoopDiagnostics = Depends(get_diagnostics)):
+    diagnostics.disable_task_tracking()
+    return {"tracking": False}
+
+@router.get("/tenants")
+async def get_tenants(services: ServiceContainer = Depends(get_services)):
+    """Tenants configurados y, para los que ya recibieron mensajes, el estado de su cola, LLM y pool HTTP."""
+    tenant_router = services.tenant_router
+    if tenant_router is None:
+        return {"enabled": False}
+    return {"enabled": True, **tenant_router.stats(), "tenants": tenant_router.tenant_stats()}
+
+@router.get("/outbound/dead-letters")
+async def get_dead_letters(
+    limit: int = Query(100, ge=1, le=10000, description="Envíos fallidos más recientes por tenant"),
+    services: ServiceContainer = Depends(get_services),
+):
+    """
+    Envíos salientes que agotaron sus reintentos o no eran reintentables (dead-letter de este worker),
+    por tenant y del más reciente al más antiguo, con el payload, el motivo y el código HTTP.
+    """
+    schedulers = {DEFAULT_TENANT: services.outbound}
+    if services.tenant_router is not None:
+        schedulers.update({runtime.tenant.tenant_id: runtime.outbound for runtime in services.tenant_router.runtimes.values()})
+    return {
+        "dead_letters": {
+            tenant_id: scheduler.dead_letter_list()[::-1][:limit]
+            for tenant_id, scheduler in schedulers.items()
+        },
+    }
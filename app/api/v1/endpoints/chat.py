@@ -1,18 +1,32 @@
-from fastapi import APIRouter, HTTPException
+from contextlib import AsyncExitStack
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from app.api.deps import get_meta_service, get_shared_state, require_admin
+from app.core.config import Settings, get_settings
 from app.models.chat import ChatMessageRequest, ChatMessageResponse
-from app.services.meta_service import meta_service
+from app.services.broadcast import CampaignCheckpoint, checkpoint_path, iter_file_lines, parse_csv, parse_jsonl
+from app.services.meta_service import MetaService
+from app.services.shared_state import LockNotAcquired, SharedState
+from app.utils.logging import sensitive
+from typing import Literal, Optional
+import asyncio
+import json
 import logging
+import os
+import tempfile
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+UPLOAD_WRITE_BYTES = 1 << 20 # La subida se escribe a disco en un hilo, por bloques de hasta 1 MiB
+
 @router.post("/send_message", response_model=ChatMessageResponse)
-async def send_chat_message(request: ChatMessageRequest):
+async def send_chat_message(request: ChatMessageRequest, meta_service: MetaService = Depends(get_meta_service)):
     """
     Endpoint de ejemplo para interactuar directamente con el LLM (sin pasar por Meta).
     Útil para pruebas.
     """
-    logger.info(f"Mensaje recibido en /send_message para user {request.user_id}: {request.message}")
+    logger.info("Mensaje recibido en /send_message para user %s: %s", request.user_id, sensitive(request.message))
     try:
         # reply = await llm_service.generate_response(request.message, request.user_id)
         await meta_service.send_whatsapp_message(
@@ -20,5 +34,84 @@ async def send_chat_message(request: ChatMessageRequest):
         )
         return ChatMessageResponse(user_id=request.user_id, reply=request.message)
     except Exception as e:
-        logger.error(f"Error en /send_message: {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail="Error al procesar el mensaje.")
\ No newline at end of file
+        logger.error("Error en /send_message: %s", e, exc_info=True)
+        raise HTTPException(status_code=500, detail="Error al procesar el mensaje.")
+
+@router.post("/broadcast", dependencies=[Depends(require_admin)])
+async def broadcast_messages(
+    request: Request,
+    campaign_id: Optional[str] = Query(None, description="Permite reanudar la campaña si se interrumpe"),
+    format: Optional[Literal["jsonl", "csv"]] = Query(None, description="Por defecto se deduce del Content-Type"),
+    max_in_flight: Optional[int] = Query(None, ge=1, le=200),
+    meta_service: MetaService = Depends(get_meta_service),
+    state: SharedState = Depends(get_shared_state),
+    settings: Settings = Depends(get_settings),
+):
+    """
+    Envío masivo. El cuerpo es un archivo JSONL (`{"to": ..., "text": ...}` o `{"to": ..., "template": {...}}`
+    por línea) o CSV con cabecera (`to,text` o `to,template,language`).
+    La respuesta es NDJSON con un resultado por destinatario, emitido a medida que termina cada envío.
+    Una campaña con `campaign_id` se ejecuta una sola vez a la vez en todos los workers (409 si ya está en curso).
+    Requiere la cabecera X-Admin-Token (como `/admin`).
+    """
+    if format is None:
+        format = "csv" if "csv" in request.headers.get("content-type", "") else "jsonl"
+
+    checkpoint = None
+    campaign_lock = AsyncExitStack()
+    if campaign_id is not None:
+        try:
+            path = checkpoint_path(settings.BROADCAST_CHECKPOINT_DIR, campaign_id)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        # Dos ejecuciones simultáneas de la misma campaña (en este u otro worker) duplicarían envíos
+        try:
+            await campaign_lock.enter_async_context(
+                state.lock(f"campaign:{campaign_id}", ttl=settings.BROADCAST_LOCK_TTL_SECONDS, timeout=0)
+            )
+        except LockNotAcquired:
+            raise HTTPException(status_code=409, detail="La campaña ya está en curso.")
+        checkpoint = CampaignCheckpoint(path)
+
+    # El archivo se vuelca a disco por bloques antes de responder: la subida nunca se carga entera
+    # en memoria y el cuerpo queda consumido antes de que empiece la respuesta en streaming.
+    # Las escrituras van a un hilo: un disco lento no bloquea el event loop.
+    try:
+        with tempfile.NamedTemporaryFile(prefix="broadcast-", suffix=f".{format}", delete=False) as upload:
+            upload_path = upload.name
+            pending = bytearray()
+            async for block in request.stream():
+                pending += block
+                if len(pending) >= UPLOAD_WRITE_BYTES:
+                    await asyncio.to_thread(upload.write, bytes(pending))
+                    pending.clear()
+            if pending:
+                await asyncio.to_thread(upload.write, bytes(pending))
+    except BaseException:
+        if checkpoint is not None:
+            checkpoint.close()
+        await campaign_lock.aclose()
+        raise
+
+    recipients = parse_csv(upload_path) if format == "csv" else parse_jsonl(iter_file_lines(upload_path))
+    logger.info("Campaña %s iniciada (%s, %d bytes)", campaign_id or "(sin id)", format, os.path.getsize(upload_path))
+
+    async def results():
+        counts = {}
+        try:
+            async for outcome in meta_service.send_bulk(
+                recipients,
+                max_in_flight=max_in_flight or settings.BROADCAST_MAX_IN_FLIGHT,
+                checkpoint=checkpoint,
+            ):
+                counts[outcome["status"]] = counts.get(outcome["status"], 0) + 1
+                yield json.dumps(outcome, ensure_ascii=False) + "\n"
+        finally:
+            await recipients.aclose()
+            os.remove(upload_path)
+            if checkpoint is not None:
+                checkpoint.close()
+            await campaign_lock.aclose()
+            logger.info("Campaña %s finalizada: %s", campaign_id or "(sin id)", counts)
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
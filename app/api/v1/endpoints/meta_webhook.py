@@ -1,8 +1,17 @@
-from fastapi import APIRouter, Request, Response, HTTPException, Query
-from app.core.config import settings
+from typing import Optional
+from fastapi import APIRouter, Depends, Request, Response, HTTPException, Query
+from pydantic import ValidationError
+from pydantic_core import from_json
+from app.api.deps import get_delivery_tracker, get_journal, get_webhook_route
+from app.core.config import Settings, get_settings
+from app.core.metrics import metrics
 from app.models.meta import MetaWebhookRequest, MetaWebhookChallengeQuery
-from app.services.meta_service import meta_service
+from app.services.delivery_tracker import DeliveryTracker
+from app.services.journal import INBOUND, Journal, JournaledWebhook
+from app.services.tenants import tenant_rejected, tenant_webhooks
+from app.utils.logging import sensitive
 import logging
+import re
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
@@ -13,6 +22,7 @@ async def verify_webhook(
     hub_mode: str = Query(..., alias="hub.mode"),
     hub_challenge: str = Query(..., alias="hub.challenge"),
     hub_verify_token: str = Query(..., alias="hub.verify_token"),
+    settings: Settings = Depends(get_settings),
 ):
     """
     Endpoint para la verificación del Webhook de Meta.
@@ -21,47 +31,85 @@ async def verify_webhook(
     # Validar con Pydantic model si se prefiere, aunque Query() ya hace algo de validación
     # query_params = MetaWebhookChallengeQuery(hub_mode=hub_mode, hub_challenge=hub_challenge, hub_verify_token=hub_verify_token)
 
-    if hub_mode == "subscribe" and hub_verify_token == settings.META_VERIFY_TOKEN:
+    if hub_mode == "subscribe" and hub_verify_token == settings.WHATSAPP_VERIFY_TOKEN:
         logger.info("Webhook verificado exitosamente.")
         return Response(content=hub_challenge, media_type="text/plain")
     else:
-        logger.warning(f"Fallo en la verificación del webhook. Modo: {hub_mode}, Token recibido: {hub_verify_token}")
+        logger.warning("Fallo en la verificación del webhook. Modo: %s", hub_mode) # El token recibido no se registra
         raise HTTPException(status_code=403, detail="Token de verificación inválido o modo incorrecto.")
 
+# Los payloads sin la clave "messages" (p. ej. solo `statuses` sent/delivered/read, la mayor
+# parte del tráfico) no tienen nada que responder: solo se comprueba que el JSON esté bien
+# formado (pydantic-core, sin construir modelos) y se confirman.
+# Se busca la clave seguida de ':' porque `"field": "messages"` aparece en todos los payloads.
+_MESSAGES_KEY = re.compile(rb'"messages"\s*:')
+# Los estados se entregan crudos al DeliveryTracker, que los parsea por lotes fuera de la petición
+_STATUSES_KEY = re.compile(rb'"statuses"\s*:')
+
 @router.post("/webhook")
-async def receive_webhook(request: Request):
+async def receive_webhook(
+    request: Request,
+    route = Depends(get_webhook_route),
+    delivery_tracker: DeliveryTracker = Depends(get_delivery_tracker),
+    journal: Optional[Journal] = Depends(get_journal),
+):
     """
     Endpoint para recibir notificaciones de Meta (ej. nuevos mensajes).
     """
-    try:
-        payload_bytes = await request.body()
-        payload_str = payload_bytes.decode('utf-8') # Para logging
-        logger.debug(f"Payload crudo recibido en /webhook POST: {payload_str}")
+    payload_bytes = await request.body()
+    # Formateo perezoso: el payload solo se convierte a texto si el nivel DEBUG está activo
+    logger.debug("Payload crudo recibido en /webhook POST: %s", sensitive(payload_bytes))
+
+    has_statuses = _STATUSES_KEY.search(payload_bytes) is not None
+    if not _MESSAGES_KEY.search(payload_bytes):
+        try:
+            from_json(payload_bytes)
+        except ValueError as e:
+            logger.error("Payload del webhook con JSON inválido: %s", e)
+            raise HTTPException(status_code=400, detail="Payload inválido: JSON mal formado")
+        if has_statuses:
+            delivery_tracker.submit(payload_bytes)
+        return Response(status_code=200, content="EVENT_RECEIVED")
 
-        # Validar y parsear con Pydantic
-        # Puede ser útil usar un try-except aquí si la estructura del payload varía mucho
-        # o si Meta envía eventos que no mapeas completamente en tus modelos.
-        # Por ahora, asumimos que MetaService manejará las variaciones internas.
-        payload_json = await request.json()
-        # validated_payload = MetaWebhookRequest(**payload_json) # Opcional si MetaService lo hace
+    # Un único parseo: bytes -> modelos tipados (validación en pydantic-core, sin dict intermedio)
+    try:
+        with metrics.stage("webhook_parse"):
+            payload = MetaWebhookRequest.model_validate_json(payload_bytes)
+    except ValidationError as e:
+        if any(error["type"] == "json_invalid" for error in e.errors()):
+            logger.error("Payload del webhook con JSON inválido: %s", e)
+            raise HTTPException(status_code=400, detail="Payload inválido: JSON mal formado")
+        # JSON válido pero con una estructura que no modelamos: se confirma para que Meta no reintente
+        logger.warning("Payload del webhook con estructura no soportada, ignorado: %s", e)
+        if has_statuses:
+            delivery_tracker.submit(payload_bytes)
+        return Response(status_code=200, content="EVENT_RECEIVED")
+    if has_statuses:
+        delivery_tracker.submit(payload_bytes)
 
-    except Exception as e:
-        logger.error(f"Error al leer/parsear el payload del webhook: {e}", exc_info=True)
-        raise HTTPException(status_code=400, detail=f"Payload inválido: {e}")
+    # Cada número de negocio (tenant) tiene su propia cola: uno con mucho tráfico no llena la de los demás
+    dispatcher, tenant_id = await route(payload)
+    if dispatcher is None:
+        # Número sin tenant configurado: se confirma para que Meta no reintente algo que nadie va a responder
+        logger.warning("Webhook para un número sin tenant configurado, ignorado.", extra={"event": "webhook_unknown_tenant"})
+        return Response(status_code=200, content="EVENT_RECEIVED")
 
-    # Procesar el mensaje en segundo plano para responder rápidamente a Meta
-    # FastAPI ejecuta las funciones `async def` en un event loop,
-    # así que `await meta_service.process_webhook_message` no bloqueará otras requests,
-    # pero sí mantendrá esta request abierta hasta que termine.
-    # Para tareas muy largas, se podría usar BackgroundTasks.
-    # from fastapi import BackgroundTasks
-    # async def receive_webhook(request: Request, background_tasks: BackgroundTasks):
-    #    ...
-    #    background_tasks.add_task(meta_service.process_webhook_message, payload_json)
-    # Pero para un chatbot, la respuesta síncrona (dentro del mismo ciclo de request/response) es usualmente preferible
-    # siempre que el LLM y otras llamadas no tarden demasiado.
+    # El procesamiento (LLM + envío de la respuesta) ocurre en los workers del dispatcher,
+    # así Meta recibe el 200 de inmediato y no reintenta la entrega por timeout.
+    item = payload
+    if journal is not None:
+        # Antes del 200: si el proceso muere sin responder, el mensaje se reenvía al arrancar.
+        # El fsync se comparte con los demás webhooks del mismo lote (group commit)
+        with metrics.stage("webhook_journal"):
+            entry_id = await journal.append(INBOUND, payload_bytes.decode("utf-8"))
+        item = JournaledWebhook(payload, entry_id)
+    if not dispatcher.submit(item):
+        # Cola llena con política 'reject': devolver 503 para que Meta reintente más tarde
+        if journal is not None:
+            journal.complete(entry_id)
+        tenant_rejected.labels(tenant_id).inc()
+        raise HTTPException(status_code=503, detail="Cola de procesamiento llena.")
 
-    logger.info("Payload del webhook recibido, delegando a MetaService.")
-    await meta_service.process_webhook_message(payload_json)
-    
-    return Response(status_code=200, content="EVENT_RECEIVED")
\ No newline at end of file
+    tenant_webhooks.labels(tenant_id).inc()
+    logger.info("Payload del webhook recibido, encolado para MetaService.", extra={"event": "webhook_enqueued", "tenant": tenant_id})
+    return Response(status_code=200, content="EVENT_RECEIVED")
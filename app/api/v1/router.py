@@ -1,6 +1,7 @@
 from fastapi import APIRouter
-from app.api.v1.endpoints import meta_webhook, chat
+from app.api.v1.endpoints import admin, meta_webhook, chat
 
 api_router_v1 = APIRouter()
 api_router_v1.include_router(meta_webhook.router, prefix="/meta", tags=["Meta Webhook"])
-api_router_v1.include_router(chat.router, prefix="/chat", tags=["Direct Chat (Test)"])
\ No newline at end of file
+api_router_v1.include_router(chat.router, prefix="/chat", tags=["Direct Chat (Test)"])
+api_router_v1.include_router(admin.router, prefix="/admin", tags=["Admin"])
\ No newline at end of file
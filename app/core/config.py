@@ -1,9 +1,23 @@
+from functools import lru_cache
+from typing import Any, Literal, Optional
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class Settings(BaseSettings):
     APP_NAME: str = "WhatsApp Bot Microservice"
     API_V1_STR: str = "/api/v1"
 
+    # Modo de ejecución (python -m app.main): en producción varios procesos, sin recarga automática
+    HOST: str = "0.0.0.0"
+    PORT: int = 8000
+    WORKERS: int = 1 # Procesos de uvicorn; los límites de envío y de Groq se reparten entre ellos
+    RELOAD: bool = False # Solo desarrollo (incompatible con WORKERS > 1)
+    SERVICES_WARMUP: bool = True # Construir los servicios en segundo plano tras el arranque (si no, en la primera petición)
+
+    # Estado compartido (deduplicación, caché de respuestas, locks): "memory" es por proceso,
+    # "sqlite" lo comparten todos los workers de la máquina
+    STATE_BACKEND: Literal["memory", "sqlite"] = "memory"
+    STATE_SQLITE_PATH: str = "shared_state.sqlite3"
+
     WHATSAPP_ACCESS_TOKEN: str
     WHATSAPP_VERIFY_TOKEN: str
     WHATSAPP_PHONE_NUMBER_ID: str
@@ -16,7 +30,186 @@ class Settings(BaseSettings):
     # QDRANT_API_KEY: str | None = None # Para futura integración
 
     LOG_LEVEL: str
+    # Logging: escritura en un hilo aparte (QueueHandler/QueueListener), JSON y redacción de datos personales
+    LOG_FORMAT: Literal["json", "text"] = "json"
+    LOG_REDACT: bool = True # Enmascara teléfonos y omite el texto de los mensajes
+    LOG_SAMPLE_RATES: str = "" # Muestreo de eventos INFO frecuentes, p. ej. "message_received=0.1,message_sent=0.1"
+    LOG_QUEUE_MAX_SIZE: int = 10000 # Registros en cola; por encima se descartan en lugar de bloquear
+
+    # Cliente HTTP compartido hacia la Graph API de Meta
+    HTTP_MAX_CONNECTIONS: int = 100
+    HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    HTTP_KEEPALIVE_EXPIRY: float = 30.0 # Segundos que una conexión ociosa se mantiene abierta
+    HTTP2_ENABLED: bool = False # Requiere el paquete `h2` (pip install "httpx[http2]")
+    HTTP_CONNECT_TIMEOUT: float = 5.0
+    HTTP_READ_TIMEOUT: float = 15.0
+    HTTP_WRITE_TIMEOUT: float = 5.0
+    HTTP_POOL_TIMEOUT: float = 5.0 # Espera máxima por una conexión libre del pool
+
+    # Cola de despacho de webhooks (se responde a Meta antes de procesar)
+    WEBHOOK_WORKERS: int = 4
+    WEBHOOK_QUEUE_MAX_SIZE: int = 1000
+    WEBHOOK_QUEUE_OVERFLOW_POLICY: Literal["reject", "drop_oldest"] = "reject"
+    WEBHOOK_DRAIN_TIMEOUT: float = 10.0 # Segundos para vaciar la cola al apagar
+
+    # Planificación por conversación (orden estricto por usuario, paralelismo entre usuarios)
+    CONVERSATION_MAX_CONCURRENCY: int = 8
+    CONVERSATION_MERGE_PENDING: bool = False # Agrupar en una sola llamada al LLM los mensajes en espera
+    CONVERSATION_MAX_MERGE: int = 5
+
+    # Deduplicación de webhooks por id de mensaje de WhatsApp
+    DEDUP_BACKEND: Optional[Literal["memory", "sqlite"]] = None # Por defecto usa STATE_BACKEND
+    DEDUP_TTL_SECONDS: float = 86400.0
+    DEDUP_MAX_ENTRIES: int = 100_000 # Solo backend en memoria
+    DEDUP_SQLITE_PATH: str = "dedup.sqlite3"
+
+    # Caché de respuestas del LLM (preguntas frecuentes)
+    RESPONSE_CACHE_ENABLED: bool = True
+    RESPONSE_CACHE_TTL_SECONDS: float = 3600.0
+    RESPONSE_CACHE_MAX_ENTRIES: int = 1000
+    RESPONSE_CACHE_MAX_BYTES: int = 5_000_000
+    RESPONSE_CACHE_SEMANTIC_ENABLED: bool = False # Búsqueda por similitud de embeddings
+    RESPONSE_CACHE_SIMILARITY_THRESHOLD: float = 0.9
+    RESPONSE_CACHE_MAX_PROMPT_CHARS: int = 200 # Mensajes más largos no se cachean
+    RESPONSE_CACHE_MIN_STANDALONE_WORDS: int = 4 # Con historial, mensajes más cortos se tratan como seguimiento
+
+    # Llamadas a Groq
+    LLM_MAX_CONCURRENCY: int = 16 # Peticiones a Groq en curso como máximo (el resto espera en cola FIFO)
+    LLM_COALESCING_ENABLED: bool = True # Preguntas idénticas simultáneas comparten una sola llamada
+
+    # Enrutamiento de modelos: GROQ_MODEL es el principal; fallback, circuit breaker y hedging
+    LLM_FALLBACK_MODELS: str = "" # Alternativas en orden, separadas por coma
+    LLM_SHORT_MESSAGE_MODEL: Optional[str] = None # Modelo más rápido/barato para mensajes cortos
+    LLM_SHORT_MESSAGE_MAX_CHARS: int = 60
+    LLM_REQUEST_TIMEOUT_SECONDS: float = 10.0 # Por intento; al vencer se pasa al siguiente modelo
+    LLM_BREAKER_FAILURE_RATE: float = 0.5 # Tasa de errores en la ventana que abre el breaker
+    LLM_BREAKER_SLOW_CALL_SECONDS: float = 5.0
+    LLM_BREAKER_SLOW_CALL_RATE: float = 0.8 # Tasa de llamadas lentas que abre el breaker
+    LLM_BREAKER_WINDOW: int = 20 # Últimas llamadas consideradas por modelo
+    LLM_BREAKER_MIN_CALLS: int = 5
+    LLM_BREAKER_OPEN_SECONDS: float = 30.0 # Tiempo abierto antes de la llamada de prueba (half-open)
+    LLM_HEDGE_ENABLED: bool = True # Llamada de respaldo al siguiente modelo si la primera se demora
+    LLM_HEDGE_PERCENTILE: float = 0.95 # Percentil de latencia del modelo que dispara el respaldo
+    LLM_HEDGE_MIN_DELAY_SECONDS: float = 0.5
+    LLM_HEDGE_INITIAL_DELAY_SECONDS: float = 2.0 # Mientras no hay suficientes muestras de latencia
+
+    # Presupuesto del prompt (tokens estimados localmente) y de la respuesta
+    LLM_SYSTEM_PROMPT: str = "Eres un asistente virtual amigable y útil para WhatsApp." # Prefijo fijo de cada prompt
+    LLM_CONTEXT_WINDOW: int = 8192 # Ventana del modelo (entrada + salida)
+    LLM_MAX_INPUT_TOKENS: int = 3072 # System prompt + historial + contexto RAG + pregunta
+    LLM_MAX_USER_TOKENS: int = 1024 # Mensajes más largos se recortan conservando inicio y final
+    LLM_MAX_CONTEXT_TOKENS: int = 1024 # Contexto RAG incluido como máximo
+    LLM_MAX_OUTPUT_TOKENS: int = 512 # Tope de `max_tokens` de la respuesta
+    LLM_MIN_OUTPUT_TOKENS: int = 64
+    LLM_USAGE_HISTORY: int = 1000 # Registros de uso por petición que se conservan para ajustar presupuestos
+
+    # Streaming de respuestas: se envía cada oración/párrafo como un mensaje apenas está lista
+    LLM_STREAMING_ENABLED: bool = False
+    LLM_STREAM_MIN_CHUNK_CHARS: int = 120
+    LLM_STREAM_MAX_CHUNKS: int = 4 # Máximo de mensajes de WhatsApp por respuesta
+
+    # Adjuntos entrantes (imagen, audio, documento): descarga por fragmentos, caché por SHA-256 y procesadores
+    MEDIA_ENABLED: bool = False # Si no, los mensajes que no son de texto se ignoran
+    MEDIA_CACHE_DIR: str = "media_cache"
+    MEDIA_CACHE_MAX_BYTES: int = 512 * 1024 * 1024 # Al superarlo se borran los archivos usados hace más tiempo
+    MEDIA_MAX_BYTES: int = 16 * 1024 * 1024 # Adjuntos más grandes no se descargan (o se corta la descarga)
+    MEDIA_CHUNK_SIZE: int = 64 * 1024
+    MEDIA_MAX_CONCURRENCY: int = 4 # Descargas simultáneas
+    MEDIA_EXECUTOR: Literal["thread", "process"] = "thread" # Pool donde corren los procesadores
+    MEDIA_WORKERS: int = 2
+    MEDIA_PROCESSORS: str = "" # Procesadores extra (paquete.modulo.Clase, separados por coma), antes de los por defecto
+
+    # Memoria de conversación (historial por usuario enviado al LLM)
+    MEMORY_ENABLED: bool = True
+    MEMORY_BACKEND: Literal["memory", "sqlite"] = "memory"
+    MEMORY_SQLITE_PATH: str = "conversations.sqlite3"
+    MEMORY_TOKEN_BUDGET: int = 1024 # Tokens de historial incluidos en cada prompt
+    MEMORY_MAX_TURNS: int = 20 # Turnos guardados por conversación; los anteriores se resumen
+    MEMORY_MAX_CONVERSATIONS: int = 10_000 # Solo backend en memoria (desalojo LRU)
+    MEMORY_IDLE_TTL_SECONDS: float = 86400.0 # Solo backend en memoria
+    MEMORY_SUMMARY_MAX_CHARS: int = 600
+    MEMORY_MAX_TURN_CHARS: int = 2000 # Texto guardado por turno; un mensaje más largo se recorta
+    MEMORY_MAX_CONVERSATION_BYTES: int = 32_000 # Texto de los turnos guardados por conversación; lo anterior se resume
+
+    # Base de conocimientos (RAG)
+    RAG_BACKEND: Literal["none", "local"] = "none"
+    RAG_INDEX_DIR: Optional[str] = None # Índice local en disco (se abre con memory-map)
+    RAG_EMBEDDING_DIMENSIONS: int = 256
+    RAG_CHUNK_SIZE: int = 500
+    RAG_CHUNK_OVERLAP: int = 50
+    RAG_TIMEOUT_SECONDS: float = 0.3 # Presupuesto de latencia: si se excede, se responde sin contexto
+
+    # Estados de entrega (sent/delivered/read/failed): ruta ligera, agregación por lotes
+    DELIVERY_BACKEND: Literal["memory", "sqlite"] = "memory" # "sqlite" vuelca la tabla de estados a disco
+    DELIVERY_SQLITE_PATH: str = "delivery_states.sqlite3"
+    DELIVERY_BATCH_SIZE: int = 500 # Payloads procesados por lote
+    DELIVERY_FLUSH_INTERVAL_SECONDS: float = 1.0
+    DELIVERY_MAX_PENDING: int = 50_000 # Payloads en espera; por encima se descartan los más antiguos
+    DELIVERY_MAX_ENTRIES: int = 100_000 # Mensajes en la tabla en memoria (desalojo LRU)
+
+    # Endpoints de administración (/api/v1/admin): diagnóstico del event loop. Sin token no existen (404)
+    ADMIN_TOKEN: Optional[str] = None # Se envía en la cabecera X-Admin-Token
+    ADMIN_PROFILE_MAX_SECONDS: float = 60.0 # Duración máxima de un profiling por muestreo
+    LOOP_STALL_THRESHOLD_SECONDS: float = 0.1 # Umbral por defecto de la detección de bloqueos del loop
+    LOOP_STALL_MAX_RECORDS: int = 100 # Bloqueos guardados (con su pila); se descartan los más antiguos
+
+    # Varios números de negocio en un despliegue: tenants indexados por phone_number_id (ver tenants.example.json).
+    # Los webhooks de WHATSAPP_PHONE_NUMBER_ID (o de cualquier número, sin archivo) usan los servicios de Settings
+    TENANTS_FILE: Optional[str] = None
+    TENANTS_RELOAD_INTERVAL_SECONDS: float = 5.0 # Cada cuánto se revisa si el archivo cambió
+
+    # Respuestas sin LLM (intenciones frecuentes: saludos, agradecimientos, horarios)
+    INTENTS_FILE: Optional[str] = None # JSON con las reglas (ver intents.example.json); sin archivo todo va al LLM
+    INTENTS_RELOAD_INTERVAL_SECONDS: float = 5.0 # Cada cuánto se revisa si el archivo cambió
+    INTENTS_MAX_WORDS: int = 8 # Mensajes más largos van al LLM (salvo `max_words` propio de la intención)
+
+    # Journal local de webhooks aceptados y envíos (recuperación tras una caída y replay offline)
+    JOURNAL_ENABLED: bool = False
+    JOURNAL_DIR: str = "journal" # Con WORKERS > 1, cada proceso toma (con flock) un subdirectorio worker-N
+    JOURNAL_COMMIT_INTERVAL_SECONDS: float = 0.002 # Ventana de group commit: un fsync por lote
+    JOURNAL_MAX_BATCH: int = 512 # Registros por lote como máximo
+    JOURNAL_SEGMENT_MAX_BYTES: int = 16 * 1024 * 1024 # Tamaño al que se rota el segmento
+    JOURNAL_RETAIN_SEGMENTS: int = 4 # Segmentos terminados que se conservan para el replay
+    JOURNAL_FSYNC: bool = True # Sin fsync un corte de energía puede perder el último lote
+
+    # Envíos salientes: ritmo (token bucket) y reintentos
+    OUTBOUND_PHONE_RATE: float = 80.0 # Mensajes/segundo por phone number ID
+    OUTBOUND_PHONE_BURST: float = 80.0
+    OUTBOUND_RECIPIENT_RATE: float = 0.5 # Mensajes/segundo por destinatario
+    OUTBOUND_RECIPIENT_BURST: float = 10.0
+    OUTBOUND_MAX_RETRIES: int = 3
+    OUTBOUND_BASE_BACKOFF: float = 0.5
+    OUTBOUND_MAX_BACKOFF: float = 30.0
+    OUTBOUND_MAX_PENDING_RETRIES: int = 1000 # Reintentos en espera; por encima se descarta a dead-letter
+    OUTBOUND_DEAD_LETTER_SIZE: int = 1000
+
+    # Envíos masivos (campañas)
+    BROADCAST_MAX_IN_FLIGHT: int = 20 # Envíos concurrentes por campaña
+    BROADCAST_CHECKPOINT_DIR: str = "broadcast_checkpoints" # Un archivo por campaign_id para reanudar
+    BROADCAST_LOCK_TTL_SECONDS: float = 3600.0 # Vigencia del lock de campaña si el worker muere sin liberarlo
 
     model_config = SettingsConfigDict(env_file=".env", extra='ignore')
 
-settings = Settings()
\ No newline at end of file
+@lru_cache
+def get_settings() -> Settings:
+    """
+    Settings del proceso, construidas la primera vez que se piden (y no al importar el módulo).
+    Es también la dependencia de FastAPI: los tests la reemplazan con `app.dependency_overrides`.
+    """
+    return Settings()
+
+class _SettingsProxy:
+    """
+    `settings` delega en `get_settings()`: el código existente sigue leyendo `settings.X`, pero las
+    Settings se construyen al primer acceso y `get_settings.cache_clear()` permite recargarlas.
+    """
+    def __getattr__(self, name: str) -> Any:
+        return getattr(get_settings(), name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        setattr(get_settings(), name, value)
+
+    def __delattr__(self, name: str) -> None:
+        delattr(get_settings(), name)
+
+settings: Settings = _SettingsProxy() # type: ignore[assignment]
@@ -0,0 +1,370 @@
+import asyncio
+import importlib
+import time
+from functools import cached_property
+from typing import Any, Dict, Optional, Tuple
+
+from app.core.config import Settings
+from app.core.diagnostics import LoopDiagnostics
+from app.core.metrics import metrics
+from app.models.meta import MetaWebhookRequest
+from app.services.conversation_store import ConversationStore, build_conversation_store
+from app.services.delivery_tracker import DeliveryTracker, build_delivery_tracker
+from app.services.dedup import MessageDeduplicator, build_dedup_backend
+from app.services.llm_service import LLMService
+from app.services.intent_router import IntentRouter, build_intent_router
+from app.services.journal import INBOUND, Journal, JournaledWebhook, build_journal
+from app.services.media import MediaPipeline, build_media_pipeline
+from app.services.meta_service import MetaService
+from app.services.model_router import ModelRouter, build_model_router
+from app.services.outbound import OutboundSendScheduler
+from app.services.prompt_builder import build_prompt_builder
+from app.services.rag_interface import NoRAGService, RAGInterface, build_rag_service
+from app.services.response_cache import ResponseCache, build_response_cache
+from app.services.tenants import (
+    DEFAULT_TENANT,
+    Tenant,
+    TenantRouter,
+    TenantRuntime,
+    build_tenant_router,
+    tenant_processing,
+    webhook_phone_number_id,
+)
+from app.services.shared_state import InMemorySharedState, SharedState, build_shared_state
+from app.services.webhook_dispatcher import WebhookDispatcher, build_webhook_dispatcher
+from app.utils.http_client import HttpClient, build_meta_http_client
+from app.utils.logging import logger, logging_stats
+
+class ServiceContainer:
+    """
+    Servicios de un proceso de la app, construidos en el arranque (lifespan) en lugar de al importar
+    los módulos. Cada worker de uvicorn tiene su propio contenedor; lo que debe verse igual desde
+    todos (deduplicación, caché de respuestas, locks de campaña) pasa por `state`, cuyo backend
+    se elige con STATE_BACKEND.
+
+    Los límites globales (ritmo de envío por número, peticiones a Groq en curso) se reparten entre
+    los WORKERS procesos para que el total no cambie al escalar.
+
+    Cada servicio se construye la primera vez que se pide (dependencias de FastAPI en `app.api.deps`),
+    así el arranque no espera al SDK de Groq ni al índice RAG; con SERVICES_WARMUP se construyen
+    en segundo plano justo después de que la app empieza a aceptar peticiones.
+    """
+    def __init__(self, settings: Settings):
+        self.settings = settings
+        self.workers = max(1, settings.WORKERS)
+        self._warmup_task: Optional[asyncio.Task] = None
+        self._replay_task: Optional[asyncio.Task] = None
+
+    def _built(self, name: str) -> Any:
+        """El servicio `name` si ya se construyó (sin construirlo), si no None."""
+        return self.__dict__.get(name)
+
+    @cached_property
+    def state(self) -> SharedState:
+        return build_shared_state(settings=self.settings)
+
+    @property
+    def state_is_shared(self) -> bool:
+        return not isinstance(self.state, InMemorySharedState)
+
+    @cached_property
+    def http_client(self) -> HttpClient:
+        return build_meta_http_client(settings=self.settings)
+
+    @cached_property
+    def rag_service(self) -> RAGInterface:
+        return build_rag_service(self.settings)
+
+    @cached_property
+    def response_cache(self) -> Optional[ResponseCache]:
+        # Con estado en memoria la caché local ya cumple ese papel: no se duplican las entradas
+        return build_response_cache(self.state if self.state_is_shared else None, self.settings)
+
+    @cached_property
+    def conversation_store(self) -> Optional[ConversationStore]:
+        return build_conversation_store(self.settings)
+
+    @cached_property
+    def model_router(self) -> ModelRouter:
+        return build_model_router(settings=self.settings)
+
+    @cached_property
+    def llm_service(self) -> LLMService:
+        return LLMService(
+            api_key=self.settings.GROQ_API_KEY,
+            response_cache=self.response_cache,
+            conversation_store=self.conversation_store,
+            history_token_budget=self.settings.MEMORY_TOKEN_BUDGET,
+            max_concurrency=max(1, self.settings.LLM_MAX_CONCURRENCY // self.workers),
+            coalesce=self.settings.LLM_COALESCING_ENABLED,
+            rag_service=self.rag_service,
+            model=self.settings.GROQ_MODEL,
+            router=self.model_router,
+            prompt_builder=build_prompt_builder(settings=self.settings),
+            settings=self.settings,
+        )
+
+    @cached_property
+    def deduplicator(self) -> MessageDeduplicator:
+        return MessageDeduplicator(build_dedup_backend(self.state, self.settings))
+
+    @cached_property
+    def outbound(self) -> OutboundSendScheduler:
+        return self._build_outbound(self.http_client)
+
+    def _build_outbound(self, http_client: HttpClient) -> OutboundSendScheduler:
+        settings = self.settings
+        return OutboundSendScheduler(
+            http_client=http_client,
+            # El límite del número es global: se reparte entre los workers. El de cada destinatario no:
+            # una conversación cae casi siempre en un mismo proceso, dividirlo lo haría WORKERS veces más lento
+            phone_rate=settings.OUTBOUND_PHONE_RATE / self.workers,
+            phone_burst=max(1.0, settings.OUTBOUND_PHONE_BURST / self.workers),
+            recipient_rate=settings.OUTBOUND_RECIPIENT_RATE,
+            recipient_burst=settings.OUTBOUND_RECIPIENT_BURST,
+            max_retries=settings.OUTBOUND_MAX_RETRIES,
+            base_backoff=settings.OUTBOUND_BASE_BACKOFF,
+            max_backoff=settings.OUTBOUND_MAX_BACKOFF,
+            max_pending_retries=settings.OUTBOUND_MAX_PENDING_RETRIES,
+            dead_letter_size=settings.OUTBOUND_DEAD_LETTER_SIZE,
+        )
+
+    @cached_property
+    def delivery_tracker(self) -> DeliveryTracker:
+        return build_delivery_tracker(self.settings)
+
+    @cached_property
+    def media_pipeline(self) -> Optional[MediaPipeline]:
+        return build_media_pipeline(self.http_client, settings=self.settings)
+
+    @cached_property
+    def journal(self) -> Optional[Journal]:
+        return build_journal(self.settings)
+
+    @cached_property
+    def diagnostics(self) -> LoopDiagnostics:
+        return LoopDiagnostics(max_stall_records=self.settings.LOOP_STALL_MAX_RECORDS)
+
+    @cached_property
+    def intent_router(self) -> Optional[IntentRouter]:
+        return build_intent_router(self.settings)
+
+    @cached_property
+    def meta_service(self) -> MetaService:
+        return MetaService(
+            llm_service=self.llm_service,
+            outbound=self.outbound,
+            deduplicator=self.deduplicator,
+            media=self.media_pipeline,
+            journal=self.journal,
+            intents=self.intent_router,
+            settings=self.settings,
+        )
+
+    async def _handle_webhook(self, item: Any, tenant: Optional[TenantRuntime] = None) -> asyncio.Future:
+        """
+        Entrega el webhook al planificador por conversación y devuelve sin esperar las respuestas:
+        el cierre en el journal y la métrica del tenant se registran cuando terminan.
+        """
+        meta_service = tenant.meta_service if tenant is not None else self.meta_service
+        started_at = time.perf_counter()
+        if isinstance(item, JournaledWebhook):
+            # Reenviado desde el journal: el id pudo quedar marcado antes de la caída
+            done = await meta_service.submit_webhook_message(item.payload, skip_dedup=item.replayed)
+        else:
+            done = await meta_service.submit_webhook_message(item)
+        tenant_id = tenant.tenant.tenant_id if tenant is not None else DEFAULT_TENANT
+        done.add_done_callback(lambda future: self._webhook_done(future, item, tenant_id, started_at))
+        return done
+
+    def _webhook_done(self, done: asyncio.Future, item: Any, tenant_id: str, started_at: float) -> None:
+        # Cancelado en el apagado: la entrada del journal queda abierta y se reenvía al arrancar
+        if done.cancelled() or any(isinstance(result, asyncio.CancelledError) for result in done.result()):
+            return
+        if isinstance(item, JournaledWebhook):
+            self.journal.complete(item.entry_id)
+        tenant_processing.labels(tenant_id).observe(time.perf_counter() - started_at)
+
+    def _drop_webhook(self, item: Any) -> None:
+        # Descartado por la política 'drop_oldest': no se responderá, tampoco al reiniciar (llegaría tarde)
+        if isinstance(item, JournaledWebhook):
+            self.journal.complete(item.entry_id)
+
+    @cached_property
+    def webhook_dispatcher(self) -> WebhookDispatcher:
+        return build_webhook_dispatcher(self._handle_webhook, on_drop=self._drop_webhook, settings=self.settings)
+
+    @cached_property
+    def tenant_router(self) -> Optional[TenantRouter]:
+        return build_tenant_router(self._build_tenant_runtime, self.settings)
+
+    def _build_tenant_runtime(self, tenant: Tenant) -> TenantRuntime:
+        """
+        Servicios propios de un tenant. Se comparten solo los que no dependen del número ni de sus
+        credenciales: deduplicación, historial (separado por `user_prefix`) y journal. Las intenciones
+        (`intents_file`) y la base de conocimientos (`rag_index_dir`) son del tenant: horarios, precios
+        o direcciones cambian de un negocio a otro, y sin las propias no se usan las de otro.
+        """
+        http_client = build_meta_http_client(tenant.max_connections, tenant.max_keepalive_connections, self.settings)
+        outbound = self._build_outbound(http_client)
+        default_media = self.media_pipeline
+        media = build_media_pipeline(http_client, tenant.access_token, default_media.executor, default_media.cache, self.settings) if default_media is not None else None
+        llm_service = LLMService(
+            api_key=tenant.groq_api_key or self.settings.GROQ_API_KEY,
+            response_cache=build_response_cache(settings=self.settings), # Local al tenant: cada negocio responde distinto
+            conversation_store=self.conversation_store,
+            history_token_budget=self.settings.MEMORY_TOKEN_BUDGET,
+            max_concurrency=max(1, (tenant.llm_max_concurrency or self.settings.LLM_MAX_CONCURRENCY) // self.workers),
+            coalesce=self.settings.LLM_COALESCING_ENABLED,
+            rag_service=build_rag_service(self.settings, tenant.rag_index_dir) if tenant.rag_index_dir else NoRAGService(),
+            model=tenant.model or self.settings.GROQ_MODEL,
+            router=build_model_router(tenant.model, self.settings),
+            prompt_builder=build_prompt_builder(tenant.system_prompt, self.settings),
+            settings=self.settings,
+        )
+        meta_service = MetaService(
+            llm_service=llm_service,
+            outbound=outbound,
+            deduplicator=self.deduplicator,
+            media=media,
+            journal=self.journal,
+            intents=build_intent_router(self.settings, tenant.intents_file) if tenant.intents_file else None,
+            phone_number_id=tenant.phone_number_id,
+            access_token=tenant.access_token,
+            conversation_concurrency=tenant.conversation_concurrency,
+            user_prefix=f"{tenant.tenant_id}:",
+            settings=self.settings,
+        )
+        # Cola propia: con la del tenant llena se rechazan solo sus webhooks
+        dispatcher = build_webhook_dispatcher(
+            lambda item: self._handle_webhook(item, runtime),
+            workers=tenant.webhook_workers,
+            max_size=tenant.queue_max_size,
+            on_drop=self._drop_webhook,
+            settings=self.settings,
+        )
+        runtime = TenantRuntime(tenant, meta_service, dispatcher, http_client, outbound, llm_service, media)
+        return runtime
+
+    async def dispatcher_for(self, payload: MetaWebhookRequest) -> Tuple[Optional[WebhookDispatcher], str]:
+        """
+        Cola y tenant del webhook según `metadata.phone_number_id`. Sin TENANTS_FILE todo va a los
+        servicios de Settings; con él, un número que no es de ningún tenant ni el de Settings da None.
+        """
+        if self.tenant_router is None:
+            return self.webhook_dispatcher, DEFAULT_TENANT
+        phone_number_id = webhook_phone_number_id(payload)
+        runtime = await self.tenant_router.resolve(phone_number_id)
+        if runtime is not None:
+            return runtime.dispatcher, runtime.tenant.tenant_id
+        if phone_number_id in (None, self.settings.WHATSAPP_PHONE_NUMBER_ID):
+            return self.webhook_dispatcher, DEFAULT_TENANT
+        self.tenant_router.unknown += 1
+        return None, DEFAULT_TENANT
+
+    async def replay_journal(self) -> int:
+        """Reencola los webhooks aceptados que la ejecución anterior no llegó a responder."""
+        await self.journal.open()
+        replayed = 0
+        for entry in self.journal.take_recovered():
+            if entry.kind != INBOUND:
+                # Envíos sin resultado: su webhook (si lo hay) se reenvía y vuelve a responder
+                self.journal.complete(entry.seq)
+                continue
+            try:
+                payload = MetaWebhookRequest.model_validate_json(entry.data)
+            except ValueError as e:
+                logger.error("Entrada %d del journal no válida, se descarta: %s", entry.seq, e)
+                self.journal.complete(entry.seq)
+                continue
+            dispatcher, _ = await self.dispatcher_for(payload)
+            if dispatcher is None or not dispatcher.submit(JournaledWebhook(payload, entry.seq, replayed=True)):
+                logger.warning("Entrada %d del journal sin tenant o con la cola llena, se descarta", entry.seq)
+                self.journal.complete(entry.seq)
+                continue
+            replayed += 1
+        if replayed:
+            logger.info("Journal: %d webhooks reencolados", replayed)
+        return replayed
+
+    def _stats_of(self, name: str, method: str = "stats") -> Dict[str, Any]:
+        service = self._built(name)
+        return getattr(service, method)() if service is not None else {}
+
+    def _conversation_stats(self) -> Dict[str, Any]:
+        meta_service = self._built("meta_service")
+        return meta_service.scheduler.stats() if meta_service is not None else {}
+
+    def register_metrics(self) -> None:
+        # Estado de los componentes que ya llevan sus propios contadores: se leen solo al exportar /metrics
+        # (y solo si el servicio ya existe: exportar no debe forzar su construcción)
+        metrics.register_stats("webhook_queue", lambda: self._stats_of("webhook_dispatcher"))
+        metrics.register_stats("conversations", self._conversation_stats)
+        metrics.register_stats("dedup", lambda: self._stats_of("deduplicator"))
+        metrics.register_stats("outbound", lambda: self._stats_of("outbound"))
+        metrics.register_stats("delivery", lambda: self._stats_of("delivery_tracker"))
+        metrics.register_stats("media", lambda: self._stats_of("media_pipeline"))
+        metrics.register_stats("journal", lambda: self._stats_of("journal"))
+        metrics.register_stats("intents", lambda: self._stats_of("intent_router"))
+        metrics.register_stats("loop", lambda: self._stats_of("diagnostics"))
+        metrics.register_stats("tenants", lambda: self._stats_of("tenant_router"))
+        metrics.register_stats("http_pool", lambda: self._stats_of("http_client", "pool_stats"))
+        metrics.register_stats("llm", lambda: self._stats_of("llm_service"))
+        metrics.register_stats("llm_router", lambda: self._stats_of("model_router"))
+        metrics.register_stats("prompt", lambda: self._stats_of("llm_service", "prompt_stats"))
+        metrics.register_stats("logging", logging_stats)
+        metrics.register_stats("response_cache", lambda: self._stats_of("response_cache"))
+
+    def _preload_modules(self) -> None:
+        # Imports pesados que no hacen falta para aceptar peticiones
+        importlib.import_module("groq")
+        if self.settings.RAG_BACKEND == "local":
+            importlib.import_module("app.services.vector_rag")
+
+    async def warm_up(self) -> None:
+        """Construye la cadena de servicios del webhook; los imports pesados van a un hilo."""
+        await asyncio.to_thread(self._preload_modules)
+        _ = self.llm_service.client
+        await self.http_client.start() # El pool queda abierto antes del primer webhook
+        await self.webhook_dispatcher.start()
+
+    async def start(self, warm_up: bool = False) -> None:
+        """Arranque mínimo: métricas y, opcionalmente, construcción de servicios en segundo plano."""
+        if self.workers > 1 and self.settings.STATE_BACKEND == "memory":
+            logger.warning(
+                "WORKERS=%d con STATE_BACKEND=memory: deduplicación, caché y locks no se comparten entre procesos.",
+                self.workers,
+            )
+        self.register_metrics()
+        if self.journal is not None:
+            # La recuperación no retrasa el arranque; los webhooks nuevos esperan a que el journal esté abierto
+            self._replay_task = asyncio.create_task(self.replay_journal(), name="journal-replay")
+        if warm_up:
+            self._warmup_task = asyncio.create_task(self.warm_up(), name="services-warmup")
+
+    async def close(self) -> None:
+        """Vacía la cola de webhooks antes de cerrar las conexiones keep-alive y el estado compartido."""
+        for task in (self._warmup_task, self._replay_task):
+            if task is not None:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        if self._built("diagnostics") is not None:
+            await self.diagnostics.close()
+        if self._built("webhook_dispatcher") is not None:
+            await self.webhook_dispatcher.stop()
+        if self._built("tenant_router") is not None:
+            await self.tenant_router.close() # Vacía la cola de cada tenant y cierra su pool
+        if self._built("journal") is not None:
+            await self.journal.close() # Después del dispatcher: sus cierres quedan escritos
+        if self._built("media_pipeline") is not None:
+            await self.media_pipeline.close()
+        if self._built("delivery_tracker") is not None:
+            await self.delivery_tracker.close()
+        if self._built("http_client") is not None:
+            await self.http_client.close()
+        if self._built("deduplicator") is not None:
+            await self.deduplicator.backend.close()
+        if self._built("conversation_store") is not None:
+            await self.conversation_store.close()
+        if self._built("state") is not None:
+            await self.state.close()
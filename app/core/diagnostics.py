@@ -0,0 +1,284 @@
+import asyncio
+import sys
+import threading
+import time
+import traceback
+import weakref
+from collections import Counter, deque
+from types import FrameType
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+from app.utils.logging import logger
+
+# Diagnóstico del event loop para los endpoints de administración (`/api/v1/admin`). Nada de esto
+# corre si no se pide: el profiler, el watchdog de bloqueos y el registro de tareas se activan
+# por endpoint y al desactivarse no queda ningún hilo, tarea ni factory instalada.
+
+def _frame_label(frame: FrameType) -> str:
+    code = frame.f_code
+    return f"{frame.f_globals.get('__name__', '?')}:{getattr(code, 'co_qualname', code.co_name)}"
+
+def collapse_stack(frame: Optional[FrameType]) -> str:
+    """Pila en formato "collapsed" (raíz;...;hoja), el que usan flamegraph.pl, speedscope e inferno."""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+class SamplingProfiler:
+    """
+    Profiler por muestreo acotado en el tiempo: un hilo toma cada `interval` segundos la pila del
+    hilo del event loop (`sys._current_frames`) y cuenta las pilas iguales. No instrumenta llamadas,
+    así el costo es el mismo con o sin carga y desaparece al terminar.
+    """
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self.sample_count = 0
+        self.started_at = 0.0
+        self.duration = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.samples[collapse_stack(frame)] += 1
+                self.sample_count += 1
+            del frame
+
+    def start(self) -> None:
+        self.started_at = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.duration = time.monotonic() - self.started_at
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+    def top_functions(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """Funciones con más muestras propias (hoja de la pila) y totales (en cualquier nivel)."""
+        own: Counter = Counter()
+        total: Counter = Counter()
+        for stack, count in self.samples.items():
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            for label in set(frames):
+                total[label] += count
+        return [
+            {"function": label, "own": count, "total": total[label], "own_ratio": round(count / self.sample_count, 4)}
+            for label, count in own.most_common(limit)
+        ]
+
+class StallWatchdog:
+    """
+    Detecta bloqueos del event loop (callbacks lentos) y guarda dónde estaba bloqueado.
+
+    Una tarea del loop late cada `threshold / 2`; un hilo aparte revisa el último latido y, si el loop
+    lleva más de `threshold` sin latir, toma la pila del hilo del loop en ese momento (el código
+    síncrono culpable). Cuando el loop vuelve, el latido registra la duración real del bloqueo.
+    `loop.set_debug(True)` detecta lo mismo pero activa el modo debug de asyncio completo y no da la pila.
+    """
+    def __init__(self, thread_id: int, threshold: float = 0.1, max_records: int = 100):
+        self.thread_id = thread_id
+        self.threshold = threshold
+        self.records: Deque[Dict[str, Any]] = deque(maxlen=max_records)
+        self.stalls = 0
+        self.max_stall_seconds = 0.0
+        self._beat = 0
+        self._beat_at = time.monotonic()
+        self._captured: Optional[tuple] = None # (latido, pila) tomada por el hilo durante un bloqueo
+        self._stop = threading.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+
+    async def _heartbeat(self) -> None:
+        interval = self.threshold / 2
+        while True:
+            started_at = time.monotonic()
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            lag = now - started_at - interval
+            captured, self._captured = self._captured, None
+            if lag >= self.threshold:
+                self._record(lag, captured[1] if captured is not None and captured[0] == self._beat else None)
+            self._beat += 1
+            self._beat_at = now
+
+    def _record(self, seconds: float, stack: Optional[List[str]]) -> None:
+        self.stalls += 1
+        self.max_stall_seconds = max(self.max_stall_seconds, seconds)
+        self.records.append({
+            "at": time.time() - seconds,
+            "duration_ms": round(seconds * 1000, 3),
+            "stack": stack, # None si el bloqueo terminó antes de que el hilo lo viera
+        })
+        logger.warning("Event loop bloqueado %.0f ms", seconds * 1000, extra={"event": "loop_stall"})
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.threshold / 2):
+            beat = self._beat
+            if self._captured is None and time.monotonic() - self._beat_at > self.threshold:
+                frame = sys._current_frames().get(self.thread_id)
+                if frame is not None:
+                    self._captured = (beat, traceback.format_stack(frame))
+                del frame
+
+    def start(self) -> None:
+        self._beat_at = time.monotonic()
+        self._task = asyncio.create_task(self._heartbeat(), name="loop-stall-heartbeat")
+        self._thread = threading.Thread(target=self._watch, name="loop-stall-watchdog", daemon=True)
+        self._thread.start()
+
+    async def stop(self) -> None:
+        self._stop.set()
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        await asyncio.to_thread(self._thread.join)
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "threshold_ms": self.threshold * 1000,
+            "stalls": self.stalls,
+            "max_stall_ms": round(self.max_stall_seconds * 1000, 3),
+            "records": list(self.records),
+        }
+
+class TaskTracker:
+    """
+    Registra cuándo se creó cada tarea instalando una task factory en el loop (encadenada con la
+    que hubiera). Las tareas creadas antes de activarlo aparecen sin edad.
+    """
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.created_at: "weakref.WeakKeyDictionary[asyncio.Task, float]" = weakref.WeakKeyDictionary()
+        self._previous_factory: Optional[Callable] = None
+
+    def _factory(self, loop: asyncio.AbstractEventLoop, coro: Any, **kwargs: Any) -> asyncio.Future:
+        if self._previous_factory is not None:
+            task = self._previous_factory(loop, coro, **kwargs)
+        else:
+            task = asyncio.Task(coro, loop=loop, **kwargs)
+        self.created_at[task] = time.monotonic()
+        return task
+
+    def install(self) -> None:
+        self._previous_factory = self.loop.get_task_factory()
+        self.loop.set_task_factory(self._factory)
+
+    def uninstall(self) -> None:
+        self.loop.set_task_factory(self._previous_factory)
+
+def _coroutine_label(task: asyncio.Task) -> str:
+    coro = task.get_coro()
+    return getattr(coro, "__qualname__", None) or type(coro).__name__
+
+def _await_location(task: asyncio.Task) -> Optional[str]:
+    stack = task.get_stack(limit=1)
+    if not stack:
+        return None
+    frame = stack[-1]
+    return f"{_frame_label(frame)}:{frame.f_lineno}"
+
+def task_report(created_at: Optional[Dict[asyncio.Task, float]] = None, limit: int = 20) -> Dict[str, Any]:
+    """Tareas pendientes del loop actual agrupadas por corrutina, con las más antiguas primero."""
+    now = time.monotonic()
+    current = asyncio.current_task()
+    groups: Dict[str, Dict[str, Any]] = {}
+    tasks = []
+    for task in asyncio.all_tasks():
+        if task is current:
+            continue
+        label = _coroutine_label(task)
+        age = now - created_at[task] if created_at is not None and task in created_at else None
+        group = groups.setdefault(label, {"coroutine": label, "count": 0, "oldest_seconds": None})
+        group["count"] += 1
+        if age is not None and (group["oldest_seconds"] is None or age > group["oldest_seconds"]):
+            group["oldest_seconds"] = round(age, 3)
+        tasks.append((age, task, label))
+    tasks.sort(key=lambda item: -1 if item[0] is None else item[0], reverse=True)
+    return {
+        "pending": len(tasks),
+        "tracking": created_at is not None,
+        "by_coroutine": sorted(groups.values(), key=lambda group: group["count"], reverse=True),
+        "oldest": [
+            {"name": task.get_name(), "coroutine": label, "age_seconds": None if age is None else round(age, 3),
+             "awaiting": _await_location(task)}
+            for age, task, label in tasks[:limit]
+        ],
+    }
+
+class LoopDiagnostics:
+    """Diagnóstico del event loop de un worker (un profiler a la vez, watchdog y registro de tareas)."""
+    def __init__(self, max_stall_records: int = 100):
+        self.max_stall_records = max_stall_records
+        self.profiler: Optional[SamplingProfiler] = None
+        self.watchdog: Optional[StallWatchdog] = None
+        self.tracker: Optional[TaskTracker] = None
+        self.profiles = 0
+
+    @property
+    def profiling(self) -> bool:
+        return self.profiler is not None
+
+    async def profile(self, seconds: float, interval: float = 0.005) -> SamplingProfiler:
+        """Muestrea el hilo del loop durante `seconds` (el loop sigue atendiendo mientras tanto)."""
+        if self.profiler is not None:
+            raise RuntimeError("Ya hay un profiling en curso")
+        profiler = SamplingProfiler(threading.get_ident(), interval)
+        self.profiler = profiler
+        try:
+            profiler.start()
+            await asyncio.sleep(seconds)
+        finally:
+            await asyncio.to_thread(profiler.stop)
+            self.profiler = None
+        self.profiles += 1
+        return profiler
+
+    async def enable_stall_detection(self, threshold: float) -> None:
+        await self.disable_stall_detection()
+        self.watchdog = StallWatchdog(threading.get_ident(), threshold, self.max_stall_records)
+        self.watchdog.start()
+        logger.info("Detección de bloqueos del event loop activada (umbral %.0f ms)", threshold * 1000)
+
+    async def disable_stall_detection(self) -> None:
+        if self.watchdog is not None:
+            watchdog, self.watchdog = self.watchdog, None
+            await watchdog.stop()
+
+    def enable_task_tracking(self) -> None:
+        if self.tracker is None:
+            self.tracker = TaskTracker(asyncio.get_running_loop())
+            self.tracker.install()
+
+    def disable_task_tracking(self) -> None:
+        if self.tracker is not None:
+            self.tracker.uninstall()
+            self.tracker = None
+
+    def tasks(self, limit: int = 20) -> Dict[str, Any]:
+        return task_report(self.tracker.created_at if self.tracker is not None else None, limit)
+
+    async def close(self) -> None:
+        await self.disable_stall_detection()
+        self.disable_task_tracking()
+
+    def stats(self) -> Dict[str, Any]:
+        watchdog = self.watchdog
+        return {
+            "profiles": self.profiles,
+            "profiling": self.profiling,
+            "stall_detection": watchdog is not None,
+            "stalls": watchdog.stalls if watchdog is not None else 0,
+            "max_stall_ms": watchdog.max_stall_seconds * 1000 if watchdog is not None else 0.0,
+            "task_tracking": self.tracker is not None,
+        }
@@ -0,0 +1,265 @@
+import math
+import time
+from bisect import bisect_left
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+# Límites (segundos) de los buckets de latencia: de 1 ms (parseo, cola) a 30 s (Groq con reintentos)
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+
+# Etapas instrumentadas del camino de una respuesta
+STAGES = ("webhook_parse", "queue_wait", "webhook_handler", "rag", "groq", "outbound_send")
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+def _format_labels(label_names: Tuple[str, ...], label_values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class _Metric:
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self._children: Dict[Tuple[str, ...], Any] = {}
+
+    def labels(self, *label_values: str) -> Any:
+        """Devuelve (y memoiza) la serie para esos valores de etiqueta."""
+        child = self._children.get(label_values)
+        if child is None:
+            child = self._children[label_values] = self._new_child()
+        return child
+
+    def _new_child(self) -> Any:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        for label_values, child in sorted(self._children.items()):
+            lines.extend(self._render_child(label_values, child))
+        return lines
+
+    def _render_child(self, label_values: Tuple[str, ...], child: Any) -> List[str]:
+        return [f"{self.name}{_format_labels(self.label_names, label_values)} {_format_value(child.value)}"]
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+class _HistogramValue:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1) # El último es el bucket +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        # Conteo por bucket no acumulado; se acumula solo al exportar
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Estimación por interpolación lineal dentro del bucket (como `histogram_quantile`)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for i, bucket_count in enumerate(self.counts):
+            if cumulative + bucket_count >= rank and bucket_count:
+                if i == len(self.bounds):
+                    return self.bounds[-1]
+                lower = self.bounds[i - 1] if i else 0.0
+                return lower + (self.bounds[i] - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+        return self.bounds[-1]
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self) -> _HistogramValue:
+        return _HistogramValue(self.buckets)
+
+    def _render_child(self, label_values: Tuple[str, ...], child: _HistogramValue) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (math.inf,), child.counts):
+            cumulative += bucket_count
+            le = f'le="{_format_value(bound)}"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.label_names, label_values, le)} {cumulative}")
+        labels = _format_labels(self.label_names, label_values)
+        lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+        lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+class _StageTimer:
+    """Context manager de una etapa: gauge en curso, histograma de duración y contador de errores."""
+    __slots__ = ("_histogram", "_in_flight", "_errors", "_started_at")
+
+    def __init__(self, histogram: _HistogramValue, in_flight: _Value, errors: _Value):
+        self._histogram = histogram
+        self._in_flight = in_flight
+        self._errors = errors
+
+    def __enter__(self) -> "_StageTimer":
+        self._in_flight.value += 1
+        self._started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        self._histogram.observe(time.perf_counter() - self._started_at)
+        self._in_flight.value -= 1
+        if exc_type is not None and exc_type is not GeneratorExit: # GeneratorExit: el consumidor cerró el stream
+            self._errors.value += 1
+
+StatsCollector = Callable[[], Dict[str, Any]]
+
+class MetricsRegistry:
+    """
+    Registro de métricas en proceso con exportación en formato de texto de Prometheus.
+
+    Las métricas propias son contadores/histogramas simples (sin locks: todo ocurre en el event loop)
+    para que instrumentar una etapa cueste del orden de un microsegundo
+    (ver `benchmarks/bench_metrics_overhead.py`). Los `stats()` que ya exponen los
+    servicios (cola, dedup, caché, envíos, pool HTTP) se leen solo al exportar, como gauges.
+    """
+    def __init__(self, namespace: str = "chatbot"):
+        self.namespace = namespace
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: Dict[str, StatsCollector] = {}
+
+        self.stage_duration = self.histogram("stage_duration_seconds", "Duración de cada etapa del procesamiento", ("stage",))
+        self.stage_in_flight = self.gauge("stage_in_flight", "Operaciones en curso por etapa", ("stage",))
+        self.stage_errors = self.counter("stage_errors_total", "Errores por etapa", ("stage",))
+        self.llm_tokens = self.counter("llm_tokens_total", "Tokens consumidos en Groq según `usage`", ("kind",))
+        self._timers: Dict[str, Tuple[_HistogramValue, _Value, _Value]] = {}
+        for stage in STAGES:
+            self._stage_series(stage)
+
+    def _register(self, metric: _Metric) -> Any:
+        if metric.name in self._metrics:
+            raise ValueError(f"Métrica duplicada: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, label_names: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(f"{self.namespace}_{name}", documentation, label_names))
+
+    def gauge(self, name: str, documentation: str, label_names: Tuple[str, ...] = ()) -> Gauge:
+        return self._register(Gauge(f"{self.namespace}_{name}", documentation, label_names))
+
+    def histogram(self, name: str, documentation: str, label_names: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(f"{self.namespace}_{name}", documentation, label_names, buckets))
+
+    def _stage_series(self, stage: str) -> Tuple[_HistogramValue, _Value, _Value]:
+        series = self._timers.get(stage)
+        if series is None:
+            series = self._timers[stage] = (
+                self.stage_duration.labels(stage),
+                self.stage_in_flight.labels(stage),
+                self.stage_errors.labels(stage),
+            )
+        return series
+
+    def stage(self, stage: str) -> _StageTimer:
+        """Mide una etapa: `with metrics.stage("groq"): ...` (también alrededor de un `await`)."""
+        return _StageTimer(*self._stage_series(stage))
+
+    def observe_stage(self, stage: str, seconds: float) -> None:
+        """Registra una duración medida por fuera (p. ej. la espera en cola)."""
+        self._stage_series(stage)[0].observe(seconds)
+
+    def record_stage_error(self, stage: str) -> None:
+        """Error sin excepción (p. ej. una respuesta HTTP 4xx/5xx)."""
+        self._stage_series(stage)[2].value += 1
+
+    def record_token_usage(self, usage: Any) -> None:
+        """Suma los tokens de `completion.usage` (se ignoran valores ausentes o no numéricos)."""
+        if usage is None:
+            return
+        for kind in ("prompt_tokens", "completion_tokens"):
+            value = getattr(usage, kind, None)
+            if isinstance(value, int):
+                self.llm_tokens.labels(kind.replace("_tokens", "")).inc(value)
+
+    def register_stats(self, prefix: str, collector: StatsCollector) -> None:
+        """
+        Exporta los valores numéricos de un `stats()` existente como gauges `<namespace>_<prefix>_<clave>`.
+        Registrar de nuevo el mismo prefijo (p. ej. otro arranque de la app) reemplaza el anterior.
+        """
+        self._collectors[prefix] = collector
+
+    def _render_collectors(self) -> Iterable[str]:
+        for prefix, collector in self._collectors.items():
+            try:
+                stats = collector()
+            except Exception:
+                continue
+            for key, value in stats.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                name = f"{self.namespace}_{prefix}_{key}"
+                yield f"# TYPE {name} gauge"
+                yield f"{name} {_format_value(value)}"
+
+    def stage_summary(self) -> Dict[str, Dict[str, float]]:
+        """Resumen legible por etapa (conteo, media y p50/p95/p99 estimados), útil en logs y benchmarks."""
+        summary = {}
+        for (stage,), histogram in sorted(self.stage_duration._children.items()):
+            summary[stage] = {
+                "count": histogram.count,
+                "avg_seconds": histogram.sum / histogram.count if histogram.count else 0.0,
+                "p50_seconds": histogram.quantile(0.5),
+                "p95_seconds": histogram.quantile(0.95),
+                "p99_seconds": histogram.quantile(0.99),
+                "errors": int(self.stage_errors.labels(stage).value),
+            }
+        return summary
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        lines.extend(self._render_collectors())
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
@@ -1,23 +1,67 @@
-from fastapi import FastAPI
-from app.core.config import settings
+from contextlib import asynccontextmanager
+from fastapi import Depends, FastAPI
+from fastapi.responses import PlainTextResponse
+from app.core.config import Settings, get_settings, settings
+from app.core.container import ServiceContainer
+from app.core.metrics import metrics
 from app.api.v1.router import api_router_v1
-import logging
-import uvicorn
+from app.utils.logging import setup_logging
 
-# Configuración básica de logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+# Importar este módulo no construye Settings ni servicios: todo lo que depende de la configuración
+# (logging, título, rutas de la API y servicios) se arma en el lifespan.
 
-app = FastAPI(
-    title=settings.APP_NAME,
-    openapi_url=f"{settings.API_V1_STR}/openapi.json"
-)
+def configure_app(app: FastAPI, app_settings: Settings) -> None:
+    """Título, OpenAPI y rutas de la API bajo API_V1_STR; solo en el primer arranque de la app."""
+    if getattr(app.state, "configured", False):
+        return
+    app.title = app_settings.APP_NAME
+    app.openapi_url = f"{app_settings.API_V1_STR}/openapi.json"
+    app.include_router(api_router_v1, prefix=app_settings.API_V1_STR)
+    app.setup() # Rutas de OpenAPI y /docs con la URL ya conocida
+    app.state.configured = True
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Arranque: el contenedor (uno por worker) construye cada servicio al primer uso; la app acepta
+    # peticiones de inmediato y, con SERVICES_WARMUP, los servicios se preparan en segundo plano.
+    # Las Settings salen de la misma dependencia que usan los endpoints (reemplazable en tests).
+    app_settings = app.dependency_overrides.get(get_settings, get_settings)()
+    setup_logging(app_settings) # QueueHandler en el root logger, JSON, redacción
+    configure_app(app, app_settings)
+    services = ServiceContainer(app_settings)
+    await services.start(warm_up=app_settings.SERVICES_WARMUP)
+    app.state.services = services
+    yield
+    # Apagado: vaciar la cola de webhooks antes de cerrar las conexiones keep-alive
+    await services.close()
+
+app = FastAPI(openapi_url=None, lifespan=lifespan) # La URL de OpenAPI se fija en `configure_app`
 
 @app.get("/", tags=["Root"])
-async def read_root():
+async def read_root(settings: Settings = Depends(get_settings)):
     return {"message": f"Welcome to {settings.APP_NAME}"}
 
-app.include_router(api_router_v1, prefix=settings.API_V1_STR)
+@app.get("/metrics", include_in_schema=False)
+async def read_metrics():
+    """Métricas en formato de texto de Prometheus (latencia por etapa, en curso, errores, tokens y colas)."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+def run() -> None:
+    """
+    Modo de ejecución configurable desde Settings: `WORKERS` procesos de uvicorn (cada uno con su
+    lifespan y sus servicios) o, en desarrollo, un único proceso con `RELOAD=true`.
+    """
+    import uvicorn # Solo lo necesita este modo de ejecución, no quien importa la app
+
+    reload = settings.RELOAD and settings.WORKERS == 1
+    uvicorn.run(
+        "app.main:app",
+        host=settings.HOST,
+        port=settings.PORT,
+        workers=None if reload else settings.WORKERS,
+        reload=reload,
+    )
 
-# Para ejecutar directamente con uvicorn:
+# Para ejecutar directamente: python -m app.main
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    run()
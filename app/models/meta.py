@@ -6,20 +6,58 @@ from typing import List, Optional
 class MetaMessageText(BaseModel):
     body: str
 
+class MetaMedia(BaseModel):
+    """Adjunto de un mensaje entrante: el contenido se descarga aparte con su `id` (Graph API)."""
+    id: str
+    mime_type: Optional[str] = None
+    sha256: Optional[str] = None # Informado por Meta; permite saltar la descarga si ya está en caché (con el mismo tamaño)
+    caption: Optional[str] = None
+    filename: Optional[str] = None # Solo documentos
+    voice: Optional[bool] = None # Solo audio: nota de voz grabada en WhatsApp
+
+MEDIA_TYPES = ("image", "audio", "document", "video", "sticker")
+
 class MetaMessage(BaseModel):
     id: str
     from_number: str = Field(..., alias="from")
     timestamp: str
     text: Optional[MetaMessageText] = None
     type: str
-    # Puedes añadir otros tipos de mensajes: image, audio, document, etc.
+    image: Optional[MetaMedia] = None
+    audio: Optional[MetaMedia] = None
+    document: Optional[MetaMedia] = None
+    video: Optional[MetaMedia] = None
+    sticker: Optional[MetaMedia] = None
+
+    @property
+    def media(self) -> Optional[MetaMedia]:
+        """El adjunto del mensaje según su `type` (None para texto y tipos sin adjunto)."""
+        return getattr(self, self.type, None) if self.type in MEDIA_TYPES else None
+
+class MetaStatusError(BaseModel):
+    code: int
+    title: Optional[str] = None
+
+class MetaStatus(BaseModel):
+    """Actualización de estado de un mensaje enviado por nosotros (sent/delivered/read/failed).
+
+    Los campos son opcionales: un estado incompleto se descarta solo (DeliveryTracker), sin
+    invalidar los demás estados del mismo payload.
+    """
+    id: Optional[str] = None # wamid del mensaje saliente
+    status: Optional[str] = None
+    timestamp: Optional[str] = None # Epoch en segundos, como texto
+    recipient_id: Optional[str] = None
+    errors: Optional[List[MetaStatusError]] = None
 
 class MetaValue(BaseModel):
     messaging_product: str
     metadata: dict
     contacts: Optional[List[dict]] = None # Presente en mensajes entrantes
     messages: Optional[List[MetaMessage]] = None
-    statuses: Optional[List[dict]] = None # Para actualizaciones de estado del mensaje
+    # Actualizaciones de estado: las valida el DeliveryTracker por separado (MetaStatusWebhook),
+    # así un estado malformado no descarta los mensajes del mismo payload
+    statuses: Optional[List[dict]] = None
 
 class MetaChange(BaseModel):
     value: MetaValue
@@ -33,12 +71,46 @@ class MetaWebhookRequest(BaseModel):
     object: str
     entry: List[MetaEntry]
 
+# Vista mínima del mismo payload para la ruta de estados: solo se validan los `statuses`
+# (pydantic ignora el resto de claves sin construir modelos para ellas)
+
+class MetaStatusValue(BaseModel):
+    statuses: List[MetaStatus] = []
+
+class MetaStatusChange(BaseModel):
+    value: MetaStatusValue
+
+class MetaStatusEntry(BaseModel):
+    changes: List[MetaStatusChange]
+
+class MetaStatusWebhook(BaseModel):
+    entry: List[MetaStatusEntry]
+
+    def iter_statuses(self):
+        for entry in self.entry:
+            for change in entry.changes:
+                yield from change.value.statuses
+
 class MetaMessageResponse(BaseModel):
     messaging_product: str = "whatsapp"
     to: str
     type: str = "text"
     text: MetaMessageText
 
+class MetaTemplateLanguage(BaseModel):
+    code: str = "es"
+
+class MetaTemplate(BaseModel):
+    name: str
+    language: MetaTemplateLanguage = MetaTemplateLanguage()
+    components: Optional[List[dict]] = None
+
+class MetaTemplateMessageResponse(BaseModel):
+    messaging_product: str = "whatsapp"
+    to: str
+    type: str = "template"
+    template: MetaTemplate
+
 class MetaWebhookChallengeQuery(BaseModel):
     hub_mode: str = Field(..., alias="hub.mode")
     hub_challenge: str = Field(..., alias="hub.challenge")
@@ -0,0 +1,153 @@
+import asyncio
+import csv
+import json
+import os
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
+
+from pydantic import ValidationError
+
+from app.models.meta import MetaTemplate
+
+READ_BLOCK_SIZE = 64 * 1024
+CSV_ROWS_PER_READ = 512 # Filas CSV que se leen por cada salto a un hilo
+
+@dataclass
+class BroadcastRecipient:
+    line: int # Número de línea/fila en el archivo subido (identifica el envío al reanudar)
+    to: str
+    text: Optional[str] = None
+    template: Optional[MetaTemplate] = None
+    error: Optional[str] = None # Fila inválida: se informa en el resultado sin enviar nada
+
+async def iter_file_lines(path: str) -> AsyncIterator[str]:
+    """Lee un archivo por bloques (en un hilo) y entrega sus líneas sin cargarlo entero en memoria."""
+    with open(path, "rb") as f:
+        pending = b""
+        while True:
+            block = await asyncio.to_thread(f.read, READ_BLOCK_SIZE)
+            if not block:
+                break
+            pending += block
+            *lines, pending = pending.split(b"\n")
+            for line in lines:
+                yield line.decode("utf-8").rstrip("\r")
+        if pending:
+            yield pending.decode("utf-8").rstrip("\r")
+
+def _recipient_from_record(line: int, record: Dict[str, Any]) -> BroadcastRecipient:
+    to = str(record.get("to") or "").strip()
+    if not to:
+        return BroadcastRecipient(line=line, to="", error="Falta el destinatario 'to'")
+    template = record.get("template")
+    if template:
+        if isinstance(template, str):
+            template = {"name": template, "language": {"code": record.get("language") or "es"}}
+        try:
+            return BroadcastRecipient(line=line, to=to, template=MetaTemplate.model_validate(template))
+        except ValidationError as e:
+            return BroadcastRecipient(line=line, to=to, error=f"Plantilla inválida: {e.errors()[0]['msg']}")
+    text = record.get("text")
+    if not text:
+        return BroadcastRecipient(line=line, to=to, error="Falta 'text' o 'template'")
+    return BroadcastRecipient(line=line, to=to, text=str(text))
+
+async def parse_jsonl(lines: AsyncIterator[str]) -> AsyncIterator[BroadcastRecipient]:
+    """Un objeto JSON por línea: {"to": ..., "text": ...} o {"to": ..., "template": {...}}."""
+    line_number = 0
+    async for raw_line in lines:
+        line_number += 1
+        if not raw_line.strip():
+            continue
+        try:
+            record = json.loads(raw_line)
+        except ValueError as e:
+            yield BroadcastRecipient(line=line_number, to="", error=f"JSON inválido: {e}")
+            continue
+        if not isinstance(record, dict):
+            yield BroadcastRecipient(line=line_number, to="", error="Se esperaba un objeto JSON")
+            continue
+        yield _recipient_from_record(line_number, record)
+
+def _read_csv_rows(reader: Any, count: int) -> List[Tuple[int, List[str]]]:
+    rows = []
+    for _ in range(count):
+        line_number = reader.line_num + 1 # Línea donde empieza la fila (un campo entre comillas puede ocupar varias)
+        row = next(reader, None)
+        if row is None:
+            break
+        rows.append((line_number, row))
+    return rows
+
+async def parse_csv(path: str) -> AsyncIterator[BroadcastRecipient]:
+    """
+    CSV con cabecera; columnas: to, text o template (+ language opcional). `csv.reader` lee el archivo
+    directamente (los campos entre comillas pueden tener saltos de línea) y por bloques de filas en un hilo.
+    """
+    header = None
+    with open(path, encoding="utf-8", newline="") as f:
+        reader = csv.reader(f)
+        while True:
+            rows = await asyncio.to_thread(_read_csv_rows, reader, CSV_ROWS_PER_READ)
+            if not rows:
+                break
+            for line_number, row in rows:
+                if not row or (len(row) == 1 and not row[0].strip()):
+                    continue
+                if header is None:
+                    header = [column.strip() for column in row]
+                    continue
+                yield _recipient_from_record(line_number, dict(zip(header, row)))
+
+class CampaignCheckpoint:
+    """
+    Registro append-only de las filas ya resueltas de una campaña. Si la campaña se interrumpe,
+    al reanudarla con el mismo id se omiten las filas registradas.
+
+    `mark_done` solo anota en memoria; `flush` escribe lo pendiente de una vez en un hilo, así el
+    event loop no hace una escritura a disco por destinatario.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._done: Set[int] = set()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self._done = {int(line) for line in f if line.strip()}
+        else:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+        self._pending: List[int] = []
+
+    def is_done(self, line: int) -> bool:
+        return line in self._done
+
+    def mark_done(self, line: int) -> None:
+        self._done.add(line)
+        self._pending.append(line)
+
+    async def flush(self) -> None:
+        if self._pending:
+            await asyncio.to_thread(self._write, self._take_pending())
+
+    def _take_pending(self) -> str:
+        data = "".join(f"{line}\n" for line in self._pending)
+        self._pending.clear()
+        return data
+
+    def _write(self, data: str) -> None:
+        self._file.write(data)
+        self._file.flush()
+
+    def __len__(self) -> int:
+        return len(self._done)
+
+    def close(self) -> None:
+        if self._pending:
+            self._write(self._take_pending())
+        self._file.close()
+
+def checkpoint_path(checkpoint_dir: str, campaign_id: str) -> str:
+    safe_id = "".join(char for char in campaign_id if char.isalnum() or char in "-_")
+    if not safe_id:
+        raise ValueError("campaign_id inválido")
+    return os.path.join(checkpoint_dir, f"{safe_id}.checkpoint")
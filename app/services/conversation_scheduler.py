@@ -0,0 +1,89 @@
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from app.utils.logging import logger
+
+class ConversationScheduler:
+    """
+    Planificador de mensajes por conversación (clave = número de teléfono del usuario).
+
+    - Los mensajes de un mismo usuario se procesan estrictamente en orden, uno a la vez.
+    - Usuarios distintos se procesan en paralelo, hasta `max_concurrency` conversaciones activas.
+    - Si `merge_pending` está activo, los mensajes que llegan mientras se genera una respuesta
+      se agrupan (hasta `max_merge`) y se entregan juntos al handler en una sola llamada.
+    """
+    def __init__(
+        self,
+        handler: Callable[[str, List[Any]], Awaitable[None]],
+        max_concurrency: int = 8,
+        merge_pending: bool = False,
+        max_merge: int = 5,
+    ):
+        self.handler = handler
+        self.max_concurrency = max(1, max_concurrency)
+        self.merge_pending = merge_pending
+        self.max_merge = max(1, max_merge)
+
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._lanes: Dict[str, Deque[Tuple[Any, asyncio.Future]]] = {}
+        self._runners: Dict[str, asyncio.Task] = {}
+        self.batches = 0
+        self.merged = 0
+
+    def submit(self, key: str, item: Any) -> asyncio.Future:
+        """
+        Encola `item` en la conversación `key`. Devuelve un future que se resuelve
+        cuando el lote que contiene el mensaje termina de procesarse.
+        """
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        future = loop.create_future()
+        self._lanes.setdefault(key, deque()).append((item, future))
+        if key not in self._runners:
+            self._runners[key] = asyncio.create_task(self._run_lane(key), name=f"conversation-{key}")
+        return future
+
+    async def _run_lane(self, key: str) -> None:
+        lane = self._lanes[key]
+        try:
+            while lane:
+                # La conversación ocupa un único slot global: un usuario muy activo
+                # no puede acaparar la capacidad del LLM.
+                async with self._semaphore:
+                    batch = [lane.popleft()]
+                    if self.merge_pending:
+                        while lane and len(batch) < self.max_merge:
+                            batch.append(lane.popleft())
+                    self.batches += 1
+                    self.merged += len(batch) - 1
+                    try:
+                        await self.handler(key, [item for item, _ in batch])
+                    except asyncio.CancelledError:
+                        for _, future in batch:
+                            future.cancel()
+                        raise
+                    except Exception as e:
+                        logger.error("Error procesando la conversación %s: %s", key, e, exc_info=True)
+                        for _, future in batch:
+                            if not future.done():
+                                future.set_exception(e)
+                    else:
+                        for _, future in batch:
+                            if not future.done():
+                                future.set_result(None)
+        finally:
+            self._runners.pop(key, None)
+            self._lanes.pop(key, None)
+            # Solo quedan mensajes si la tarea fue cancelada (apagado): se cancelan sus futures
+            for _, future in lane:
+                future.cancel()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "active_conversations": len(self._runners),
+            "pending_messages": sum(len(lane) for lane in self._lanes.values()),
+            "batches": self.batches,
+            "merged_messages": self.merged,
+        }
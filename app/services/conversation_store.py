@@ -0,0 +1,295 @@
+import asyncio
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+
+from app.core.config import Settings, settings
+from app.utils.tokens import estimate_tokens
+
+@dataclass
+class ConversationTurn:
+    role: str # "user" o "assistant"
+    content: str
+    tokens: int = 0
+
+    def __post_init__(self):
+        if not self.tokens:
+            self.tokens = estimate_tokens(self.content)
+
+def clip_turn(content: str, max_chars: int) -> str:
+    """Recorta el texto de un turno a `max_chars` (un mensaje muy largo no se guarda entero)."""
+    if max_chars and len(content) > max_chars:
+        return content[:max_chars - 1] + "…"
+    return content
+
+def turn_bytes(turn: ConversationTurn) -> int:
+    return len(turn.content.encode("utf-8"))
+
+def summarize_turns(previous_summary: str, turns: Iterable[ConversationTurn], max_chars: int = 600) -> str:
+    """
+    Resumen extractivo y barato de los turnos antiguos: primera oración de cada turno,
+    acumulada sobre el resumen previo y recortada a `max_chars` (se conservan los más recientes).
+    """
+    lines = [previous_summary] if previous_summary else []
+    for turn in turns:
+        first_sentence = turn.content.strip().split("\n", 1)[0].split(". ", 1)[0][:160]
+        speaker = "Usuario" if turn.role == "user" else "Asistente"
+        lines.append(f"{speaker}: {first_sentence}")
+    summary = " | ".join(lines)
+    if len(summary) > max_chars:
+        summary = "…" + summary[-(max_chars - 1):]
+    return summary
+
+def pack_window(summary: str, turns: List[ConversationTurn], token_budget: int) -> List[Dict[str, str]]:
+    """
+    Empaqueta los turnos más recientes que caben en `token_budget` (en orden cronológico),
+    precedidos del resumen de lo anterior si existe y cabe.
+    """
+    messages: List[Dict[str, str]] = []
+    remaining = token_budget
+    summary_message = None
+    if summary:
+        summary_message = {"role": "system", "content": f"Resumen de la conversación anterior: {summary}"}
+        summary_tokens = estimate_tokens(summary_message["content"])
+        if summary_tokens <= remaining:
+            remaining -= summary_tokens
+        else:
+            summary_message = None
+
+    for turn in reversed(turns):
+        if turn.tokens > remaining:
+            break
+        remaining -= turn.tokens
+        messages.append({"role": turn.role, "content": turn.content})
+    messages.reverse()
+    if summary_message is not None:
+        messages.insert(0, summary_message)
+    return messages
+
+class ConversationStore(ABC):
+    @abstractmethod
+    async def append(self, user_id: str, role: str, content: str) -> None:
+        """Añade un turno a la conversación del usuario."""
+        pass
+
+    @abstractmethod
+    async def get_window(self, user_id: str, token_budget: int) -> List[Dict[str, str]]:
+        """
+        Devuelve el historial listo para `messages_payload`: resumen de los turnos antiguos
+        (si hay) y los turnos más recientes que caben en el presupuesto de tokens.
+        """
+        pass
+
+    async def close(self) -> None:
+        pass
+
+@dataclass
+class _Conversation:
+    turns: Deque[ConversationTurn]
+    summary: str = ""
+    # Turnos desalojados del historial que aún no se han plegado en el resumen (resumen perezoso)
+    pending_summary: List[ConversationTurn] = field(default_factory=list)
+    last_access: float = field(default_factory=time.monotonic)
+    size: int = 0 # Bytes de texto de `turns`
+
+class InMemoryConversationStore(ConversationStore):
+    """
+    Conversaciones en memoria indexadas por usuario (búsqueda O(1)).
+    Cada conversación guarda como mucho `max_turns` turnos (de hasta `max_turn_chars` caracteres y
+    `max_bytes` de texto entre todos) más un resumen acotado; los turnos que no caben se resumen.
+    Las conversaciones inactivas se desalojan por LRU (`max_conversations`) o por `idle_ttl_seconds`.
+    """
+    def __init__(
+        self,
+        max_turns: int = 20,
+        max_conversations: int = 10_000,
+        idle_ttl_seconds: float = 86400.0,
+        summary_max_chars: int = 600,
+        max_turn_chars: int = 2000,
+        max_bytes: int = 32_000,
+    ):
+        self.max_turns = max_turns
+        self.max_turn_chars = max_turn_chars
+        self.max_bytes = max_bytes
+        self.max_conversations = max_conversations
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self.summary_max_chars = summary_max_chars
+        self._conversations: "OrderedDict[str, _Conversation]" = OrderedDict()
+
+    def _get(self, user_id: str, create: bool) -> Optional[_Conversation]:
+        now = time.monotonic()
+        conversation = self._conversations.get(user_id)
+        if conversation is not None and now - conversation.last_access > self.idle_ttl_seconds:
+            del self._conversations[user_id]
+            conversation = None
+        if conversation is None:
+            if not create:
+                return None
+            conversation = _Conversation(turns=deque(maxlen=self.max_turns))
+            self._conversations[user_id] = conversation
+            while len(self._conversations) > self.max_conversations:
+                self._conversations.popitem(last=False)
+        conversation.last_access = now
+        self._conversations.move_to_end(user_id)
+        return conversation
+
+    async def append(self, user_id: str, role: str, content: str) -> None:
+        conversation = self._get(user_id, create=True)
+        if len(conversation.turns) == conversation.turns.maxlen:
+            conversation.pending_summary.append(conversation.turns[0])
+            conversation.size -= turn_bytes(conversation.turns[0])
+            # Cota de memoria: si nadie pidió la ventana en mucho tiempo, se pliega ya
+            if len(conversation.pending_summary) >= self.max_turns:
+                self._fold_summary(conversation)
+        turn = ConversationTurn(role=role, content=clip_turn(content, self.max_turn_chars))
+        conversation.turns.append(turn)
+        conversation.size += turn_bytes(turn)
+        # Presupuesto de bytes: los turnos más antiguos se resumen aunque no se haya llegado a `max_turns`
+        if self.max_bytes and conversation.size > self.max_bytes:
+            while conversation.size > self.max_bytes and len(conversation.turns) > 1:
+                oldest = conversation.turns.popleft()
+                conversation.size -= turn_bytes(oldest)
+                conversation.pending_summary.append(oldest)
+            self._fold_summary(conversation)
+
+    def _fold_summary(self, conversation: _Conversation) -> None:
+        if conversation.pending_summary:
+            conversation.summary = summarize_turns(
+                conversation.summary, conversation.pending_summary, self.summary_max_chars
+            )
+            conversation.pending_summary.clear()
+
+    async def get_window(self, user_id: str, token_budget: int) -> List[Dict[str, str]]:
+        conversation = self._get(user_id, create=False)
+        if conversation is None:
+            return []
+        self._fold_summary(conversation)
+        return pack_window(conversation.summary, list(conversation.turns), token_budget)
+
+    def __len__(self) -> int:
+        return len(self._conversations)
+
+class SQLiteConversationStore(ConversationStore):
+    """
+    Conversaciones persistidas en SQLite (sobreviven a reinicios). Índice por (user_id, seq),
+    por lo que leer una conversación no depende del número total de conversaciones.
+    Las consultas se ejecutan en un hilo para no bloquear el event loop.
+    """
+    def __init__(
+        self,
+        path: str = "conversations.sqlite3",
+        max_turns: int = 20,
+        summary_max_chars: int = 600,
+        max_turn_chars: int = 2000,
+        max_bytes: int = 32_000,
+    ):
+        self.path = path
+        self.max_turns = max_turns
+        self.max_turn_chars = max_turn_chars
+        self.max_bytes = max_bytes
+        self.summary_max_chars = summary_max_chars
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS conversation_turns (
+                user_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                tokens INTEGER NOT NULL,
+                PRIMARY KEY (user_id, seq)
+            );
+            CREATE TABLE IF NOT EXISTS conversation_summaries (
+                user_id TEXT PRIMARY KEY,
+                summary TEXT NOT NULL
+            );
+            """
+        )
+        self._conn.commit()
+
+    def _append_sync(self, user_id: str, role: str, content: str) -> None:
+        turn = ConversationTurn(role=role, content=clip_turn(content, self.max_turn_chars))
+        with self._lock, self._conn:
+            (last_seq,) = self._conn.execute(
+                "SELECT COALESCE(MAX(seq), 0) FROM conversation_turns WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            self._conn.execute(
+                "INSERT INTO conversation_turns (user_id, seq, role, content, tokens) VALUES (?, ?, ?, ?, ?)",
+                (user_id, last_seq + 1, turn.role, turn.content, turn.tokens),
+            )
+            # Los turnos que exceden `max_turns` o el presupuesto de bytes se pliegan en el resumen y se borran
+            rows = self._conn.execute(
+                "SELECT seq, role, content, tokens FROM conversation_turns WHERE user_id = ? ORDER BY seq",
+                (user_id,),
+            ).fetchall()
+            folded = max(0, len(rows) - self.max_turns)
+            size = sum(len(content.encode("utf-8")) for _, _, content, _ in rows[folded:])
+            while self.max_bytes and size > self.max_bytes and folded < len(rows) - 1:
+                size -= len(rows[folded][2].encode("utf-8"))
+                folded += 1
+            overflow = rows[:folded]
+            if overflow:
+                row = self._conn.execute(
+                    "SELECT summary FROM conversation_summaries WHERE user_id = ?", (user_id,)
+                ).fetchone()
+                summary = summarize_turns(
+                    row[0] if row else "",
+                    (ConversationTurn(role=r, content=c, tokens=t) for _, r, c, t in overflow),
+                    self.summary_max_chars,
+                )
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO conversation_summaries (user_id, summary) VALUES (?, ?)",
+                    (user_id, summary),
+                )
+                self._conn.execute(
+                    "DELETE FROM conversation_turns WHERE user_id = ? AND seq <= ?", (user_id, overflow[-1][0])
+                )
+
+    def _load_sync(self, user_id: str) -> Tuple[str, List[ConversationTurn]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT role, content, tokens FROM conversation_turns WHERE user_id = ? ORDER BY seq DESC LIMIT ?",
+                (user_id, self.max_turns),
+            ).fetchall()
+            summary_row = self._conn.execute(
+                "SELECT summary FROM conversation_summaries WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        turns = [ConversationTurn(role=r, content=c, tokens=t) for r, c, t in reversed(rows)]
+        return (summary_row[0] if summary_row else ""), turns
+
+    async def append(self, user_id: str, role: str, content: str) -> None:
+        await asyncio.to_thread(self._append_sync, user_id, role, content)
+
+    async def get_window(self, user_id: str, token_budget: int) -> List[Dict[str, str]]:
+        summary, turns = await asyncio.to_thread(self._load_sync, user_id)
+        return pack_window(summary, turns, token_budget)
+
+    async def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+def build_conversation_store(settings: Settings = settings) -> Optional[ConversationStore]:
+    if not settings.MEMORY_ENABLED:
+        return None
+    if settings.MEMORY_BACKEND == "sqlite":
+        return SQLiteConversationStore(
+            path=settings.MEMORY_SQLITE_PATH,
+            max_turns=settings.MEMORY_MAX_TURNS,
+            summary_max_chars=settings.MEMORY_SUMMARY_MAX_CHARS,
+            max_turn_chars=settings.MEMORY_MAX_TURN_CHARS,
+            max_bytes=settings.MEMORY_MAX_CONVERSATION_BYTES,
+        )
+    return InMemoryConversationStore(
+        max_turns=settings.MEMORY_MAX_TURNS,
+        max_conversations=settings.MEMORY_MAX_CONVERSATIONS,
+        idle_ttl_seconds=settings.MEMORY_IDLE_TTL_SECONDS,
+        summary_max_chars=settings.MEMORY_SUMMARY_MAX_CHARS,
+        max_turn_chars=settings.MEMORY_MAX_TURN_CHARS,
+        max_bytes=settings.MEMORY_MAX_CONVERSATION_BYTES,
+    )
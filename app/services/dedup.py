@@ -0,0 +1,95 @@
+from abc import ABC, abstractmethod
+from typing import Dict, Optional
+
+from app.core.config import Settings, settings
+from app.services.shared_state import InMemorySharedState, SharedState, SQLiteSharedState
+from app.utils.logging import logger
+
+class DedupBackend(ABC):
+    @abstractmethod
+    async def check_and_mark(self, key: str) -> bool:
+        """
+        Marca `key` como vista y devuelve True si ya lo estaba (y no ha expirado).
+        Debe ser atómica: dos entregas concurrentes de la misma clave no pueden devolver ambas False.
+        """
+        pass
+
+    async def close(self) -> None:
+        pass
+
+class SharedStateDedupBackend(DedupBackend):
+    """
+    Deduplicación sobre el estado compartido (`SharedState.add` es atómico): con un backend
+    compartido, una reentrega de Meta que llega a otro worker también se detecta.
+    """
+    def __init__(self, state: SharedState, ttl_seconds: float = 86400.0, prefix: str = "dedup:", owns_state: bool = False):
+        self.state = state
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+        self.owns_state = owns_state # Si el estado es propio se cierra con el backend
+
+    async def check_and_mark(self, key: str) -> bool:
+        return not await self.state.add(self.prefix + key, ttl=self.ttl_seconds)
+
+    async def close(self) -> None:
+        if self.owns_state:
+            await self.state.close()
+
+class InMemoryDedupBackend(SharedStateDedupBackend):
+    """Conjunto acotado en memoria con expiración (TTL) y desalojo LRU."""
+    def __init__(self, ttl_seconds: float = 86400.0, max_entries: int = 100_000):
+        super().__init__(InMemorySharedState(max_entries=max_entries), ttl_seconds, owns_state=True)
+        self.max_entries = max_entries
+
+    def __len__(self) -> int:
+        return len(self.state)
+
+class SQLiteDedupBackend(SharedStateDedupBackend):
+    """
+    Backend persistente en SQLite, compartido por los procesos que abren el mismo archivo;
+    las consultas se ejecutan en un hilo para no bloquear el event loop.
+    """
+    def __init__(self, path: str = "dedup.sqlite3", ttl_seconds: float = 86400.0):
+        super().__init__(SQLiteSharedState(path=path), ttl_seconds, owns_state=True)
+        self.path = path
+
+    def purge_expired(self) -> int:
+        return self.state.purge_expired()
+
+class MessageDeduplicator:
+    """
+    Capa de idempotencia para los webhooks de Meta, indexada por el id del mensaje de WhatsApp.
+    Meta reintenta las entregas ante timeouts y 5xx; los duplicados se descartan antes de llamar al LLM.
+    """
+    def __init__(self, backend: DedupBackend):
+        self.backend = backend
+        self.hits = 0 # Duplicados detectados
+        self.misses = 0 # Mensajes nuevos
+
+    async def is_duplicate(self, message_id: str) -> bool:
+        try:
+            duplicate = await self.backend.check_and_mark(message_id)
+        except Exception as e:
+            # Ante un fallo del backend es preferible procesar (posible duplicado) que perder el mensaje
+            logger.error("Error consultando el índice de deduplicación para %s: %s", message_id, e)
+            return False
+        if duplicate:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return duplicate
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
+
+def build_dedup_backend(state: Optional[SharedState] = None, settings: Settings = settings) -> DedupBackend:
+    """
+    Sin DEDUP_BACKEND explícito se usa el estado compartido de la app (`state`) cuando no es el de
+    memoria; con STATE_BACKEND="memory" se mantiene el conjunto propio acotado por DEDUP_MAX_ENTRIES.
+    """
+    backend = settings.DEDUP_BACKEND
+    if backend is None and state is not None and not isinstance(state, InMemorySharedState):
+        return SharedStateDedupBackend(state, ttl_seconds=settings.DEDUP_TTL_SECONDS)
+    if backend == "sqlite":
+        return SQLiteDedupBackend(path=settings.DEDUP_SQLITE_PATH, ttl_seconds=settings.DEDUP_TTL_SECONDS)
+    return InMemoryDedupBackend(ttl_seconds=settings.DEDUP_TTL_SECONDS, max_entries=settings.DEDUP_MAX_ENTRIES)
@@ -0,0 +1,289 @@
+import asyncio
+import sqlite3
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, Iterable, List, Optional
+
+from pydantic import ValidationError
+
+from app.core.config import Settings, settings
+from app.core.metrics import Histogram
+from app.models.meta import MetaStatus, MetaStatusWebhook
+from app.utils.logging import logger
+
+# Orden de los estados de un mensaje: una actualización atrasada (p. ej. `sent` después de `read`)
+# completa sus marcas de tiempo pero no hace retroceder el estado
+STATUS_RANK = {"sent": 1, "delivered": 2, "read": 3, "failed": 4}
+
+# Latencias de entrega en segundos (los timestamps de Meta tienen resolución de 1 s)
+LATENCY_BUCKETS = (1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0, 6 * 3600.0, 24 * 3600.0)
+
+class DeliveryState:
+    """Fila de la tabla de estados: una por mensaje saliente."""
+    __slots__ = ("recipient_id", "status", "sent_at", "delivered_at", "read_at", "failed_at", "error_code")
+
+    def __init__(self, recipient_id: Optional[str] = None):
+        self.recipient_id = recipient_id
+        self.status: Optional[str] = None
+        self.sent_at: Optional[int] = None
+        self.delivered_at: Optional[int] = None
+        self.read_at: Optional[int] = None
+        self.failed_at: Optional[int] = None
+        self.error_code: Optional[int] = None
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+class DeliveryTracker:
+    """
+    Ruta ligera para los webhooks de estado (sent/delivered/read/failed), la mayor parte del tráfico.
+
+    El endpoint solo llama a `submit` con los bytes crudos: se agregan a un buffer y se responde a
+    Meta sin parsear nada. Una tarea en segundo plano procesa el buffer por lotes (cada
+    `flush_interval` segundos o al llegar a `batch_size`): valida solo los `statuses`, actualiza
+    la tabla compacta de estados por mensaje (LRU acotada a `max_entries`) y mide la latencia
+    de entrega y de lectura desde el `sent`.
+
+    Con `sqlite_path` las filas modificadas se vuelcan en bloque (un `executemany` por lote)
+    para consultarlas después de que salgan de memoria o tras un reinicio.
+    """
+    def __init__(
+        self,
+        batch_size: int = 500,
+        flush_interval: float = 1.0,
+        max_pending: int = 50_000,
+        max_entries: int = 100_000,
+        sqlite_path: Optional[str] = None,
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_entries = max_entries
+        self.sqlite_path = sqlite_path
+
+        self._pending: Deque[bytes] = deque(maxlen=max_pending)
+        self._table: "OrderedDict[str, DeliveryState]" = OrderedDict()
+        self._dirty: Dict[str, DeliveryState] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+        self._db_lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+        self.latency = Histogram("delivery_latency_seconds", "Latencia desde `sent`", ("status",), LATENCY_BUCKETS)
+        self.received = 0
+        self.dropped = 0
+        self.invalid = 0
+        self.statuses = 0
+        self.batches = 0
+        self.persisted = 0
+        self.by_status: Dict[str, int] = {status: 0 for status in STATUS_RANK}
+
+    # --- Ruta caliente (endpoint) ---
+
+    def submit(self, payload_bytes: bytes) -> None:
+        """Encola un payload de estados sin parsearlo; nunca bloquea ni falla."""
+        if self._task is None:
+            self._start()
+        if len(self._pending) >= self.max_pending:
+            # Se prefiere perder estados viejos a crecer sin límite si el procesamiento se atrasa
+            # (la deque descarta el más antiguo al agregar)
+            self.dropped += 1
+        self._pending.append(payload_bytes)
+        self.received += 1
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    # --- Procesamiento por lotes ---
+
+    def _start(self) -> None:
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run(), name="delivery-tracker")
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._start()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error("Error al procesar estados de entrega: %s", e, exc_info=True)
+
+    def _parse(self, batch: Iterable[bytes]) -> List[MetaStatus]:
+        statuses: List[MetaStatus] = []
+        for payload_bytes in batch:
+            try:
+                statuses.extend(MetaStatusWebhook.model_validate_json(payload_bytes).iter_statuses())
+            except ValidationError:
+                self.invalid += 1
+        return statuses
+
+    def _apply(self, status: MetaStatus) -> None:
+        if status.id is None or status.timestamp is None:
+            self.invalid += 1
+            return
+        rank = STATUS_RANK.get(status.status)
+        if rank is None:
+            return
+        try:
+            timestamp = int(status.timestamp)
+        except ValueError:
+            self.invalid += 1
+            return
+        state = self._table.get(status.id)
+        if state is None:
+            state = self._table[status.id] = DeliveryState(status.recipient_id)
+            if len(self._table) > self.max_entries:
+                self._table.popitem(last=False)
+        else:
+            self._table.move_to_end(status.id)
+
+        had_delivered = state.sent_at is not None and state.delivered_at is not None
+        had_read = state.sent_at is not None and state.read_at is not None
+        column = f"{status.status}_at"
+        if getattr(state, column) is None:
+            setattr(state, column, timestamp)
+        if status.status == "failed" and status.errors:
+            state.error_code = status.errors[0].code
+        if state.status is None or rank >= STATUS_RANK[state.status]:
+            state.status = status.status
+        state.recipient_id = state.recipient_id or status.recipient_id
+
+        # Latencias: se observan una vez, cuando se conocen ambos extremos (en cualquier orden)
+        if not had_delivered and state.sent_at is not None and state.delivered_at is not None:
+            self.latency.labels("delivered").observe(max(0, state.delivered_at - state.sent_at))
+        if not had_read and state.sent_at is not None and state.read_at is not None:
+            self.latency.labels("read").observe(max(0, state.read_at - state.sent_at))
+
+        self.statuses += 1
+        self.by_status[status.status] += 1
+        self._dirty[status.id] = state
+
+    async def flush(self) -> None:
+        """Procesa todo lo pendiente y vuelca a SQLite las filas modificadas."""
+        async with self._flush_lock:
+            while self._pending:
+                batch = [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+                for status in self._parse(batch):
+                    self._apply(status)
+                self.batches += 1
+                await asyncio.sleep(0) # Ceder el loop entre lotes grandes
+            if self._dirty and self.sqlite_path:
+                rows, self._dirty = self._dirty, {}
+                await asyncio.to_thread(self._persist_sync, rows)
+            else:
+                self._dirty.clear()
+
+    # --- SQLite ---
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.sqlite_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS delivery_states (
+                    message_id TEXT PRIMARY KEY,
+                    recipient_id TEXT,
+                    status TEXT NOT NULL,
+                    sent_at INTEGER,
+                    delivered_at INTEGER,
+                    read_at INTEGER,
+                    failed_at INTEGER,
+                    error_code INTEGER
+                )
+                """
+            )
+            self._conn.commit()
+        return self._conn
+
+    def _persist_sync(self, rows: Dict[str, DeliveryState]) -> None:
+        # Upsert que fusiona con lo ya guardado: la fila en memoria puede ser parcial si se desalojó antes
+        rank_case = "CASE {} WHEN 'sent' THEN 1 WHEN 'delivered' THEN 2 WHEN 'read' THEN 3 WHEN 'failed' THEN 4 ELSE 0 END"
+        with self._db_lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany(
+                    f"""
+                    INSERT INTO delivery_states (message_id, recipient_id, status, sent_at, delivered_at, read_at, failed_at, error_code)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(message_id) DO UPDATE SET
+                        recipient_id = COALESCE(delivery_states.recipient_id, excluded.recipient_id),
+                        status = CASE WHEN {rank_case.format('excluded.status')} >= {rank_case.format('delivery_states.status')}
+                                      THEN excluded.status ELSE delivery_states.status END,
+                        sent_at = COALESCE(delivery_states.sent_at, excluded.sent_at),
+                        delivered_at = COALESCE(delivery_states.delivered_at, excluded.delivered_at),
+                        read_at = COALESCE(delivery_states.read_at, excluded.read_at),
+                        failed_at = COALESCE(delivery_states.failed_at, excluded.failed_at),
+                        error_code = COALESCE(excluded.error_code, delivery_states.error_code)
+                    """,
+                    [
+                        (message_id, s.recipient_id, s.status, s.sent_at, s.delivered_at, s.read_at, s.failed_at, s.error_code)
+                        for message_id, s in rows.items()
+                    ],
+                )
+        self.persisted += len(rows)
+
+    def _load_sync(self, message_id: str) -> Optional[Dict[str, Any]]:
+        with self._db_lock:
+            row = self._connect().execute(
+                "SELECT recipient_id, status, sent_at, delivered_at, read_at, failed_at, error_code "
+                "FROM delivery_states WHERE message_id = ?",
+                (message_id,),
+            ).fetchone()
+        return dict(zip(DeliveryState.__slots__, row)) if row else None
+
+    async def get(self, message_id: str) -> Optional[Dict[str, Any]]:
+        """Estado de un mensaje: desde memoria o, si ya se desalojó, desde SQLite."""
+        state = self._table.get(message_id)
+        if state is not None:
+            return state.as_dict()
+        if self.sqlite_path:
+            return await asyncio.to_thread(self._load_sync, message_id)
+        return None
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+        with self._db_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def stats(self) -> Dict[str, Any]:
+        stats: Dict[str, Any] = {
+            "received": self.received,
+            "pending": len(self._pending),
+            "dropped": self.dropped,
+            "invalid": self.invalid,
+            "statuses": self.statuses,
+            "batches": self.batches,
+            "tracked": len(self._table),
+            "persisted": self.persisted,
+        }
+        for status, count in self.by_status.items():
+            stats[f"status_{status}"] = count
+        for status in ("delivered", "read"):
+            histogram = self.latency.labels(status)
+            for q in (0.5, 0.95, 0.99):
+                stats[f"{status}_latency_p{int(q * 100)}_seconds"] = histogram.quantile(q)
+        return stats
+
+def build_delivery_tracker(settings: Settings = settings) -> DeliveryTracker:
+    return DeliveryTracker(
+        batch_size=settings.DELIVERY_BATCH_SIZE,
+        flush_interval=settings.DELIVERY_FLUSH_INTERVAL_SECONDS,
+        max_pending=settings.DELIVERY_MAX_PENDING,
+        max_entries=settings.DELIVERY_MAX_ENTRIES,
+        sqlite_path=settings.DELIVERY_SQLITE_PATH if settings.DELIVERY_BACKEND == "sqlite" else None,
+    )
@@ -0,0 +1,40 @@
+import hashlib
+import math
+from abc import ABC, abstractmethod
+from typing import List
+
+from app.utils.text import normalize_text
+
+class EmbeddingInterface(ABC):
+    @abstractmethod
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        """
+        Devuelve un vector (normalizado a norma 1) por cada texto de entrada.
+        """
+        pass
+
+class HashingEmbedder(EmbeddingInterface):
+    """
+    Embedder local sin dependencias ni red: feature hashing de palabras y bigramas.
+    No captura sinónimos como un modelo real, pero agrupa bien variantes de la misma pregunta
+    y permite probar la búsqueda por similitud de forma determinista y offline.
+    """
+    def __init__(self, dimensions: int = 256):
+        self.dimensions = dimensions
+
+    def _embed_one(self, text: str) -> List[float]:
+        vector = [0.0] * self.dimensions
+        words = normalize_text(text).split()
+        features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+        for feature in features:
+            digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dimensions
+            sign = 1.0 if digest[4] & 1 else -1.0
+            vector[bucket] += sign
+        norm = math.sqrt(sum(value * value for value in vector))
+        if norm:
+            vector = [value / norm for value in vector]
+        return vector
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed_one(text) for text in texts]
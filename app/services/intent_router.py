@@ -0,0 +1,279 @@
+import asyncio
+import json
+import os
+import re
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from app.core.config import Settings, settings
+from app.utils.logging import logger
+from app.utils.text import normalize_text
+
+_KEYWORDS_GROUP = "kw"
+_METRIC_UNSAFE = re.compile(r"\W")
+
+# Palabras que no cambian el sentido de un mensaje anclado ("¿cuál es el horario?" = "horario").
+# "no", "pero" y similares quedan fuera a propósito: "gracias pero no me sirve" no es un agradecimiento.
+FILLER_WORDS = frozenset((
+    "a", "al", "con", "de", "del", "el", "en", "es", "la", "las", "lo", "los", "para", "por", "son",
+    "su", "sus", "un", "una", "y", "que", "cual", "cuales", "cuando", "como", "donde", "me", "te",
+    "le", "les", "nos", "ustedes", "usted", "tu", "hoy", "favor", "porfa", "ok", "oye", "hey",
+))
+
+@dataclass
+class IntentRule:
+    """
+    Intención respondida sin LLM. `keywords` y `phrases` se comparan como palabras completas sobre el
+    texto normalizado (ver `normalize_text`), igual que `patterns` (expresiones regulares).
+    Solo aplica a mensajes de hasta `max_words` palabras: "hola" sí, "hola, quiero cambiar mi pedido" no.
+
+    Con `anchored` las coincidencias (de cualquier intención) deben cubrir todo el mensaje salvo
+    palabras de relleno (`FILLER_WORDS`): "gracias" y "muchas gracias!" sí, "gracias pero no me
+    sirve" no; "¿cuál es el horario?" sí, "¿cuál es el horario de devoluciones?" no.
+    """
+    name: str
+    responses: List[str]
+    keywords: List[str] = field(default_factory=list)
+    phrases: List[str] = field(default_factory=list)
+    patterns: List[str] = field(default_factory=list)
+    max_words: Optional[int] = None
+    priority: int = 0 # Si un mensaje coincide con varias intenciones gana la de mayor prioridad
+    anchored: bool = False
+
+def _trie_pattern(literals: Iterable[str]) -> str:
+    """
+    Alternativa de literales con forma de árbol de prefijos: "hola|holas|hora" -> "ho(?:la(?:s)?|ra)".
+    El motor de regex avanza por un solo camino del árbol en cada posición, así el costo depende del
+    largo del literal más largo y no de cuántos literales hay.
+    """
+    trie: Dict[str, Any] = {}
+    for literal in literals:
+        node = trie
+        for char in literal:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def render(node: Dict[str, Any]) -> str:
+        branches = [re.escape(char) + render(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        ends = "" in node
+        if len(branches) == 1 and not ends:
+            return branches[0]
+        group = "(?:" + "|".join(branches) + ")"
+        return group + "?" if ends else group # El final del literal va al último: se prueba primero el más largo
+
+    return render(trie)
+
+def parse_rules(data: Any) -> List[IntentRule]:
+    """Valida el contenido del archivo de intenciones (`{"intents": [...]}`)."""
+    items = data.get("intents") if isinstance(data, dict) else data
+    if not isinstance(items, list):
+        raise ValueError("Se esperaba una lista de intenciones en 'intents'")
+    rules, names = [], set()
+    for item in items:
+        if not isinstance(item, dict) or not item.get("name"):
+            raise ValueError(f"Intención sin nombre: {item!r}")
+        responses = item.get("responses") or ([item["response"]] if item.get("response") else [])
+        if not responses:
+            raise ValueError(f"La intención '{item['name']}' no tiene respuesta")
+        if item["name"] in names:
+            raise ValueError(f"Intención repetida: '{item['name']}'")
+        names.add(item["name"])
+        rules.append(IntentRule(
+            name=item["name"],
+            responses=list(responses),
+            keywords=list(item.get("keywords", ())),
+            phrases=list(item.get("phrases", ())),
+            patterns=list(item.get("patterns", ())),
+            max_words=item.get("max_words"),
+            priority=int(item.get("priority", 0)),
+            anchored=bool(item.get("anchored", False)),
+        ))
+    return rules
+
+class IntentMatcher:
+    """
+    Todas las reglas compiladas en una sola expresión regular: un grupo con el árbol de prefijos de
+    todas las palabras clave y frases (la intención se resuelve con un diccionario por el texto
+    encontrado) seguido de un grupo por cada regex. Inmutable: recargar crea otro matcher.
+    """
+    def __init__(self, rules: List[IntentRule], default_max_words: int = 8):
+        self.rules = rules
+        self.default_max_words = default_max_words
+        self._literal_intent: Dict[str, int] = {}
+        self._group_intent: Dict[str, int] = {}
+        alternatives = []
+        for index, rule in enumerate(rules):
+            for literal in (*rule.keywords, *rule.phrases):
+                literal = normalize_text(literal)
+                if literal:
+                    # Un literal repetido en dos intenciones queda en la de mayor prioridad
+                    current = self._literal_intent.get(literal)
+                    if current is None or rules[current].priority < rule.priority:
+                        self._literal_intent[literal] = index
+        if self._literal_intent:
+            alternatives.append(fr"(?P<{_KEYWORDS_GROUP}>\b{_trie_pattern(self._literal_intent)}\b)")
+        for index, rule in enumerate(rules):
+            for number, pattern in enumerate(rule.patterns):
+                name = f"r{index}_{number}"
+                re.compile(pattern) # Error con la regex concreta antes que con la alternancia completa
+                alternatives.append(f"(?P<{name}>{pattern})")
+                self._group_intent[name] = index
+        self.pattern_count = len(self._literal_intent) + len(self._group_intent)
+        self._regex = re.compile("|".join(alternatives)) if alternatives else None
+        self._max_words = max((rule.max_words or default_max_words for rule in rules), default=0)
+        self._next_response = [0] * len(rules)
+
+    def match(self, text: str) -> Optional[Tuple[IntentRule, str]]:
+        """Intención y respuesta para un mensaje, o None si debe ir al LLM."""
+        if self._regex is None:
+            return None
+        normalized = normalize_text(text)
+        words = normalized.count(" ") + 1 if normalized else 0
+        if not words or words > self._max_words:
+            return None
+        spans: List[Tuple[int, int]] = []
+        candidates: List[int] = []
+        for found in self._regex.finditer(normalized):
+            spans.append(found.span())
+            group = found.lastgroup
+            index = self._literal_intent.get(found.group()) if group == _KEYWORDS_GROUP else self._group_intent.get(group)
+            if index is None or words > (self.rules[index].max_words or self.default_max_words):
+                continue
+            candidates.append(index)
+        best: Optional[int] = None
+        covered: Optional[bool] = None # Se calcula una vez y solo si alguna candidata está anclada
+        for index in candidates:
+            if self.rules[index].anchored:
+                if covered is None:
+                    covered = _covered(normalized, spans)
+                if not covered:
+                    continue
+            if best is None or self.rules[index].priority > self.rules[best].priority:
+                best = index
+        if best is None:
+            return None
+        rule = self.rules[best]
+        # Las variantes de respuesta se alternan para no contestar siempre lo mismo
+        response = rule.responses[self._next_response[best] % len(rule.responses)]
+        self._next_response[best] += 1
+        return rule, response
+
+def _covered(normalized: str, spans: List[Tuple[int, int]]) -> bool:
+    """True si fuera de las coincidencias solo quedan palabras de relleno."""
+    rest, start = [], 0
+    for begin, end in spans:
+        rest.append(normalized[start:begin])
+        start = end
+    rest.append(normalized[start:])
+    return all(word in FILLER_WORDS for word in " ".join(rest).split())
+
+class IntentRouter:
+    """
+    Etapa previa al LLM en `MetaService`: saludos, agradecimientos, horarios y otros mensajes
+    frecuentes se responden desde plantillas sin pasar por Groq; el resto sigue al LLM.
+
+    Las reglas se leen de `path` (JSON) y se recargan sin reiniciar cuando cambia el archivo:
+    como mucho una vez cada `reload_interval` se compara su mtime y, si cambió, se compila el
+    nuevo matcher en un hilo y se reemplaza el anterior. Un archivo inválido se informa en el log
+    y se siguen usando las reglas cargadas.
+    """
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        rules: Optional[List[IntentRule]] = None,
+        reload_interval: float = 5.0,
+        default_max_words: int = 8,
+    ):
+        self.path = path
+        self.reload_interval = reload_interval
+        self.default_max_words = default_max_words
+        self.matcher = IntentMatcher(rules or [], default_max_words)
+        self._mtime: Optional[float] = None
+        self._checked_at = 0.0
+        self._reload_lock = asyncio.Lock()
+        self.hits: Dict[str, int] = {}
+
+        self.checked = 0
+        self.matched = 0
+        self.match_seconds = 0.0
+        self.reloads = 0
+        self.reload_errors = 0
+        if path is not None and rules is None:
+            try:
+                self._install(*self._compile_sync())
+            except (OSError, ValueError, re.error) as e:
+                # Sin reglas todo va al LLM; se vuelve a intentar cuando el archivo cambie
+                self.reload_errors += 1
+                logger.error("No se pudieron cargar las intenciones de %s: %s", path, e)
+
+    def _compile_sync(self) -> Tuple[IntentMatcher, float]:
+        mtime = os.stat(self.path).st_mtime
+        with open(self.path, encoding="utf-8") as rules_file:
+            rules = parse_rules(json.load(rules_file))
+        return IntentMatcher(rules, self.default_max_words), mtime
+
+    def _install(self, matcher: IntentMatcher, mtime: float) -> None:
+        self.matcher = matcher
+        self._mtime = mtime
+        self.hits = {rule.name: self.hits.get(rule.name, 0) for rule in matcher.rules}
+        logger.info("Intenciones cargadas desde %s: %d reglas, %d patrones", self.path, len(matcher.rules), matcher.pattern_count)
+
+    async def reload_if_changed(self) -> bool:
+        """Recarga las reglas si el archivo cambió (revisa el mtime como mucho cada `reload_interval`)."""
+        now = time.monotonic()
+        if self.path is None or now - self._checked_at < self.reload_interval or self._reload_lock.locked():
+            return False
+        self._checked_at = now
+        async with self._reload_lock:
+            try:
+                if os.stat(self.path).st_mtime == self._mtime:
+                    return False
+                compiled = await asyncio.to_thread(self._compile_sync)
+            except (OSError, ValueError, re.error) as e:
+                self.reload_errors += 1
+                logger.error("No se pudieron recargar las intenciones de %s (se mantienen las anteriores): %s", self.path, e)
+                return False
+            self._install(*compiled)
+            self.reloads += 1
+            return True
+
+    async def route(self, text: str) -> Optional[str]:
+        """Respuesta de plantilla para el mensaje, o None si debe responderla el LLM."""
+        await self.reload_if_changed()
+        started_at = time.perf_counter()
+        result = self.matcher.match(text)
+        self.match_seconds += time.perf_counter() - started_at
+        self.checked += 1
+        if result is None:
+            return None
+        rule, response = result
+        self.matched += 1
+        self.hits[rule.name] = self.hits.get(rule.name, 0) + 1
+        return response
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "rules": len(self.matcher.rules),
+            "patterns": self.matcher.pattern_count,
+            "checked": self.checked,
+            "matched": self.matched,
+            "hit_ratio": self.matched / self.checked if self.checked else 0.0,
+            "avg_match_us": self.match_seconds / self.checked * 1e6 if self.checked else 0.0,
+            "reloads": self.reloads,
+            "reload_errors": self.reload_errors,
+            **{f"hits_{_METRIC_UNSAFE.sub('_', name)}": count for name, count in self.hits.items()},
+        }
+
+def build_intent_router(settings: Settings = settings, path: Optional[str] = None) -> Optional[IntentRouter]:
+    """Intenciones de INTENTS_FILE o, para un tenant, las de su propio archivo (`path`)."""
+    path = path or settings.INTENTS_FILE
+    if not path:
+        return None
+    return IntentRouter(
+        path=path,
+        reload_interval=settings.INTENTS_RELOAD_INTERVAL_SECONDS,
+        default_max_words=settings.INTENTS_MAX_WORDS,
+    )
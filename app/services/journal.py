@@ -0,0 +1,375 @@
+import asyncio
+import json
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+from app.core.config import Settings, settings
+from app.utils.logging import logger
+
+try:
+    import fcntl
+except ImportError: # Windows: sin bloqueo entre procesos
+    fcntl = None
+
+SEGMENT_PREFIX = "journal-"
+SEGMENT_SUFFIX = ".log"
+SLOT_PREFIX = "worker-"
+LOCK_FILE = ".lock"
+
+INBOUND = "inbound" # Payload de webhook aceptado (se confirmó a Meta)
+OUTBOUND = "outbound" # Envío a la Graph API
+DONE = "done" # Cierre de una entrada anterior (respuesta enviada, envío resuelto)
+
+@dataclass
+class JournalEntry:
+    seq: int
+    kind: str
+    ts: float
+    data: Any
+    segment: int = 0
+
+class JournaledWebhook(NamedTuple):
+    """Payload encolado en el dispatcher junto con su entrada del journal (para cerrarla al terminar)."""
+    payload: Any
+    entry_id: int
+    replayed: bool = False # Reenviado desde el journal al arrancar: no pasa por la deduplicación
+
+class JournalLocked(RuntimeError):
+    """Otro proceso ya usa el directorio del journal (o todos sus slots)."""
+
+def _lock_directory(directory: str) -> Optional[Any]:
+    """Bloqueo exclusivo del directorio mientras el archivo siga abierto; None si ya lo tiene otro proceso."""
+    os.makedirs(directory, exist_ok=True)
+    lock_file = open(os.path.join(directory, LOCK_FILE), "a")
+    if fcntl is None:
+        return lock_file
+    try:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+def segment_path(directory: str, number: int) -> str:
+    return os.path.join(directory, f"{SEGMENT_PREFIX}{number:06d}{SEGMENT_SUFFIX}")
+
+def list_segments(directory: str) -> List[int]:
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+        for name in os.listdir(directory)
+        if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)
+    )
+
+def read_segment(path: str, number: int = 0) -> Iterator[JournalEntry]:
+    """
+    Registros de un segmento en orden. Una línea incompleta o corrupta (escritura cortada por una caída)
+    se descarta: solo puede ser parte del último lote, que nunca se confirmó.
+    """
+    with open(path, "rb") as segment:
+        for line in segment:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                logger.warning("Registro incompleto descartado en %s", path)
+                continue
+            yield JournalEntry(record["s"], record["k"], record.get("t", 0.0), record.get("d"), number)
+
+def read_journal(directory: str) -> Iterator[JournalEntry]:
+    """Todos los registros de todos los segmentos, en orden (para la recuperación y el replay offline)."""
+    for number in list_segments(directory):
+        yield from read_segment(segment_path(directory, number), number)
+
+class Journal:
+    """
+    Journal local de solo escritura con los webhooks aceptados y los envíos salientes, para no perder
+    mensajes si el proceso muere entre el 200 a Meta y el envío de la respuesta.
+
+    Group commit: los registros se acumulan durante `commit_interval` (o hasta `max_batch`) y se escriben
+    con un único `write` + `fsync` por lote en un hilo aparte; `append(durable=True)` espera a que su
+    lote esté en disco. Los cierres (`complete`) no esperan: si se pierden, la entrada se reenvía al
+    arrancar (entrega al menos una vez).
+
+    El log se divide en segmentos de hasta `segment_max_bytes`. Los segmentos se borran del más viejo
+    en adelante cuando quedan más de `retain_segments` segmentos más nuevos (los retenidos sirven para
+    el replay offline, ver `benchmarks/replay_journal.py`). Solo se borra un prefijo: un cierre va
+    siempre después de su entrada, así ningún cierre que se borra deja una entrada viva sin cerrar.
+    Si el segmento más viejo aún tiene entradas abiertas, se copian (mismo id) al segmento actual y
+    se borra en la compactación siguiente: una entrada que tarda no retiene todo el log.
+
+    Cada proceso escribe en un directorio propio y bloqueado (flock): con `slots` > 1 (WORKERS
+    procesos) toma el primer `<directory>/worker-N` libre, así solo su dueño recupera y reenvía sus
+    entradas y ningún otro proceso escribe ni compacta sus segmentos. Un worker que se reinicia
+    toma el slot que dejó libre el anterior.
+    """
+    def __init__(
+        self,
+        directory: str = "journal",
+        segment_max_bytes: int = 16 * 1024 * 1024,
+        commit_interval: float = 0.002,
+        max_batch: int = 512,
+        retain_segments: int = 4,
+        fsync: bool = True,
+        slots: int = 1,
+    ):
+        self.base_directory = directory
+        self.directory = directory # Con slots > 1, el subdirectorio tomado al abrir
+        self.slots = max(1, slots)
+        self._lock_file: Optional[Any] = None
+        self.segment_max_bytes = segment_max_bytes
+        self.commit_interval = commit_interval
+        self.max_batch = max_batch
+        self.retain_segments = retain_segments
+        self.fsync = fsync
+
+        self._next_seq = 1
+        self._segment = 0
+        self._file: Optional[Any] = None
+        self._buffer: List[Tuple[bytes, int, str, Optional[asyncio.Future]]] = []
+        self._has_pending: Optional[asyncio.Event] = None
+        self._writer: Optional[asyncio.Task] = None
+        self._open_lock = asyncio.Lock()
+        self._opened = False
+        self._closing = False
+        self._entry_segment: Dict[int, int] = {} # Entradas abiertas -> segmento
+        self._segment_open: Dict[int, int] = {} # Entradas abiertas por segmento
+        self.recovered: List[JournalEntry] = []
+
+        self.appended = 0
+        self.completed = 0
+        self.batches = 0
+        self.fsyncs = 0
+        self.write_seconds = 0.0
+        self.segments_removed = 0
+        self.forwarded = 0 # Entradas abiertas copiadas al segmento actual para liberar uno viejo
+
+    # --- Apertura y recuperación ---
+
+    def _claim_directory(self) -> None:
+        if self.slots == 1:
+            candidates = [self.base_directory]
+        else:
+            candidates = [os.path.join(self.base_directory, f"{SLOT_PREFIX}{slot}") for slot in range(self.slots)]
+        for directory in candidates:
+            self._lock_file = _lock_directory(directory)
+            if self._lock_file is not None:
+                self.directory = directory
+                return
+        raise JournalLocked(f"El journal {self.base_directory} ya está en uso por otros {self.slots} procesos")
+
+    def _orphan_slots(self) -> List[str]:
+        if not os.path.isdir(self.base_directory):
+            return []
+        return sorted(
+            name for name in os.listdir(self.base_directory)
+            if name.startswith(SLOT_PREFIX) and name[len(SLOT_PREFIX):].isdigit() and int(name[len(SLOT_PREFIX):]) >= self.slots
+        )
+
+    def _recover_sync(self) -> List[JournalEntry]:
+        self._claim_directory()
+        orphans = self._orphan_slots()
+        if orphans:
+            logger.warning("Journal: %s no pertenecen a ningún worker (WORKERS=%d) y no se reenvían", ", ".join(orphans), self.slots)
+        pending: Dict[int, JournalEntry] = {}
+        last_seq = 0
+        segments = list_segments(self.directory)
+        for entry in read_journal(self.directory):
+            last_seq = max(last_seq, entry.seq)
+            if entry.kind == DONE:
+                pending.pop(entry.seq, None)
+            else:
+                pending[entry.seq] = entry
+        self._next_seq = last_seq + 1
+        for entry in pending.values():
+            self._track_open(entry.seq, entry.segment)
+        # Siempre se escribe en un segmento nuevo: el último pudo quedar con una línea cortada
+        self._segment = (segments[-1] if segments else 0) + 1
+        self._file = open(segment_path(self.directory, self._segment), "ab")
+        return list(pending.values())
+
+    async def open(self) -> None:
+        """Lee los segmentos existentes (entradas sin cerrar en `recovered`) y arranca el escritor."""
+        async with self._open_lock:
+            if self._opened:
+                return
+            self.recovered = await asyncio.to_thread(self._recover_sync)
+            self._has_pending = asyncio.Event()
+            self._writer = asyncio.create_task(self._write_loop(), name="journal-writer")
+            self._opened = True
+            if self.recovered:
+                logger.warning("Journal: %d entradas sin terminar de la ejecución anterior", len(self.recovered))
+
+    def take_recovered(self) -> List[JournalEntry]:
+        recovered, self.recovered = self.recovered, []
+        return recovered
+
+    # --- Escritura ---
+
+    def _enqueue(self, seq: int, kind: str, record: Dict[str, Any], future: Optional[asyncio.Future]) -> None:
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+        self._buffer.append((line, seq, kind, future))
+        self._has_pending.set()
+
+    async def append(self, kind: str, data: Any, durable: bool = True) -> int:
+        """Agrega un registro y devuelve su id; con `durable` espera a que su lote tenga fsync."""
+        if not self._opened:
+            await self.open()
+        seq = self._next_seq
+        self._next_seq += 1
+        future = asyncio.get_running_loop().create_future() if durable else None
+        self._enqueue(seq, kind, {"s": seq, "k": kind, "t": time.time(), "d": data}, future)
+        self.appended += 1
+        if future is not None:
+            await future
+        return seq
+
+    def complete(self, seq: Optional[int]) -> None:
+        """Cierra una entrada (sin esperar al disco)."""
+        if seq is None or not self._opened:
+            return
+        self._enqueue(seq, DONE, {"s": seq, "k": DONE}, None)
+        self.completed += 1
+
+    def _write_sync(self, lines: List[bytes]) -> Tuple[int, Optional[int]]:
+        """Escribe un lote en el segmento actual; devuelve ese segmento y el anterior si se rotó."""
+        started_at = time.perf_counter()
+        segment = self._segment
+        self._file.write(b"".join(lines))
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        rotated = None
+        if self._file.tell() >= self.segment_max_bytes:
+            self._file.close()
+            rotated = segment
+            self._segment += 1
+            self._file = open(segment_path(self.directory, self._segment), "ab")
+        self.write_seconds += time.perf_counter() - started_at
+        return segment, rotated
+
+    async def _write_loop(self) -> None:
+        while True:
+            await self._has_pending.wait()
+            if self._closing and not self._buffer:
+                return
+            if not self._closing and len(self._buffer) < self.max_batch:
+                await asyncio.sleep(self.commit_interval) # Ventana del lote: se suman los que lleguen mientras
+            await self._flush_buffer()
+
+    async def _flush_buffer(self) -> None:
+        batch, self._buffer = self._buffer[:self.max_batch], self._buffer[self.max_batch:]
+        if not self._buffer and not self._closing:
+            self._has_pending.clear()
+        if not batch:
+            return
+        try:
+            segment, rotated = await asyncio.to_thread(self._write_sync, [line for line, *_ in batch])
+        except Exception as e:
+            logger.error("Error al escribir el journal: %s", e, exc_info=True)
+            for *_, future in batch:
+                if future is not None and not future.done():
+                    future.set_exception(e)
+            return
+        self.batches += 1
+        self.fsyncs += self.fsync
+        for _, seq, kind, future in batch:
+            if kind == DONE:
+                self._close_entry(seq)
+            else:
+                self._track_open(seq, segment)
+            if future is not None and not future.done():
+                future.set_result(None)
+        if rotated is not None:
+            await self._compact()
+
+    # --- Segmentos ---
+
+    def _track_open(self, seq: int, segment: int) -> None:
+        if seq in self._entry_segment:
+            self._close_entry(seq) # Copia de una entrada abierta en un segmento más nuevo
+        self._entry_segment[seq] = segment
+        self._segment_open[segment] = self._segment_open.get(segment, 0) + 1
+
+    def _close_entry(self, seq: int) -> None:
+        segment = self._entry_segment.pop(seq, None)
+        if segment is None:
+            return
+        self._segment_open[segment] -= 1
+        if not self._segment_open[segment]:
+            del self._segment_open[segment]
+
+    def _compactable_segments(self) -> Tuple[List[int], Optional[int]]:
+        """Prefijo de segmentos que se pueden borrar y, si lo corta, el segmento con entradas abiertas."""
+        segments = [number for number in list_segments(self.directory) if number != self._segment]
+        removable = []
+        for number in segments[:max(0, len(segments) - self.retain_segments)]:
+            if self._segment_open.get(number):
+                return removable, number
+            removable.append(number)
+        return removable, None
+
+    def _read_open_entries(self, number: int, seqs: Set[int]) -> List[JournalEntry]:
+        return [entry for entry in read_segment(segment_path(self.directory, number), number) if entry.seq in seqs and entry.kind != DONE]
+
+    async def _forward_open_entries(self, number: int) -> None:
+        seqs = {seq for seq, segment in self._entry_segment.items() if segment == number}
+        entries = await asyncio.to_thread(self._read_open_entries, number, seqs)
+        # Una entrada cuyo cierre ya está en el buffer no se copia: la copia quedaría después del cierre
+        closing = {seq for _, seq, kind, _ in self._buffer if kind == DONE}
+        for entry in entries:
+            if self._entry_segment.get(entry.seq) == number and entry.seq not in closing:
+                self._enqueue(entry.seq, entry.kind, {"s": entry.seq, "k": entry.kind, "t": entry.ts, "d": entry.data}, None)
+                self.forwarded += 1
+
+    async def _compact(self) -> None:
+        removable, blocking = await asyncio.to_thread(self._compactable_segments)
+        for number in removable:
+            await asyncio.to_thread(os.remove, segment_path(self.directory, number))
+            self.segments_removed += 1
+        if blocking is not None and not self._closing:
+            await self._forward_open_entries(blocking)
+
+    async def close(self) -> None:
+        """Escribe lo pendiente y cierra el segmento actual."""
+        if not self._opened:
+            return
+        # El escritor vacía el buffer y termina (no se cancela a mitad de una escritura)
+        self._closing = True
+        self._has_pending.set()
+        await self._writer
+        await self._compact()
+        self._file.close()
+        self._lock_file.close() # Libera el directorio para el siguiente proceso
+        self._lock_file = None
+        self._opened = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "appended": self.appended,
+            "completed": self.completed,
+            "open_entries": len(self._entry_segment),
+            "pending_writes": len(self._buffer),
+            "batches": self.batches,
+            "fsyncs": self.fsyncs,
+            "records_per_batch": (self.appended + self.completed) / self.batches if self.batches else 0.0,
+            "avg_write_ms": self.write_seconds / self.batches * 1000 if self.batches else 0.0,
+            "segment": self._segment,
+            "segments_removed": self.segments_removed,
+            "forwarded": self.forwarded,
+        }
+
+def build_journal(settings: Settings = settings) -> Optional[Journal]:
+    if not settings.JOURNAL_ENABLED:
+        return None
+    return Journal(
+        directory=settings.JOURNAL_DIR,
+        segment_max_bytes=settings.JOURNAL_SEGMENT_MAX_BYTES,
+        commit_interval=settings.JOURNAL_COMMIT_INTERVAL_SECONDS,
+        max_batch=settings.JOURNAL_MAX_BATCH,
+        retain_segments=settings.JOURNAL_RETAIN_SEGMENTS,
+        fsync=settings.JOURNAL_FSYNC,
+        slots=settings.WORKERS, # Un subdirectorio por proceso de uvicorn
+    )
@@ -0,0 +1,181 @@
+import asyncio
+import contextlib
+import hashlib
+import json
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Hashable, List, Optional
+
+from app.core.metrics import metrics
+from app.utils.text import normalize_text
+
+CreateFn = Callable[..., Awaitable[Any]]
+
+class FairLimiter:
+    """
+    Límite de concurrencia con cola FIFO estricta: cuando se libera un cupo se entrega directamente
+    al que lleva más tiempo esperando, de modo que una ráfaga nueva no puede adelantar a los que ya
+    estaban en cola.
+    """
+    def __init__(self, limit: int):
+        if limit < 1:
+            raise ValueError("limit debe ser >= 1")
+        self.limit = limit
+        self._active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self.max_waiting = 0
+        self.waited = 0
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self) -> None:
+        if self._active < self.limit and not self._waiters:
+            self._active += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.waited += 1
+        self.max_waiting = max(self.max_waiting, len(self._waiters))
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # El cupo ya nos fue entregado: pasarlo al siguiente en la cola
+                self.release()
+            else:
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+            raise
+
+    def release(self) -> None:
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None) # El cupo pasa al siguiente sin liberarse (`_active` no cambia)
+                return
+        self._active -= 1
+
+    async def __aenter__(self) -> "FairLimiter":
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self.release()
+
+class SingleFlight:
+    """
+    Coalescencia de llamadas concurrentes idénticas: la primera llamada con una clave ejecuta la función
+    y las que llegan mientras está en curso esperan el mismo resultado (o la misma excepción).
+    La llamada corre en su propia tarea, así que cancelar a uno de los que esperan no afecta al resto;
+    si se cancela el último que la esperaba (timeout, perdedor de un hedge) se cancela también la llamada.
+    """
+    def __init__(self):
+        self._in_flight: Dict[Hashable, asyncio.Task] = {}
+        self._waiters: Dict[asyncio.Task, int] = {}
+        self.issued = 0
+        self.coalesced = 0
+
+    def __len__(self) -> int:
+        return len(self._in_flight)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._in_flight.get(key)
+        if task is None:
+            self.issued += 1
+            task = asyncio.ensure_future(fn())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        else:
+            self.coalesced += 1
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._waiters[task] == 1 and not task.done():
+                task.cancel() # Nadie más espera el resultado: liberar el cupo de Groq
+            raise
+        finally:
+            self._waiters[task] -= 1
+            if not self._waiters[task]:
+                del self._waiters[task]
+
+def completion_key(model: str, messages: List[Dict[str, str]], **options: Any) -> str:
+    """
+    Clave de coalescencia: modelo, opciones y mensajes con el contenido normalizado
+    (mayúsculas, tildes y puntuación no distinguen dos preguntas).
+    """
+    canonical = json.dumps(
+        [model, sorted(options.items()), [(m["role"], normalize_text(m["content"])) for m in messages]],
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.blake2b(canonical.encode("utf-8"), digest_size=16).hexdigest()
+
+class CoalescingCompletions:
+    """
+    Capa delante de `client.chat.completions.create`: coalescencia single-flight de peticiones idénticas
+    y límite global de peticiones a Groq en curso con cola justa. Recibe la función `create` en cada
+    llamada para no fijar el cliente (el servicio puede reemplazarlo, p. ej. en tests).
+
+    Con `limited=False` la llamada no toma cupo: es para quien ya lo tomó con `limiter` antes de
+    entrar al router de modelos, así la espera en la cola local no cuenta para el timeout, el
+    circuit breaker ni el hedging (que miden solo la respuesta de Groq).
+    """
+    def __init__(self, max_concurrency: int = 16, coalesce: bool = True):
+        self.limiter = FairLimiter(max_concurrency)
+        self.single_flight: Optional[SingleFlight] = SingleFlight() if coalesce else None
+        self.uncoalesced = 0 # Llamadas emitidas sin pasar por single-flight (desactivado o streaming)
+
+    async def _create(self, create_fn: CreateFn, messages: List[Dict[str, str]], model: str, limited: bool, **options: Any) -> Any:
+        async with self.limiter if limited else contextlib.nullcontext():
+            with metrics.stage("groq"):
+                completion = await create_fn(messages=messages, model=model, **options)
+        # Solo las llamadas emitidas cuentan tokens: las coalescidas comparten esta misma respuesta
+        metrics.record_token_usage(getattr(completion, "usage", None))
+        return completion
+
+    async def create(
+        self, create_fn: CreateFn, messages: List[Dict[str, str]], model: str, limited: bool = True, **options: Any,
+    ) -> Any:
+        if self.single_flight is None:
+            self.uncoalesced += 1
+            return await self._create(create_fn, messages, model, limited, **options)
+        key = completion_key(model, messages, **options)
+        return await self.single_flight.do(key, lambda: self._create(create_fn, messages, model, limited, **options))
+
+    async def stream(
+        self, create_fn: CreateFn, messages: List[Dict[str, str]], model: str, limited: bool = True, **options: Any,
+    ) -> AsyncIterator[Any]:
+        """
+        Respuesta en streaming: no se coalesce (cada cliente consume su propio stream), pero ocupa
+        un cupo del limitador durante todo el stream, que es lo que dura la petición en Groq.
+        """
+        self.uncoalesced += 1
+        async with self.limiter if limited else contextlib.nullcontext():
+            with metrics.stage("groq"):
+                stream = await create_fn(messages=messages, model=model, stream=True, **options)
+                async for chunk in stream:
+                    # Groq informa el uso en el último fragmento (`x_groq.usage`)
+                    metrics.record_token_usage(getattr(getattr(chunk, "x_groq", None), "usage", None))
+                    yield chunk
+
+    def stats(self) -> Dict[str, Any]:
+        issued, coalesced = self.uncoalesced, 0
+        if self.single_flight is not None:
+            issued += self.single_flight.issued
+            coalesced = self.single_flight.coalesced
+        return {
+            "issued": issued,
+            "coalesced": coalesced,
+            "in_flight": self.limiter.active,
+            "waiting": self.limiter.waiting,
+            "max_waiting": self.limiter.max_waiting,
+            "max_concurrency": self.limiter.limit,
+        }
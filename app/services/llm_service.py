@@ -1,74 +1,267 @@
-from groq import Groq, AsyncGroq
-from app.core.config import settings
-from app.services.rag_interface import rag_service # Importa la instancia, no la clase
-from typing import List, Dict, Any
+from app.core.config import Settings, settings
+from app.core.metrics import metrics
+from app.services.conversation_store import ConversationStore
+from app.services.llm_coalescing import CoalescingCompletions
+from app.services.model_router import ModelRouter
+from app.services.prompt_builder import BuiltPrompt, PromptBuilder
+from app.services.rag_interface import NoRAGService, RAGInterface
+from app.services.response_cache import ResponseCache
+from typing import AsyncIterator, List, Dict, Any, Optional
+from app.utils.logging import sensitive
+import asyncio
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
+FALLBACK_REPLY = "Lo siento, no pude procesar tu solicitud en este momento."
+
+# Fragmentos que el stream de Groq puede adelantarse al consumidor: el cupo del limitador se
+# libera cuando Groq termina, aunque los envíos por WhatsApp vayan más lentos
+STREAM_BUFFER_CHUNKS = 1024
+
 class LLMService:
-    def __init__(self, api_key: str):
+    def __init__(
+        self,
+        api_key: str,
+        response_cache: Optional[ResponseCache] = None,
+        conversation_store: Optional[ConversationStore] = None,
+        history_token_budget: int = 1024,
+        max_concurrency: int = 16,
+        coalesce: bool = True,
+        rag_service: Optional[RAGInterface] = None,
+        model: str = "llama3-8b-8192",
+        router: Optional[ModelRouter] = None,
+        prompt_builder: Optional[PromptBuilder] = None,
+        settings: Settings = settings,
+    ):
         if not api_key:
             raise ValueError("GROQ_API_KEY no configurada.")
-        self.client = AsyncGroq(api_key=api_key)
-        # Podrías configurar el modelo aquí o pasarlo en cada llamada
-        self.model = "llama3-8b-8192" # Ejemplo, verifica modelos disponibles en Groq
+        self.api_key = api_key
+        self.settings = settings
+        self._client = None # Se crea en el primer uso (ver `client`)
+        self.model = model # Modelo principal (GROQ_MODEL); el router decide el de cada llamada
+        # Fallback entre modelos, circuit breaker por modelo y hedging
+        self.router = router or ModelRouter([model])
+        self.rag_service = rag_service if rag_service is not None else NoRAGService() # Un índice vacío es falsy
+        self.response_cache = response_cache
+        self.conversation_store = conversation_store
+        self.history_token_budget = history_token_budget
+        # Presupuestos de tokens, recorte de entrada, system prompt fijo y registro de uso por petición
+        self.prompt_builder = prompt_builder or PromptBuilder()
+        # Todas las llamadas a Groq pasan por aquí: coalescencia de preguntas idénticas simultáneas
+        # y tope global de peticiones en curso
+        self.completions = CoalescingCompletions(max_concurrency=max_concurrency, coalesce=coalesce)
 
-    async def generate_response(self, user_prompt: str, user_id: str) -> str:
+    @property
+    def client(self) -> Any:
         """
-        Genera una respuesta usando el LLM, opcionalmente enriquecida con RAG.
+        Cliente de Groq, creado al primer uso: importar el SDK cuesta más que el resto de la app,
+        así que no se paga al importar el módulo ni al arrancar (el contenedor lo precarga en un hilo).
+        """
+        if self._client is None:
+            from groq import AsyncGroq
+            self._client = AsyncGroq(api_key=self.api_key)
+        return self._client
+
+    @client.setter
+    def client(self, value: Any) -> None:
+        self._client = value
+
+    @client.deleter
+    def client(self) -> None:
+        self._client = None
+
+    async def _load_history(self, user_id: str) -> List[Dict[str, str]]:
+        """Historial reciente de la conversación, acotado por `history_token_budget`."""
+        if self.conversation_store is None:
+            return []
+        try:
+            return await self.conversation_store.get_window(user_id, self.history_token_budget)
+        except Exception as e:
+            logger.error("Error al leer el historial de user %s: %s", user_id, e)
+            return []
+
+    async def _build_prompt(self, user_prompt: str, user_id: str, history: List[Dict[str, str]]) -> BuiltPrompt:
+        """
+        Construye los mensajes para el LLM: system prompt, historial reciente de la conversación
+        (ver `_load_history`) y la pregunta, con contexto RAG si lo hay; todo dentro
+        de los presupuestos de `prompt_builder`, que además fija `max_tokens`.
+        Compartido por la generación completa y por la generación en streaming.
         """
-        context_str = ""
+        context_items: List[str] = []
         try:
-            # 1. (Futuro) Consultar base de conocimientos (RAG)
-            # Descomentar y adaptar cuando Qdrant esté integrado
-            # relevant_docs = await rag_service.search_knowledge_base(user_prompt)
-            # if relevant_docs:
-            #     context_items = [doc.get("payload", {}).get("text", "") for doc in relevant_docs]
-            #     context_str = "\n\nContexto relevante:\n" + "\n".join(filter(None, context_items))
-            #     logger.info(f"Contexto RAG para user {user_id}: {context_str}")
-            pass # Placeholder para RAG
+            # 1. Consultar base de conocimientos (RAG) con presupuesto de latencia:
+            # si la búsqueda tarda más de RAG_TIMEOUT_SECONDS se responde sin contexto.
+            with metrics.stage("rag"):
+                relevant_docs = await asyncio.wait_for(
+                    self.rag_service.search_knowledge_base(user_prompt), timeout=self.settings.RAG_TIMEOUT_SECONDS
+                )
+            if relevant_docs:
+                context_items = [doc.get("payload", {}).get("text", "") for doc in relevant_docs]
+                logger.info("Contexto RAG para user %s: %d fragmentos", user_id, len(relevant_docs), extra={"event": "rag_context"})
+        except asyncio.TimeoutError:
+            logger.warning("Búsqueda RAG para user %s excedió %ss; se omite el contexto", user_id, self.settings.RAG_TIMEOUT_SECONDS)
         except Exception as e:
-            logger.error(f"Error al consultar RAG para user {user_id}: {e}")
+            logger.error("Error al consultar RAG para user %s: %s", user_id, e)
             # Continuar sin contexto RAG si falla
 
-        full_prompt = user_prompt
-        if context_str:
-             full_prompt = f"{context_str}\n\nBasándote en el contexto anterior si es relevante, y en tu conocimiento general, responde a la siguiente pregunta del usuario:\nUsuario: {user_prompt}"
-        else:
-            full_prompt = f"Usuario: {user_prompt}"
-
-
-        system_message = "Eres un asistente virtual amigable y útil para WhatsApp."
-        # Para modelos más recientes como Llama 3, es mejor usar solo `user` y `assistant` roles,
-        # y el system prompt puede ir en el primer mensaje del `user` o en opciones de la API si lo soporta.
-        # Groq podría tener una forma específica de pasar el system prompt, revisar su documentación.
-        # Por ahora, lo incluimos en el primer mensaje del usuario o como una instrucción general.
-
-        messages_payload = [
-            {
-                "role": "system",
-                "content": system_message
-            },
-            {
-                "role": "user",
-                "content": full_prompt,
-            }
-        ]
-        
+        prompt = self.prompt_builder.build(user_prompt, context_items, history)
+        if prompt.usage.user_truncated:
+            logger.info("Mensaje de user %s recortado a %d tokens", user_id, self.prompt_builder.max_user_tokens, extra={"event": "prompt_truncated"})
+        return prompt
+
+    def _record_usage(self, prompt: BuiltPrompt, user_id: str, usage: Any, model: Optional[str]) -> None:
+        prompt.usage.record_completion(usage, model)
+        self.prompt_builder.record(prompt.usage)
+        logger.info(
+            "Tokens para user %s: entrada ~%d (real %s), salida %s de %d",
+            user_id, prompt.usage.input_tokens, prompt.usage.prompt_tokens, prompt.usage.completion_tokens, prompt.max_tokens,
+            extra={"event": "llm_usage"},
+        )
+
+    async def _remember(self, user_id: str, user_prompt: str, response_content: str) -> None:
+        if self.conversation_store is None:
+            return
+        try:
+            await self.conversation_store.append(user_id, "user", user_prompt)
+            await self.conversation_store.append(user_id, "assistant", response_content)
+        except Exception as e:
+            logger.error("Error al guardar el historial de user %s: %s", user_id, e)
+
+    async def generate_response(self, user_prompt: str, user_id: str) -> str:
+        """
+        Genera una respuesta usando el LLM, opcionalmente enriquecida con RAG.
+        Las preguntas frecuentes se sirven desde la caché de respuestas sin llamar a Groq.
+        """
+        # El historial se lee antes que la caché: con conversación previa un seguimiento
+        # ("¿y cuánto cuesta?") depende de ese contexto y no se comparte; una pregunta autocontenida sí
+        history = await self._load_history(user_id)
+        cache_lookup = None
+        if self.response_cache is not None:
+            cache_lookup = await self.response_cache.lookup(user_prompt, has_history=bool(history))
+            if cache_lookup.response is not None:
+                logger.info("Respuesta servida desde caché para user %s", user_id, extra={"event": "cache_hit"})
+                await self._remember(user_id, user_prompt, cache_lookup.response)
+                return cache_lookup.response
+
+        prompt = await self._build_prompt(user_prompt, user_id, history)
+        full_prompt = prompt.messages[-1]["content"]
+
         try:
-            logger.info(f"Enviando a Groq para user {user_id}: Model={self.model}, Prompt='{full_prompt[:100]}...'")
-            chat_completion = await self.client.chat.completions.create(
-                messages=messages_payload,
-                model=self.model,
-                # temperature=0.7, # Opcional
-                # max_tokens=1024, # Opcional
-            )
+            logger.info("Enviando a Groq para user %s: model=%s, prompt=%s", user_id, self.model, sensitive(full_prompt), extra={"event": "llm_request"})
+            # El cupo de Groq se toma antes del router: la espera en la cola local no cuenta para su
+            # timeout, su circuit breaker ni su hedging (un hedge comparte el cupo de la petición)
+            async with self.completions.limiter:
+                started_at = time.perf_counter()
+                chat_completion, model = await self.router.complete(
+                    lambda model: self.completions.create(
+                        self.client.chat.completions.create,
+                        messages=prompt.messages,
+                        model=model,
+                        limited=False,
+                        max_tokens=prompt.max_tokens,
+                        # temperature=0.7, # Opcional
+                    ),
+                    prompt_chars=len(user_prompt),
+                )
             response_content = chat_completion.choices[0].message.content
-            logger.info(f"Respuesta de Groq para user {user_id}: '{response_content[:100]}...'")
+            logger.info("Respuesta de Groq (%s) para user %s: %s", model, user_id, sensitive(response_content), extra={"event": "llm_response"})
+            self._record_usage(prompt, user_id, getattr(chat_completion, "usage", None), model)
+            if cache_lookup is not None and response_content:
+                await self.response_cache.store(cache_lookup, response_content, time.perf_counter() - started_at)
+            await self._remember(user_id, user_prompt, response_content)
             return response_content
         except Exception as e:
-            logger.error(f"Error al interactuar con Groq API para user {user_id}: {e}")
-            return "Lo siento, no pude procesar tu solicitud en este momento."
+            logger.error("Error al interactuar con Groq API para user %s: %s", user_id, e)
+            return FALLBACK_REPLY
+
+    async def stream_response(self, user_prompt: str, user_id: str) -> AsyncIterator[str]:
+        """
+        Genera la respuesta en streaming y va entregando los fragmentos de texto a medida que llegan.
+        Registra el tiempo hasta el primer token (TTFT). Si la respuesta está en caché se entrega de una vez.
+        """
+        # El historial se lee antes que la caché: con conversación previa un seguimiento
+        # ("¿y cuánto cuesta?") depende de ese contexto y no se comparte; una pregunta autocontenida sí
+        history = await self._load_history(user_id)
+        cache_lookup = None
+        if self.response_cache is not None:
+            cache_lookup = await self.response_cache.lookup(user_prompt, has_history=bool(history))
+            if cache_lookup.response is not None:
+                logger.info("Respuesta servida desde caché para user %s", user_id, extra={"event": "cache_hit"})
+                await self._remember(user_id, user_prompt, cache_lookup.response)
+                yield cache_lookup.response
+                return
+
+        prompt = await self._build_prompt(user_prompt, user_id, history)
+        parts: List[str] = []
+        queue: asyncio.Queue = asyncio.Queue(maxsize=STREAM_BUFFER_CHUNKS)
+        reader = asyncio.create_task(self._read_stream(prompt, user_prompt, user_id, queue))
+        try:
+            while True:
+                delta = await queue.get()
+                if delta is None:
+                    break
+                if isinstance(delta, Exception):
+                    raise delta
+                parts.append(delta)
+                yield delta
+            usage, generation_seconds = await reader
+        except Exception as e:
+            logger.error("Error en el streaming de Groq API para user %s: %s", user_id, e)
+            if not parts:
+                yield FALLBACK_REPLY
+            return
+        finally:
+            reader.cancel() # El consumidor dejó de leer: no seguir ocupando el cupo de Groq
+
+        if parts:
+            self._record_usage(prompt, user_id, usage, None)
+            response_content = "".join(parts)
+            if cache_lookup is not None:
+                await self.response_cache.store(cache_lookup, response_content, generation_seconds)
+            await self._remember(user_id, user_prompt, response_content)
+
+    async def _read_stream(self, prompt: BuiltPrompt, user_prompt: str, user_id: str, queue: asyncio.Queue) -> tuple:
+        """
+        Lee el stream de Groq dentro del cupo del limitador y deja los fragmentos de texto en `queue`,
+        terminando con `None` (o con la excepción, si falla). Devuelve `(usage, segundos de generación)`.
+        """
+        usage, started_at, first = None, time.perf_counter(), True
+        try:
+            # Como en `generate_response`, el cupo se toma fuera del router y dura lo que dura el stream
+            async with self.completions.limiter:
+                started_at = time.perf_counter()
+                stream = self.router.stream(
+                    lambda model: self.completions.stream(
+                        self.client.chat.completions.create,
+                        messages=prompt.messages,
+                        model=model,
+                        limited=False,
+                        max_tokens=prompt.max_tokens,
+                    ),
+                    prompt_chars=len(user_prompt),
+                )
+                async for chunk in stream:
+                    # Groq informa el uso en el último fragmento (`x_groq.usage`)
+                    usage = getattr(getattr(chunk, "x_groq", None), "usage", None) or usage
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if not delta:
+                        continue
+                    if first:
+                        logger.info("TTFT de Groq para user %s: %.0f ms", user_id, (time.perf_counter() - started_at) * 1000)
+                        first = False
+                    await queue.put(delta)
+        except Exception as e:
+            await queue.put(e)
+            return usage, time.perf_counter() - started_at
+        await queue.put(None)
+        return usage, time.perf_counter() - started_at
+
+    def stats(self) -> Dict[str, Any]:
+        return self.completions.stats()
 
-llm_service = LLMService(api_key=settings.GROQ_API_KEY)
\ No newline at end of file
+    def prompt_stats(self) -> Dict[str, Any]:
+        return self.prompt_builder.stats()
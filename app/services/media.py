@@ -0,0 +1,452 @@
+import asyncio
+import contextlib
+import hashlib
+import importlib
+import json
+import os
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+from app.core.config import Settings, settings
+from app.models.meta import MetaMedia
+from app.utils.http_client import HttpClient
+from app.utils.logging import logger
+
+class MediaError(Exception):
+    """No se pudo obtener o procesar un adjunto."""
+
+class MediaTooLarge(MediaError):
+    """El adjunto supera MEDIA_MAX_BYTES (se corta la descarga sin leer el resto)."""
+
+# --- Procesadores ---
+
+class MediaProcessor(ABC):
+    """
+    Convierte un adjunto ya descargado en texto para el LLM. `process` es síncrono y corre en el pool
+    de MEDIA_EXECUTOR (hilos o procesos), nunca en el event loop; con procesos, la instancia debe
+    poder serializarse con pickle.
+    """
+    name: str = ""
+    mime_prefixes: Sequence[str] = ()
+
+    def accepts(self, mime_type: str) -> bool:
+        return any(mime_type.startswith(prefix) for prefix in self.mime_prefixes)
+
+    @abstractmethod
+    def process(self, path: str, mime_type: str) -> str:
+        pass
+
+class TranscriptionStandIn(MediaProcessor):
+    """
+    Sustituto de un transcriptor de notas de voz: lee el archivo completo (como lo haría un modelo
+    real) y devuelve un marcador con su tamaño. Reemplazar por un procesador con un modelo de voz.
+    """
+    name = "transcription"
+    mime_prefixes = ("audio/",)
+
+    def process(self, path: str, mime_type: str) -> str:
+        size = 0
+        with open(path, "rb") as media_file:
+            for chunk in iter(lambda: media_file.read(1 << 16), b""):
+                size += len(chunk)
+        return f"[Nota de voz de {size // 1024} KB; transcripción no disponible]"
+
+class DocumentTextExtractor(MediaProcessor):
+    """Texto de documentos planos (txt, csv, json); el resto se describe por tipo y tamaño."""
+    name = "document_text"
+    mime_prefixes = ("text/", "application/json")
+
+    def __init__(self, max_chars: int = 4000):
+        self.max_chars = max_chars
+
+    def process(self, path: str, mime_type: str) -> str:
+        with open(path, "r", encoding="utf-8", errors="replace") as media_file:
+            return media_file.read(self.max_chars)
+
+class MediaDescription(MediaProcessor):
+    """Procesador por defecto: tipo y tamaño del adjunto, para que el LLM sepa qué recibió."""
+    name = "description"
+    mime_prefixes = ("",)
+
+    def process(self, path: str, mime_type: str) -> str:
+        return f"[Archivo {mime_type} de {os.path.getsize(path) // 1024} KB]"
+
+DEFAULT_PROCESSORS = (
+    "app.services.media.TranscriptionStandIn",
+    "app.services.media.DocumentTextExtractor",
+    "app.services.media.MediaDescription",
+)
+
+def load_processors(paths: Sequence[str]) -> List[MediaProcessor]:
+    """Instancia procesadores a partir de rutas `paquete.modulo.Clase` (en orden de prioridad)."""
+    processors = []
+    for path in paths:
+        module_name, _, class_name = path.strip().rpartition(".")
+        processors.append(getattr(importlib.import_module(module_name), class_name)())
+    return processors
+
+# --- Caché por contenido ---
+
+WRITE_BUFFER_BYTES = 1 << 20 # Las descargas se escriben a disco (en un hilo) por bloques de este tamaño
+
+class MediaCache:
+    """
+    Caché en disco direccionada por contenido: cada archivo se guarda con el SHA-256 calculado al
+    descargarlo como nombre (`<dir>/ab/abcdef…`) y el texto ya procesado al lado
+    (`…<sha>.<procesador>.json`). Un mismo archivo reenviado muchas veces se guarda y procesa una
+    sola vez.
+
+    Los archivos suman como mucho `max_bytes`: al guardar uno nuevo se borran los usados hace más
+    tiempo (orden LRU, persistido en el mtime para sobrevivir reinicios), salvo los fijados por
+    `commit` que aún se están procesando. Los métodos hacen I/O de disco: se llaman desde un hilo.
+    """
+    def __init__(self, directory: str = "media_cache", max_bytes: int = 512 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._index: Optional["OrderedDict[str, int]"] = None # sha -> bytes, del uso más viejo al más reciente
+        self._pinned: Dict[str, int] = {}
+        self.total_bytes = 0
+        self.evicted = 0
+
+    def path_for(self, sha256: str) -> str:
+        return os.path.join(self.directory, sha256[:2], sha256)
+
+    def temp_file(self) -> Any:
+        # En el mismo directorio para que `commit` sea un rename atómico
+        return tempfile.NamedTemporaryFile(dir=self.directory, prefix=".download-", delete=False)
+
+    def _load_index(self) -> "OrderedDict[str, int]":
+        if self._index is None:
+            found = []
+            for shard in os.scandir(self.directory):
+                if not shard.is_dir():
+                    continue
+                for entry in os.scandir(shard.path):
+                    if "." not in entry.name: # Los resultados (`<sha>.<procesador>.json`) van con su archivo
+                        stat = entry.stat()
+                        found.append((stat.st_mtime, entry.name, stat.st_size))
+            self._index = OrderedDict((name, size) for _, name, size in sorted(found))
+            self.total_bytes = sum(self._index.values())
+        return self._index
+
+    def commit(self, temp_path: str, sha256: str) -> bool:
+        """
+        Guarda la descarga con su hash y la deja fijada hasta `release`. Devuelve False si el
+        contenido ya estaba en la caché (la copia descargada se descarta).
+        """
+        path = self.path_for(sha256)
+        with self._lock:
+            index = self._load_index()
+            stored = sha256 not in index
+            if stored:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(temp_path, path)
+                index[sha256] = os.path.getsize(path)
+                self.total_bytes += index[sha256]
+            else:
+                os.unlink(temp_path)
+                os.utime(path)
+                index.move_to_end(sha256)
+            self._pinned[sha256] = self._pinned.get(sha256, 0) + 1
+            self._evict(index)
+        return stored
+
+    def acquire(self, sha256: str) -> Optional[int]:
+        """Tamaño del archivo si está en la caché (y lo deja fijado hasta `release`); None si no está."""
+        with self._lock:
+            index = self._load_index()
+            size = index.get(sha256)
+            if size is not None:
+                os.utime(self.path_for(sha256))
+                index.move_to_end(sha256)
+                self._pinned[sha256] = self._pinned.get(sha256, 0) + 1
+            return size
+
+    def release(self, sha256: str) -> None:
+        with self._lock:
+            if self._pinned.get(sha256, 0) <= 1:
+                self._pinned.pop(sha256, None)
+            else:
+                self._pinned[sha256] -= 1
+
+    def _evict(self, index: "OrderedDict[str, int]") -> None:
+        for sha256 in list(index):
+            if self.total_bytes <= self.max_bytes:
+                break
+            if sha256 in self._pinned:
+                continue
+            path = self.path_for(sha256)
+            for name in os.listdir(os.path.dirname(path)):
+                if name == sha256 or name.startswith(f"{sha256}."):
+                    with contextlib.suppress(OSError):
+                        os.remove(os.path.join(os.path.dirname(path), name))
+            self.total_bytes -= index.pop(sha256)
+            self.evicted += 1
+
+    def load_result(self, sha256: str, processor: str) -> Optional[str]:
+        try:
+            with open(f"{self.path_for(sha256)}.{processor}.json", "r", encoding="utf-8") as result_file:
+                return json.load(result_file)["text"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def store_result(self, sha256: str, processor: str, text: str) -> None:
+        path = f"{self.path_for(sha256)}.{processor}.json"
+        with open(f"{path}.tmp", "w", encoding="utf-8") as result_file:
+            json.dump({"text": text}, result_file, ensure_ascii=False)
+        os.replace(f"{path}.tmp", path)
+
+# --- Pipeline ---
+
+@dataclass
+class MediaResult:
+    sha256: str
+    mime_type: str
+    size: int
+    text: str
+    processor: str
+    downloaded: bool # False si el archivo ya estaba en caché
+    stored: bool # False si el contenido ya estaba en caché (sin descarga, o la descarga se descartó)
+    processed: bool # False si el texto ya estaba en caché
+
+class MediaPipeline:
+    """
+    Descarga y procesamiento de adjuntos entrantes.
+
+    1. `GET /{media-id}` devuelve la URL temporal, el tamaño y el SHA-256; si el tamaño excede
+       `max_bytes` no se descarga. Si el SHA-256 informado ya está en la caché y el tamaño coincide
+       con el del archivo guardado, se omite la descarga (un reenvío del mismo archivo). El hash
+       informado no se verifica sin descargar: por eso se exige que coincidan el del webhook y el
+       de la Graph API (si vienen ambos) y también el tamaño.
+    2. La descarga se lee por fragmentos de `chunk_size` hacia un archivo temporal mientras se
+       calcula el hash (nunca el archivo entero en memoria) y se corta si supera `max_bytes`. Las
+       escrituras a disco van en un hilo, por bloques de `WRITE_BUFFER_BYTES`.
+    3. Lo descargado se guarda con el hash calculado, no con el informado: un contenido ya visto no
+       se vuelve a guardar ni a procesar. El procesador que acepta el MIME type corre en `executor`;
+       su texto se guarda junto al archivo.
+
+    Como mucho `max_concurrency` descargas a la vez; el mismo adjunto en curso comparte el trabajo.
+    """
+    def __init__(
+        self,
+        http_client: HttpClient,
+        cache: MediaCache,
+        processors: Optional[Sequence[MediaProcessor]] = None,
+        access_token: str = "",
+        max_concurrency: int = 4,
+        max_bytes: int = 16 * 1024 * 1024,
+        chunk_size: int = 64 * 1024,
+        workers: int = 2,
+        use_processes: bool = False,
+        executor: Optional[Executor] = None,
+    ):
+        self.http_client = http_client
+        self.cache = cache
+        self.processors = list(processors) if processors is not None else load_processors(DEFAULT_PROCESSORS)
+        self.access_token = access_token
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self._owns_executor = executor is None
+        if executor is None:
+            # Procesos para procesadores que usan CPU sin soltar el GIL (modelos en Python puro)
+            executor = ProcessPoolExecutor(max_workers=workers) if use_processes else ThreadPoolExecutor(max_workers=workers, thread_name_prefix="media")
+        self.executor = executor
+        self._download_slots = asyncio.Semaphore(max_concurrency)
+        self._in_flight: Dict[str, asyncio.Task] = {}
+        self._results: "OrderedDict[str, str]" = OrderedDict() # (sha:procesador) -> texto, LRU pequeña
+
+        self.downloads = 0
+        self.downloaded_bytes = 0
+        self.download_skipped = 0
+        self.deduplicated = 0
+        self.sha256_mismatches = 0
+        self.results_cached = 0
+        self.processed = 0
+        self.too_large = 0
+        self.failed = 0
+        self.coalesced = 0
+
+    @property
+    def _headers(self) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {self.access_token}"}
+
+    def processor_for(self, mime_type: str) -> MediaProcessor:
+        for processor in self.processors:
+            if processor.accepts(mime_type):
+                return processor
+        raise MediaError(f"Sin procesador para {mime_type}")
+
+    async def _describe(self, media_id: str) -> Dict[str, Any]:
+        response = await self.http_client.get(media_id, headers=self._headers)
+        response.raise_for_status()
+        return response.json()
+
+    async def iter_media(self, url: str, expected_size: Optional[int] = None) -> AsyncIterator[bytes]:
+        """Contenido de un adjunto por fragmentos, con el techo de tamaño aplicado durante la lectura."""
+        if expected_size is not None and expected_size > self.max_bytes:
+            self.too_large += 1
+            raise MediaTooLarge(f"Adjunto de {expected_size} bytes (máximo {self.max_bytes})")
+        received = 0
+        async with self._download_slots:
+            async with self.http_client.stream("GET", url, headers=self._headers) as response:
+                response.raise_for_status()
+                async for chunk in response.aiter_bytes(self.chunk_size):
+                    received += len(chunk)
+                    if received > self.max_bytes:
+                        self.too_large += 1
+                        raise MediaTooLarge(f"Adjunto de más de {self.max_bytes} bytes")
+                    yield chunk
+        self.downloads += 1
+        self.downloaded_bytes += received
+
+    async def _download(self, url: str, expected_size: Optional[int]) -> Tuple[str, bool]:
+        """Descarga a la caché; devuelve el SHA-256 calculado y si el contenido era nuevo."""
+        digest = hashlib.sha256()
+        temp = await asyncio.to_thread(self.cache.temp_file)
+        try:
+            try:
+                pending = bytearray()
+                async for chunk in self.iter_media(url, expected_size):
+                    digest.update(chunk)
+                    pending += chunk
+                    if len(pending) >= WRITE_BUFFER_BYTES:
+                        data, pending = pending, bytearray()
+                        await asyncio.to_thread(temp.write, data)
+                if pending:
+                    await asyncio.to_thread(temp.write, pending)
+            finally:
+                await asyncio.to_thread(temp.close)
+            sha256 = digest.hexdigest()
+            return sha256, await asyncio.to_thread(self.cache.commit, temp.name, sha256)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.unlink(temp.name)
+            raise
+
+    async def _cached(self, media: MetaMedia, info: Dict[str, Any]) -> Optional[str]:
+        """SHA-256 informado si su archivo ya está en la caché con el mismo tamaño (queda fijado); si no, None."""
+        declared = media.sha256 or info.get("sha256")
+        if not declared or (media.sha256 and info.get("sha256") and media.sha256 != info["sha256"]):
+            return None
+        size = await asyncio.to_thread(self.cache.acquire, declared)
+        if size is None:
+            return None
+        if size != info.get("file_size"):
+            await asyncio.to_thread(self.cache.release, declared)
+            return None
+        return declared
+
+    async def _process(self, media: MetaMedia) -> MediaResult:
+        info = await self._describe(media.id)
+        sha256 = await self._cached(media, info)
+        downloaded = sha256 is None
+        if downloaded:
+            sha256, stored = await self._download(info["url"], info.get("file_size"))
+        else:
+            stored = False
+            self.download_skipped += 1
+        try:
+            declared = media.sha256 or info.get("sha256")
+            if downloaded and declared and declared != sha256:
+                self.sha256_mismatches += 1
+                logger.warning("El SHA-256 informado para el adjunto %s no coincide con el contenido", media.id)
+            if downloaded and not stored:
+                self.deduplicated += 1
+
+            mime_type = media.mime_type or info.get("mime_type") or "application/octet-stream"
+            processor = self.processor_for(mime_type)
+            result_key = f"{sha256}:{processor.name}"
+            text = self._results.get(result_key)
+            if text is None:
+                text = await asyncio.to_thread(self.cache.load_result, sha256, processor.name)
+            processed = text is None
+            if processed:
+                loop = asyncio.get_running_loop()
+                text = await loop.run_in_executor(self.executor, processor.process, self.cache.path_for(sha256), mime_type)
+                await asyncio.to_thread(self.cache.store_result, sha256, processor.name, text)
+                self.processed += 1
+            else:
+                self.results_cached += 1
+            self._results[result_key] = text
+            self._results.move_to_end(result_key)
+            if len(self._results) > 1024:
+                self._results.popitem(last=False)
+            size = await asyncio.to_thread(os.path.getsize, self.cache.path_for(sha256))
+        finally:
+            await asyncio.to_thread(self.cache.release, sha256)
+        return MediaResult(sha256, mime_type, size, text, processor.name, downloaded, stored, processed)
+
+    async def handle(self, media: MetaMedia) -> MediaResult:
+        """Descarga y procesa un adjunto (un contenido ya visto no se procesa de nuevo); devuelve el texto para el LLM."""
+        key = media.id
+        task = self._in_flight.get(key)
+        if task is None:
+            task = self._in_flight[key] = asyncio.create_task(self._process(media))
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        else:
+            self.coalesced += 1
+        try:
+            return await asyncio.shield(task)
+        except MediaError as e:
+            logger.warning("Adjunto %s descartado: %s", media.id, e)
+            raise
+        except Exception as e:
+            self.failed += 1
+            logger.error("Error al procesar el adjunto %s: %s", media.id, e)
+            raise MediaError(f"No se pudo procesar el adjunto {media.id}: {e}") from e
+
+    async def close(self) -> None:
+        tasks = list(self._in_flight.values())
+        for task in tasks:
+            task.cancel()
+        # Se esperan para que cada descarga cancelada borre su temporal y suelte su archivo fijado
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self._owns_executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "downloads": self.downloads,
+            "downloaded_bytes": self.downloaded_bytes,
+            "download_skipped": self.download_skipped,
+            "deduplicated": self.deduplicated,
+            "sha256_mismatches": self.sha256_mismatches,
+            "cache_bytes": self.cache.total_bytes,
+            "cache_evicted": self.cache.evicted,
+            "processed": self.processed,
+            "results_cached": self.results_cached,
+            "too_large": self.too_large,
+            "failed": self.failed,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._in_flight),
+        }
+
+def build_media_pipeline(
+    http_client: HttpClient,
+    access_token: Optional[str] = None,
+    executor: Optional[Executor] = None,
+    cache: Optional[MediaCache] = None,
+    settings: Settings = settings,
+) -> Optional[MediaPipeline]:
+    if not settings.MEDIA_ENABLED:
+        return None
+    extra = [path for path in settings.MEDIA_PROCESSORS.split(",") if path.strip()]
+    return MediaPipeline(
+        http_client=http_client,
+        cache=cache or MediaCache(settings.MEDIA_CACHE_DIR, settings.MEDIA_CACHE_MAX_BYTES),
+        processors=load_processors([*extra, *DEFAULT_PROCESSORS]), # Los configurados tienen prioridad
+        access_token=access_token or settings.WHATSAPP_ACCESS_TOKEN,
+        max_concurrency=settings.MEDIA_MAX_CONCURRENCY,
+        max_bytes=settings.MEDIA_MAX_BYTES,
+        chunk_size=settings.MEDIA_CHUNK_SIZE,
+        workers=settings.MEDIA_WORKERS,
+        use_processes=settings.MEDIA_EXECUTOR == "process",
+        executor=executor, # Compartidos entre tenants: el pool de procesamiento y el disco son de la máquina
+    )
@@ -1,78 +1,316 @@
-from typing import Any, Dict
+import asyncio
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional
 
-import httpx
-from app.core.config import settings
-from app.models.meta import MetaMessageText, MetaMessageResponse
-from app.services.llm_service import llm_service
-from app.utils.http_client import meta_http_client # Usar el cliente HTTP configurado
-from app.utils.logging import logger
+from app.core.config import Settings, settings
+from app.models.meta import (
+    MetaMessage,
+    MetaMessageResponse,
+    MetaMessageText,
+    MetaTemplate,
+    MetaTemplateMessageResponse,
+    MetaWebhookRequest,
+)
+from app.services.broadcast import BroadcastRecipient, CampaignCheckpoint
+from app.services.conversation_scheduler import ConversationScheduler
+from app.services.dedup import MessageDeduplicator, build_dedup_backend
+from app.services.intent_router import IntentRouter
+from app.services.journal import OUTBOUND, Journal
+from app.services.llm_service import LLMService
+from app.services.media import MediaError, MediaPipeline
+from app.services.outbound import OutboundSendScheduler, SendResult
+from app.services.streaming import chunk_by_sentences
+from app.utils.logging import logger, sensitive
+
+def _log_reply_errors(done: asyncio.Future) -> None:
+    if done.cancelled():
+        return
+    for result in done.result():
+        if isinstance(result, Exception):
+            logger.error("Error respondiendo un mensaje del webhook: %s", result)
 
 class MetaService:
-    async def process_webhook_message(self, payload: Dict[str, Any]) -> None:
+    """
+    Orquesta la conversación con WhatsApp. Los colaboradores (LLM, envíos salientes, deduplicación)
+    se reciben ya construidos: el contenedor de servicios los crea en el arranque de la app.
+
+    Cada número de negocio (tenant) tiene su propia instancia: `phone_number_id` y `access_token`
+    (por defecto los de Settings) son los del número que envía, y `user_prefix` separa el historial
+    de un mismo usuario con distintos números.
+    """
+    def __init__(
+        self,
+        llm_service: LLMService,
+        outbound: OutboundSendScheduler,
+        deduplicator: Optional[MessageDeduplicator] = None,
+        media: Optional[MediaPipeline] = None,
+        journal: Optional[Journal] = None,
+        intents: Optional[IntentRouter] = None,
+        phone_number_id: Optional[str] = None,
+        access_token: Optional[str] = None,
+        conversation_concurrency: Optional[int] = None,
+        user_prefix: str = "",
+        settings: Settings = settings,
+    ):
+        self.settings = settings
+        self.llm_service = llm_service
+        self.outbound = outbound
+        self.media = media # Sin pipeline de adjuntos solo se responden los mensajes de texto
+        self.intents = intents # Respuestas de plantilla antes del LLM
+        self.journal = journal # Registro de envíos salientes (los webhooks se registran en el endpoint)
+        self.deduplicator = deduplicator or MessageDeduplicator(build_dedup_backend())
+        self._phone_number_id = phone_number_id
+        self._access_token = access_token
+        self.user_prefix = user_prefix
+        self.scheduler = ConversationScheduler(
+            handler=self._reply_to_conversation,
+            max_concurrency=conversation_concurrency or settings.CONVERSATION_MAX_CONCURRENCY,
+            merge_pending=settings.CONVERSATION_MERGE_PENDING,
+            max_merge=settings.CONVERSATION_MAX_MERGE,
+        )
+
+    @property
+    def phone_number_id(self) -> str:
+        return self._phone_number_id or self.settings.WHATSAPP_PHONE_NUMBER_ID
+
+    @property
+    def access_token(self) -> str:
+        return self._access_token or self.settings.WHATSAPP_ACCESS_TOKEN
+
+    async def process_webhook_message(self, payload: MetaWebhookRequest, skip_dedup: bool = False) -> None:
+        """Procesa un mensaje entrante de WhatsApp y espera a que se envíen sus respuestas (scripts, replay offline)."""
+        await (await self.submit_webhook_message(payload, skip_dedup=skip_dedup))
+
+    async def submit_webhook_message(self, payload: MetaWebhookRequest, skip_dedup: bool = False) -> asyncio.Future:
         """
-        Procesa un mensaje entrante de WhatsApp.
-        Extrae el mensaje del usuario, obtiene una respuesta del LLM y la envía de vuelta.
+        Entrega los mensajes de un webhook a la cola de su conversación sin esperar las respuestas.
+        Extrae el mensaje del usuario; el planificador obtiene la respuesta del LLM y la envía de vuelta.
+        Con `skip_dedup` (webhooks reenviados desde el journal) no se consulta la deduplicación:
+        el id quedó marcado en la ejecución que no llegó a responder.
+
+        Devuelve un future que se resuelve (con la lista de resultados, excepciones incluidas) cuando
+        todas las respuestas del payload terminaron: el worker del dispatcher no espera a la conversación
+        más lenta, el límite real es CONVERSATION_MAX_CONCURRENCY.
         """
+        pending = []
         try:
-            if payload.get("object") != "whatsapp_business_account":
+            if payload.object != "whatsapp_business_account":
                 logger.warning("Object 'whatsapp_business_account' not found")
                 return
 
-            # Generador para extraer mensajes de texto relevantes
+            # Generador para extraer mensajes relevantes: texto y, si hay pipeline, adjuntos
             text_messages = (
                 msg
-                for entry in payload.get("entry", [])
-                for change in entry.get("changes", [])
-                for msg in change.get("value", {}).get("messages", [])
-                if msg.get("type") == "text"
+                for entry in payload.entry
+                for change in entry.changes
+                for msg in change.value.messages or ()
+                if (msg.type == "text" and msg.text is not None) or (self.media is not None and msg.media is not None)
             )
 
+            # Cada mensaje va a la cola de su conversación: orden estricto por usuario,
+            # paralelismo entre usuarios distintos.
             for message_data in text_messages:
-                user_phone_number = message_data["from"]
-                user_message_text = message_data["text"]["body"]
-                message_id = message_data["id"]
+                user_phone_number = message_data.from_number
+                message_id = message_data.id
 
-                logger.info(f"Mensaje recibido de {user_phone_number} (ID: {message_id}): {user_message_text}")
+                # Meta reintenta entregas: descartar duplicados antes de cualquier trabajo del LLM
+                if not skip_dedup and await self.deduplicator.is_duplicate(message_id):
+                    logger.info("Mensaje duplicado ignorado (ID: %s)", message_id, extra={"event": "message_duplicate"})
+                    continue
 
-                # Obtener y enviar respuesta
-                bot_reply = await llm_service.generate_response(user_message_text, user_id=user_phone_number)
-                await self.send_whatsapp_message(user_phone_number, bot_reply)
+                body = message_data.text.body if message_data.text is not None else f"[{message_data.type}]"
+                logger.info(
+                    "Mensaje recibido de %s (ID: %s): %s", user_phone_number, message_id, sensitive(body),
+                    extra={"event": "message_received"},
+                )
+                pending.append(self.scheduler.submit(user_phone_number, message_data))
         except Exception as e:
-            logger.error(f"Error procesando el webhook de Meta: {e}", exc_info=True)
+            logger.error("Error procesando el webhook de Meta: %s", e, exc_info=True)
             # Considerar enviar un mensaje de error genérico al usuario si es apropiado y posible
+        done = asyncio.gather(*pending, return_exceptions=True)
+        done.add_done_callback(_log_reply_errors)
+        return done
 
 
-    async def send_whatsapp_message(self, to_phone_number: str, message_text: str) -> None:
+    async def _reply_to_conversation(self, user_phone_number: str, messages: List[MetaMessage]) -> None:
         """
-        Envía un mensaje de texto a un usuario de WhatsApp a través de la API de Meta.
+        Genera y envía una respuesta para uno o más mensajes consecutivos de un mismo usuario.
+        Si el planificador agrupó varios mensajes, se responden con una sola llamada al LLM.
         """
-        if not settings.WHATSAPP_PHONE_NUMBER_ID or not settings.WHATSAPP_VERIFY_TOKEN:
-            logger.error("WHATSAPP_PHONE_NUMBER_ID o WHATSAPP_VERIFY_TOKEN no configurados.")
+        user_message_text = "\n".join([await self._message_text(message) for message in messages])
+        if len(messages) > 1:
+            logger.info("Agrupando %d mensajes de %s en una sola respuesta", len(messages), user_phone_number)
+
+        if self.intents is not None:
+            template_reply = await self.intents.route(user_message_text)
+            if template_reply is not None:
+                logger.info("Respuesta de plantilla para %s (sin LLM)", user_phone_number, extra={"event": "intent_reply"})
+                await self.send_whatsapp_message(user_phone_number, template_reply)
+                return
+
+        if self.settings.LLM_STREAMING_ENABLED:
+            await self._stream_reply(user_phone_number, user_message_text)
             return
 
-        url_endpoint = f"/{settings.WHATSAPP_PHONE_NUMBER_ID}/messages"
-        
+        # Obtener y enviar respuesta
+        bot_reply = await self.llm_service.generate_response(user_message_text, user_id=self.user_prefix + user_phone_number)
+        await self.send_whatsapp_message(user_phone_number, bot_reply)
+
+    async def _message_text(self, message: MetaMessage) -> str:
+        """Texto del mensaje para el LLM; los adjuntos se descargan y procesan aquí (en la cola del usuario)."""
+        if message.text is not None:
+            return message.text.body
+        media = message.media
+        try:
+            result = await self.media.handle(media)
+            text = result.text
+        except MediaError:
+            text = f"[El usuario envió un archivo ({message.type}) que no se pudo procesar]"
+        return f"{media.caption}\n{text}" if media.caption else text
+
+    async def _stream_reply(self, user_phone_number: str, user_message_text: str) -> None:
+        """
+        Envía la respuesta en varios mensajes a medida que el LLM la genera (corte por oración/párrafo),
+        de modo que la latencia percibida es el tiempo hasta la primera oración y no la generación completa.
+        """
+        started_at = time.perf_counter()
+        chunks_sent = 0
+        deltas = self.llm_service.stream_response(user_message_text, user_id=self.user_prefix + user_phone_number)
+        async for chunk in chunk_by_sentences(
+            deltas,
+            min_chars=self.settings.LLM_STREAM_MIN_CHUNK_CHARS,
+            max_chunks=self.settings.LLM_STREAM_MAX_CHUNKS,
+        ):
+            await self.send_whatsapp_message(user_phone_number, chunk)
+            chunks_sent += 1
+            if chunks_sent == 1:
+                logger.info("Primer envío a %s tras %.0f ms", user_phone_number, (time.perf_counter() - started_at) * 1000)
+        logger.info("Respuesta en streaming a %s: %d mensajes en %.0f ms", user_phone_number, chunks_sent, (time.perf_counter() - started_at) * 1000)
+
+    async def send_whatsapp_message(self, to_phone_number: str, message_text: str) -> Optional[SendResult]:
+        """
+        Envía un mensaje de texto a un usuario de WhatsApp a través de la API de Meta.
+        El envío pasa por el planificador saliente (ritmo por número/destinatario y reintentos).
+        """
         message_payload = MetaMessageResponse(
             to=to_phone_number,
             text=MetaMessageText(body=message_text)
         )
-        
+        result = await self._send_payload(to_phone_number, message_payload.model_dump(by_alias=True))
+        if result is not None and result.ok:
+            logger.info(
+                "Mensaje enviado a %s: %s (respuesta API: %s)", to_phone_number, sensitive(message_text), result.response,
+                extra={"event": "message_sent"},
+            )
+        return result
+
+    async def send_template_message(self, to_phone_number: str, template: MetaTemplate) -> Optional[SendResult]:
+        """Envía una plantilla aprobada (necesaria para escribir fuera de la ventana de 24 horas)."""
+        message_payload = MetaTemplateMessageResponse(to=to_phone_number, template=template)
+        result = await self._send_payload(to_phone_number, message_payload.model_dump(exclude_none=True))
+        if result is not None and result.ok:
+            logger.info(
+                "Plantilla '%s' enviada a %s (respuesta API: %s)", template.name, to_phone_number, result.response,
+                extra={"event": "template_sent"},
+            )
+        return result
+
+    async def _send_payload(self, to_phone_number: str, payload: Dict[str, Any]) -> Optional[SendResult]:
+        if not self.phone_number_id or not self.settings.WHATSAPP_VERIFY_TOKEN:
+            logger.error("WHATSAPP_PHONE_NUMBER_ID o WHATSAPP_VERIFY_TOKEN no configurados.")
+            return None
+
         headers = {
-            "Authorization": f"Bearer {settings.WHATSAPP_ACCESS_TOKEN}",
+            "Authorization": f"Bearer {self.access_token}",
             "Content-Type": "application/json",
         }
 
+        entry_id = None
+        if self.journal is not None:
+            # Sin esperar al fsync: el registro del envío no debe sumar latencia a la respuesta
+            entry_id = await self.journal.append(OUTBOUND, {"to": to_phone_number, "payload": payload}, durable=False)
         try:
-            response = await meta_http_client.post(
-                url_endpoint,
-                json=message_payload.model_dump(by_alias=True),
-                headers=headers
+            result = await self.outbound.send(
+                self.phone_number_id,
+                to_phone_number,
+                payload,
+                headers=headers,
             )
-            response.raise_for_status()
-            logger.info(f"Mensaje enviado a {to_phone_number}: {message_text[:50]}... Respuesta API: {response.json()}")
-        except httpx.HTTPStatusError as e:
-            logger.error(f"Error HTTP al enviar mensaje a {to_phone_number}: {e.response.status_code} - {e.response.text}")
         except Exception as e:
-            logger.error(f"Error genérico al enviar mensaje a {to_phone_number}: {e}")
+            logger.error("Error genérico al enviar mensaje a %s: %s", to_phone_number, e)
+            return None
+        finally:
+            if self.journal is not None:
+                self.journal.complete(entry_id)
 
-meta_service = MetaService()
\ No newline at end of file
+        if not result.ok:
+            logger.error(
+                "Error HTTP al enviar mensaje a %s (%s tras %d intentos): %s - %s",
+                to_phone_number, result.status, result.attempts, result.status_code, result.error,
+            )
+        return result
+
+    async def _send_recipient(self, recipient: BroadcastRecipient) -> Dict[str, Any]:
+        outcome: Dict[str, Any] = {"line": recipient.line, "to": recipient.to}
+        if recipient.error:
+            outcome.update(status="invalid", error=recipient.error)
+            return outcome
+        if recipient.template is not None:
+            result = await self.send_template_message(recipient.to, recipient.template)
+        else:
+            result = await self.send_whatsapp_message(recipient.to, recipient.text)
+        if result is None:
+            outcome.update(status="error", error="Envío no realizado (ver logs)")
+            return outcome
+        outcome.update(status=result.status, attempts=result.attempts, status_code=result.status_code)
+        if result.ok:
+            outcome["message_id"] = ((result.response or {}).get("messages") or [{}])[0].get("id")
+        else:
+            outcome["error"] = result.error
+        return outcome
+
+    async def send_bulk(
+        self,
+        recipients: AsyncIterator[BroadcastRecipient],
+        max_in_flight: int = 20,
+        checkpoint: Optional[CampaignCheckpoint] = None,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Envío masivo: consume los destinatarios a medida que se leen (nunca la lista completa en memoria),
+        mantiene como máximo `max_in_flight` envíos concurrentes sobre el pool compartido y entrega cada
+        resultado en cuanto termina (en orden de finalización, no de entrada).
+
+        Con `checkpoint`, las filas ya resueltas se omiten y cada resultado definitivo ("sent", "failed",
+        "invalid") se registra; los "dropped" y errores locales quedan pendientes para reanudar la campaña.
+        """
+        in_flight: set = set()
+
+        async def drain(return_when: str):
+            done, _ = await asyncio.wait(in_flight, return_when=return_when)
+            outcomes = []
+            for task in done:
+                in_flight.discard(task)
+                outcome = task.result()
+                if checkpoint is not None and outcome["status"] in ("sent", "failed", "invalid"):
+                    checkpoint.mark_done(outcome["line"])
+                outcomes.append(outcome)
+            if checkpoint is not None:
+                await checkpoint.flush() # Una escritura por tanda de envíos terminados, antes de informarlos
+            for outcome in outcomes:
+                yield outcome
+
+        try:
+            async for recipient in recipients:
+                if checkpoint is not None and checkpoint.is_done(recipient.line):
+                    continue
+                in_flight.add(asyncio.create_task(self._send_recipient(recipient)))
+                if len(in_flight) >= max_in_flight:
+                    async for outcome in drain(asyncio.FIRST_COMPLETED):
+                        yield outcome
+            if in_flight:
+                async for outcome in drain(asyncio.ALL_COMPLETED):
+                    yield outcome
+        finally:
+            # Cliente desconectado o error: no dejar envíos huérfanos
+            for task in in_flight:
+                task.cancel()
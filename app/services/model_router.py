@@ -0,0 +1,346 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional, Sequence, Tuple
+
+from app.core.config import Settings, settings
+from app.utils.logging import logger
+
+class AllModelsUnavailable(Exception):
+    """Ningún modelo pudo responder: todos fallaron o tienen el circuit breaker abierto."""
+
+class CircuitBreaker:
+    """
+    Circuit breaker por modelo y endpoint, con ventana deslizante de las últimas `window` llamadas.
+
+    - closed: se abre si, con al menos `min_calls` llamadas en la ventana, la tasa de errores supera
+      `failure_rate` o la de llamadas lentas (>= `slow_call_seconds`) supera `slow_call_rate`.
+    - open: rechaza sin llamar durante `open_seconds` (el llamador pasa al siguiente modelo al instante
+      en lugar de esperar el timeout del cliente).
+    - half_open: deja pasar `half_open_probes` llamadas de prueba; si salen bien se cierra, si no se reabre.
+    """
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(
+        self,
+        name: str = "",
+        failure_rate: float = 0.5,
+        slow_call_seconds: float = 5.0,
+        slow_call_rate: float = 0.8,
+        window: int = 20,
+        min_calls: int = 5,
+        open_seconds: float = 30.0,
+        half_open_probes: int = 1,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self._clock = clock
+        self._window: Deque[Tuple[bool, bool]] = deque(maxlen=window) # (falló, lenta)
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+        self.opened = 0 # Veces que se abrió
+
+    @property
+    def state(self) -> str:
+        if self._state == self.OPEN and self._clock() - self._opened_at >= self.open_seconds:
+            self._state = self.HALF_OPEN
+            self._probes = 0
+        return self._state
+
+    def allow(self) -> bool:
+        """True si se puede llamar ahora (en half_open reserva una de las llamadas de prueba)."""
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN and self._probes < self.half_open_probes:
+            self._probes += 1
+            return True
+        return False
+
+    def release(self) -> None:
+        """La llamada autorizada se canceló sin resultado (p. ej. perdió un hedge): no cuenta."""
+        if self._state == self.HALF_OPEN and self._probes > 0:
+            self._probes -= 1
+
+    def record(self, ok: bool, seconds: float) -> None:
+        slow = seconds >= self.slow_call_seconds
+        if self._state == self.HALF_OPEN:
+            if ok and not slow:
+                self._state = self.CLOSED
+                self._window.clear()
+                logger.info("Circuit breaker cerrado para %s", self.name)
+            else:
+                self._trip()
+            return
+        self._window.append((not ok, slow))
+        if len(self._window) < self.min_calls:
+            return
+        failures = sum(failed for failed, _ in self._window) / len(self._window)
+        slow_calls = sum(is_slow for _, is_slow in self._window) / len(self._window)
+        if failures >= self.failure_rate or slow_calls >= self.slow_call_rate:
+            self._trip()
+
+    def _trip(self) -> None:
+        self._state = self.OPEN
+        self._opened_at = self._clock()
+        self._window.clear()
+        self.opened += 1
+        logger.warning("Circuit breaker abierto para %s durante %.0fs", self.name, self.open_seconds)
+
+class LatencyTracker:
+    """Latencias de las últimas llamadas exitosas de un modelo, para fijar el retardo del hedge."""
+    def __init__(self, size: int = 200):
+        self._samples: Deque[float] = deque(maxlen=size)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def add(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, q: float) -> float:
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+class ModelRouter:
+    """
+    Elige el modelo de cada llamada a Groq y reintenta en los siguientes si falla.
+
+    - Orden: `short_message_model` primero para mensajes de hasta `short_message_max_chars`
+      caracteres, luego `models` (el principal y sus alternativas, en orden).
+    - Cada intento tiene su propio timeout y pasa por el circuit breaker de su modelo; los
+      modelos con el breaker abierto se saltan sin esperar.
+    - Hedging: si el intento en curso supera el percentil `hedge_percentile` de latencia de su modelo,
+      se lanza una llamada de respaldo al siguiente modelo y gana la primera que responda.
+    """
+    MIN_HEDGE_SAMPLES = 20 # Por debajo, el retardo del hedge es `hedge_initial_delay`
+
+    def __init__(
+        self,
+        models: Sequence[str],
+        short_message_model: Optional[str] = None,
+        short_message_max_chars: int = 60,
+        endpoint: str = "groq",
+        request_timeout: float = 10.0,
+        hedge: bool = True,
+        hedge_percentile: float = 0.95,
+        hedge_min_delay: float = 0.5,
+        hedge_initial_delay: float = 2.0,
+        breaker_factory: Optional[Callable[[str], CircuitBreaker]] = None,
+    ):
+        if not models:
+            raise ValueError("Se necesita al menos un modelo")
+        self.models = list(dict.fromkeys(models))
+        self.short_message_model = short_message_model
+        self.short_message_max_chars = short_message_max_chars
+        self.endpoint = endpoint
+        self.request_timeout = request_timeout
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_initial_delay = hedge_initial_delay
+        self._breaker_factory = breaker_factory or (lambda name: CircuitBreaker(name))
+        self._breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+        self._latency: Dict[str, LatencyTracker] = {}
+
+        self.calls = 0
+        self.failures = 0
+        self.fallbacks = 0 # Respuestas de un modelo distinto del primero elegido
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.short_routed = 0
+        self.rejected = 0 # Llamadas sin ningún modelo disponible
+
+    def breaker(self, model: str) -> CircuitBreaker:
+        key = (self.endpoint, model)
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            breaker = self._breakers[key] = self._breaker_factory(f"{self.endpoint}/{model}")
+        return breaker
+
+    def latency(self, model: str) -> LatencyTracker:
+        tracker = self._latency.get(model)
+        if tracker is None:
+            tracker = self._latency[model] = LatencyTracker()
+        return tracker
+
+    def candidates(self, prompt_chars: int) -> List[str]:
+        if self.short_message_model and prompt_chars <= self.short_message_max_chars:
+            return list(dict.fromkeys([self.short_message_model, *self.models]))
+        return list(self.models)
+
+    def hedge_delay(self, model: str) -> float:
+        tracker = self.latency(model)
+        if len(tracker) < self.MIN_HEDGE_SAMPLES:
+            return self.hedge_initial_delay
+        return max(self.hedge_min_delay, tracker.percentile(self.hedge_percentile))
+
+    def _next_allowed(self, remaining: List[str]) -> Optional[str]:
+        while remaining:
+            model = remaining.pop(0)
+            if self.breaker(model).allow():
+                return model
+        return None
+
+    async def complete(self, call: Callable[[str], Awaitable[Any]], prompt_chars: int = 0) -> Tuple[Any, str]:
+        """
+        Ejecuta `call(model)` con el primer modelo disponible, con fallback y hedging.
+        Devuelve (resultado, modelo que respondió) o lanza `AllModelsUnavailable`.
+        """
+        self.calls += 1
+        remaining = self.candidates(prompt_chars)
+        if remaining[0] != self.models[0]:
+            self.short_routed += 1
+        first = self._next_allowed(remaining)
+        if first is None:
+            self.rejected += 1
+            raise AllModelsUnavailable("Todos los modelos tienen el circuit breaker abierto")
+
+        running: Dict[asyncio.Task, Tuple[str, float, bool]] = {} # tarea -> (modelo, inicio, es hedge)
+        hedged = False
+        last_error: Optional[BaseException] = None
+
+        def launch(model: str, is_hedge: bool = False) -> None:
+            task = asyncio.ensure_future(asyncio.wait_for(call(model), timeout=self.request_timeout))
+            running[task] = (model, time.monotonic(), is_hedge)
+
+        launch(first)
+        try:
+            while running:
+                timeout = None
+                if self.hedge and not hedged and len(running) == 1 and remaining:
+                    model, started_at, _ = next(iter(running.values()))
+                    timeout = max(0.0, started_at + self.hedge_delay(model) - time.monotonic())
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # El intento en curso va más lento que su percentil: respaldo con el siguiente modelo
+                    hedged = True
+                    backup = self._next_allowed(remaining)
+                    if backup is not None:
+                        self.hedges += 1
+                        launch(backup, is_hedge=True)
+                    continue
+
+                for task in done:
+                    model, started_at, is_hedge = running.pop(task)
+                    elapsed = time.monotonic() - started_at
+                    error = task.exception()
+                    if error is None:
+                        self.breaker(model).record(True, elapsed)
+                        self.latency(model).add(elapsed)
+                        if model != first:
+                            self.fallbacks += 1
+                        if is_hedge:
+                            self.hedge_wins += 1
+                        return task.result(), model
+                    self.failures += 1
+                    self.breaker(model).record(False, elapsed)
+                    last_error = error
+                    logger.warning("Fallo del modelo %s tras %.2fs: %r", model, elapsed, error)
+
+                if not running:
+                    following = self._next_allowed(remaining)
+                    if following is not None:
+                        launch(following)
+            raise AllModelsUnavailable("Ningún modelo respondió") from last_error
+        finally:
+            # Perdedores del hedge o cancelación del llamador: no dejar llamadas colgando
+            for task, (model, _, _) in running.items():
+                task.cancel()
+                self.breaker(model).release()
+
+    async def stream(self, open_stream: Callable[[str], AsyncIterator[Any]], prompt_chars: int = 0) -> AsyncIterator[Any]:
+        """
+        Streaming con fallback: se prueba cada modelo hasta que uno entrega su primer fragmento
+        (el breaker mide el tiempo hasta ese fragmento). Sin hedging, y una vez empezado el stream
+        un error ya no cambia de modelo: parte de la respuesta puede haberse enviado.
+        """
+        self.calls += 1
+        remaining = self.candidates(prompt_chars)
+        last_error: Optional[BaseException] = None
+        first_model: Optional[str] = None
+        while True:
+            model = self._next_allowed(remaining)
+            if model is None:
+                if last_error is None:
+                    self.rejected += 1
+                raise AllModelsUnavailable("Ningún modelo respondió") from last_error
+            first_model = first_model or model
+            chunks = open_stream(model)
+            started_at = time.monotonic()
+            try:
+                first_chunk = await asyncio.wait_for(chunks.__anext__(), timeout=self.request_timeout)
+            except StopAsyncIteration:
+                self.breaker(model).record(True, time.monotonic() - started_at)
+                return
+            except asyncio.CancelledError:
+                self.breaker(model).release()
+                await chunks.aclose()
+                raise
+            except Exception as e:
+                self.failures += 1
+                self.breaker(model).record(False, time.monotonic() - started_at)
+                last_error = e
+                logger.warning("Fallo del modelo %s al iniciar el streaming: %r", model, e)
+                await chunks.aclose()
+                continue
+            elapsed = time.monotonic() - started_at
+            self.breaker(model).record(True, elapsed)
+            self.latency(model).add(elapsed)
+            if model != first_model:
+                self.fallbacks += 1
+            break
+
+        try:
+            yield first_chunk
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            await chunks.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "failures": self.failures,
+            "fallbacks": self.fallbacks,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "short_routed": self.short_routed,
+            "rejected": self.rejected,
+            "open_breakers": sum(breaker.state != CircuitBreaker.CLOSED for breaker in self._breakers.values()),
+        }
+
+    def breaker_states(self) -> Dict[str, str]:
+        return {breaker.name: breaker.state for breaker in self._breakers.values()}
+
+def parse_models(value: str) -> List[str]:
+    return [model.strip() for model in value.split(",") if model.strip()]
+
+def build_model_router(model: Optional[str] = None, settings: Settings = settings) -> ModelRouter:
+    """Router con `model` (por defecto GROQ_MODEL) como principal y LLM_FALLBACK_MODELS como alternativas."""
+    return ModelRouter(
+        models=[model or settings.GROQ_MODEL, *parse_models(settings.LLM_FALLBACK_MODELS)],
+        short_message_model=settings.LLM_SHORT_MESSAGE_MODEL or None,
+        short_message_max_chars=settings.LLM_SHORT_MESSAGE_MAX_CHARS,
+        request_timeout=settings.LLM_REQUEST_TIMEOUT_SECONDS,
+        hedge=settings.LLM_HEDGE_ENABLED,
+        hedge_percentile=settings.LLM_HEDGE_PERCENTILE,
+        hedge_min_delay=settings.LLM_HEDGE_MIN_DELAY_SECONDS,
+        hedge_initial_delay=settings.LLM_HEDGE_INITIAL_DELAY_SECONDS,
+        breaker_factory=lambda name: CircuitBreaker(
+            name,
+            failure_rate=settings.LLM_BREAKER_FAILURE_RATE,
+            slow_call_seconds=settings.LLM_BREAKER_SLOW_CALL_SECONDS,
+            slow_call_rate=settings.LLM_BREAKER_SLOW_CALL_RATE,
+            window=settings.LLM_BREAKER_WINDOW,
+            min_calls=settings.LLM_BREAKER_MIN_CALLS,
+            open_seconds=settings.LLM_BREAKER_OPEN_SECONDS,
+        ),
+    )
@@ -0,0 +1,229 @@
+import asyncio
+import random
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+from typing import Any, Deque, Dict, List, Optional
+
+import httpx
+
+from app.core.metrics import metrics
+from app.utils.http_client import HttpClient
+from app.utils.logging import logger
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+class TokenBucket:
+    """Token bucket clásico: `rate` tokens por segundo con ráfagas de hasta `capacity`."""
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def try_acquire(self, tokens: float = 1.0) -> float:
+        """Consume `tokens` si hay disponibles y devuelve 0; si no, devuelve los segundos a esperar."""
+        self._refill()
+        if self._tokens >= tokens:
+            self._tokens -= tokens
+            return 0.0
+        return (tokens - self._tokens) / self.rate
+
+    async def acquire(self, tokens: float = 1.0) -> float:
+        """Espera hasta poder consumir `tokens`. Devuelve el tiempo total esperado."""
+        waited = 0.0
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait == 0.0:
+                return waited
+            await asyncio.sleep(wait)
+            waited += wait
+
+@dataclass
+class SendResult:
+    status: str # "sent", "failed" (error no reintentable) o "dropped" (reintentos agotados)
+    attempts: int
+    status_code: Optional[int] = None
+    response: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.status == "sent"
+
+@dataclass
+class DeadLetter:
+    to: str
+    payload: Dict[str, Any]
+    reason: str
+    attempts: int
+    status_code: Optional[int] = None
+    failed_at: float = field(default_factory=time.time)
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Interpreta la cabecera Retry-After (segundos o fecha HTTP)."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class OutboundSendScheduler:
+    """
+    Planificador de envíos salientes hacia la Graph API.
+
+    - Ritmo: un token bucket por phone number ID (límite de throughput del número) y otro por
+      destinatario (límite por par emisor/receptor).
+    - Reintentos ante 429, 5xx y errores de red con backoff exponencial y jitter, respetando
+      `Retry-After`. Los reintentos en espera están acotados (`max_pending_retries`).
+    - Los envíos que no se pueden completar quedan en una lista dead-letter inspeccionable.
+    """
+    def __init__(
+        self,
+        http_client: HttpClient,
+        phone_rate: float = 80.0,
+        phone_burst: float = 80.0,
+        recipient_rate: float = 0.5,
+        recipient_burst: float = 10.0,
+        max_retries: int = 3,
+        base_backoff: float = 0.5,
+        max_backoff: float = 30.0,
+        max_pending_retries: int = 1000,
+        dead_letter_size: int = 1000,
+        max_recipient_buckets: int = 10_000,
+    ):
+        self.http_client = http_client
+        self.phone_rate = phone_rate
+        self.phone_burst = phone_burst
+        self.recipient_rate = recipient_rate
+        self.recipient_burst = recipient_burst
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.max_pending_retries = max_pending_retries
+        self.max_recipient_buckets = max_recipient_buckets
+
+        self._phone_buckets: Dict[str, TokenBucket] = {}
+        self._recipient_buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._pending_retries = 0
+        self.dead_letters: Deque[DeadLetter] = deque(maxlen=dead_letter_size)
+
+        self.sent = 0
+        self.retried = 0
+        self.throttled = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def _phone_bucket(self, phone_number_id: str) -> TokenBucket:
+        bucket = self._phone_buckets.get(phone_number_id)
+        if bucket is None:
+            bucket = self._phone_buckets[phone_number_id] = TokenBucket(self.phone_rate, self.phone_burst)
+        return bucket
+
+    def _recipient_bucket(self, to: str) -> TokenBucket:
+        bucket = self._recipient_buckets.get(to)
+        if bucket is None:
+            bucket = self._recipient_buckets[to] = TokenBucket(self.recipient_rate, self.recipient_burst)
+            while len(self._recipient_buckets) > self.max_recipient_buckets:
+                self._recipient_buckets.popitem(last=False)
+        else:
+            self._recipient_buckets.move_to_end(to)
+        return bucket
+
+    def _backoff(self, attempt: int, retry_after: Optional[float]) -> float:
+        if retry_after is not None:
+            return min(retry_after, self.max_backoff)
+        # Full jitter: evita que los reintentos de muchos envíos lleguen sincronizados
+        return random.uniform(0, min(self.max_backoff, self.base_backoff * (2 ** (attempt - 1))))
+
+    async def _wait_for_tokens(self, phone_number_id: str, to: str) -> None:
+        waited = await self._phone_bucket(phone_number_id).acquire()
+        waited += await self._recipient_bucket(to).acquire()
+        if waited > 0:
+            self.throttled += 1
+
+    def _dead_letter(self, to: str, payload: Dict[str, Any], result: SendResult) -> SendResult:
+        self.dead_letters.append(DeadLetter(
+            to=to, payload=payload, reason=result.error or result.status,
+            attempts=result.attempts, status_code=result.status_code,
+        ))
+        if result.status == "dropped":
+            self.dropped += 1
+        else:
+            self.failed += 1
+        return result
+
+    async def send(
+        self,
+        phone_number_id: str,
+        to: str,
+        payload: Dict[str, Any],
+        headers: Optional[Dict[str, str]] = None,
+    ) -> SendResult:
+        endpoint = f"/{phone_number_id}/messages"
+        attempt = 0
+        while True:
+            attempt += 1
+            await self._wait_for_tokens(phone_number_id, to)
+            retry_after = None
+            try:
+                with metrics.stage("outbound_send"):
+                    response = await self.http_client.post(endpoint, json=payload, headers=headers)
+            except httpx.TransportError as e:
+                status_code, error = None, f"{type(e).__name__}: {e}"
+            else:
+                if response.is_success:
+                    self.sent += 1
+                    try:
+                        body = response.json()
+                    except ValueError:
+                        body = None
+                    return SendResult(status="sent", attempts=attempt, status_code=response.status_code, response=body)
+                status_code, error = response.status_code, response.text
+                metrics.record_stage_error("outbound_send")
+                if status_code not in RETRYABLE_STATUS_CODES:
+                    return self._dead_letter(to, payload, SendResult(
+                        status="failed", attempts=attempt, status_code=status_code, error=error,
+                    ))
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+
+            if attempt > self.max_retries or self._pending_retries >= self.max_pending_retries:
+                return self._dead_letter(to, payload, SendResult(
+                    status="dropped", attempts=attempt, status_code=status_code, error=error,
+                ))
+
+            delay = self._backoff(attempt, retry_after)
+            self.retried += 1
+            logger.warning(
+                "Envío a %s falló (intento %d, %s); reintento en %.2fs", to, attempt, status_code or error, delay
+            )
+            self._pending_retries += 1
+            try:
+                await asyncio.sleep(delay)
+            finally:
+                self._pending_retries -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sent": self.sent,
+            "retried": self.retried,
+            "throttled": self.throttled,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "pending_retries": self._pending_retries,
+            "dead_letters": len(self.dead_letters),
+        }
+
+    def dead_letter_list(self) -> List[Dict[str, Any]]:
+        return [vars(letter).copy() for letter in self.dead_letters]
@@ -0,0 +1,192 @@
+from collections import deque
+from dataclasses import asdict, dataclass, field
+from typing import Any, Deque, Dict, List, Optional, Sequence
+
+from app.core.config import Settings, settings
+from app.utils.tokens import estimate_tokens, truncate_to_tokens
+
+DEFAULT_SYSTEM_PROMPT = "Eres un asistente virtual amigable y útil para WhatsApp."
+
+CONTEXT_HEADER = "\n\nContexto relevante:\n"
+CONTEXT_INSTRUCTION = (
+    "\n\nBasándote en el contexto anterior si es relevante, y en tu conocimiento general, "
+    "responde a la siguiente pregunta del usuario:\nUsuario: "
+)
+USER_PREFIX = "Usuario: "
+
+# Fragmentos RAG que no alcanzan este tamaño tras recortarlos se descartan (no aportan contexto útil)
+MIN_CONTEXT_FRAGMENT_TOKENS = 32
+
+@dataclass
+class PromptUsage:
+    """Tokens de una petición: estimados al construir el prompt y reales según `usage` de Groq."""
+    system_tokens: int = 0
+    history_tokens: int = 0
+    context_tokens: int = 0
+    user_tokens: int = 0
+    input_tokens: int = 0
+    max_tokens: int = 0
+    user_truncated: bool = False
+    context_fragments: int = 0
+    context_dropped: int = 0
+    history_dropped: int = 0
+    model: Optional[str] = None
+    prompt_tokens: Optional[int] = None # Reales (Groq)
+    completion_tokens: Optional[int] = None
+
+    def record_completion(self, usage: Any, model: Optional[str] = None) -> None:
+        self.model = model or self.model
+        for kind in ("prompt_tokens", "completion_tokens"):
+            value = getattr(usage, kind, None)
+            if isinstance(value, int):
+                setattr(self, kind, value)
+
+@dataclass
+class BuiltPrompt:
+    messages: List[Dict[str, str]]
+    max_tokens: int
+    usage: PromptUsage = field(default_factory=PromptUsage)
+
+class PromptBuilder:
+    """
+    Arma los mensajes para el LLM dentro de presupuestos fijos de tokens.
+
+    El system prompt se construye una sola vez y se reutiliza idéntico en cada petición (prefijo
+    estable). El resto de la entrada se reparte en este orden de prioridad: la pregunta del usuario
+    (hasta `max_user_tokens`, recortada conservando inicio y final), el contexto RAG (fragmentos
+    completos por relevancia hasta `max_context_tokens`; el último puede recortarse) y el historial,
+    del que se descartan los turnos más antiguos hasta que todo cabe en `max_input_tokens`.
+
+    `max_tokens` de la respuesta se deriva de lo que queda en la ventana del modelo, acotado entre
+    `min_output_tokens` y `max_output_tokens`.
+    """
+    def __init__(
+        self,
+        system_prompt: str = DEFAULT_SYSTEM_PROMPT,
+        context_window: int = 8192,
+        max_input_tokens: int = 3072,
+        max_output_tokens: int = 512,
+        min_output_tokens: int = 64,
+        max_user_tokens: int = 1024,
+        max_context_tokens: int = 1024,
+        user_tail_ratio: float = 0.3,
+        usage_history: int = 1000,
+    ):
+        if min_output_tokens > max_output_tokens:
+            raise ValueError("min_output_tokens no puede superar max_output_tokens")
+        self.context_window = context_window
+        self.max_input_tokens = min(max_input_tokens, context_window - min_output_tokens)
+        self.max_output_tokens = max_output_tokens
+        self.min_output_tokens = min_output_tokens
+        self.max_user_tokens = max_user_tokens
+        self.max_context_tokens = max_context_tokens
+        self.user_tail_ratio = user_tail_ratio
+        self.system_message: Dict[str, str] = {"role": "system", "content": system_prompt}
+        self.system_tokens = estimate_tokens(system_prompt)
+        self.recent: Deque[PromptUsage] = deque(maxlen=usage_history)
+        self.requests = 0
+        self.user_truncations = 0
+        self.context_truncations = 0
+        self.history_truncations = 0
+        self.estimated_input_tokens = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def _fit_context(self, fragments: Sequence[str], usage: PromptUsage) -> str:
+        remaining = self.max_context_tokens
+        kept: List[str] = []
+        for fragment in filter(None, fragments):
+            tokens = estimate_tokens(fragment)
+            if tokens > remaining:
+                if remaining >= MIN_CONTEXT_FRAGMENT_TOKENS:
+                    kept.append(truncate_to_tokens(fragment, remaining))
+                break
+            kept.append(fragment)
+            remaining -= tokens
+        usage.context_fragments = len(kept)
+        usage.context_dropped = len([f for f in fragments if f]) - len(kept)
+        if not kept:
+            return ""
+        context_str = CONTEXT_HEADER + "\n".join(kept)
+        usage.context_tokens = estimate_tokens(context_str)
+        return context_str
+
+    def build(
+        self,
+        user_prompt: str,
+        context_fragments: Sequence[str] = (),
+        history: Sequence[Dict[str, str]] = (),
+    ) -> BuiltPrompt:
+        usage = PromptUsage(system_tokens=self.system_tokens)
+
+        user_text = truncate_to_tokens(user_prompt, self.max_user_tokens, tail_ratio=self.user_tail_ratio)
+        usage.user_truncated = user_text != user_prompt
+        context_str = self._fit_context(context_fragments, usage) if context_fragments else ""
+        if context_str:
+            full_prompt = f"{context_str}{CONTEXT_INSTRUCTION}{user_text}"
+        else:
+            full_prompt = f"{USER_PREFIX}{user_text}"
+        usage.user_tokens = max(0, estimate_tokens(full_prompt) - usage.context_tokens)
+
+        # El historial usa lo que queda; se descartan primero los turnos más antiguos
+        available = self.max_input_tokens - self.system_tokens - usage.context_tokens - usage.user_tokens
+        kept_history: List[Dict[str, str]] = []
+        for message in reversed(history):
+            tokens = estimate_tokens(message.get("content", ""))
+            if tokens > available:
+                break
+            kept_history.append(message)
+            available -= tokens
+            usage.history_tokens += tokens
+        kept_history.reverse()
+        usage.history_dropped = len(history) - len(kept_history)
+
+        usage.input_tokens = self.system_tokens + usage.history_tokens + usage.context_tokens + usage.user_tokens
+        usage.max_tokens = max(self.min_output_tokens, min(self.max_output_tokens, self.context_window - usage.input_tokens))
+        messages = [self.system_message, *kept_history, {"role": "user", "content": full_prompt}]
+        return BuiltPrompt(messages=messages, max_tokens=usage.max_tokens, usage=usage)
+
+    def record(self, usage: PromptUsage) -> None:
+        """Registra el uso de una petición ya respondida (para ajustar los presupuestos)."""
+        self.recent.append(usage)
+        self.requests += 1
+        self.user_truncations += usage.user_truncated
+        self.context_truncations += usage.context_dropped > 0
+        self.history_truncations += usage.history_dropped > 0
+        self.estimated_input_tokens += usage.input_tokens
+        self.prompt_tokens += usage.prompt_tokens or 0
+        self.completion_tokens += usage.completion_tokens or 0
+
+    def recent_usage(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        records = list(self.recent)[-limit:] if limit else list(self.recent)
+        return [asdict(record) for record in records]
+
+    def stats(self) -> Dict[str, Any]:
+        recent = list(self.recent)
+        inputs = sorted(record.input_tokens for record in recent)
+        # Fracción de `max_tokens` que realmente usan las respuestas: si es baja, se puede bajar el tope
+        completions = [record.completion_tokens / record.max_tokens for record in recent if record.completion_tokens and record.max_tokens]
+        return {
+            "requests": self.requests,
+            "user_truncations": self.user_truncations,
+            "context_truncations": self.context_truncations,
+            "history_truncations": self.history_truncations,
+            "estimated_input_tokens": self.estimated_input_tokens,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "input_tokens_p50": inputs[len(inputs) // 2] if inputs else 0,
+            "input_tokens_p95": inputs[min(len(inputs) - 1, int(len(inputs) * 0.95))] if inputs else 0,
+            "output_budget_used": sum(completions) / len(completions) if completions else 0.0,
+        }
+
+def build_prompt_builder(system_prompt: Optional[str] = None, settings: Settings = settings) -> PromptBuilder:
+    return PromptBuilder(
+        system_prompt=system_prompt or settings.LLM_SYSTEM_PROMPT,
+        context_window=settings.LLM_CONTEXT_WINDOW,
+        max_input_tokens=settings.LLM_MAX_INPUT_TOKENS,
+        max_output_tokens=settings.LLM_MAX_OUTPUT_TOKENS,
+        min_output_tokens=settings.LLM_MIN_OUTPUT_TOKENS,
+        max_user_tokens=settings.LLM_MAX_USER_TOKENS,
+        max_context_tokens=settings.LLM_MAX_CONTEXT_TOKENS,
+        usage_history=settings.LLM_USAGE_HISTORY,
+    )
@@ -1,5 +1,6 @@
 from abc import ABC, abstractmethod
 from typing import List, Dict, Any, Optional
+from app.core.config import Settings, settings
 
 class RAGInterface(ABC):
     @abstractmethod
@@ -45,6 +46,16 @@ class NoRAGService(RAGInterface):
     async def add_document(self, document_text: str, metadata: Optional[Dict[str, Any]] = None) -> Any:
         return {"status": "no_rag_service_active"}
 
-# Instancia del servicio RAG (cambiar a QdrantRAGService cuando esté listo)
-# rag_service: RAGInterface = QdrantRAGService(qdrant_url=settings.QDRANT_URL, api_key=settings.QDRANT_API_KEY)
-rag_service: RAGInterface = NoRAGService() # Usar este por ahora
\ No newline at end of file
+def build_rag_service(settings: Settings = settings, index_dir: Optional[str] = None) -> RAGInterface:
+    """Base de conocimientos de RAG_INDEX_DIR o, para un tenant, la de su propio índice (`index_dir`)."""
+    if settings.RAG_BACKEND == "local":
+        # Import diferido: numpy solo se carga si el backend local está activo
+        from app.services.embeddings import HashingEmbedder
+        from app.services.vector_rag import LocalVectorRAGService
+        return LocalVectorRAGService(
+            embedder=HashingEmbedder(dimensions=settings.RAG_EMBEDDING_DIMENSIONS),
+            index_dir=index_dir or settings.RAG_INDEX_DIR,
+            chunk_size=settings.RAG_CHUNK_SIZE,
+            chunk_overlap=settings.RAG_CHUNK_OVERLAP,
+        )
+    return NoRAGService()
@@ -0,0 +1,256 @@
+import re
+import sys
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from app.core.config import Settings, settings
+from app.services.embeddings import EmbeddingInterface, HashingEmbedder
+from app.services.shared_state import SharedState
+from app.utils.text import normalize_text
+
+# Mensajes que dependen del usuario o del contexto y no deben compartir respuesta:
+# referencias a datos propios ("mi pedido"), números largos (pedidos, RUT, teléfonos)
+# y seguimientos que solo tienen sentido dentro de la conversación.
+DEFAULT_BYPASS_PATTERN = r"\b(mi|mis|mio|mia|nuestro|nuestra)\b|\d{4,}|\b(eso|esto|lo anterior|y si)\b"
+
+# Con conversación previa, además, se tratan como seguimiento los mensajes que empiezan
+# encadenando ("y...", "pero...") o que apuntan a algo ya mencionado ("ese plan", "ahí").
+DEFAULT_FOLLOW_UP_PATTERN = (
+    r"^(y|pero|entonces|tambien|ademas|o sea)\b"
+    r"|\b(ese|esa|esos|esas|aquel|aquella|aquello|ahi|alli|lo mismo|el otro|la otra|el primero|la primera)\b"
+)
+
+@dataclass
+class _CacheEntry:
+    response: str
+    expires_at: float
+    size: int
+    generation_seconds: float
+    embedding: Optional[np.ndarray] = None
+
+@dataclass
+class CacheLookup:
+    """Resultado de consultar la caché; se reutiliza al guardar para no normalizar ni vectorizar dos veces."""
+    key: str
+    response: Optional[str] = None
+    bypassed: bool = False
+    embedding: Optional[np.ndarray] = None
+
+class ResponseCache:
+    """
+    Caché de respuestas del LLM para preguntas frecuentes.
+
+    Primero busca una coincidencia exacta del texto normalizado (minúsculas, sin tildes,
+    puntuación ni espacios extra) y, si hay un embedder configurado, cae a una búsqueda por
+    similitud coseno con umbral configurable. Entradas con TTL, desalojo LRU y techo de memoria.
+
+    Con `shared_state` las coincidencias exactas se publican también ahí, de modo que una respuesta
+    generada en un worker se sirve desde los demás (la búsqueda semántica sigue siendo local).
+
+    Un mensaje de un usuario con historial solo se trata como contextual si parece un seguimiento
+    (muy corto o con referencias a lo anterior); las preguntas autocontenidas se siguen cacheando.
+    """
+    def __init__(
+        self,
+        ttl_seconds: float = 3600.0,
+        max_entries: int = 1000,
+        max_bytes: int = 5_000_000,
+        embedder: Optional[EmbeddingInterface] = None,
+        similarity_threshold: float = 0.9,
+        max_prompt_chars: int = 200,
+        bypass_pattern: Optional[str] = DEFAULT_BYPASS_PATTERN,
+        follow_up_pattern: Optional[str] = DEFAULT_FOLLOW_UP_PATTERN,
+        min_standalone_words: int = 4,
+        shared_state: Optional[SharedState] = None,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.embedder = embedder
+        self.similarity_threshold = similarity_threshold
+        self.max_prompt_chars = max_prompt_chars
+        self._bypass = re.compile(bypass_pattern) if bypass_pattern else None
+        self._follow_up = re.compile(follow_up_pattern) if follow_up_pattern else None
+        self.min_standalone_words = min_standalone_words
+        self.shared_state = shared_state
+
+        self._entries: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        self._bytes = 0
+        # Matriz de embeddings (una fila por entrada) para la búsqueda semántica; se reconstruye
+        # solo cuando cambia el conjunto de entradas
+        self._matrix: Optional[np.ndarray] = None
+        self._matrix_keys: List[str] = []
+
+        self.hits_exact = 0
+        self.hits_semantic = 0
+        self.hits_shared = 0 # Coincidencias exactas servidas desde el estado compartido
+        self.misses = 0
+        self.bypassed = 0
+        self.latency_saved_seconds = 0.0
+
+    def is_follow_up(self, normalized_prompt: str) -> bool:
+        """Un mensaje corto o con referencias a lo anterior solo se entiende con el historial."""
+        if len(normalized_prompt.split()) < self.min_standalone_words:
+            return True
+        return bool(self._follow_up and self._follow_up.search(normalized_prompt))
+
+    def should_bypass(self, normalized_prompt: str, has_history: bool = False) -> bool:
+        """Turnos personalizados o contextuales no se cachean ni se sirven desde caché."""
+        if not normalized_prompt or len(normalized_prompt) > self.max_prompt_chars:
+            return True
+        if self._bypass and self._bypass.search(normalized_prompt):
+            return True
+        return has_history and self.is_follow_up(normalized_prompt)
+
+    async def lookup(self, prompt: str, has_history: bool = False) -> CacheLookup:
+        """`has_history`: el usuario tiene conversación previa (LLMService lo indica)."""
+        key = normalize_text(prompt)
+        if self.should_bypass(key, has_history):
+            self.bypassed += 1
+            return CacheLookup(key=key, bypassed=True)
+
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry.expires_at > now:
+                self._entries.move_to_end(key)
+                self.hits_exact += 1
+                self.latency_saved_seconds += entry.generation_seconds
+                return CacheLookup(key=key, response=entry.response)
+            self._remove(key)
+
+        shared_response = await self._shared_get(key)
+        if shared_response is not None:
+            self.hits_shared += 1
+            self._put(key, shared_response, generation_seconds=0.0, embedding=None)
+            return CacheLookup(key=key, response=shared_response)
+
+        lookup = CacheLookup(key=key)
+        if self.embedder is not None and self._entries:
+            lookup.embedding = await self._embed(key)
+            match = self._most_similar(lookup.embedding, now)
+            if match is not None:
+                match_key, entry = match
+                self._entries.move_to_end(match_key)
+                self.hits_semantic += 1
+                self.latency_saved_seconds += entry.generation_seconds
+                lookup.response = entry.response
+                return lookup
+
+        self.misses += 1
+        return lookup
+
+    def _most_similar(self, embedding: np.ndarray, now: float) -> Optional[tuple]:
+        if self._matrix is None:
+            self._matrix_keys = [key for key, entry in self._entries.items() if entry.embedding is not None]
+            rows = [self._entries[key].embedding for key in self._matrix_keys]
+            self._matrix = np.vstack(rows) if rows else np.empty((0, embedding.shape[0]), dtype=np.float32)
+        if not self._matrix_keys:
+            return None
+        # Los vectores vienen normalizados: el producto punto es la similitud coseno
+        scores = self._matrix @ embedding
+        for index in np.argsort(scores)[::-1]:
+            if scores[index] < self.similarity_threshold:
+                return None
+            key = self._matrix_keys[index]
+            entry = self._entries[key]
+            if entry.expires_at > now:
+                return key, entry
+        return None
+
+    async def _embed(self, key: str) -> np.ndarray:
+        return np.asarray((await self.embedder.embed([key]))[0], dtype=np.float32)
+
+    async def store(self, lookup: CacheLookup, response: str, generation_seconds: float) -> None:
+        if lookup.bypassed or lookup.response is not None:
+            return
+        embedding = lookup.embedding
+        if self.embedder is not None and embedding is None:
+            embedding = await self._embed(lookup.key)
+
+        self._put(lookup.key, response, generation_seconds, embedding)
+        if self.shared_state is not None:
+            try:
+                await self.shared_state.set(self._shared_key(lookup.key), response, ttl=self.ttl_seconds)
+            except Exception:
+                pass # La copia local ya quedó guardada; el estado compartido es una optimización
+
+    def _shared_key(self, key: str) -> str:
+        return f"response_cache:{key}"
+
+    async def _shared_get(self, key: str) -> Optional[str]:
+        if self.shared_state is None:
+            return None
+        try:
+            return await self.shared_state.get(self._shared_key(key))
+        except Exception:
+            return None
+
+    def _put(self, key: str, response: str, generation_seconds: float, embedding: Optional[np.ndarray]) -> None:
+        size = sys.getsizeof(key) + sys.getsizeof(response) + (embedding.nbytes if embedding is not None else 0)
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = _CacheEntry(
+            response=response,
+            expires_at=time.monotonic() + self.ttl_seconds,
+            size=size,
+            generation_seconds=generation_seconds,
+            embedding=embedding,
+        )
+        self._bytes += size
+        if embedding is not None:
+            self._matrix = None
+        # Desalojo LRU hasta respetar el número de entradas y el techo de memoria
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+        if entry.embedding is not None:
+            self._matrix = None
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._bytes = 0
+        self._matrix = None
+
+    def stats(self) -> Dict[str, Any]:
+        hits = self.hits_exact + self.hits_semantic + self.hits_shared
+        lookups = hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits_exact": self.hits_exact,
+            "hits_semantic": self.hits_semantic,
+            "hits_shared": self.hits_shared,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "latency_saved_seconds": self.latency_saved_seconds,
+        }
+
+def build_response_cache(
+    shared_state: Optional[SharedState] = None,
+    settings: Settings = settings,
+) -> Optional[ResponseCache]:
+    if not settings.RESPONSE_CACHE_ENABLED:
+        return None
+    embedder = HashingEmbedder() if settings.RESPONSE_CACHE_SEMANTIC_ENABLED else None
+    return ResponseCache(
+        ttl_seconds=settings.RESPONSE_CACHE_TTL_SECONDS,
+        max_entries=settings.RESPONSE_CACHE_MAX_ENTRIES,
+        max_bytes=settings.RESPONSE_CACHE_MAX_BYTES,
+        embedder=embedder,
+        similarity_threshold=settings.RESPONSE_CACHE_SIMILARITY_THRESHOLD,
+        max_prompt_chars=settings.RESPONSE_CACHE_MAX_PROMPT_CHARS,
+        min_standalone_words=settings.RESPONSE_CACHE_MIN_STANDALONE_WORDS,
+        shared_state=shared_state,
+    )
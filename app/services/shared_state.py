@@ -0,0 +1,198 @@
+import asyncio
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional, Tuple
+
+from app.core.config import Settings, settings
+
+class LockNotAcquired(Exception):
+    """No se pudo obtener un lock compartido dentro del tiempo de espera indicado."""
+
+class SharedState(ABC):
+    """
+    Estado clave/valor con expiración compartido por los componentes que deben comportarse igual con
+    uno o varios workers: deduplicación, caché de respuestas y locks con nombre.
+
+    - `InMemorySharedState`: un solo proceso (por defecto, sin coste de E/S).
+    - `SQLiteSharedState`: un archivo compartido por todos los workers de la máquina.
+    """
+    @abstractmethod
+    async def get(self, key: str) -> Optional[str]:
+        pass
+
+    @abstractmethod
+    async def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        pass
+
+    @abstractmethod
+    async def add(self, key: str, value: str = "1", ttl: Optional[float] = None) -> bool:
+        """Guarda `key` solo si no existe (o expiró). Atómico: devuelve True si la guardó esta llamada."""
+        pass
+
+    @abstractmethod
+    async def delete(self, key: str, value: Optional[str] = None) -> bool:
+        """Borra `key` (si se indica `value`, solo si coincide). Devuelve True si borró algo."""
+        pass
+
+    @asynccontextmanager
+    async def lock(self, name: str, ttl: float = 30.0, timeout: Optional[float] = None, poll_interval: float = 0.05) -> AsyncIterator[None]:
+        """
+        Lock con nombre basado en `add`: el dueño guarda un token único y lo borra al salir.
+        `ttl` acota cuánto dura si el proceso dueño muere; `timeout=0` intenta una sola vez.
+        """
+        key = f"lock:{name}"
+        token = uuid.uuid4().hex
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not await self.add(key, token, ttl):
+            if deadline is not None and time.monotonic() >= deadline:
+                raise LockNotAcquired(name)
+            await asyncio.sleep(poll_interval)
+        try:
+            yield
+        finally:
+            await self.delete(key, token)
+
+    async def close(self) -> None:
+        pass
+
+class InMemorySharedState(SharedState):
+    """Diccionario acotado con expiración y desalojo LRU, para un único proceso."""
+    def __init__(self, max_entries: int = 100_000):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[str, Optional[float]]]" = OrderedDict() # clave -> (valor, expira)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _live(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _store(self, key: str, value: str, ttl: Optional[float]) -> None:
+        self._entries[key] = (value, None if ttl is None else time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+        # Desalojo LRU; las entradas más antiguas suelen ser también las expiradas
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[str]:
+        return self._live(key)
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        self._store(key, value, ttl)
+
+    async def add(self, key: str, value: str = "1", ttl: Optional[float] = None) -> bool:
+        # Sin await entre la consulta y la escritura: atómico dentro del event loop
+        if self._live(key) is not None:
+            return False
+        self._store(key, value, ttl)
+        return True
+
+    async def delete(self, key: str, value: Optional[str] = None) -> bool:
+        if self._live(key) is None or (value is not None and self._entries[key][0] != value):
+            return False
+        del self._entries[key]
+        return True
+
+class SQLiteSharedState(SharedState):
+    """
+    Estado compartido en un archivo SQLite (modo WAL) para varios workers en la misma máquina.
+    Cada operación es una transacción corta (`BEGIN IMMEDIATE` en las que escriben) ejecutada en un
+    hilo para no bloquear el event loop.
+    """
+    PURGE_EVERY = 1000 # Escrituras entre limpiezas de entradas expiradas
+
+    def __init__(self, path: str = "shared_state.sqlite3", busy_timeout_ms: int = 5000):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(f"PRAGMA busy_timeout={int(busy_timeout_ms)}")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS shared_state (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+        )
+        self._writes = 0
+
+    def _write(self, statements) -> sqlite3.Cursor:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = None
+                for sql, params in statements:
+                    cursor = self._conn.execute(sql, params)
+                self._writes += 1
+                if self._writes % self.PURGE_EVERY == 0:
+                    self._conn.execute("DELETE FROM shared_state WHERE expires_at <= ?", (time.time(),))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return cursor
+
+    def _get_sync(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM shared_state WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (key, time.time()),
+            ).fetchone()
+        return row[0] if row else None
+
+    async def get(self, key: str) -> Optional[str]:
+        return await asyncio.to_thread(self._get_sync, key)
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        expires_at = None if ttl is None else time.time() + ttl
+        await asyncio.to_thread(self._write, [(
+            "INSERT OR REPLACE INTO shared_state (key, value, expires_at) VALUES (?, ?, ?)", (key, value, expires_at),
+        )])
+
+    async def add(self, key: str, value: str = "1", ttl: Optional[float] = None) -> bool:
+        now = time.time()
+        cursor = await asyncio.to_thread(self._write, [
+            ("DELETE FROM shared_state WHERE key = ? AND expires_at <= ?", (key, now)),
+            (
+                "INSERT OR IGNORE INTO shared_state (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, None if ttl is None else now + ttl),
+            ),
+        ])
+        return cursor.rowcount == 1
+
+    async def delete(self, key: str, value: Optional[str] = None) -> bool:
+        if value is None:
+            statement = ("DELETE FROM shared_state WHERE key = ?", (key,))
+        else:
+            statement = ("DELETE FROM shared_state WHERE key = ? AND value = ?", (key, value))
+        cursor = await asyncio.to_thread(self._write, [statement])
+        return cursor.rowcount > 0
+
+    def purge_expired(self) -> int:
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM shared_state WHERE expires_at <= ?", (time.time(),))
+        return cursor.rowcount
+
+    async def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+def build_shared_state(
+    backend: Optional[str] = None,
+    path: Optional[str] = None,
+    max_entries: int = 100_000,
+    settings: Settings = settings,
+) -> SharedState:
+    backend = backend or settings.STATE_BACKEND
+    if backend == "sqlite":
+        return SQLiteSharedState(path=path or settings.STATE_SQLITE_PATH)
+    return InMemorySharedState(max_entries=max_entries)
@@ -0,0 +1,61 @@
+import re
+from typing import AsyncIterator, Optional
+
+# Límite de longitud de un mensaje de texto de WhatsApp
+WHATSAPP_MAX_TEXT_CHARS = 4096
+
+_PARAGRAPH_BOUNDARY = re.compile(r"\n\s*\n")
+_SENTENCE_BOUNDARY = re.compile(r"[.!?…](?:[\"')\]]*)(?=\s)")
+
+def _find_cut(buffer: str, min_chars: int) -> Optional[int]:
+    """
+    Devuelve la posición donde cortar el buffer (fin de párrafo preferido, si no fin de oración),
+    siempre que el fragmento resultante tenga al menos `min_chars`. None si aún no hay un corte válido.
+    """
+    paragraph_cuts = [m.start() for m in _PARAGRAPH_BOUNDARY.finditer(buffer) if m.start() >= min_chars]
+    if paragraph_cuts:
+        return paragraph_cuts[0]
+    sentence_cuts = [m.end() for m in _SENTENCE_BOUNDARY.finditer(buffer) if m.end() >= min_chars]
+    if sentence_cuts:
+        return sentence_cuts[-1]
+    return None
+
+async def chunk_by_sentences(
+    deltas: AsyncIterator[str],
+    min_chars: int = 120,
+    max_chunks: int = 4,
+    max_chars: int = WHATSAPP_MAX_TEXT_CHARS,
+) -> AsyncIterator[str]:
+    """
+    Agrupa los deltas de un stream del LLM en fragmentos listos para enviar como mensajes.
+
+    Se corta en límites de párrafo u oración una vez alcanzado `min_chars`. Tras `max_chunks - 1`
+    cortes todo el resto va al último fragmento, salvo que supere `max_chars` (límite de WhatsApp).
+    """
+    buffer = ""
+    emitted = 0
+    async for delta in deltas:
+        buffer += delta
+        while True:
+            cut = None
+            if emitted < max_chunks - 1:
+                cut = _find_cut(buffer, min_chars)
+            if cut is None and len(buffer) > max_chars:
+                # Corte forzado en el último espacio antes del límite
+                cut = buffer.rfind(" ", 0, max_chars)
+                cut = cut if cut > 0 else max_chars
+            if cut is None:
+                break
+            chunk, buffer = buffer[:cut].strip(), buffer[cut:].lstrip()
+            if chunk:
+                emitted += 1
+                yield chunk
+
+    remainder = buffer.strip()
+    while len(remainder) > max_chars:
+        cut = remainder.rfind(" ", 0, max_chars)
+        cut = cut if cut > 0 else max_chars
+        yield remainder[:cut].strip()
+        remainder = remainder[cut:].lstrip()
+    if remainder:
+        yield remainder
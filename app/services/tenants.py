@@ -0,0 +1,247 @@
+import asyncio
+import json
+import os
+import time
+from dataclasses import dataclass, field, fields
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from app.core.config import Settings, settings
+from app.core.metrics import metrics
+from app.services.llm_service import LLMService
+from app.services.media import MediaPipeline
+from app.services.meta_service import MetaService
+from app.services.outbound import OutboundSendScheduler
+from app.services.webhook_dispatcher import WebhookDispatcher
+from app.utils.http_client import HttpClient
+from app.utils.logging import logger
+
+DEFAULT_TENANT = "default" # Número configurado en Settings (WHATSAPP_PHONE_NUMBER_ID)
+SECRET_FROM_ENV = "env:" # "env:NOMBRE" toma el valor de la variable de entorno NOMBRE
+
+# Métricas por tenant (la cardinalidad la acota el archivo de tenants)
+tenant_webhooks = metrics.counter("tenant_webhooks_total", "Webhooks con mensajes aceptados por tenant", ("tenant",))
+tenant_rejected = metrics.counter("tenant_webhooks_rejected_total", "Webhooks rechazados con la cola del tenant llena", ("tenant",))
+tenant_processing = metrics.histogram(
+    "tenant_processing_seconds", "Procesamiento de un webhook por tenant (LLM + envío de la respuesta)", ("tenant",),
+)
+
+@dataclass(frozen=True)
+class Tenant:
+    """
+    Un número de negocio servido por este despliegue. Los campos opcionales sin valor usan los de
+    Settings; los límites de conexiones y concurrencia son propios del tenant (no se comparten), así
+    un tenant con mucho tráfico no deja sin capacidad a los demás.
+    """
+    tenant_id: str
+    phone_number_id: str
+    access_token: str = field(repr=False)
+    groq_api_key: Optional[str] = field(default=None, repr=False)
+    model: Optional[str] = None
+    system_prompt: Optional[str] = None
+    intents_file: Optional[str] = None # Respuestas de plantilla propias; sin archivo el tenant no las usa
+    rag_index_dir: Optional[str] = None # Base de conocimientos propia (RAG_BACKEND=local); sin índice responde sin RAG
+    max_connections: Optional[int] = None # Pool HTTP propio hacia la Graph API
+    max_keepalive_connections: Optional[int] = None
+    webhook_workers: Optional[int] = None # Webhooks del tenant procesándose a la vez
+    queue_max_size: Optional[int] = None # Webhooks en espera; por encima se responde 503 (solo a este tenant)
+    conversation_concurrency: Optional[int] = None # Conversaciones respondiéndose a la vez
+    llm_max_concurrency: Optional[int] = None # Llamadas a Groq en curso
+
+_TENANT_FIELDS = {tenant_field.name for tenant_field in fields(Tenant)}
+
+def _secret(value: Any) -> Any:
+    if isinstance(value, str) and value.startswith(SECRET_FROM_ENV):
+        name = value[len(SECRET_FROM_ENV):]
+        if name not in os.environ:
+            raise ValueError(f"Variable de entorno no definida: {name}")
+        return os.environ[name]
+    return value
+
+def parse_tenants(data: Any) -> List[Tenant]:
+    """Valida el contenido del archivo de tenants (`{"tenants": [...]}`)."""
+    items = data.get("tenants") if isinstance(data, dict) else data
+    if not isinstance(items, list):
+        raise ValueError("Se esperaba una lista de tenants en 'tenants'")
+    tenants: List[Tenant] = []
+    ids, phones = set(), set()
+    for item in items:
+        if not isinstance(item, dict):
+            raise ValueError(f"Tenant inválido: {item!r}")
+        item = dict(item)
+        item.setdefault("tenant_id", item.pop("id", None))
+        unknown = set(item) - _TENANT_FIELDS
+        if unknown:
+            raise ValueError(f"Campos desconocidos en el tenant {item.get('tenant_id')!r}: {sorted(unknown)}")
+        for required in ("tenant_id", "phone_number_id", "access_token"):
+            if not item.get(required):
+                raise ValueError(f"Tenant sin '{required}': {item.get('tenant_id')!r}")
+        if item["tenant_id"] in ids or item["tenant_id"] == DEFAULT_TENANT:
+            raise ValueError(f"Id de tenant repetido o reservado: '{item['tenant_id']}'")
+        if str(item["phone_number_id"]) in phones:
+            raise ValueError(f"phone_number_id repetido: '{item['phone_number_id']}'")
+        ids.add(item["tenant_id"])
+        phones.add(str(item["phone_number_id"]))
+        item["phone_number_id"] = str(item["phone_number_id"])
+        item["access_token"] = _secret(item["access_token"])
+        item["groq_api_key"] = _secret(item.get("groq_api_key"))
+        tenants.append(Tenant(**item))
+    return tenants
+
+class TenantRegistry:
+    """
+    Tenants indexados por `phone_number_id` (el de `metadata` en cada webhook), leídos de un JSON
+    y recargados sin reiniciar cuando cambia el archivo (se revisa el mtime como mucho cada
+    `reload_interval`; un archivo inválido deja los tenants cargados).
+    """
+    def __init__(self, path: Optional[str] = None, tenants: Optional[List[Tenant]] = None, reload_interval: float = 5.0):
+        self.path = path
+        self.reload_interval = reload_interval
+        self.by_phone: Dict[str, Tenant] = {tenant.phone_number_id: tenant for tenant in tenants or ()}
+        self._mtime: Optional[float] = None
+        self._checked_at = 0.0
+        self._reload_lock = asyncio.Lock()
+        self.reloads = 0
+        self.reload_errors = 0
+        if path is not None and tenants is None:
+            try:
+                self._install(*self._load_sync())
+            except (OSError, ValueError) as e:
+                self.reload_errors += 1
+                logger.error("No se pudieron cargar los tenants de %s: %s", path, e)
+
+    def _load_sync(self) -> Tuple[List[Tenant], float]:
+        mtime = os.stat(self.path).st_mtime
+        with open(self.path, encoding="utf-8") as tenants_file:
+            return parse_tenants(json.load(tenants_file)), mtime
+
+    def _install(self, tenants: List[Tenant], mtime: float) -> None:
+        self.by_phone = {tenant.phone_number_id: tenant for tenant in tenants}
+        self._mtime = mtime
+        logger.info("Tenants cargados desde %s: %d", self.path, len(tenants))
+
+    def get(self, phone_number_id: Optional[str]) -> Optional[Tenant]:
+        return self.by_phone.get(phone_number_id) if phone_number_id is not None else None
+
+    async def reload_if_changed(self) -> bool:
+        now = time.monotonic()
+        if self.path is None or now - self._checked_at < self.reload_interval or self._reload_lock.locked():
+            return False
+        self._checked_at = now
+        async with self._reload_lock:
+            try:
+                if os.stat(self.path).st_mtime == self._mtime:
+                    return False
+                loaded = await asyncio.to_thread(self._load_sync)
+            except (OSError, ValueError) as e:
+                self.reload_errors += 1
+                logger.error("No se pudieron recargar los tenants de %s (se mantienen los anteriores): %s", self.path, e)
+                return False
+            self._install(*loaded)
+            self.reloads += 1
+            return True
+
+@dataclass
+class TenantRuntime:
+    """Servicios propios de un tenant: su cola de webhooks, su pool HTTP, su LLM y su MetaService."""
+    tenant: Tenant
+    meta_service: MetaService
+    dispatcher: WebhookDispatcher
+    http_client: HttpClient
+    outbound: OutboundSendScheduler
+    llm_service: LLMService
+    media: Optional[MediaPipeline] = None
+
+    async def close(self) -> None:
+        # La cola se vacía antes de cerrar el pool: los webhooks aceptados terminan de responderse
+        await self.dispatcher.stop()
+        if self.media is not None:
+            await self.media.close()
+        await self.http_client.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queue": self.dispatcher.stats(),
+            "conversations": self.meta_service.scheduler.stats(),
+            "llm": self.llm_service.stats(),
+            "outbound": self.outbound.stats(),
+            "http_pool": self.http_client.pool_stats(),
+            "intents": self.meta_service.intents.stats() if self.meta_service.intents is not None else {},
+        }
+
+class TenantRouter:
+    """
+    Resuelve el tenant de cada webhook y mantiene sus servicios (`TenantRuntime`), construidos con
+    `build_runtime` la primera vez que llega un mensaje para el número. Si la configuración de un
+    tenant cambia al recargar el archivo, sus servicios se reemplazan: los nuevos webhooks van a los
+    nuevos y los anteriores terminan lo que tenían en cola antes de cerrarse.
+    """
+    def __init__(self, registry: TenantRegistry, build_runtime: Callable[[Tenant], TenantRuntime]):
+        self.registry = registry
+        self.build_runtime = build_runtime
+        self.runtimes: Dict[str, TenantRuntime] = {}
+        self._retiring: Set[asyncio.Task] = set()
+        self.retired = 0
+        self.unknown = 0
+
+    def _retire(self, runtime: TenantRuntime) -> None:
+        self.retired += 1
+        task = asyncio.create_task(runtime.close(), name=f"tenant-retire-{runtime.tenant.tenant_id}")
+        self._retiring.add(task)
+        task.add_done_callback(self._retiring.discard)
+
+    def _drop_stale(self) -> None:
+        for phone_number_id, runtime in list(self.runtimes.items()):
+            if self.registry.get(phone_number_id) != runtime.tenant:
+                logger.info("Tenant %s modificado o eliminado: se reemplazan sus servicios", runtime.tenant.tenant_id)
+                del self.runtimes[phone_number_id]
+                self._retire(runtime)
+
+    async def resolve(self, phone_number_id: Optional[str]) -> Optional[TenantRuntime]:
+        """Servicios del tenant dueño de `phone_number_id`, o None si no hay tenant para ese número."""
+        if await self.registry.reload_if_changed():
+            self._drop_stale()
+        tenant = self.registry.get(phone_number_id)
+        if tenant is None:
+            return None
+        runtime = self.runtimes.get(phone_number_id)
+        if runtime is None:
+            runtime = self.runtimes[phone_number_id] = self.build_runtime(tenant)
+            logger.info("Servicios del tenant %s creados (phone_number_id %s)", tenant.tenant_id, phone_number_id)
+        return runtime
+
+    async def close(self) -> None:
+        for runtime in self.runtimes.values():
+            self._retire(runtime)
+        self.runtimes.clear()
+        await asyncio.gather(*self._retiring, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "configured": len(self.registry.by_phone),
+            "active": len(self.runtimes),
+            "retired": self.retired,
+            "unknown_numbers": self.unknown,
+            "reloads": self.registry.reloads,
+            "reload_errors": self.registry.reload_errors,
+        }
+
+    def tenant_stats(self) -> Dict[str, Dict[str, Any]]:
+        return {runtime.tenant.tenant_id: runtime.stats() for runtime in self.runtimes.values()}
+
+def webhook_phone_number_id(payload: Any) -> Optional[str]:
+    """`metadata.phone_number_id` del primer cambio del webhook (el número que recibió los mensajes)."""
+    for entry in payload.entry:
+        for change in entry.changes:
+            phone_number_id = change.value.metadata.get("phone_number_id")
+            if phone_number_id is not None:
+                return str(phone_number_id)
+    return None
+
+def build_tenant_router(
+    build_runtime: Callable[[Tenant], TenantRuntime],
+    settings: Settings = settings,
+) -> Optional[TenantRouter]:
+    if not settings.TENANTS_FILE:
+        return None
+    registry = TenantRegistry(path=settings.TENANTS_FILE, reload_interval=settings.TENANTS_RELOAD_INTERVAL_SECONDS)
+    return TenantRouter(registry, build_runtime)
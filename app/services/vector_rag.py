@@ -0,0 +1,180 @@
+import argparse
+import asyncio
+import json
+import os
+import uuid
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from app.core.config import settings
+from app.services.embeddings import EmbeddingInterface, HashingEmbedder
+from app.services.rag_interface import RAGInterface
+from app.utils.logging import logger
+from app.utils.text import chunk_text
+
+EMBEDDINGS_FILE = "embeddings.npy"
+DOCUMENTS_FILE = "documents.jsonl"
+
+class LocalVectorRAGService(RAGInterface):
+    """
+    Base de conocimientos vectorial en proceso.
+
+    Los embeddings viven en una matriz float32 normalizada (una fila por fragmento), de modo que la
+    similitud coseno es un único producto matriz-vector y el top-k se obtiene con `argpartition`.
+    Si `index_dir` tiene un índice guardado, la matriz se abre con memory-map: una base grande
+    carga al instante y sin copiarse a memoria hasta que se añaden documentos nuevos.
+    """
+    def __init__(
+        self,
+        embedder: EmbeddingInterface,
+        index_dir: Optional[str] = None,
+        chunk_size: int = 500,
+        chunk_overlap: int = 50,
+        batch_size: int = 64,
+    ):
+        self.embedder = embedder
+        self.index_dir = index_dir
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.batch_size = batch_size
+
+        self._buffer: Optional[np.ndarray] = None # Filas reservadas (capacidad); puede ser un memmap de solo lectura
+        self._size = 0
+        self._documents: List[Dict[str, Any]] = []
+
+        if index_dir and os.path.exists(os.path.join(index_dir, EMBEDDINGS_FILE)):
+            self.load(index_dir)
+
+    @property
+    def matrix(self) -> np.ndarray:
+        if self._buffer is None:
+            return np.empty((0, 0), dtype=np.float32)
+        return self._buffer[:self._size]
+
+    def __len__(self) -> int:
+        return self._size
+
+    def load(self, index_dir: str) -> None:
+        self._buffer = np.load(os.path.join(index_dir, EMBEDDINGS_FILE), mmap_mode="r")
+        self._size = self._buffer.shape[0]
+        with open(os.path.join(index_dir, DOCUMENTS_FILE), encoding="utf-8") as f:
+            self._documents = [json.loads(line) for line in f]
+        logger.info("Índice RAG cargado (memory-map) desde %s: %d fragmentos", index_dir, self._size)
+
+    def save(self, index_dir: Optional[str] = None) -> None:
+        index_dir = index_dir or self.index_dir
+        if not index_dir:
+            raise ValueError("No se indicó un directorio para guardar el índice RAG.")
+        os.makedirs(index_dir, exist_ok=True)
+        # Escritura atómica: archivo temporal + rename, para no dejar un índice a medias
+        embeddings_tmp = os.path.join(index_dir, EMBEDDINGS_FILE + ".tmp")
+        with open(embeddings_tmp, "wb") as f:
+            np.save(f, np.ascontiguousarray(self.matrix, dtype=np.float32))
+        documents_tmp = os.path.join(index_dir, DOCUMENTS_FILE + ".tmp")
+        with open(documents_tmp, "w", encoding="utf-8") as f:
+            for document in self._documents:
+                f.write(json.dumps(document, ensure_ascii=False) + "\n")
+        os.replace(embeddings_tmp, os.path.join(index_dir, EMBEDDINGS_FILE))
+        os.replace(documents_tmp, os.path.join(index_dir, DOCUMENTS_FILE))
+
+    def _append_rows(self, rows: np.ndarray) -> None:
+        needed = self._size + rows.shape[0]
+        if self._buffer is None or needed > self._buffer.shape[0] or not self._buffer.flags.writeable:
+            # Crecimiento geométrico: las inserciones por lotes son O(1) amortizado.
+            # Un memmap de solo lectura se copia a memoria en la primera inserción.
+            capacity = max(needed, 2 * (self._buffer.shape[0] if self._buffer is not None else 0), 64)
+            buffer = np.empty((capacity, rows.shape[1]), dtype=np.float32)
+            if self._size:
+                buffer[:self._size] = self._buffer[:self._size]
+            self._buffer = buffer
+        self._buffer[self._size:needed] = rows
+        self._size = needed
+
+    async def _embed_matrix(self, texts: List[str]) -> np.ndarray:
+        vectors = np.asarray(await self.embedder.embed(texts), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    async def add_documents(self, documents: Iterable[Tuple[str, Optional[Dict[str, Any]]]]) -> List[str]:
+        """
+        Ingesta por lotes: divide cada documento en fragmentos y los vectoriza en lotes de `batch_size`.
+        Devuelve los ids de los fragmentos añadidos.
+        """
+        pending: List[Dict[str, Any]] = []
+        added_ids: List[str] = []
+
+        async def flush() -> None:
+            rows = await self._embed_matrix([item["text"] for item in pending])
+            self._append_rows(rows)
+            self._documents.extend(pending)
+            added_ids.extend(item["id"] for item in pending)
+            pending.clear()
+
+        for document_text, metadata in documents:
+            document_id = (metadata or {}).get("id") or uuid.uuid4().hex
+            for i, chunk in enumerate(chunk_text(document_text, self.chunk_size, self.chunk_overlap)):
+                pending.append({
+                    "id": f"{document_id}:{i}",
+                    "text": chunk,
+                    "metadata": dict(metadata or {}),
+                })
+                if len(pending) >= self.batch_size:
+                    await flush()
+        if pending:
+            await flush()
+        return added_ids
+
+    async def add_document(self, document_text: str, metadata: Optional[Dict[str, Any]] = None) -> Any:
+        chunk_ids = await self.add_documents([(document_text, metadata)])
+        return {"status": "added", "chunks": chunk_ids}
+
+    def _top_k(self, query: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        scores = self.matrix @ query
+        k = min(top_k, scores.shape[0])
+        if k < scores.shape[0]:
+            candidates = np.argpartition(scores, -k)[-k:]
+        else:
+            candidates = np.arange(scores.shape[0])
+        order = candidates[np.argsort(scores[candidates])[::-1]]
+        return order, scores[order]
+
+    async def search_knowledge_base(self, query_text: str, top_k: int = 3) -> List[Dict[str, Any]]:
+        if self._size == 0 or top_k <= 0:
+            return []
+        query = (await self._embed_matrix([query_text]))[0]
+        # El producto matriz-vector libera el GIL: se ejecuta en un hilo para no bloquear el event loop
+        indices, scores = await asyncio.to_thread(self._top_k, query, top_k)
+        results = []
+        for index, score in zip(indices.tolist(), scores.tolist()):
+            document = self._documents[index]
+            results.append({
+                "id": document["id"],
+                "payload": {"text": document["text"], **document["metadata"]},
+                "score": score,
+            })
+        return results
+
+async def _ingest(index_dir: str, paths: List[str]) -> None:
+    # Mismo embedder y fragmentación que usa la app al consultar el índice
+    service = LocalVectorRAGService(
+        embedder=HashingEmbedder(dimensions=settings.RAG_EMBEDDING_DIMENSIONS),
+        index_dir=index_dir,
+        chunk_size=settings.RAG_CHUNK_SIZE,
+        chunk_overlap=settings.RAG_CHUNK_OVERLAP,
+    )
+    documents = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            documents.append((f.read(), {"id": os.path.basename(path), "source": path}))
+    chunk_ids = await service.add_documents(documents)
+    service.save()
+    print(f"{len(chunk_ids)} fragmentos añadidos; el índice tiene {len(service)} fragmentos en {index_dir}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingesta de documentos de texto en el índice RAG local.")
+    parser.add_argument("index_dir")
+    parser.add_argument("paths", nargs="+")
+    args = parser.parse_args()
+    asyncio.run(_ingest(args.index_dir, args.paths))
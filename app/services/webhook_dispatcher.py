@@ -0,0 +1,176 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from app.core.config import Settings, settings
+from app.core.metrics import metrics
+from app.utils.logging import logger
+
+class WebhookDispatcher:
+    """
+    Cola en proceso para desacoplar la recepción del webhook de su procesamiento.
+    El endpoint encola el payload y responde a Meta de inmediato; un número fijo de
+    workers asyncio consume la cola y ejecuta el handler (LLM + envío de la respuesta).
+
+    Si el handler devuelve un future, el trabajo siguió en otro lado (p. ej. el planificador por
+    conversación) y el worker queda libre para el siguiente payload; `join` y `stop` esperan
+    también a esos futures.
+    """
+    def __init__(
+        self,
+        handler: Callable[[Any], Awaitable[Optional[asyncio.Future]]],
+        workers: int = 4,
+        max_size: int = 1000,
+        overflow_policy: str = "reject",
+        drain_timeout: float = 10.0,
+        on_drop: Optional[Callable[[Any], None]] = None,
+    ):
+        if overflow_policy not in ("reject", "drop_oldest"):
+            raise ValueError(f"Política de desborde no soportada: {overflow_policy}")
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.max_size = max_size
+        self.overflow_policy = overflow_policy
+        self.drain_timeout = drain_timeout
+        self.on_drop = on_drop # Se llama con cada payload descartado por 'drop_oldest' (p. ej. cerrar su entrada del journal)
+
+        self._queue: Optional[asyncio.Queue[Tuple[float, Any]]] = None
+        self._worker_tasks: List[asyncio.Task] = []
+        self._handed_off: Set[asyncio.Future] = set()
+        self._accepting = False
+
+        self.enqueued = 0
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.dropped = 0
+        self._wait_count = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    @property
+    def running(self) -> bool:
+        return bool(self._worker_tasks)
+
+    async def start(self) -> None:
+        """Arranca los workers. Se llama desde el arranque de la app."""
+        self._ensure_started()
+
+    def _ensure_started(self) -> None:
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._worker_tasks = [
+            asyncio.create_task(self._worker(i), name=f"webhook-worker-{i}")
+            for i in range(self.workers)
+        ]
+        self._accepting = True
+
+    def submit(self, payload: Any) -> bool:
+        """
+        Encola un payload sin bloquear. Devuelve False si la cola está llena y la
+        política es 'reject' (el llamador debe responder con error para que Meta reintente).
+        """
+        if not self.running:
+            self._ensure_started()
+        if not self._accepting:
+            self.rejected += 1
+            return False
+
+        item = (time.monotonic(), payload)
+        if self._queue.full():
+            if self.overflow_policy == "reject":
+                self.rejected += 1
+                logger.warning("Cola de webhooks llena (%d), payload rechazado.", self.max_size)
+                return False
+            # drop_oldest: se descarta el payload más antiguo para hacer sitio al nuevo
+            _, dropped = self._queue.get_nowait()
+            self._queue.task_done()
+            self.dropped += 1
+            if self.on_drop is not None:
+                self.on_drop(dropped)
+            logger.warning("Cola de webhooks llena (%d), se descartó el payload más antiguo.", self.max_size)
+
+        self._queue.put_nowait(item)
+        self.enqueued += 1
+        return True
+
+    async def _worker(self, worker_id: int) -> None:
+        while True:
+            enqueued_at, payload = await self._queue.get()
+            wait = time.monotonic() - enqueued_at
+            self._wait_count += 1
+            self._wait_total += wait
+            self._wait_max = max(self._wait_max, wait)
+            metrics.observe_stage("queue_wait", wait)
+            try:
+                with metrics.stage("webhook_handler"):
+                    handed_off = await self.handler(payload)
+                if isinstance(handed_off, asyncio.Future) and not handed_off.done():
+                    self._handed_off.add(handed_off)
+                    handed_off.add_done_callback(self._handed_off.discard)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                logger.error("Error en el worker %d procesando un webhook: %s", worker_id, e, exc_info=True)
+            finally:
+                self._queue.task_done()
+
+    async def join(self) -> None:
+        """Espera a que todos los payloads encolados hayan sido procesados, incluido el trabajo derivado."""
+        if self._queue is not None:
+            await self._queue.join()
+        while self._handed_off:
+            await asyncio.gather(*self._handed_off, return_exceptions=True)
+
+    async def stop(self) -> None:
+        """
+        Deja de aceptar payloads, espera a que la cola se vacíe (hasta `drain_timeout`)
+        y detiene los workers. Se llama desde el apagado de la app.
+        """
+        if not self.running:
+            return
+        self._accepting = False
+        try:
+            await asyncio.wait_for(self.join(), timeout=self.drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(
+                "Timeout vaciando la cola de webhooks; %d payloads sin procesar y %d en curso.",
+                self._queue.qsize(), len(self._handed_off),
+            )
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+    def stats(self) -> Dict[str, Any]:
+        """Métricas de la cola: profundidad, contadores y tiempo de espera en cola."""
+        return {
+            "depth": self._queue.qsize() if self._queue is not None else 0,
+            "max_size": self.max_size,
+            "workers": len(self._worker_tasks),
+            "in_progress": len(self._handed_off),
+            "enqueued": self.enqueued,
+            "processed": self.processed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "dropped": self.dropped,
+            "wait_avg_seconds": self._wait_total / self._wait_count if self._wait_count else 0.0,
+            "wait_max_seconds": self._wait_max,
+        }
+
+def build_webhook_dispatcher(
+    handler: Callable[[Any], Awaitable[Optional[asyncio.Future]]],
+    workers: Optional[int] = None,
+    max_size: Optional[int] = None,
+    on_drop: Optional[Callable[[Any], None]] = None,
+    settings: Settings = settings,
+) -> WebhookDispatcher:
+    return WebhookDispatcher(
+        handler=handler,
+        workers=workers or settings.WEBHOOK_WORKERS,
+        max_size=max_size or settings.WEBHOOK_QUEUE_MAX_SIZE,
+        overflow_policy=settings.WEBHOOK_QUEUE_OVERFLOW_POLICY,
+        drain_timeout=settings.WEBHOOK_DRAIN_TIMEOUT,
+        on_drop=on_drop,
+    )
@@ -1,17 +1,144 @@
+import contextlib
+import weakref
 import httpx
-from app.core.config import settings
-from typing import Any, Dict, Optional
+from app.core.config import Settings, settings
+from typing import Any, AsyncIterator, Dict, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+def _http2_available() -> bool:
+    try:
+        import h2 # noqa: F401
+    except ImportError:
+        return False
+    return True
 
 class HttpClient:
-    def __init__(self, base_url: str = ""):
+    """
+    Cliente HTTP con un único `httpx.AsyncClient` compartido.
+    El pool de conexiones se abre en el arranque de la app y se cierra en el apagado,
+    así cada envío reutiliza conexiones keep-alive en vez de repetir el handshake TCP+TLS.
+    """
+    def __init__(
+        self,
+        base_url: str = "",
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30.0,
+        http2: bool = False,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 15.0,
+        write_timeout: float = 5.0,
+        pool_timeout: float = 5.0,
+    ):
         self.base_url = base_url
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = httpx.Timeout(
+            connect=connect_timeout, read=read_timeout, write=write_timeout, pool=pool_timeout
+        )
+        if http2 and not _http2_available():
+            logger.warning("HTTP/2 solicitado pero el paquete 'h2' no está instalado; se usará HTTP/1.1.")
+            http2 = False
+        self.http2 = http2
+        self._client: Optional[httpx.AsyncClient] = None
+        self.in_flight = 0 # Peticiones enviadas cuya respuesta aún no termina (incluye las que esperan conexión)
+        self.requests = 0
+        self.connections_opened = 0
+        # Un stream de red por conexión abierta: el pool suelta la conexión (y su stream) al cerrarla
+        self._streams: "weakref.WeakSet[Any]" = weakref.WeakSet()
+        self._extensions = {"trace": self._trace}
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # Creación perezosa por si se usa fuera del lifespan de la app (scripts, tests)
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                limits=self.limits,
+                timeout=self.timeout,
+                http2=self.http2,
+            )
+        return self._client
+
+    async def start(self) -> None:
+        """Abre el pool de conexiones. Se llama desde el arranque de la app."""
+        _ = self.client
+
+    async def close(self) -> None:
+        """Cierra el pool de conexiones. Se llama desde el apagado de la app."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._streams = weakref.WeakSet() # Una respuesta retenida aún referencia el stream de su conexión
 
-    async def get(self, endpoint: str, params: Optional[Dict[str, Any]] = None) -> httpx.Response:
-        async with httpx.AsyncClient(base_url=self.base_url) as client:
-            return await client.get(endpoint, params=params)
+    async def _trace(self, event: str, info: Dict[str, Any]) -> None:
+        # Extensión "trace" de httpcore (pública): avisa de cada conexión TCP nueva con su stream de red
+        if event == "connection.connect_tcp.complete":
+            self.connections_opened += 1
+            self._streams.add(info["return_value"])
+
+    @contextlib.asynccontextmanager
+    async def _tracked(self) -> AsyncIterator[None]:
+        self.in_flight += 1
+        self.requests += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+
+    async def get(self, endpoint: str, params: Optional[Dict[str, Any]] = None, headers: Optional[Dict[str, str]] = None) -> httpx.Response:
+        async with self._tracked():
+            return await self.client.get(endpoint, params=params, headers=headers, extensions=self._extensions)
+
+    @contextlib.asynccontextmanager
+    async def stream(self, method: str, url: str, headers: Optional[Dict[str, str]] = None) -> AsyncIterator[httpx.Response]:
+        """Respuesta sin leer el cuerpo: se consume por fragmentos con `aiter_bytes` (descargas grandes)."""
+        async with self._tracked(), self.client.stream(method, url, headers=headers, extensions=self._extensions) as response:
+            yield response
 
     async def post(self, endpoint: str, json: Optional[Dict[str, Any]] = None, headers: Optional[Dict[str, str]] = None) -> httpx.Response:
-        async with httpx.AsyncClient(base_url=self.base_url) as client:
-            return await client.post(endpoint, json=json, headers=headers)
+        async with self._tracked():
+            return await self.client.post(endpoint, json=json, headers=headers, extensions=self._extensions)
+
+    def pool_stats(self) -> Dict[str, int]:
+        """
+        Estado del pool para dimensionarlo: conexiones abiertas, en uso, ociosas (keep-alive) y
+        peticiones esperando conexión. Sin leer el estado interno de httpx/httpcore: las conexiones
+        abiertas se siguen con la extensión `trace` y las peticiones en curso con un contador. Con
+        HTTP/1.1 cada petición en curso ocupa una conexión; con HTTP/2 varias comparten una, así
+        que `waiting` es una cota superior.
+        """
+        connections = len(self._streams)
+        in_use = min(self.in_flight, connections)
+        return {
+            "connections": connections,
+            "in_use": in_use,
+            "idle": connections - in_use,
+            "waiting": self.in_flight - in_use,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "connections_opened": self.connections_opened,
+        }
 
-meta_http_client = HttpClient(base_url=f"https://graph.facebook.com/{settings.WHATSAPP_API_VERSION}/")
\ No newline at end of file
+def build_meta_http_client(
+    max_connections: Optional[int] = None,
+    max_keepalive_connections: Optional[int] = None,
+    settings: Settings = settings,
+) -> HttpClient:
+    """Pool hacia la Graph API; los límites se pueden fijar por tenant (por defecto los de Settings)."""
+    return HttpClient(
+        base_url=f"https://graph.facebook.com/{settings.WHATSAPP_API_VERSION}/",
+        max_connections=max_connections or settings.HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=max_keepalive_connections or settings.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY,
+        http2=settings.HTTP2_ENABLED,
+        connect_timeout=settings.HTTP_CONNECT_TIMEOUT,
+        read_timeout=settings.HTTP_READ_TIMEOUT,
+        write_timeout=settings.HTTP_WRITE_TIMEOUT,
+        pool_timeout=settings.HTTP_POOL_TIMEOUT,
+    )
@@ -1,17 +1,213 @@
+import atexit
+import json
 import logging
-from app.core.config import settings
-
-def setup_logging():
-    logger = logging.getLogger(settings.APP_NAME)
-    logger.setLevel(getattr(logging, settings.LOG_LEVEL))
-    
-    handler = logging.StreamHandler()
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-    )
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
-    
+import logging.handlers
+import queue
+import re
+import sys
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+from app.core.config import Settings, settings
+
+# Números con forma de teléfono E.164 / wa_id: se conservan los 4 últimos dígitos. Con '+', de 7 a 15
+# dígitos; sin '+', como los wa_id (con código de país): 11 dígitos si empiezan con 1 (NANP) o de 11 a 15
+# si no. Así no se enmascaran timestamps (10 o 13 dígitos empezando con 1) ni ids numéricos más largos.
+_PHONE_NUMBER = re.compile(r"(?<![\w.+])(?:\+[1-9]\d{2,10}|1\d{6}|[2-9]\d{6,10})(\d{4})(?![\w.])")
+# Campos `extra` que siempre contienen texto del usuario o del modelo
+SENSITIVE_FIELDS = frozenset({"body", "text", "prompt", "reply", "message_text"})
+
+# Atributos propios de LogRecord: lo demás llegó por `extra=` y se exporta como campo del JSON
+_RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+# LOG_REDACT de la última `configure_logging` (redactar hasta entonces): `Sensitive` se formatea en el
+# hilo del listener y no debe leer `settings`, que podría construirse o recargarse desde ese hilo
+_redact = True
+
+def redact_phone_numbers(text: str) -> str:
+    return _PHONE_NUMBER.sub(lambda match: "*" * (len(match.group(0)) - 4) + match.group(1), text)
+
+def _redacted(text: str) -> str:
+    return f"<redactado: {len(text)} caracteres>"
+
+class Sensitive:
+    """
+    Envuelve texto del usuario o del modelo para pasarlo como argumento de un log.
+    Con LOG_REDACT activo (según `configure_logging`) solo se registra su longitud. Como el formateo es perezoso,
+    `str()` se evalúa en el hilo del listener y solo si el registro llega a escribirse.
+    """
+    __slots__ = ("text",)
+
+    def __init__(self, text: Any):
+        self.text = text
+
+    def __str__(self) -> str:
+        text = "" if self.text is None else str(self.text)
+        return _redacted(text) if _redact else text
+
+    __repr__ = __str__
+
+def sensitive(text: Any) -> Sensitive:
+    return Sensitive(text)
+
+class JsonFormatter(logging.Formatter):
+    """Una línea JSON por registro; el mensaje se interpola aquí (en el hilo del listener), no al loguear."""
+    def __init__(self, redact: bool = True):
+        super().__init__()
+        self.redact = redact
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = record.getMessage()
+        if self.redact:
+            message = redact_phone_numbers(message)
+        entry: Dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": message,
+        }
+        for key, value in vars(record).items():
+            if key in _RECORD_ATTRIBUTES or key.startswith("_"):
+                continue
+            if self.redact and key in SENSITIVE_FIELDS:
+                value = _redacted("" if value is None else str(value))
+            elif self.redact and isinstance(value, str):
+                value = redact_phone_numbers(value)
+            entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class TextFormatter(logging.Formatter):
+    """Formato de texto clásico (desarrollo local), con la misma redacción que el JSON."""
+    def __init__(self, redact: bool = True):
+        super().__init__("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+        self.redact = redact
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        return redact_phone_numbers(line) if self.redact else line
+
+class SamplingFilter(logging.Filter):
+    """
+    Muestreo de eventos INFO/DEBUG de alto volumen. Los registros marcados con `extra={"event": ...}`
+    cuyo evento tiene una tasa configurada se conservan 1 de cada N (determinista, sin `random`).
+    WARNING y superiores no se muestrean nunca.
+    """
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.every = {event: max(1, round(1 / rate)) for event, rate in rates.items() if rate > 0}
+        self.disabled = {event for event, rate in rates.items() if rate <= 0}
+        self._seen: Dict[str, int] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        event = getattr(record, "event", None)
+        if event is None or record.levelno > logging.INFO:
+            return True
+        if event in self.disabled:
+            return False
+        every = self.every.get(event)
+        if every is None:
+            return True
+        seen = self._seen.get(event, 0)
+        self._seen[event] = seen + 1
+        if seen % every:
+            return False
+        record.sample_every = every # Permite reescalar los conteos al analizar los logs
+        return True
+
+def parse_sample_rates(value: str) -> Dict[str, float]:
+    """'message_received=0.1,message_sent=0.05' -> {'message_received': 0.1, 'message_sent': 0.05}"""
+    rates = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        event, _, rate = item.partition("=")
+        rates[event.strip()] = float(rate)
+    return rates
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler que no formatea en el hilo que loguea: el registro pasa tal cual a la cola y el
+    listener hace la interpolación, el JSON y la escritura. Si la cola se llena el registro se
+    descarta (y se cuenta) en lugar de bloquear el event loop.
+    """
+    def __init__(self, log_queue: queue.SimpleQueue, max_size: int = 0):
+        super().__init__(log_queue)
+        self.max_size = max_size
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        # SimpleQueue (en C, sin Condition) es más barata que queue.Queue; el tope se controla aquí
+        if self.max_size and self.queue.qsize() >= self.max_size:
+            self.dropped += 1
+            return
+        self.queue.put_nowait(record)
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional[NonBlockingQueueHandler] = None
+_setup_lock = threading.Lock()
+
+def build_formatter(settings: Settings = settings) -> logging.Formatter:
+    if settings.LOG_FORMAT == "text":
+        return TextFormatter(redact=settings.LOG_REDACT)
+    return JsonFormatter(redact=settings.LOG_REDACT)
+
+def configure_logging(stream=None, settings: Settings = settings) -> NonBlockingQueueHandler:
+    """
+    Único punto de configuración: el root logger recibe un QueueHandler (sin más handlers, así no hay
+    líneas duplicadas) y un QueueListener escribe en `stream` (stderr por defecto) desde su propio hilo.
+    Es idempotente; llamarlo de nuevo reemplaza la configuración (p. ej. en benchmarks).
+    """
+    global _listener, _queue_handler, _redact
+    with _setup_lock:
+        shutdown_logging()
+        _redact = settings.LOG_REDACT
+        log_queue: queue.SimpleQueue = queue.SimpleQueue()
+        output = logging.StreamHandler(stream or sys.stderr)
+        output.setFormatter(build_formatter(settings))
+
+        _queue_handler = NonBlockingQueueHandler(log_queue, max_size=settings.LOG_QUEUE_MAX_SIZE)
+        _queue_handler.addFilter(SamplingFilter(parse_sample_rates(settings.LOG_SAMPLE_RATES)))
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            if isinstance(handler, NonBlockingQueueHandler) or type(handler) is logging.StreamHandler:
+                root.removeHandler(handler)
+        root.addHandler(_queue_handler)
+        root.setLevel(getattr(logging, settings.LOG_LEVEL))
+        # Ningún formato usa hilo/proceso: no calcularlos en cada LogRecord (se crean en el event loop)
+        logging.logThreads = False
+        logging.logProcesses = False
+        logging.logMultiprocessing = False
+
+        _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+        _listener.start()
+        return _queue_handler
+
+def shutdown_logging() -> None:
+    """Vacía la cola y detiene el hilo del listener (al salir del proceso)."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+def logging_stats() -> Dict[str, int]:
+    if _queue_handler is None:
+        return {"queued": 0, "dropped": 0}
+    return {"queued": _queue_handler.queue.qsize(), "dropped": _queue_handler.dropped}
+
+def setup_logging(settings: Settings = settings) -> logging.Logger:
+    """
+    Configura el logging si aún no lo está. Se llama desde el lifespan de la app (no al importar:
+    importar el módulo no construye Settings ni arranca el hilo del listener).
+    """
+    if _listener is None:
+        configure_logging(settings=settings)
+        atexit.register(shutdown_logging)
     return logger
 
-logger = setup_logging()
\ No newline at end of file
+# Sin handler propio: propaga al root y se escribe una sola vez (cuando el logging está configurado)
+logger = logging.getLogger("app")
@@ -0,0 +1,57 @@
+import re
+import unicodedata
+from typing import List
+
+_PUNCTUATION = re.compile(r"[^\w\s]", re.UNICODE)
+_WHITESPACE = re.compile(r"\s+")
+
+def normalize_text(text: str) -> str:
+    """
+    Normaliza un mensaje para compararlo: minúsculas, sin tildes, sin puntuación
+    y con los espacios colapsados. "¿Horario?" y "horario" quedan iguales.
+    """
+    text = unicodedata.normalize("NFKD", text.casefold())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    text = _PUNCTUATION.sub(" ", text)
+    return _WHITESPACE.sub(" ", text).strip()
+
+_SENTENCE_END = re.compile(r"(?<=[.!?…])\s+|\n\s*\n")
+
+def chunk_text(text: str, max_chars: int = 500, overlap_chars: int = 50) -> List[str]:
+    """
+    Divide un documento en fragmentos de hasta `max_chars`, cortando en fin de oración o párrafo
+    cuando es posible. Cada fragmento arrastra hasta `overlap_chars` del final del anterior
+    para no perder contexto en los bordes.
+    """
+    text = text.strip()
+    if not text:
+        return []
+    if len(text) <= max_chars:
+        return [text]
+
+    pieces: List[str] = []
+    for sentence in _SENTENCE_END.split(text):
+        sentence = sentence.strip()
+        # Oraciones más largas que el fragmento se parten por palabras
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(" ", 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            pieces.append(sentence[:cut])
+            sentence = sentence[cut:].strip()
+        if sentence:
+            pieces.append(sentence)
+
+    chunks: List[str] = []
+    current = ""
+    for piece in pieces:
+        if current and len(current) + 1 + len(piece) > max_chars:
+            chunks.append(current)
+            tail = current[-overlap_chars:] if overlap_chars else ""
+            # El solapamiento empieza en un límite de palabra
+            tail = tail[tail.find(" ") + 1:] if " " in tail else tail
+            current = f"{tail} {piece}".strip() if len(tail) + 1 + len(piece) <= max_chars else piece
+        else:
+            current = f"{current} {piece}".strip()
+    if current:
+        chunks.append(current)
+    return chunks
@@ -0,0 +1,68 @@
+import re
+from functools import lru_cache
+
+# Palabras y signos sueltos: los tokenizers BPE separan casi siempre la puntuación y parten
+# las palabras largas en trozos de ~4 caracteres
+_PIECES = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+TRUNCATION_MARKER = " […] "
+
+# Solo se cachean textos cortos (system prompt, fragmentos RAG, mensajes del historial): los
+# prompts completos y los mensajes largos son casi siempre únicos y ocuparían la caché sin aciertos.
+# Con este límite la caché ocupa como mucho ~maxsize * CACHE_MAX_CHARS caracteres.
+CACHE_MAX_CHARS = 2048
+
+def _estimate(text: str) -> int:
+    if not text:
+        return 0
+    return max(1, sum((len(piece) + 3) // 4 for piece in _PIECES.findall(text)))
+
+_estimate_cached = lru_cache(maxsize=4096)(_estimate)
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimación rápida y local del número de tokens de un texto: un token por signo de puntuación
+    y uno cada ~4 caracteres de cada palabra. Suficiente para repartir presupuestos de contexto
+    sin cargar un tokenizer.
+
+    Los textos de hasta `CACHE_MAX_CHARS` caracteres se cachean: el system prompt, los fragmentos
+    RAG y el historial se estiman una vez aunque aparezcan en muchos prompts.
+    """
+    if len(text) > CACHE_MAX_CHARS:
+        return _estimate(text)
+    return _estimate_cached(text)
+
+def _cut_at_word(text: str, max_chars: int, from_end: bool = False) -> str:
+    if len(text) <= max_chars:
+        return text
+    if from_end:
+        tail = text[-max_chars:]
+        space = tail.find(" ")
+        return tail[space + 1:] if 0 <= space < max_chars // 2 else tail
+    head = text[:max_chars]
+    space = head.rfind(" ")
+    return head[:space] if space > max_chars // 2 else head
+
+def truncate_to_tokens(text: str, max_tokens: int, tail_ratio: float = 0.0) -> str:
+    """
+    Recorta `text` para que quepa en `max_tokens` cortando en límites de palabra.
+    Con `tail_ratio` > 0 conserva también esa fracción del final (p. ej. en mensajes reenviados
+    la pregunta suele estar al final) y marca el corte con `TRUNCATION_MARKER`.
+    """
+    if max_tokens <= 0:
+        return ""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    # Se parte de la proporción de caracteres y se ajusta hasta que la estimación cabe
+    max_chars = max(1, len(text) * max_tokens // estimate_tokens(text))
+    while True:
+        if tail_ratio > 0 and max_tokens > 16: # Con presupuestos mínimos el marcador no compensa
+            tail_chars = int(max_chars * tail_ratio)
+            head = _cut_at_word(text, max_chars - tail_chars).rstrip()
+            tail = _cut_at_word(text, tail_chars, from_end=True).lstrip() if tail_chars else ""
+            truncated = f"{head}{TRUNCATION_MARKER}{tail}".strip()
+        else:
+            truncated = _cut_at_word(text, max_chars).rstrip()
+        if estimate_tokens(truncated) <= max_tokens or max_chars <= 1:
+            return truncated
+        max_chars = max(1, int(max_chars * 0.9))
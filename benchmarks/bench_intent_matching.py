@@ -0,0 +1,105 @@
+"""
+Throughput del router de intenciones con miles de patrones: alternancia única compilada como árbol
+de prefijos (`IntentMatcher`) frente a probar una regex por patrón.
+
+Genera `--intents` intenciones sintéticas con `--keywords` palabras clave cada una (más unas pocas
+regex) y mide cuántos mensajes por segundo se clasifican, con una mezcla de mensajes que coinciden,
+que no coinciden y que superan el máximo de palabras. Incluye el costo de compilar las reglas (lo
+que tarda una recarga en caliente).
+
+Uso:
+    python -m benchmarks.bench_intent_matching [--intents 200] [--keywords 25] [--number 20000]
+"""
+import argparse
+import random
+import re
+import string
+import time
+
+from app.services.intent_router import IntentMatcher, IntentRule
+from app.utils.text import normalize_text
+
+QUESTIONS = [
+    "Hola",
+    "¡Muchas gracias!",
+    "¿A qué hora abren el sábado?",
+    "Necesito cambiar la dirección de envío de mi pedido",
+    "¿Tienen sucursal en Valparaíso?",
+    "Quiero hablar con una persona",
+]
+
+def synthetic_rules(intents: int, keywords: int, rng: random.Random) -> list:
+    def word() -> str:
+        return "".join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 10)))
+
+    rules = [
+        IntentRule(name="saludo", responses=["¡Hola!"], keywords=["hola", "buenas"], max_words=4),
+        IntentRule(name="agradecimiento", responses=["¡De nada!"], phrases=["muchas gracias"], keywords=["gracias"]),
+        IntentRule(name="horario", responses=["9 a 19"], patterns=[r"\b(abren|cierran)\b.*\b(sabado|domingo)\b"]),
+    ]
+    for i in range(intents):
+        literals = [word() for _ in range(keywords)]
+        rules.append(IntentRule(
+            name=f"intencion_{i}",
+            responses=[f"Respuesta {i}"],
+            keywords=literals[: keywords // 2],
+            phrases=[f"{a} {b}" for a, b in zip(literals[keywords // 2::2], literals[keywords // 2 + 1::2])],
+            patterns=[fr"\b{word()}\d+\b"] if i % 50 == 0 else [],
+        ))
+    return rules
+
+class NaiveMatcher:
+    """Referencia: una regex compilada por patrón, probadas una tras otra."""
+    def __init__(self, rules: list):
+        self.patterns = [
+            (re.compile(fr"\b{re.escape(normalize_text(literal))}\b"), rule)
+            for rule in rules for literal in (*rule.keywords, *rule.phrases)
+        ] + [(re.compile(pattern), rule) for rule in rules for pattern in rule.patterns]
+
+    def match(self, text: str):
+        normalized = normalize_text(text)
+        for pattern, rule in self.patterns:
+            if pattern.search(normalized):
+                return rule
+        return None
+
+def _throughput(match, messages: list) -> float:
+    started_at = time.perf_counter()
+    for message in messages:
+        match(message)
+    return len(messages) / (time.perf_counter() - started_at)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--intents", type=int, default=200)
+    parser.add_argument("--keywords", type=int, default=25)
+    parser.add_argument("--number", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=1234)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    rules = synthetic_rules(args.intents, args.keywords, rng)
+    started_at = time.perf_counter()
+    matcher = IntentMatcher(rules)
+    compile_ms = (time.perf_counter() - started_at) * 1000
+    naive = NaiveMatcher(rules)
+
+    synthetic = [literal for rule in rules[3:] for literal in rule.keywords]
+    messages = [
+        rng.choice(QUESTIONS) if i % 2 else f"hola {rng.choice(synthetic)}" if i % 4 else "texto sin ninguna coincidencia"
+        for i in range(args.number)
+    ]
+    matched = sum(matcher.match(message) is not None for message in messages)
+
+    print(f"{len(rules)} intenciones, {matcher.pattern_count} patrones; compilación: {compile_ms:.1f} ms")
+    print(f"{args.number} mensajes, {matched} respondidos sin LLM\n")
+    print(f"{'matcher':<22}{'mensajes/s':>14}{'µs/mensaje':>14}")
+    for label, match, messages_run in (
+        ("alternancia única", matcher.match, messages),
+        ("una regex por patrón", naive.match, messages[: max(1, args.number // 20)]),
+    ):
+        rate = _throughput(match, messages_run)
+        print(f"{label:<22}{rate:>14,.0f}{1e6 / rate:>14.1f}")
+
+if __name__ == "__main__":
+    main()
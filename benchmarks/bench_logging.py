@@ -0,0 +1,110 @@
+"""
+Tiempo del event loop dedicado a logging bajo carga: configuración anterior vs. subsistema actual.
+
+Cada "petición" simulada emite los logs INFO del camino de un mensaje (recibido, encolado, envío a
+Groq, respuesta, mensaje enviado) desde muchas tareas concurrentes. Se mide el tiempo que el event
+loop pasa dentro de las llamadas a logging:
+
+- anterior: `basicConfig` + un StreamHandler propio en el logger de la app (cada línea se escribe
+  dos veces), f-strings construidos siempre y escritura síncrona en el hilo del loop;
+- actual: QueueHandler sin formateo en el loop, JSON + redacción + escritura en el hilo del listener.
+
+La salida va a un archivo temporal (como stderr redirigido a un archivo o a un pipe).
+
+Uso:
+    python -m benchmarks.bench_logging [--requests 5000] [--concurrency 200]
+"""
+import argparse
+import asyncio
+import logging
+import tempfile
+import time
+
+from app.core.config import settings
+from app.utils.logging import configure_logging, sensitive, shutdown_logging
+
+USER_TEXT = "Hola, quería saber el horario de atención de la sucursal del centro y si abren el domingo"
+REPLY_TEXT = "¡Hola! La sucursal del centro atiende de lunes a sábado de 9:00 a 19:00. Los domingos está cerrada."
+API_RESPONSE = {"messaging_product": "whatsapp", "contacts": [{"input": "56912345678", "wa_id": "56912345678"}], "messages": [{"id": "wamid.HBgLNTY5MTIzNDU2NzgVAgARGBI"}]}
+
+def legacy_request_logs(logger: logging.Logger, phone: str, i: int) -> None:
+    logger.info(f"Mensaje recibido de {phone} (ID: wamid.{i}): {USER_TEXT}")
+    logger.info("Payload del webhook recibido, encolado para MetaService.")
+    logger.info(f"Enviando a Groq para user {phone}: Model=llama3-8b-8192, Prompt='Usuario: {USER_TEXT[:100]}...'")
+    logger.info(f"Respuesta de Groq para user {phone}: '{REPLY_TEXT[:100]}...'")
+    logger.info(f"Mensaje enviado a {phone}: {REPLY_TEXT[:50]}... Respuesta API: {API_RESPONSE}")
+
+def current_request_logs(logger: logging.Logger, phone: str, i: int) -> None:
+    logger.info("Mensaje recibido de %s (ID: %s): %s", phone, f"wamid.{i}", sensitive(USER_TEXT), extra={"event": "message_received"})
+    logger.info("Payload del webhook recibido, encolado para MetaService.", extra={"event": "webhook_enqueued"})
+    logger.info("Enviando a Groq para user %s: model=%s, prompt=%s", phone, "llama3-8b-8192", sensitive(USER_TEXT), extra={"event": "llm_request"})
+    logger.info("Respuesta de Groq para user %s: %s", phone, sensitive(REPLY_TEXT), extra={"event": "llm_response"})
+    logger.info("Mensaje enviado a %s: %s (respuesta API: %s)", phone, sensitive(REPLY_TEXT), API_RESPONSE, extra={"event": "message_sent"})
+
+async def run_load(emit, logger: logging.Logger, requests: int, concurrency: int) -> dict:
+    in_logging = 0.0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one_request(i: int) -> None:
+        nonlocal in_logging
+        async with semaphore:
+            await asyncio.sleep(0) # Intercalar tareas como en un webhook real
+            started_at = time.perf_counter()
+            emit(logger, f"569{i:08d}", i)
+            in_logging += time.perf_counter() - started_at
+
+    started_at = time.perf_counter()
+    await asyncio.gather(*(one_request(i) for i in range(requests)))
+    return {"loop_logging_seconds": in_logging, "wall_seconds": time.perf_counter() - started_at}
+
+def configure_legacy(stream) -> logging.Logger:
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    root_handler = logging.StreamHandler(stream)
+    root_handler.setFormatter(formatter)
+    root.addHandler(root_handler)
+    root.setLevel(logging.INFO)
+    logger = logging.getLogger("bench.legacy")
+    app_handler = logging.StreamHandler(stream) # Segundo handler: cada línea se escribe dos veces
+    app_handler.setFormatter(formatter)
+    logger.addHandler(app_handler)
+    return logger
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    args = parser.parse_args()
+    settings.LOG_LEVEL = "INFO"
+
+    results = {}
+    with tempfile.TemporaryFile("w+") as output:
+        shutdown_logging()
+        logger = configure_legacy(output)
+        results["anterior"] = asyncio.run(run_load(legacy_request_logs, logger, args.requests, args.concurrency))
+        results["anterior"]["bytes"] = output.tell()
+        logger.handlers.clear()
+
+    for label, sample_rates in (("actual", ""), ("actual + muestreo 10%", "message_received=0.1,webhook_enqueued=0.1,llm_request=0.1,llm_response=0.1,message_sent=0.1")):
+        settings.LOG_SAMPLE_RATES = sample_rates
+        with tempfile.TemporaryFile("w+") as output:
+            configure_logging(stream=output)
+            logger = logging.getLogger(settings.APP_NAME)
+            results[label] = asyncio.run(run_load(current_request_logs, logger, args.requests, args.concurrency))
+            shutdown_logging() # Espera a que el listener termine de escribir
+            results[label]["bytes"] = output.tell()
+
+    calls = args.requests * 5
+    print(f"{args.requests} peticiones x 5 logs INFO, concurrencia {args.concurrency}\n")
+    print(f"{'configuración':<26}{'loop en logging (ms)':>22}{'µs/log':>9}{'wall (ms)':>11}{'bytes escritos':>16}")
+    for label, result in results.items():
+        print(
+            f"{label:<26}{result['loop_logging_seconds'] * 1000:>22.1f}"
+            f"{result['loop_logging_seconds'] / calls * 1e6:>9.2f}"
+            f"{result['wall_seconds'] * 1000:>11.1f}{result['bytes']:>16}"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Costo de la instrumentación por etapa frente al trabajo real de una petición.
+
+Mide el costo de `metrics.stage(...)` (entrar/salir del context manager) y de `observe_stage`, y lo
+compara con el parseo de un webhook de texto, que es la etapa más barata del camino instrumentado.
+Una petición con respuesta pasa por ~6 etapas (parseo, cola, handler, RAG, Groq, envío).
+
+Uso:
+    python -m benchmarks.bench_metrics_overhead [--number 200000]
+"""
+import argparse
+import timeit
+
+from app.core.metrics import MetricsRegistry
+from app.models.meta import MetaWebhookRequest
+from benchmarks.payloads import encode, text_message
+
+STAGES_PER_REQUEST = 6
+TYPICAL_REPLY_MS = 300 # Referencia: latencia de una respuesta corta de Groq más el envío
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=200000)
+    args = parser.parse_args()
+
+    registry = MetricsRegistry()
+    payload_bytes = encode(text_message())
+
+    def baseline():
+        pass
+
+    def timed_stage():
+        with registry.stage("groq"):
+            pass
+
+    def observed():
+        registry.observe_stage("queue_wait", 0.003)
+
+    def parse():
+        MetaWebhookRequest.model_validate_json(payload_bytes)
+
+    def timed_parse():
+        with registry.stage("webhook_parse"):
+            MetaWebhookRequest.model_validate_json(payload_bytes)
+
+    def per_call_ns(fn, number):
+        return min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e9
+
+    empty_ns = per_call_ns(baseline, args.number)
+    stage_ns = per_call_ns(timed_stage, args.number) - empty_ns
+    observe_ns = per_call_ns(observed, args.number) - empty_ns
+    parse_number = max(1, args.number // 10)
+    parse_ns = per_call_ns(parse, parse_number)
+    timed_parse_ns = per_call_ns(timed_parse, parse_number)
+
+    print(f"{'operación':<36}{'ns/op':>10}")
+    print(f"{'metrics.stage() (enter+exit)':<36}{stage_ns:>10.0f}")
+    print(f"{'metrics.observe_stage()':<36}{observe_ns:>10.0f}")
+    print(f"{'parseo webhook de texto':<36}{parse_ns:>10.0f}")
+    print(f"{'parseo webhook de texto + stage()':<36}{timed_parse_ns:>10.0f}")
+    per_request_us = stage_ns * STAGES_PER_REQUEST / 1000
+    print(f"\nInstrumentación por petición ({STAGES_PER_REQUEST} etapas): {per_request_us:.2f} µs")
+    print(f"Sobrecosto relativo sobre solo el parseo: {(stage_ns / parse_ns) * 100:.1f}%")
+    print(f"Sobrecosto sobre una respuesta de {TYPICAL_REPLY_MS} ms (Groq + envío): {per_request_us / (TYPICAL_REPLY_MS * 1000) * 100:.4f}%")
+
+if __name__ == "__main__":
+    main()
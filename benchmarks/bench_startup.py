@@ -0,0 +1,127 @@
+"""
+Tiempo de arranque: cuánto tarda un proceso nuevo en poder atender peticiones.
+
+Cada repetición corre en un intérprete nuevo (los imports ya cacheados falsearían la medición) y mide,
+desde el inicio del proceso:
+  - import:  `import app.main` terminado.
+  - startup: lifespan completado (la app ya acepta conexiones).
+  - ready:   primera respuesta 200 de `GET /`.
+  - warm:    servicios del webhook construidos (SDK de Groq, cliente, dispatcher); con
+             SERVICES_WARMUP=false no hay precarga y se mide lo que tarda el primer webhook.
+
+Con `--server` mide además el caso real de autoscaling: `python -m app.main` hasta que el puerto
+responde (incluye el arranque del intérprete y de uvicorn).
+
+Uso:
+    python -m benchmarks.bench_startup [--runs 7] [--server]
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+# Variables mínimas para construir Settings sin un .env (no se contacta ningún servicio externo)
+BENCH_ENV = {
+    "WHATSAPP_ACCESS_TOKEN": "bench",
+    "WHATSAPP_VERIFY_TOKEN": "bench",
+    "WHATSAPP_PHONE_NUMBER_ID": "bench",
+    "WHATSAPP_API_VERSION": "v19.0",
+    "GROQ_API_KEY": "bench",
+    "GROQ_MODEL": "llama3-8b-8192",
+    "LOG_LEVEL": "WARNING",
+}
+
+async def _measure_child(process_started_at: float) -> Dict[str, float]:
+    import httpx
+
+    def since_start() -> float:
+        return (time.perf_counter() - process_started_at) * 1000
+
+    from app.main import app
+    timings = {"import": since_start()}
+    async with app.router.lifespan_context(app):
+        timings["startup"] = since_start()
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+            response = await client.get("/")
+            assert response.status_code == 200
+            timings["ready"] = since_start()
+            services = app.state.services
+            if services._warmup_task is not None:
+                await services._warmup_task
+            else:
+                await services.warm_up()
+            timings["warm"] = since_start()
+    return timings
+
+def _child() -> None:
+    # perf_counter no tiene origen común entre procesos: se parte del instante de creación del proceso
+    process_started_at = time.perf_counter() - (time.time() - float(os.environ["BENCH_SPAWNED_AT"]))
+    print(json.dumps(asyncio.run(_measure_child(process_started_at))))
+
+def _run_child(env: Dict[str, str]) -> Dict[str, float]:
+    env = {**env, "BENCH_SPAWNED_AT": repr(time.time())}
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_startup", "--child"], env=env, capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def _run_server(env: Dict[str, str], timeout: float = 30.0) -> float:
+    import httpx
+
+    port = _free_port()
+    started_at = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "app.main"],
+        env={**env, "HOST": "127.0.0.1", "PORT": str(port), "WORKERS": "1"},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - started_at < timeout:
+            try:
+                if httpx.get(f"http://127.0.0.1:{port}/", timeout=0.5).status_code == 200:
+                    return (time.perf_counter() - started_at) * 1000
+            except httpx.TransportError:
+                time.sleep(0.01)
+        raise TimeoutError("El servidor no respondió a tiempo")
+    finally:
+        process.terminate()
+        process.wait()
+
+def _summary(samples: List[float]) -> str:
+    return f"{statistics.median(samples):>9.0f}{min(samples):>9.0f}{max(samples):>9.0f}"
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=7)
+    parser.add_argument("--server", action="store_true", help="Mide también `python -m app.main` hasta el primer 200")
+    parser.add_argument("--no-warmup", action="store_true", help="SERVICES_WARMUP=false (servicios al primer uso)")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        _child()
+        return
+
+    env = {**os.environ, **BENCH_ENV, "SERVICES_WARMUP": "false" if args.no_warmup else "true"}
+    runs = [_run_child(env) for _ in range(args.runs)]
+    print(f"{args.runs} procesos nuevos, ms desde el inicio del proceso (mediana / mín / máx)\n")
+    print(f"{'hito':<12}{'p50':>9}{'mín':>9}{'máx':>9}")
+    for key in ("import", "startup", "ready", "warm"):
+        print(f"{key:<12}{_summary([run[key] for run in runs])}")
+    if args.server:
+        samples = [_run_server(env) for _ in range(args.runs)]
+        print(f"{'servidor':<12}{_summary(samples)}")
+
+if __name__ == "__main__":
+    main()
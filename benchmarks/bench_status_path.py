@@ -0,0 +1,64 @@
+"""
+Costo de la ruta de estados (sent/delivered/read): lo que paga la petición frente a lo que se hace por lotes.
+
+  - ack:   lo que ocurre dentro de la petición (búsqueda de claves + `DeliveryTracker.submit`).
+  - lote:  costo por payload del procesamiento en segundo plano (parseo de `statuses` + tabla de estados).
+  - full:  referencia, parsear el payload completo con `MetaWebhookRequest`.
+
+Uso:
+    python -m benchmarks.bench_status_path [--number 50000]
+"""
+import argparse
+import asyncio
+import re
+import time
+import timeit
+
+from app.models.meta import MetaWebhookRequest
+from app.services.delivery_tracker import DeliveryTracker
+from benchmarks.payloads import encode, status_update
+
+_MESSAGES_KEY = re.compile(rb'"messages"\s*:')
+_STATUSES_KEY = re.compile(rb'"statuses"\s*:')
+
+async def _measure(number: int) -> None:
+    tracker = DeliveryTracker(batch_size=number + 1, flush_interval=3600, max_pending=number + 1)
+    payloads = [
+        encode(status_update(("sent", "delivered", "read")[i % 3], message_id=f"wamid.bench{i // 3}"))
+        for i in range(number)
+    ]
+
+    def ack(payload_bytes: bytes) -> None:
+        if _STATUSES_KEY.search(payload_bytes):
+            tracker.submit(payload_bytes)
+        _MESSAGES_KEY.search(payload_bytes)
+
+    started_at = time.perf_counter()
+    for payload_bytes in payloads:
+        ack(payload_bytes)
+    ack_us = (time.perf_counter() - started_at) / number * 1e6
+
+    started_at = time.perf_counter()
+    await tracker.flush()
+    batch_us = (time.perf_counter() - started_at) / number * 1e6
+
+    full = min(timeit.repeat(lambda: MetaWebhookRequest.model_validate_json(payloads[0]), number=number, repeat=3))
+    full_us = full / number * 1e6
+
+    print(f"{number} payloads de estado ({len(payloads[0])} bytes)\n")
+    print(f"{'etapa':<10}{'µs/payload':>12}")
+    print(f"{'ack':<10}{ack_us:>12.2f}")
+    print(f"{'lote':<10}{batch_us:>12.2f}")
+    print(f"{'full':<10}{full_us:>12.2f}")
+    stats = tracker.stats()
+    print(f"\nmensajes: {stats['tracked']}, estados: {stats['statuses']}, lotes: {stats['batches']}")
+    await tracker.close()
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=50000)
+    args = parser.parse_args()
+    asyncio.run(_measure(args.number))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Microbenchmark del parseo de payloads del webhook: ruta anterior vs. ruta de un solo parseo.
+
+Uso:
+    python -m benchmarks.bench_webhook_parsing [--number 20000]
+"""
+import argparse
+import json
+import logging
+import re
+import timeit
+
+from app.models.meta import MetaWebhookRequest
+from benchmarks.payloads import encode, multi_message_batch, status_update, text_message
+
+logger = logging.getLogger("bench")
+logger.setLevel(logging.INFO) # DEBUG desactivado, como en producción
+
+_MESSAGES_KEY = re.compile(rb'"messages"\s*:')
+
+def legacy_path(payload_bytes: bytes) -> int:
+    # request.body() -> decode para el log -> f-string (siempre se construye) -> request.json() -> .get encadenados
+    payload_str = payload_bytes.decode("utf-8")
+    logger.debug(f"Payload crudo recibido en /webhook POST: {payload_str}")
+    payload = json.loads(payload_bytes)
+    if payload.get("object") != "whatsapp_business_account":
+        return 0
+    return sum(
+        1
+        for entry in payload.get("entry", [])
+        for change in entry.get("changes", [])
+        for msg in change.get("value", {}).get("messages", [])
+        if msg.get("type") == "text"
+    )
+
+def single_pass_path(payload_bytes: bytes) -> int:
+    logger.debug("Payload crudo recibido en /webhook POST: %s", payload_bytes)
+    if not _MESSAGES_KEY.search(payload_bytes):
+        return 0
+    payload = MetaWebhookRequest.model_validate_json(payload_bytes)
+    return sum(
+        1
+        for entry in payload.entry
+        for change in entry.changes
+        for msg in change.value.messages or ()
+        if msg.type == "text" and msg.text is not None
+    )
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=20000)
+    args = parser.parse_args()
+
+    cases = {
+        "text_message": encode(text_message()),
+        "status_only": encode(status_update()),
+        "multi_message_batch": encode(multi_message_batch(10)),
+    }
+    print(f"{'payload':<22}{'bytes':>7}{'legacy µs':>12}{'single-pass µs':>16}{'speedup':>10}")
+    for name, payload_bytes in cases.items():
+        assert legacy_path(payload_bytes) == single_pass_path(payload_bytes)
+        legacy = min(timeit.repeat(lambda: legacy_path(payload_bytes), number=args.number, repeat=3))
+        single = min(timeit.repeat(lambda: single_pass_path(payload_bytes), number=args.number, repeat=3))
+        legacy_us = legacy / args.number * 1e6
+        single_us = single / args.number * 1e6
+        print(f"{name:<22}{len(payload_bytes):>7}{legacy_us:>12.2f}{single_us:>16.2f}{legacy_us / single_us:>9.1f}x")
+
+if __name__ == "__main__":
+    main()
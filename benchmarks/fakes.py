@@ -0,0 +1,92 @@
+"""
+Sustitutos locales de Groq y de la Graph API para pruebas de carga, con latencia y tasa de error configurables.
+"""
+import asyncio
+import json
+import random
+import time
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Optional
+
+import httpx
+
+class FakeGroqCompletions:
+    """
+    Imita `AsyncGroq().chat.completions`: espera una latencia log-normal (mediana `latency_ms`)
+    y falla con probabilidad `error_rate`. Soporta `stream=True` con un TTFT de ~1/4 de la latencia.
+    """
+    def __init__(self, latency_ms: float = 300.0, jitter: float = 0.3, error_rate: float = 0.0, rng: Optional[random.Random] = None):
+        self.latency_ms = latency_ms
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rng = rng or random.Random()
+        self.calls = 0
+        self.errors = 0
+
+    def _latency(self) -> float:
+        return self.latency_ms / 1000 * self.rng.lognormvariate(0, self.jitter)
+
+    def _reply(self, messages: List[Dict[str, str]]) -> str:
+        question = messages[-1]["content"][-80:]
+        return f"Gracias por escribir. Sobre tu consulta ({question}) te cuento lo siguiente. Nuestro horario es de 9 a 19 horas."
+
+    async def create(self, messages: List[Dict[str, str]], model: str, stream: bool = False, **options):
+        self.calls += 1
+        latency = self._latency()
+        if self.rng.random() < self.error_rate:
+            await asyncio.sleep(latency / 2)
+            self.errors += 1
+            raise RuntimeError("Groq simulado: error 503")
+        reply = self._reply(messages)
+        usage = SimpleNamespace(prompt_tokens=sum(len(m["content"]) for m in messages) // 4, completion_tokens=len(reply) // 4)
+        if stream:
+            return self._stream(reply, latency)
+        await asyncio.sleep(latency)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=reply))], usage=usage)
+
+    async def _stream(self, reply: str, latency: float):
+        words = reply.split(" ")
+        await asyncio.sleep(latency / 4)
+        per_word = (latency * 3 / 4) / len(words)
+        for i, word in enumerate(words):
+            if i:
+                await asyncio.sleep(per_word)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=word + " "))])
+
+def fake_groq_client(completions: FakeGroqCompletions) -> SimpleNamespace:
+    return SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+class FakeGraphAPI:
+    """
+    Handler de `httpx.MockTransport` para `POST /{phone_number_id}/messages`: latencia fija con jitter,
+    una fracción de respuestas 503 (reintentables) y un callback por cada envío aceptado.
+    """
+    def __init__(
+        self,
+        latency_ms: float = 80.0,
+        jitter: float = 0.2,
+        error_rate: float = 0.0,
+        on_send: Optional[Callable[[str, float], None]] = None,
+        rng: Optional[random.Random] = None,
+    ):
+        self.latency_ms = latency_ms
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.on_send = on_send
+        self.rng = rng or random.Random()
+        self.requests = 0
+        self.errors = 0
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        await asyncio.sleep(self.latency_ms / 1000 * self.rng.lognormvariate(0, self.jitter))
+        if self.rng.random() < self.error_rate:
+            self.errors += 1
+            return httpx.Response(503, json={"error": {"message": "Servicio no disponible (simulado)"}})
+        to = json.loads(request.content)["to"]
+        if self.on_send is not None:
+            self.on_send(to, time.perf_counter())
+        return httpx.Response(200, json={"messaging_product": "whatsapp", "messages": [{"id": f"wamid.fake{self.requests}"}]})
+
+    def transport(self) -> httpx.MockTransport:
+        return httpx.MockTransport(self)
@@ -0,0 +1,297 @@
+"""
+Prueba de carga reproducible del camino completo del webhook.
+
+Reproduce tráfico realista de Meta (mensajes de texto, ráfagas de estados sent/delivered/read y
+lotes de varios mensajes) contra `receive_webhook` a través de la app ASGI, con sustitutos locales
+de Groq y de la Graph API (latencia y tasa de error configurables). Las llegadas siguen un proceso
+de Poisson con semilla fija, así dos ejecuciones con los mismos parámetros generan el mismo tráfico.
+
+Reporta throughput, latencia del ack HTTP, latencia extremo a extremo (POST del webhook -> primer
+envío de la respuesta a la Graph API) con p50/p95/p99 y el retraso del event loop. Guarda el
+resultado en JSON y, con `--baseline`, marca regresiones (código de salida 1).
+
+Uso:
+    python -m benchmarks.load_test [--rate 50] [--duration 20] [--mix text=0.6,status=0.3,batch=0.1]
+        [--groq-latency-ms 300] [--groq-error-rate 0.01] [--graph-latency-ms 80] [--graph-error-rate 0.01]
+        [--output benchmarks/results/run.json] [--baseline benchmarks/baselines/load_test.json] [--tolerance 0.15]
+        [--save-baseline]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import platform
+import random
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from benchmarks.fakes import FakeGraphAPI, FakeGroqCompletions, fake_groq_client
+from benchmarks.payloads import encode, multi_message_batch, status_update, text_message
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baselines", "load_test.json")
+QUESTIONS = [
+    "Hola, ¿cuál es el horario de atención?",
+    "¿Cuánto cuesta el plan básico?",
+    "Necesito cambiar la dirección de envío de mi pedido",
+    "¿Tienen sucursal en Valparaíso?",
+    "Quiero hablar con una persona",
+    "¿Cómo pago con transferencia?",
+]
+
+# Métricas comparadas con la línea base: (ruta en el resultado, True si "más alto es peor")
+REGRESSION_CHECKS = [
+    ("throughput.replies_per_second", False),
+    ("end_to_end_ms.p50", True),
+    ("end_to_end_ms.p95", True),
+    ("end_to_end_ms.p99", True),
+    ("ack_ms.p99", True),
+    ("event_loop_lag_ms.p99", True),
+]
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    """p50/p95/p99 por rango más cercano, más media y máximo."""
+    if not values:
+        return {"count": 0, "p50": 0.0, "p95": 0.0, "p99": 0.0, "mean": 0.0, "max": 0.0}
+    ordered = sorted(values)
+
+    def rank(q: float) -> float:
+        return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+    return {
+        "count": len(ordered),
+        "p50": round(rank(0.50), 3),
+        "p95": round(rank(0.95), 3),
+        "p99": round(rank(0.99), 3),
+        "mean": round(sum(ordered) / len(ordered), 3),
+        "max": round(ordered[-1], 3),
+    }
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, _, weight = item.partition("=")
+        if name not in ("text", "status", "batch"):
+            raise ValueError(f"Escenario desconocido: {name}")
+        mix[name] = float(weight)
+    return mix
+
+def comparable_config(args: argparse.Namespace) -> Dict[str, Any]:
+    """Parámetros que definen el tráfico y los sustitutos (los que deben coincidir con la línea base)."""
+    return {key: value for key, value in vars(args).items() if key not in ("output", "baseline", "save_baseline", "tolerance")}
+
+def _lookup(result: Dict[str, Any], path: str) -> Optional[float]:
+    value: Any = result
+    for key in path.split("."):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+def compare_to_baseline(result: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[Dict[str, Any]]:
+    """Devuelve las métricas que empeoraron más de `tolerance` (fracción) respecto de la línea base."""
+    regressions = []
+    for path, higher_is_worse in REGRESSION_CHECKS:
+        current, reference = _lookup(result, path), _lookup(baseline, path)
+        if current is None or not reference:
+            continue
+        change = (current - reference) / reference
+        if (change > tolerance) if higher_is_worse else (change < -tolerance):
+            regressions.append({"metric": path, "baseline": reference, "current": current, "change": round(change, 3)})
+    return regressions
+
+class LoopLagMonitor:
+    """Mide cuánto se atrasa un `asyncio.sleep(interval)`: el tiempo que el loop estuvo ocupado con otra cosa."""
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples_ms: List[float] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self) -> None:
+        while True:
+            started_at = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples_ms.append(max(0.0, (time.perf_counter() - started_at - self.interval) * 1000))
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+async def run_load_test(args: argparse.Namespace) -> Dict[str, Any]:
+    # Importar la app después de fijar la configuración de la prueba (variables de entorno)
+    from app.core.config import settings
+    from app.core.metrics import metrics
+    from app.main import app
+
+    logging.getLogger().setLevel(logging.WARNING) # Sin logs INFO por mensaje durante la prueba
+    rng = random.Random(args.seed)
+    mix = parse_mix(args.mix)
+    scenarios, weights = list(mix), list(mix.values())
+
+    sent_at: Dict[str, float] = {}
+    first_reply_at: Dict[str, float] = {}
+
+    def on_send(to: str, at: float) -> None:
+        first_reply_at.setdefault(to, at)
+
+    groq = FakeGroqCompletions(args.groq_latency_ms, args.groq_jitter, args.groq_error_rate, rng=random.Random(args.seed + 1))
+    graph = FakeGraphAPI(args.graph_latency_ms, 0.2, args.graph_error_rate, on_send=on_send, rng=random.Random(args.seed + 2))
+
+    ack_ms: List[float] = []
+    http_errors: Dict[str, int] = {}
+    counts = {"text": 0, "status": 0, "batch": 0, "messages": 0, "requests": 0}
+    sender_counter = 0
+
+    def next_sender() -> str:
+        nonlocal sender_counter
+        sender_counter += 1
+        return f"569{sender_counter:08d}" # Un remitente por mensaje: cada respuesta se correlaciona por `to`
+
+    async def post(client: httpx.AsyncClient, payload_bytes: bytes) -> None:
+        started_at = time.perf_counter()
+        response = await client.post(f"{settings.API_V1_STR}/meta/webhook", content=payload_bytes, headers={"Content-Type": "application/json"})
+        ack_ms.append((time.perf_counter() - started_at) * 1000)
+        counts["requests"] += 1
+        if response.status_code != 200:
+            http_errors[str(response.status_code)] = http_errors.get(str(response.status_code), 0) + 1
+
+    async def arrival(client: httpx.AsyncClient, scenario: str) -> None:
+        counts[scenario] += 1
+        if scenario == "status":
+            for status in ("sent", "delivered", "read"):
+                await post(client, encode(status_update(status, recipient=next_sender())))
+            return
+        if scenario == "text":
+            senders = [next_sender()]
+            payload = text_message(sender=senders[0], body=rng.choice(QUESTIONS))
+        else:
+            senders = [next_sender() for _ in range(args.batch_size)]
+            payload = multi_message_batch(senders=senders)
+        now = time.perf_counter()
+        for sender in senders:
+            sent_at[sender] = now
+        counts["messages"] += len(senders)
+        await post(client, encode(payload))
+
+    monitor = LoopLagMonitor()
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        services = app.state.services
+        services.llm_service.client = fake_groq_client(groq)
+        # El pool de la Graph API apunta al sustituto local (misma base_url, mismo planificador saliente)
+        http_client = services.http_client
+        await http_client.close()
+        http_client._client = httpx.AsyncClient(base_url=http_client.base_url, transport=graph.transport())
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest") as client:
+            monitor.start()
+            started_at = time.perf_counter()
+            tasks = []
+            next_arrival = started_at
+            deadline = started_at + args.duration
+            while True:
+                next_arrival += rng.expovariate(args.rate)
+                if next_arrival >= deadline:
+                    break
+                await asyncio.sleep(max(0.0, next_arrival - time.perf_counter()))
+                tasks.append(asyncio.create_task(arrival(client, rng.choices(scenarios, weights)[0])))
+            await asyncio.gather(*tasks)
+            send_phase_seconds = time.perf_counter() - started_at
+            try:
+                await asyncio.wait_for(services.webhook_dispatcher.join(), timeout=args.drain_timeout)
+            except asyncio.TimeoutError:
+                pass
+            total_seconds = time.perf_counter() - started_at
+            await monitor.stop()
+            outbound_stats = services.outbound.stats()
+
+    end_to_end_ms = [(first_reply_at[s] - t0) * 1000 for s, t0 in sent_at.items() if s in first_reply_at]
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "environment": {"python": platform.python_version(), "platform": platform.platform()},
+        "config": comparable_config(args),
+        "counts": {**counts, "replies": len(end_to_end_ms), "unanswered": counts["messages"] - len(end_to_end_ms)},
+        "throughput": {
+            "requests_per_second": round(counts["requests"] / send_phase_seconds, 2),
+            "replies_per_second": round(len(end_to_end_ms) / total_seconds, 2),
+        },
+        "ack_ms": percentiles(ack_ms),
+        "end_to_end_ms": percentiles(end_to_end_ms),
+        "event_loop_lag_ms": percentiles(monitor.samples_ms),
+        "errors": {
+            "http": http_errors,
+            "groq_injected": groq.errors,
+            "graph_injected": graph.errors,
+            "outbound": outbound_stats,
+        },
+        "stages": {
+            stage: {key: round(value * 1000, 3) if key.endswith("_seconds") else value for key, value in summary.items()}
+            for stage, summary in metrics.stage_summary().items()
+        },
+    }
+
+def print_report(result: Dict[str, Any]) -> None:
+    counts, throughput = result["counts"], result["throughput"]
+    print(f"Peticiones: {counts['requests']} ({counts['text']} texto, {counts['status']} ráfagas de estado, {counts['batch']} lotes)")
+    print(f"Mensajes: {counts['messages']}, respondidos: {counts['replies']}, sin respuesta: {counts['unanswered']}")
+    print(f"Throughput: {throughput['requests_per_second']} peticiones/s, {throughput['replies_per_second']} respuestas/s\n")
+    print(f"{'':<26}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+    for label, key in (("ack HTTP (ms)", "ack_ms"), ("extremo a extremo (ms)", "end_to_end_ms"), ("retraso del loop (ms)", "event_loop_lag_ms")):
+        stats = result[key]
+        print(f"{label:<26}{stats['p50']:>10.1f}{stats['p95']:>10.1f}{stats['p99']:>10.1f}{stats['max']:>10.1f}")
+    print("\nPor etapa (ms):")
+    for stage, summary in result["stages"].items():
+        if summary["count"]:
+            print(f"  {stage:<18} n={summary['count']:<6} p50={summary['p50_seconds']:<9} p99={summary['p99_seconds']:<9} errores={summary['errors']}")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rate", type=float, default=50.0, help="Llegadas por segundo (Poisson)")
+    parser.add_argument("--duration", type=float, default=20.0, help="Segundos generando tráfico")
+    parser.add_argument("--mix", default="text=0.6,status=0.3,batch=0.1")
+    parser.add_argument("--batch-size", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--groq-latency-ms", type=float, default=300.0)
+    parser.add_argument("--groq-jitter", type=float, default=0.3)
+    parser.add_argument("--groq-error-rate", type=float, default=0.0)
+    parser.add_argument("--graph-latency-ms", type=float, default=80.0)
+    parser.add_argument("--graph-error-rate", type=float, default=0.0)
+    parser.add_argument("--drain-timeout", type=float, default=60.0)
+    parser.add_argument("--output", help="Archivo JSON donde guardar el resultado")
+    parser.add_argument("--baseline", default=None, help=f"Línea base para comparar (p. ej. {DEFAULT_BASELINE})")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Empeoramiento tolerado (fracción)")
+    parser.add_argument("--save-baseline", action="store_true", help=f"Guardar este resultado como línea base en {DEFAULT_BASELINE}")
+    args = parser.parse_args()
+
+    result = asyncio.run(run_load_test(args))
+    print_report(result)
+
+    for path in filter(None, (args.output, DEFAULT_BASELINE if args.save_baseline else None)):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"\nResultado guardado en {path}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("config") != result["config"]:
+            print("\nAviso: la línea base se generó con otros parámetros; la comparación puede no ser válida.")
+        regressions = compare_to_baseline(result, baseline, args.tolerance)
+        if regressions:
+            print(f"\nREGRESIONES respecto de {args.baseline} (tolerancia {args.tolerance:.0%}):")
+            for regression in regressions:
+                print(f"  {regression['metric']}: {regression['baseline']} -> {regression['current']} ({regression['change']:+.1%})")
+            sys.exit(1)
+        print(f"\nSin regresiones respecto de {args.baseline} (tolerancia {args.tolerance:.0%}).")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Payloads realistas de webhooks de Meta para benchmarks y pruebas de carga.
+"""
+import json
+import random
+from typing import Any, Dict, List, Optional
+
+PHONE_NUMBER_ID = "106540352242922"
+
+def _envelope(value: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "object": "whatsapp_business_account",
+        "entry": [{
+            "id": "102290129340398",
+            "changes": [{"value": value, "field": "messages"}],
+        }],
+    }
+
+def _metadata() -> Dict[str, str]:
+    return {"display_phone_number": "15550783881", "phone_number_id": PHONE_NUMBER_ID}
+
+def text_message(sender: str = "56912345678", body: str = "Hola, ¿cuál es el horario de atención?", message_id: str = "") -> Dict[str, Any]:
+    message_id = message_id or f"wamid.HBgLNTY5MTIzNDU2NzgVAgASGBQzQTdC{random.getrandbits(48):012X}"
+    return _envelope({
+        "messaging_product": "whatsapp",
+        "metadata": _metadata(),
+        "contacts": [{"profile": {"name": "Cliente"}, "wa_id": sender}],
+        "messages": [{
+            "from": sender,
+            "id": message_id,
+            "timestamp": "1717000000",
+            "text": {"body": body},
+            "type": "text",
+        }],
+    })
+
+def multi_message_batch(count: int = 5, senders: Optional[List[str]] = None) -> Dict[str, Any]:
+    senders = senders or [f"569{10000000 + i:08d}" for i in range(count)]
+    return _envelope({
+        "messaging_product": "whatsapp",
+        "metadata": _metadata(),
+        "contacts": [{"profile": {"name": f"Cliente {i}"}, "wa_id": s} for i, s in enumerate(senders)],
+        "messages": [{
+            "from": sender,
+            "id": f"wamid.batch{i}{random.getrandbits(32):08X}",
+            "timestamp": "1717000000",
+            "text": {"body": f"Mensaje número {i}: quiero saber el precio del plan"},
+            "type": "text",
+        } for i, sender in enumerate(senders)],
+    })
+
+def status_update(status: str = "delivered", recipient: str = "56912345678", message_id: str = "") -> Dict[str, Any]:
+    message_id = message_id or f"wamid.out{random.getrandbits(48):012X}"
+    return _envelope({
+        "messaging_product": "whatsapp",
+        "metadata": _metadata(),
+        "statuses": [{
+            "id": message_id,
+            "status": status,
+            "timestamp": "1717000001",
+            "recipient_id": recipient,
+            "conversation": {
+                "id": "CONVERSATION_ID",
+                "expiration_timestamp": "1717086400",
+                "origin": {"type": "service"},
+            },
+            "pricing": {"billable": True, "pricing_model": "CBP", "category": "service"},
+        }],
+    })
+
+def status_burst(count: int = 3) -> List[Dict[str, Any]]:
+    return [status_update(status) for status in ("sent", "delivered", "read")[:count]]
+
+def encode(payload: Dict[str, Any]) -> bytes:
+    return json.dumps(payload, ensure_ascii=False).encode("utf-8")
@@ -0,0 +1,124 @@
+"""
+Replay offline del journal: vuelve a pasar por `MetaService` los webhooks registrados en producción
+(segmentos `journal-*.log` de JOURNAL_DIR), con sustitutos locales de Groq y de la Graph API.
+
+Reproduce el tráfico real (mismos textos, remitentes y agrupación por webhook) respetando los
+intervalos originales entre llegadas, escalados con `--speed` (0 = sin pausas, lo más rápido posible).
+La deduplicación no se consulta: el mismo journal puede reproducirse varias veces.
+
+Reporta throughput, latencia de procesamiento por webhook y las etapas medidas por `metrics`.
+
+Uso:
+    python -m benchmarks.replay_journal journal/ [--speed 1.0] [--limit 1000]
+        [--groq-latency-ms 300] [--graph-latency-ms 80] [--output benchmarks/results/replay.json]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from typing import Any, Dict, List
+
+import httpx
+
+from benchmarks.fakes import FakeGraphAPI, FakeGroqCompletions, fake_groq_client
+from benchmarks.load_test import percentiles
+
+async def run_replay(args: argparse.Namespace) -> Dict[str, Any]:
+    # El replay no debe escribir un journal nuevo (ni leer el que se reproduce como pendiente)
+    os.environ["JOURNAL_ENABLED"] = "false"
+    from app.core.config import settings
+    from app.core.container import ServiceContainer
+    from app.core.metrics import metrics
+    from app.models.meta import MetaWebhookRequest
+    from app.services.journal import INBOUND, read_journal
+
+    logging.getLogger().setLevel(logging.WARNING)
+    entries = [entry for entry in read_journal(args.directory) if entry.kind == INBOUND]
+    if args.limit:
+        entries = entries[:args.limit]
+    if not entries:
+        raise SystemExit(f"Sin webhooks registrados en {args.directory}")
+
+    groq = FakeGroqCompletions(args.groq_latency_ms, args.groq_jitter, rng=random.Random(args.seed))
+    graph = FakeGraphAPI(args.graph_latency_ms, 0.2, rng=random.Random(args.seed + 1))
+    services = ServiceContainer(settings)
+    services.llm_service.client = fake_groq_client(groq)
+    http_client = services.http_client
+    await http_client.close()
+    http_client._client = httpx.AsyncClient(base_url=http_client.base_url, transport=graph.transport())
+
+    processing_ms: List[float] = []
+    invalid = 0
+
+    async def replay(payload: Any) -> None:
+        started_at = time.perf_counter()
+        await services.meta_service.process_webhook_message(payload, skip_dedup=True)
+        processing_ms.append((time.perf_counter() - started_at) * 1000)
+
+    tasks = []
+    started_at = time.perf_counter()
+    first_ts = entries[0].ts
+    for entry in entries:
+        if args.speed > 0:
+            await asyncio.sleep(max(0.0, started_at + (entry.ts - first_ts) / args.speed - time.perf_counter()))
+        try:
+            payload = MetaWebhookRequest.model_validate_json(entry.data)
+        except ValueError:
+            invalid += 1
+            continue
+        tasks.append(asyncio.create_task(replay(payload)))
+    await asyncio.gather(*tasks)
+    total_seconds = time.perf_counter() - started_at
+    await services.close()
+
+    return {
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "counts": {"webhooks": len(tasks), "invalid": invalid, "groq_calls": groq.calls, "sends": graph.requests},
+        "throughput": {"webhooks_per_second": round(len(tasks) / total_seconds, 2)},
+        "original_span_seconds": round(entries[-1].ts - first_ts, 3),
+        "replay_seconds": round(total_seconds, 3),
+        "processing_ms": percentiles(processing_ms),
+        "stages": {
+            stage: {key: round(value * 1000, 3) if key.endswith("_seconds") else value for key, value in summary.items()}
+            for stage, summary in metrics.stage_summary().items()
+        },
+    }
+
+def print_report(result: Dict[str, Any]) -> None:
+    counts = result["counts"]
+    print(f"Webhooks: {counts['webhooks']} (inválidos: {counts['invalid']}), llamadas a Groq: {counts['groq_calls']}, envíos: {counts['sends']}")
+    print(f"Duración original: {result['original_span_seconds']} s, replay: {result['replay_seconds']} s "
+          f"({result['throughput']['webhooks_per_second']} webhooks/s)\n")
+    stats = result["processing_ms"]
+    print(f"{'':<26}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+    print(f"{'procesamiento (ms)':<26}{stats['p50']:>10.1f}{stats['p95']:>10.1f}{stats['p99']:>10.1f}{stats['max']:>10.1f}")
+    print("\nPor etapa (ms):")
+    for stage, summary in result["stages"].items():
+        if summary["count"]:
+            print(f"  {stage:<18} n={summary['count']:<6} p50={summary['p50_seconds']:<9} p99={summary['p99_seconds']:<9} errores={summary['errors']}")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directory", help="Directorio con los segmentos del journal (JOURNAL_DIR, o JOURNAL_DIR/worker-N con WORKERS > 1)")
+    parser.add_argument("--speed", type=float, default=1.0, help="Factor sobre los intervalos originales (0 = sin pausas)")
+    parser.add_argument("--limit", type=int, default=0, help="Máximo de webhooks a reproducir (0 = todos)")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--groq-latency-ms", type=float, default=300.0)
+    parser.add_argument("--groq-jitter", type=float, default=0.3)
+    parser.add_argument("--graph-latency-ms", type=float, default=80.0)
+    parser.add_argument("--output", help="Archivo JSON donde guardar el resultado")
+    args = parser.parse_args()
+
+    result = asyncio.run(run_replay(args))
+    print_report(result)
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"\nResultado guardado en {args.output}")
+
+if __name__ == "__main__":
+    main()
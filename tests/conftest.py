@@ -1,7 +1,7 @@
 import pytest
 from fastapi.testclient import TestClient
 from app.main import app # Asegúrate que la app se pueda importar
-from app.core.config import Settings, settings as app_settings
+from app.core.config import Settings, get_settings
 from dotenv import load_dotenv
 import os
 
@@ -21,40 +21,41 @@ def load_test_env():
 @pytest.fixture(scope="session")
 def test_settings() -> Settings:
     # Aquí puedes sobreescribir settings para los tests si es necesario
-    # Por ejemplo, usar un META_VERIFY_TOKEN específico para tests.
+    # Por ejemplo, usar un WHATSAPP_VERIFY_TOKEN específico para tests.
     # Asegúrate que las variables necesarias estén en tu .env o .env.test
     # o seteadas en el entorno de CI.
     return Settings(
-        META_VERIFY_TOKEN=os.getenv("META_VERIFY_TOKEN", "test_token"),
-        META_ACCESS_TOKEN=os.getenv("META_ACCESS_TOKEN", "test_access_token"),
+        WHATSAPP_VERIFY_TOKEN=os.getenv("WHATSAPP_VERIFY_TOKEN", "test_token"),
+        WHATSAPP_ACCESS_TOKEN=os.getenv("WHATSAPP_ACCESS_TOKEN", "test_access_token"),
         WHATSAPP_PHONE_NUMBER_ID=os.getenv("WHATSAPP_PHONE_NUMBER_ID", "test_phone_id"),
         GROQ_API_KEY=os.getenv("GROQ_API_KEY", "test_groq_key_dummy") # Importante si no mockeas Groq
     )
 
 @pytest.fixture(scope="function") # 'function' scope para TestClient para aislar tests
 def client(test_settings) -> TestClient:
-    # Sobrescribir las settings de la app con las de test
-    # Esto es un poco hacky; una mejor forma sería usar dependencias de FastAPI para settings.
-    # Pero para simplicidad en el esqueleto:
-    original_settings = app_settings.__dict__.copy()
-    app_settings.__dict__.update(test_settings.model_dump())
-    
+    # Las settings de test se inyectan por la dependencia `get_settings` (endpoints y lifespan)
+    app.dependency_overrides[get_settings] = lambda: test_settings
     with TestClient(app) as c:
         yield c
-    
-    # Restaurar settings originales
-    app_settings.__dict__.clear()
-    app_settings.__dict__.update(original_settings)
+    app.dependency_overrides.pop(get_settings, None)
+
+@pytest.fixture
+def admin_client(test_settings) -> TestClient:
+    # Con ADMIN_TOKEN: habilita /admin y los endpoints protegidos (cabecera X-Admin-Token: admin-secret)
+    app.dependency_overrides[get_settings] = lambda: test_settings.model_copy(update={"ADMIN_TOKEN": "admin-secret"})
+    with TestClient(app) as c:
+        yield c
+    app.dependency_overrides.pop(get_settings, None)
 
 # Fixture para mockear httpx (usando respx)
 @pytest.fixture
-async def mocked_httpx_router(test_settings):
+def mocked_httpx_router(test_settings):
     from respx import MockRouter
     router = MockRouter(assert_all_called=False) # False para no fallar si no todas las rutas mockeadas son llamadas
 
     # Mock para enviar mensajes de WhatsApp
-    meta_api_version = "v19.0" # Debe coincidir con http_client.py
+    meta_api_version = test_settings.WHATSAPP_API_VERSION # La de las Settings inyectadas en la app
     meta_graph_url = f"https://graph.facebook.com/{meta_api_version}/{test_settings.WHATSAPP_PHONE_NUMBER_ID}/messages"
-    router.post(meta_graph_url).respond(json={"message_id": "mocked_message_id"})
+    router.post(meta_graph_url, name="meta_send_message").respond(json={"message_id": "mocked_message_id"})
     
     yield router
\ No newline at end of file
@@ -0,0 +1,48 @@
+import pytest
+from fastapi.testclient import TestClient
+from app.core.config import settings
+
+# Marcar todos los tests en este módulo como asyncio
+pytestmark = pytest.mark.asyncio
+
+ADMIN = {"X-Admin-Token": "admin-secret"} # ADMIN_TOKEN del fixture `admin_client`
+
+async def test_admin_endpoints_do_not_exist_without_token(client: TestClient):
+    response = client.get(f"{settings.API_V1_STR}/admin/tasks", headers=ADMIN)
+    assert response.status_code == 404
+    assert "diagnostics" not in vars(client.app.state.services) # Nada se construye ni se activa
+
+async def test_admin_endpoints_require_the_token(admin_client: TestClient):
+    assert admin_client.get(f"{settings.API_V1_STR}/admin/tasks").status_code == 401
+    assert admin_client.get(f"{settings.API_V1_STR}/admin/tasks", headers={"X-Admin-Token": "otro"}).status_code == 401
+
+async def test_profile_stalls_and_tasks(admin_client: TestClient):
+    base = f"{settings.API_V1_STR}/admin"
+    response = admin_client.post(f"{base}/profile", params={"seconds": 0.1, "interval_ms": 2}, headers=ADMIN)
+    assert response.status_code == 200 and int(response.headers["X-Profile-Samples"]) > 0
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in response.text.splitlines())
+    assert admin_client.post(f"{base}/profile", params={"seconds": 3600}, headers=ADMIN).status_code == 400
+
+    assert admin_client.get(f"{base}/loop/stalls", headers=ADMIN).json() == {"enabled": False}
+    assert admin_client.post(f"{base}/loop/stalls", params={"threshold_ms": 50}, headers=ADMIN).json()["threshold_ms"] == 50
+    report = admin_client.get(f"{base}/loop/stalls", headers=ADMIN).json()
+    assert report["enabled"] and report["stalls"] == 0
+    assert admin_client.delete(f"{base}/loop/stalls", headers=ADMIN).json() == {"enabled": False}
+
+    assert admin_client.post(f"{base}/tasks/tracking", headers=ADMIN).json() == {"tracking": True}
+    tasks = admin_client.get(f"{base}/tasks", headers=ADMIN).json()
+    assert tasks["tracking"] and tasks["pending"] >= 1 # Al menos los workers del dispatcher
+    assert admin_client.delete(f"{base}/tasks/tracking", headers=ADMIN).json() == {"tracking": False}
+
+async def test_dead_letters_are_listed(admin_client: TestClient, mocked_httpx_router):
+    mocked_httpx_router["meta_send_message"].respond(400, json={"error": {"message": "Número inválido"}})
+    meta_service = admin_client.app.state.services.meta_service
+    with mocked_httpx_router:
+        result = admin_client.portal.call(meta_service.send_whatsapp_message, "5690000", "Hola")
+    assert not result.ok # 400: no reintentable, va directo a la lista dead-letter
+
+    response = admin_client.get(f"{settings.API_V1_STR}/admin/outbound/dead-letters", headers=ADMIN)
+    assert response.status_code == 200
+    [letter] = response.json()["dead_letters"]["default"]
+    assert letter["to"] == "5690000" and letter["status_code"] == 400
+    assert admin_client.get(f"{settings.API_V1_STR}/admin/outbound/dead-letters").status_code == 401
@@ -0,0 +1,63 @@
+import json
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from app.core.config import settings
+
+# Marcar todos los tests en este módulo como asyncio
+pytestmark = pytest.mark.asyncio
+
+ADMIN = {"X-Admin-Token": "admin-secret"} # ADMIN_TOKEN del fixture `admin_client`
+
+def _reply(request: httpx.Request) -> httpx.Response:
+    to = json.loads(request.content)["to"]
+    if to == "invalido":
+        return httpx.Response(400, json={"error": {"message": "Invalid parameter"}})
+    return httpx.Response(200, json={"messages": [{"id": f"wamid.{to}"}]})
+
+async def test_broadcast_streams_ndjson_results_and_resumes(admin_client: TestClient, mocked_httpx_router, test_settings, monkeypatch, tmp_path):
+    monkeypatch.setattr(test_settings, "BROADCAST_CHECKPOINT_DIR", str(tmp_path)) # Settings inyectadas en la app
+    mocked_httpx_router["meta_send_message"].side_effect = _reply
+    body = "to,text\n56911111111,Aviso\ninvalido,Aviso\n56922222222,Aviso\n"
+
+    with mocked_httpx_router:
+        response = admin_client.post(
+            f"{settings.API_V1_STR}/chat/broadcast",
+            params={"campaign_id": "promo-1"},
+            content=body,
+            headers={"Content-Type": "text/csv", **ADMIN},
+        )
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        outcomes = {o["to"]: o for o in map(json.loads, response.text.splitlines())}
+        assert outcomes["56911111111"]["status"] == "sent"
+        assert outcomes["56911111111"]["message_id"] == "wamid.56911111111"
+        assert outcomes["invalido"]["status"] == "failed" and outcomes["invalido"]["status_code"] == 400
+        assert mocked_httpx_router["meta_send_message"].call_count == 3
+
+        # Misma campaña: todas las filas ya están resueltas
+        response = admin_client.post(
+            f"{settings.API_V1_STR}/chat/broadcast",
+            params={"campaign_id": "promo-1", "format": "csv"},
+            content=body,
+            headers=ADMIN,
+        )
+        assert response.status_code == 200 and response.text == ""
+        assert mocked_httpx_router["meta_send_message"].call_count == 3
+    assert (tmp_path / "promo-1.checkpoint").exists()
+
+async def test_broadcast_rejects_campaign_already_running(admin_client: TestClient, test_settings, monkeypatch, tmp_path):
+    monkeypatch.setattr(test_settings, "BROADCAST_CHECKPOINT_DIR", str(tmp_path))
+    state = admin_client.app.state.services.state
+    # Otro worker tiene la campaña en curso
+    assert admin_client.portal.call(state.add, "lock:campaign:promo-2", "otro-worker", 60)
+
+    response = admin_client.post(f"{settings.API_V1_STR}/chat/broadcast", params={"campaign_id": "promo-2"}, content="", headers=ADMIN)
+    assert response.status_code == 409
+
+async def test_broadcast_requires_the_admin_token(admin_client: TestClient, mocked_httpx_router):
+    body = "to,text\n56911111111,Aviso\n"
+    with mocked_httpx_router:
+        response = admin_client.post(f"{settings.API_V1_STR}/chat/broadcast", content=body, headers={"X-Admin-Token": "otro"})
+    assert response.status_code == 401
+    assert mocked_httpx_router["meta_send_message"].call_count == 0
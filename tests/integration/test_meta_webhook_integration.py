@@ -10,7 +10,7 @@ def test_verify_webhook_success(client: TestClient, test_settings): # test_setti
     params = {
         "hub.mode": "subscribe",
         "hub.challenge": "12345challenge",
-        "hub.verify_token": test_settings.META_VERIFY_TOKEN # Usa el token de las settings de test
+        "hub.verify_token": test_settings.WHATSAPP_VERIFY_TOKEN # Usa el token de las settings de test
     }
     response = client.get(f"{settings.API_V1_STR}/meta/webhook", params=params)
     assert response.status_code == 200
@@ -57,13 +57,16 @@ async def test_receive_webhook_text_message(client: TestClient, mocked_httpx_rou
     # Mockear el servicio LLM para que no haga una llamada real a Groq
     # y devuelva una respuesta predecible.
     # También mockear el cliente HTTP para la API de Meta.
-    with patch('app.services.meta_service.llm_service.generate_response', AsyncMock(return_value="Hola! Soy el bot.")) as mock_llm_response, \
+    with patch.object(client.app.state.services.llm_service, 'generate_response', AsyncMock(return_value="Hola! Soy el bot.")) as mock_llm_response, \
          mocked_httpx_router: # Activar el router mockeado de respx
 
         response = client.post(f"{settings.API_V1_STR}/meta/webhook", json=sample_payload)
         
         assert response.status_code == 200
         assert response.text == "EVENT_RECEIVED"
+
+        # El procesamiento ocurre en los workers del dispatcher: esperar a que la cola se vacíe
+        client.portal.call(client.app.state.services.webhook_dispatcher.join)
         
         # Verificar que el servicio LLM fue llamado con el mensaje correcto
         mock_llm_response.assert_called_once_with("Hola bot", user_id="1234567890")
@@ -74,7 +77,7 @@ async def test_receive_webhook_text_message(client: TestClient, mocked_httpx_rou
         # El fixture mocked_httpx_router ya contiene el mock para el POST a Meta.
         # Si `assert_all_called=True` estuviera en respx, fallaría si no se llama.
         # Para ser más explícito:
-        assert mocked_httpx_router["post", f"https://graph.facebook.com/v19.0/{settings.WHATSAPP_PHONE_NUMBER_ID}/messages"].called
+        assert mocked_httpx_router["meta_send_message"].called
 
 
 async def test_receive_webhook_unsupported_message_type(client: TestClient):
@@ -84,10 +87,123 @@ async def test_receive_webhook_unsupported_message_type(client: TestClient):
     }
     # No esperamos que falle, solo que no haga ciertas acciones (como llamar al LLM)
     # Esto depende de la lógica en meta_service.py
-    with patch('app.services.meta_service.llm_service.generate_response', AsyncMock()) as mock_llm_response, \
+    with patch.object(client.app.state.services.llm_service, 'generate_response', AsyncMock()) as mock_llm_response, \
          patch('app.services.meta_service.MetaService.send_whatsapp_message', AsyncMock()) as mock_send_message:
         
         response = client.post(f"{settings.API_V1_STR}/meta/webhook", json=sample_payload)
         assert response.status_code == 200
+        client.portal.call(client.app.state.services.webhook_dispatcher.join)
         mock_llm_response.assert_not_called() # No debería llamar al LLM si el tipo no es 'text'
-        mock_send_message.assert_not_called() # No debería intentar enviar respuesta
\ No newline at end of file
+        mock_send_message.assert_not_called() # No debería intentar enviar respuesta
+
+async def test_receive_webhook_duplicate_delivery_is_ignored(client: TestClient):
+    sample_payload = {
+        "object": "whatsapp_business_account",
+        "entry": [{"id": "WABA_ID", "changes": [{"field": "messages", "value": {
+            "messaging_product": "whatsapp",
+            "metadata": {"phone_number_id": settings.WHATSAPP_PHONE_NUMBER_ID},
+            "messages": [{"from": "1234567890", "id": "wamid.duplicated_id", "timestamp": "1600000000",
+                          "text": {"body": "Hola otra vez"}, "type": "text"}]
+        }}]}]
+    }
+    with patch.object(client.app.state.services.llm_service, 'generate_response', AsyncMock(return_value="Hola!")) as mock_llm_response, \
+         patch('app.services.meta_service.MetaService.send_whatsapp_message', AsyncMock()) as mock_send_message:
+
+        # Meta reintenta la misma entrega (mismo id de mensaje)
+        for _ in range(2):
+            response = client.post(f"{settings.API_V1_STR}/meta/webhook", json=sample_payload)
+            assert response.status_code == 200
+        client.portal.call(client.app.state.services.webhook_dispatcher.join)
+
+        mock_llm_response.assert_called_once_with("Hola otra vez", user_id="1234567890")
+        mock_send_message.assert_called_once()
+
+
+async def test_receive_webhook_status_only_is_acked_without_processing(client: TestClient):
+    sample_payload = {
+        "object": "whatsapp_business_account",
+        "entry": [{"id": "WABA_ID", "changes": [{"field": "messages", "value": {
+            "messaging_product": "whatsapp",
+            "metadata": {"phone_number_id": settings.WHATSAPP_PHONE_NUMBER_ID},
+            "statuses": [{"id": "wamid.out", "status": "delivered", "timestamp": "1600000001", "recipient_id": "1234567890"}]
+        }}]}]
+    }
+    with patch.object(client.app.state.services.webhook_dispatcher, 'submit') as mock_submit:
+        response = client.post(f"{settings.API_V1_STR}/meta/webhook", json=sample_payload)
+        assert response.status_code == 200
+        assert response.text == "EVENT_RECEIVED"
+        mock_submit.assert_not_called()
+
+    # El estado se agrega por lotes en la tabla de entregas
+    tracker = client.app.state.services.delivery_tracker
+    client.portal.call(tracker.flush)
+    assert client.portal.call(tracker.get, "wamid.out")["status"] == "delivered"
+
+
+async def test_receive_webhook_invalid_json(client: TestClient):
+    response = client.post(
+        f"{settings.API_V1_STR}/meta/webhook",
+        content=b'{"object": "whatsapp_business_account", "entry": [{"changes": [{"value": {"messages": [',
+        headers={"Content-Type": "application/json"},
+    )
+    assert response.status_code == 400
+
+
+async def test_receive_webhook_invalid_json_without_messages(client: TestClient):
+    response = client.post(
+        f"{settings.API_V1_STR}/meta/webhook",
+        content=b'{"object": "whatsapp_business_account", "entry": [{"changes": [{"value": {"statuses": [',
+        headers={"Content-Type": "application/json"},
+    )
+    assert response.status_code == 400 # El prefiltro no confirma un JSON mal formado
+    assert client.app.state.services.delivery_tracker.stats()["pending"] == 0
+
+
+async def test_malformed_status_does_not_drop_messages_of_the_same_payload(client: TestClient):
+    sample_payload = {
+        "object": "whatsapp_business_account",
+        "entry": [{"id": "WABA_ID", "changes": [{"field": "messages", "value": {
+            "messaging_product": "whatsapp",
+            "metadata": {"phone_number_id": settings.WHATSAPP_PHONE_NUMBER_ID},
+            "messages": [{"from": "1234567890", "id": "wamid.with_status", "timestamp": "1600000000",
+                          "text": {"body": "Hola con estado"}, "type": "text"}],
+            "statuses": [{"id": "wamid.out2", "status": "read"}, # Sin timestamp
+                         {"id": "wamid.out2", "status": "sent", "timestamp": "1600000001"}],
+        }}]}]
+    }
+    with patch.object(client.app.state.services.llm_service, 'generate_response', AsyncMock(return_value="Hola!")) as mock_llm_response, \
+         patch('app.services.meta_service.MetaService.send_whatsapp_message', AsyncMock()):
+        response = client.post(f"{settings.API_V1_STR}/meta/webhook", json=sample_payload)
+        assert response.status_code == 200
+        client.portal.call(client.app.state.services.webhook_dispatcher.join)
+        mock_llm_response.assert_called_once_with("Hola con estado", user_id="1234567890")
+
+    # El estado incompleto se descarta solo; el otro estado del mismo payload se registra
+    tracker = client.app.state.services.delivery_tracker
+    client.portal.call(tracker.flush)
+    assert client.portal.call(tracker.get, "wamid.out2")["status"] == "sent"
+    assert tracker.stats()["invalid"] == 1
+
+
+async def test_metrics_endpoint_exposes_stage_timings(client: TestClient):
+    sample_payload = {
+        "object": "whatsapp_business_account",
+        "entry": [{"id": "WABA_ID", "changes": [{"field": "messages", "value": {
+            "messaging_product": "whatsapp",
+            "metadata": {"phone_number_id": settings.WHATSAPP_PHONE_NUMBER_ID},
+            "messages": [{"from": "1234567890", "id": "wamid.metrics_id", "timestamp": "1600000000",
+                          "text": {"body": "Hola métricas"}, "type": "text"}]
+        }}]}]
+    }
+    with patch.object(client.app.state.services.llm_service, 'generate_response', AsyncMock(return_value="Hola!")), \
+         patch('app.services.meta_service.MetaService.send_whatsapp_message', AsyncMock()):
+        client.post(f"{settings.API_V1_STR}/meta/webhook", json=sample_payload)
+        client.portal.call(client.app.state.services.webhook_dispatcher.join)
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'chatbot_stage_duration_seconds_count{stage="webhook_parse"}' in response.text
+    assert 'chatbot_stage_duration_seconds_count{stage="queue_wait"}' in response.text
+    assert "chatbot_webhook_queue_processed" in response.text
+    assert "chatbot_http_pool_in_flight" in response.text
@@ -0,0 +1,99 @@
+import json
+import pytest
+from unittest.mock import AsyncMock, patch
+from app.services.broadcast import CampaignCheckpoint, checkpoint_path, iter_file_lines, parse_csv, parse_jsonl
+from app.services.meta_service import MetaService
+from app.services.outbound import SendResult
+
+# Marcar todos los tests en este módulo como asyncio
+pytestmark = pytest.mark.asyncio
+
+async def _lines(*lines):
+    for line in lines:
+        yield line
+
+async def _collect(iterator):
+    return [item async for item in iterator]
+
+async def test_iter_file_lines_reads_across_block_boundaries(tmp_path):
+    path = tmp_path / "recipients.jsonl"
+    path.write_bytes(("\n".join(f"línea {i}" for i in range(5000)) + "\r\n").encode("utf-8"))
+    with patch("app.services.broadcast.READ_BLOCK_SIZE", 1024):
+        lines = await _collect(iter_file_lines(str(path)))
+    assert len(lines) == 5000
+    assert lines[0] == "línea 0" and lines[-1] == "línea 4999"
+
+async def test_parse_jsonl_reports_invalid_rows():
+    recipients = await _collect(parse_jsonl(_lines(
+        '{"to": "56911111111", "text": "Hola"}',
+        '',
+        '{"to": "56922222222", "template": {"name": "promo", "language": {"code": "es_CL"}}}',
+        'no es json',
+        '{"text": "sin destinatario"}',
+    )))
+    assert [r.line for r in recipients] == [1, 3, 4, 5]
+    assert recipients[0].text == "Hola"
+    assert recipients[1].template.name == "promo" and recipients[1].template.language.code == "es_CL"
+    assert recipients[2].error.startswith("JSON inválido")
+    assert recipients[3].error == "Falta el destinatario 'to'"
+
+async def test_parse_csv_supports_text_and_templates(tmp_path):
+    path = tmp_path / "recipients.csv"
+    path.write_text('to,text,template,language\n56911111111,"Hola, ¿cómo estás?",,\n56922222222,,promo,en_US\n', encoding="utf-8")
+    recipients = await _collect(parse_csv(str(path)))
+    assert recipients[0].line == 2 and recipients[0].text == "Hola, ¿cómo estás?"
+    assert recipients[1].template.name == "promo" and recipients[1].template.language.code == "en_US"
+
+async def test_parse_csv_keeps_quoted_multiline_fields(tmp_path):
+    path = tmp_path / "recipients.csv"
+    path.write_text('to,text\r\n56911111111,"Hola:\r\nmañana abrimos a las 10."\r\n\r\n56922222222,Aviso\r\n', encoding="utf-8")
+    with patch("app.services.broadcast.CSV_ROWS_PER_READ", 1):
+        recipients = await _collect(parse_csv(str(path)))
+    assert [(r.line, r.to) for r in recipients] == [(2, "56911111111"), (5, "56922222222")]
+    assert recipients[0].text == "Hola:\r\nmañana abrimos a las 10."
+
+async def test_checkpoint_survives_reopen(tmp_path):
+    path = checkpoint_path(str(tmp_path / "checkpoints"), "campaña/../1")
+    assert path.endswith("campaña1.checkpoint")
+    checkpoint = CampaignCheckpoint(path)
+    checkpoint.mark_done(3)
+    checkpoint.close()
+    reopened = CampaignCheckpoint(path)
+    assert reopened.is_done(3) and not reopened.is_done(4)
+    reopened.mark_done(4)
+    reopened.mark_done(5)
+    await reopened.flush() # Una sola escritura para las dos filas
+    with open(path, encoding="utf-8") as f:
+        assert f.read().split() == ["3", "4", "5"]
+    reopened.close()
+
+async def test_send_bulk_bounds_concurrency_and_resumes(tmp_path):
+    service = MetaService(llm_service=AsyncMock(), outbound=AsyncMock())
+    in_flight = 0
+    max_seen = 0
+
+    async def fake_send(to, payload):
+        nonlocal in_flight, max_seen
+        in_flight += 1
+        max_seen = max(max_seen, in_flight)
+        try:
+            if to == "fallo":
+                return SendResult(status="dropped", attempts=4, status_code=503, error="503")
+            return SendResult(status="sent", attempts=1, status_code=200, response={"messages": [{"id": f"wamid.{to}"}]})
+        finally:
+            in_flight -= 1
+
+    rows = [json.dumps({"to": str(i), "text": "Aviso"}) for i in range(10)] + [json.dumps({"to": "fallo", "text": "Aviso"})]
+    checkpoint = CampaignCheckpoint(str(tmp_path / "c.checkpoint"))
+    with patch.object(service, "_send_payload", AsyncMock(side_effect=fake_send)) as mock_send:
+        outcomes = await _collect(service.send_bulk(parse_jsonl(_lines(*rows)), max_in_flight=3, checkpoint=checkpoint))
+        assert len(outcomes) == 11 and max_seen <= 3
+        assert sum(o["status"] == "sent" for o in outcomes) == 10
+        assert {o["message_id"] for o in outcomes if o["status"] == "sent"} == {f"wamid.{i}" for i in range(10)}
+
+        # Reanudar: solo se reintenta la fila que no quedó resuelta
+        mock_send.reset_mock()
+        outcomes = await _collect(service.send_bulk(parse_jsonl(_lines(*rows)), max_in_flight=3, checkpoint=checkpoint))
+        assert [o["line"] for o in outcomes] == [11]
+        assert mock_send.await_count == 1
+    checkpoint.close()
@@ -0,0 +1,65 @@
+import asyncio
+import pytest
+from app.services.conversation_scheduler import ConversationScheduler
+
+# Marcar todos los tests en este módulo como asyncio
+pytestmark = pytest.mark.asyncio
+
+async def test_same_user_is_processed_in_order():
+    handled = []
+
+    async def handler(key, items):
+        # El primer mensaje tarda más: si no hubiera orden por usuario, "2" terminaría antes
+        await asyncio.sleep(0.02 if items[0] == 1 else 0)
+        handled.extend(items)
+
+    scheduler = ConversationScheduler(handler=handler, max_concurrency=4)
+    futures = [scheduler.submit("user_a", n) for n in (1, 2, 3)]
+    await asyncio.gather(*futures)
+    assert handled == [1, 2, 3]
+
+async def test_different_users_run_in_parallel_up_to_cap():
+    running = 0
+    peak = 0
+
+    async def handler(key, items):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+
+    scheduler = ConversationScheduler(handler=handler, max_concurrency=2)
+    futures = [scheduler.submit(f"user_{i}", "hola") for i in range(5)]
+    await asyncio.gather(*futures)
+    assert peak == 2
+    assert scheduler.stats()["active_conversations"] == 0
+
+async def test_pending_messages_are_merged():
+    batches = []
+    first_started = asyncio.Event()
+    release = asyncio.Event()
+
+    async def handler(key, items):
+        batches.append(list(items))
+        first_started.set()
+        await release.wait()
+
+    scheduler = ConversationScheduler(handler=handler, max_concurrency=1, merge_pending=True, max_merge=5)
+    futures = [scheduler.submit("user_a", "hola")]
+    await first_started.wait()
+    # Estos llegan mientras se genera la primera respuesta
+    futures += [scheduler.submit("user_a", text) for text in ("¿estás?", "necesito ayuda")]
+    release.set()
+    await asyncio.gather(*futures)
+
+    assert batches == [["hola"], ["¿estás?", "necesito ayuda"]]
+    assert scheduler.stats()["merged_messages"] == 1
+
+async def test_handler_error_is_propagated_to_futures():
+    async def handler(key, items):
+        raise RuntimeError("fallo del LLM")
+
+    scheduler = ConversationScheduler(handler=handler)
+    with pytest.raises(RuntimeError):
+        await scheduler.submit("user_a", "hola")
@@ -0,0 +1,130 @@
+import pytest
+from unittest.mock import AsyncMock, patch
+from app.services.conversation_store import (
+    ConversationTurn,
+    InMemoryConversationStore,
+    SQLiteConversationStore,
+    pack_window,
+)
+from app.services.llm_service import LLMService
+from app.services.response_cache import ResponseCache
+from app.core.config import settings
+
+# Marcar todos los tests en este módulo como asyncio
+pytestmark = pytest.mark.asyncio
+
+async def test_window_keeps_most_recent_turns_within_budget():
+    turns = [ConversationTurn(role="user", content="x" * 40) for _ in range(5)] # 10 tokens cada uno
+    window = pack_window("", turns, token_budget=25)
+    assert len(window) == 2
+
+async def test_in_memory_store_returns_history_in_order():
+    store = InMemoryConversationStore()
+    await store.append("u1", "user", "Hola")
+    await store.append("u1", "assistant", "¡Hola! ¿En qué te ayudo?")
+    await store.append("u2", "user", "Otro usuario")
+
+    window = await store.get_window("u1", token_budget=100)
+    assert window == [
+        {"role": "user", "content": "Hola"},
+        {"role": "assistant", "content": "¡Hola! ¿En qué te ayudo?"},
+    ]
+    assert await store.get_window("desconocido", token_budget=100) == []
+
+async def test_in_memory_store_summarizes_evicted_turns_lazily():
+    store = InMemoryConversationStore(max_turns=3)
+    for text in ("Quiero un plan. Es para mi casa", "Tenemos tres planes", "El más barato", "Cuesta 10 mil", "Lo quiero"):
+        await store.append("u1", "user", text)
+
+    conversation = store._conversations["u1"]
+    assert conversation.summary == "" and len(conversation.pending_summary) == 2
+
+    window = await store.get_window("u1", token_budget=500)
+    assert window[0]["role"] == "system"
+    assert "Quiero un plan" in window[0]["content"]
+    assert "Tenemos tres planes" in window[0]["content"]
+    assert [m["content"] for m in window[1:]] == ["El más barato", "Cuesta 10 mil", "Lo quiero"]
+    assert conversation.pending_summary == []
+
+async def test_in_memory_store_evicts_least_recently_used_conversation():
+    store = InMemoryConversationStore(max_conversations=2)
+    await store.append("u1", "user", "a")
+    await store.append("u2", "user", "b")
+    await store.get_window("u1", token_budget=10) # u1 pasa a ser el más reciente
+    await store.append("u3", "user", "c")
+    assert len(store) == 2
+    assert await store.get_window("u2", token_budget=10) == []
+
+async def test_in_memory_store_clips_turns_and_bounds_conversation_bytes():
+    store = InMemoryConversationStore(max_turn_chars=100, max_bytes=250)
+    await store.append("u1", "user", "a" * 1000)
+    conversation = store._conversations["u1"]
+    assert conversation.turns[-1].content == "a" * 99 + "…"
+
+    for text in ("b" * 90, "c" * 90):
+        await store.append("u1", "user", text)
+    assert [turn.content[0] for turn in conversation.turns] == ["b", "c"] # El primero ya no cabía
+    assert conversation.size == 180 and conversation.pending_summary == []
+    assert conversation.summary.startswith("Usuario: aaa")
+
+async def test_sqlite_store_bounds_conversation_bytes(tmp_path):
+    store = SQLiteConversationStore(path=str(tmp_path / "conversations.sqlite3"), max_turn_chars=100, max_bytes=250)
+    for text in ("a" * 1000, "b" * 90, "c" * 90):
+        await store.append("u1", "user", text)
+    window = await store.get_window("u1", token_budget=500)
+    assert window[0]["role"] == "system" and "aaa" in window[0]["content"]
+    assert [m["content"] for m in window[1:]] == ["b" * 90, "c" * 90]
+    await store.close()
+
+async def test_sqlite_store_persists_and_bounds_turns(tmp_path):
+    path = str(tmp_path / "conversations.sqlite3")
+    store = SQLiteConversationStore(path=path, max_turns=2)
+    for text in ("Primera pregunta", "Primera respuesta", "Segunda pregunta"):
+        await store.append("u1", "user", text)
+    await store.close()
+
+    reopened = SQLiteConversationStore(path=path, max_turns=2)
+    window = await reopened.get_window("u1", token_budget=500)
+    assert "Primera pregunta" in window[0]["content"] # Plegada en el resumen
+    assert [m["content"] for m in window[1:]] == ["Primera respuesta", "Segunda pregunta"]
+    await reopened.close()
+
+async def test_llm_service_sends_history_and_records_turns():
+    store = InMemoryConversationStore()
+    llm_service_instance = LLMService(api_key=settings.GROQ_API_KEY, conversation_store=store)
+    mock_groq_client = AsyncMock()
+    mock_chat_completion = AsyncMock()
+    mock_chat_completion.choices = [AsyncMock()]
+    mock_chat_completion.choices[0].message.content = "Respuesta"
+    mock_groq_client.chat.completions.create = AsyncMock(return_value=mock_chat_completion)
+
+    with patch.object(llm_service_instance, 'client', mock_groq_client):
+        await llm_service_instance.generate_response("Primera", "u1")
+        await llm_service_instance.generate_response("Segunda", "u1")
+
+    messages = mock_groq_client.chat.completions.create.call_args[1]["messages"]
+    assert [m["role"] for m in messages] == ["system", "user", "assistant", "user"]
+    assert messages[1]["content"] == "Primera"
+    assert messages[-1]["content"] == "Usuario: Segunda"
+
+async def test_follow_ups_are_answered_from_each_users_own_context():
+    store = InMemoryConversationStore()
+    await store.append("u1", "user", "¿Tienen el plan básico?")
+    await store.append("u2", "user", "¿Tienen el plan premium?")
+    llm_service_instance = LLMService(api_key=settings.GROQ_API_KEY, conversation_store=store, response_cache=ResponseCache())
+
+    async def create(messages, **kwargs):
+        completion = AsyncMock()
+        completion.choices = [AsyncMock()]
+        completion.choices[0].message.content = f"Respuesta para: {messages[1]['content']}"
+        return completion
+
+    mock_groq_client = AsyncMock()
+    mock_groq_client.chat.completions.create = AsyncMock(side_effect=create)
+    with patch.object(llm_service_instance, 'client', mock_groq_client):
+        first = await llm_service_instance.generate_response("y cuánto cuesta?", "u1")
+        second = await llm_service_instance.generate_response("y cuánto cuesta?", "u2")
+
+    assert first == "Respuesta para: ¿Tienen el plan básico?"
+    assert second == "Respuesta para: ¿Tienen el plan premium?" # No la respuesta cacheada para u1
+    assert mock_groq_client.chat.completions.create.await_count == 2
@@ -0,0 +1,43 @@
+import asyncio
+import pytest
+from app.services.dedup import InMemoryDedupBackend, MessageDeduplicator, SQLiteDedupBackend
+
+# Marcar todos los tests en este módulo como asyncio
+pytestmark = pytest.mark.asyncio
+
+async def test_in_memory_backend_detects_duplicates_and_counts():
+    deduplicator = MessageDeduplicator(InMemoryDedupBackend())
+    assert not await deduplicator.is_duplicate("wamid.1")
+    assert await deduplicator.is_duplicate("wamid.1")
+    assert not await deduplicator.is_duplicate("wamid.2")
+    assert deduplicator.stats() == {"hits": 1, "misses": 2}
+
+async def test_in_memory_backend_is_bounded_lru():
+    backend = InMemoryDedupBackend(max_entries=2)
+    for key in ("a", "b", "c"):
+        await backend.check_and_mark(key)
+    assert len(backend) == 2
+    assert not await backend.check_and_mark("a") # "a" fue desalojada
+
+async def test_in_memory_backend_expires_entries():
+    backend = InMemoryDedupBackend(ttl_seconds=0.01)
+    await backend.check_and_mark("a")
+    await asyncio.sleep(0.02)
+    assert not await backend.check_and_mark("a")
+
+async def test_sqlite_backend_is_shared_between_instances(tmp_path):
+    path = str(tmp_path / "dedup.sqlite3")
+    replica_a = SQLiteDedupBackend(path=path)
+    replica_b = SQLiteDedupBackend(path=path)
+
+    assert not await replica_a.check_and_mark("wamid.1")
+    assert await replica_b.check_and_mark("wamid.1")
+
+    await replica_a.close()
+    await replica_b.close()
+
+async def test_sqlite_backend_expires_entries(tmp_path):
+    backend = SQLiteDedupBackend(path=str(tmp_path / "dedup.sqlite3"), ttl_seconds=0)
+    assert not await backend.check_and_mark("wamid.1")
+    assert not await backend.check_and_mark("wamid.1")
+    await backend.close()
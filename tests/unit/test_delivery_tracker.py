@@ -0,0 +1,67 @@
+import json
+import pytest
+from app.services.delivery_tracker import DeliveryTracker
+
+# Marcar todos los tests en este módulo como asyncio
+pytestmark = pytest.mark.asyncio
+
+def _status_payload(*statuses) -> bytes:
+    return json.dumps({
+        "object": "whatsapp_business_account",
+        "entry": [{"id": "WABA_ID", "changes": [{"field": "messages", "value": {
+            "messaging_product": "whatsapp",
+            "metadata": {"phone_number_id": "123"},
+            "statuses": [
+                {"id": message_id, "status": status, "timestamp": str(timestamp), "recipient_id": "5691234",
+                 "conversation": {"id": "CONV"}, "pricing": {"billable": True}}
+                for message_id, status, timestamp in statuses
+            ],
+        }}]}],
+    }).encode()
+
+async def test_statuses_are_aggregated_per_message_in_any_order():
+    tracker = DeliveryTracker(flush_interval=3600)
+    tracker.submit(_status_payload(("wamid.1", "read", 1030)))
+    tracker.submit(_status_payload(("wamid.1", "sent", 1000), ("wamid.1", "delivered", 1002)))
+    tracker.submit(_status_payload(("wamid.2", "failed", 1005)))
+    assert tracker.stats()["pending"] == 3 # Nada se procesa dentro de la petición
+    await tracker.flush()
+
+    state = await tracker.get("wamid.1")
+    assert state["status"] == "read" # Un `sent` atrasado no hace retroceder el estado
+    assert (state["sent_at"], state["delivered_at"], state["read_at"]) == (1000, 1002, 1030)
+    stats = tracker.stats()
+    assert stats["tracked"] == 2 and stats["statuses"] == 4 and stats["batches"] == 1
+    assert stats["status_failed"] == 1
+    assert tracker.latency.labels("delivered").count == 1 and tracker.latency.labels("read").count == 1
+    assert 1.0 < stats["delivered_latency_p50_seconds"] <= 2.0
+    assert 10.0 < stats["read_latency_p50_seconds"] <= 30.0
+    await tracker.close()
+
+async def test_invalid_payloads_are_counted_and_pending_is_bounded():
+    tracker = DeliveryTracker(flush_interval=3600, max_pending=2)
+    tracker.submit(b'{"entry": [{"changes": [{"value": {"statuses": [{"id": 1}]}}]}]}')
+    tracker.submit(_status_payload(("wamid.1", "sent", 1000)))
+    tracker.submit(_status_payload(("wamid.2", "sent", 1000)))
+    assert tracker.stats()["dropped"] == 1 # Se descartó el más antiguo (el inválido)
+    await tracker.flush()
+    assert tracker.stats()["tracked"] == 2 and tracker.stats()["invalid"] == 0
+    await tracker.close()
+
+async def test_batch_flush_persists_to_sqlite_and_merges_after_eviction(tmp_path):
+    path = str(tmp_path / "delivery.sqlite3")
+    tracker = DeliveryTracker(flush_interval=3600, max_entries=1, sqlite_path=path)
+    tracker.submit(_status_payload(("wamid.1", "sent", 1000), ("wamid.1", "delivered", 1001)))
+    await tracker.flush()
+    # wamid.2 desaloja a wamid.1 de memoria; el `read` tardío crea una fila parcial que se fusiona en disco
+    tracker.submit(_status_payload(("wamid.2", "sent", 1003), ("wamid.1", "read", 1060)))
+    await tracker.flush()
+    assert tracker.stats()["persisted"] == 3 # Una fila por mensaje modificado en cada lote
+    await tracker.close()
+
+    reopened = DeliveryTracker(sqlite_path=path)
+    state = await reopened.get("wamid.1")
+    assert state["status"] == "read"
+    assert (state["sent_at"], state["delivered_at"], state["read_at"]) == (1000, 1001, 1060)
+    assert (await reopened.get("wamid.2"))["status"] == "sent"
+    await reopened.close()
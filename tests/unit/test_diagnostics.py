@@ -0,0 +1,66 @@
+import asyncio
+import time
+import pytest
+from app.core.diagnostics import LoopDiagnostics
+
+# Marcar todos los tests en este módulo como asyncio
+pytestmark = pytest.mark.asyncio
+
+def blocking_render(seconds: float) -> None:
+    """Trabajo síncrono que bloquea el loop (como un dump grande o un log síncrono)."""
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+async def _block_later(seconds: float) -> None:
+    await asyncio.sleep(0.05)
+    blocking_render(seconds)
+
+async def test_sampling_profiler_attributes_samples_to_the_blocking_function():
+    diagnostics = LoopDiagnostics()
+    blocker = asyncio.create_task(_block_later(0.2))
+    profiler = await diagnostics.profile(0.4, interval=0.002)
+    await blocker
+
+    assert profiler.sample_count > 0 and not diagnostics.profiling
+    blocking = sum(count for stack, count in profiler.samples.items() if stack.endswith("test_diagnostics:blocking_render"))
+    assert blocking >= 10 # ~0.2 s de 0.4 s muestreados cada 2 ms (el loop ocioso cuenta el resto)
+    line = profiler.collapsed().splitlines()[0]
+    stack, count = line.rsplit(" ", 1)
+    assert ";" in stack and int(count) > 0 # Formato "raíz;...;hoja N"
+    assert profiler.top_functions()[0]["own"] >= profiler.top_functions()[-1]["own"]
+
+async def test_stall_watchdog_records_duration_and_offending_stack():
+    diagnostics = LoopDiagnostics()
+    await diagnostics.enable_stall_detection(threshold=0.05)
+    await asyncio.sleep(0.06)
+    blocking_render(0.25)
+    await asyncio.sleep(0.06) # El latido vuelve a correr y registra el bloqueo
+    report = diagnostics.watchdog.report()
+    await diagnostics.disable_stall_detection()
+
+    assert report["stalls"] >= 1
+    stall = max(report["records"], key=lambda record: record["duration_ms"])
+    assert stall["duration_ms"] >= 200
+    assert any("blocking_render" in frame for frame in stall["stack"])
+    assert diagnostics.watchdog is None and diagnostics.stats()["stalls"] == 0
+
+async def test_task_report_groups_pending_tasks_with_ages_only_while_tracking():
+    diagnostics = LoopDiagnostics()
+    loop = asyncio.get_running_loop()
+    untracked = asyncio.create_task(asyncio.sleep(10))
+    diagnostics.enable_task_tracking()
+    tracked = [asyncio.create_task(asyncio.Event().wait(), name=f"espera-{i}") for i in range(3)]
+    await asyncio.sleep(0.02)
+    report = diagnostics.tasks(limit=5)
+    diagnostics.disable_task_tracking()
+
+    assert loop.get_task_factory() is None # Sin rastro al desactivar
+    groups = {group["coroutine"]: group for group in report["by_coroutine"]}
+    assert groups["Event.wait"]["count"] == 3 and groups["Event.wait"]["oldest_seconds"] >= 0.02
+    assert groups["sleep"]["oldest_seconds"] is None # Creada antes de activar el registro
+    oldest = report["oldest"][0]
+    assert oldest["name"].startswith("espera-") and "Event.wait" in oldest["awaiting"]
+    for task in (untracked, *tracked):
+        task.cancel()
+    await asyncio.gather(untracked, *tracked, return_exceptions=True)
@@ -0,0 +1,93 @@
+import asyncio
+import contextlib
+import pytest
+import respx
+import httpx
+from app.utils.http_client import HttpClient
+
+# Marcar todos los tests en este módulo como asyncio
+pytestmark = pytest.mark.asyncio
+
+BASE_URL = "https://graph.example.test/v19.0/"
+
+async def test_client_is_reused_between_calls():
+    http_client = HttpClient(base_url=BASE_URL)
+    await http_client.start()
+    first_client = http_client.client
+
+    with respx.mock:
+        respx.post(f"{BASE_URL}123/messages").respond(json={"ok": True})
+        respx.get(f"{BASE_URL}me").respond(json={"id": "me"})
+        await http_client.post("123/messages", json={"a": 1})
+        await http_client.get("me")
+
+    # El mismo AsyncClient (y su pool) atiende todas las peticiones
+    assert http_client.client is first_client
+    await http_client.close()
+    assert http_client._client is None
+
+async def test_limits_and_timeouts_are_configured():
+    http_client = HttpClient(
+        base_url=BASE_URL,
+        max_connections=7,
+        max_keepalive_connections=3,
+        keepalive_expiry=12.5,
+        connect_timeout=1.0,
+        read_timeout=2.0,
+        write_timeout=3.0,
+        pool_timeout=4.0,
+    )
+    assert http_client.limits == httpx.Limits(max_connections=7, max_keepalive_connections=3, keepalive_expiry=12.5)
+    assert http_client.timeout == httpx.Timeout(connect=1.0, read=2.0, write=3.0, pool=4.0)
+
+async def test_pool_stats_when_closed():
+    http_client = HttpClient(base_url=BASE_URL, max_connections=2)
+    stats = http_client.pool_stats()
+    assert (stats["connections"], stats["in_use"], stats["idle"], stats["waiting"]) == (0, 0, 0, 0)
+
+async def _serve_keepalive(release: asyncio.Event):
+    """Servidor HTTP/1.1 mínimo con keep-alive; `/slow` responde cuando se activa `release`."""
+    async def handle(reader, writer):
+        while True:
+            head = await reader.readuntil(b"\r\n\r\n") if not reader.at_eof() else b""
+            if not head:
+                break
+            length = next((int(line.split(b":")[1]) for line in head.split(b"\r\n") if line.lower().startswith(b"content-length")), 0)
+            await reader.readexactly(length)
+            if b" /slow " in head.split(b"\r\n")[0]:
+                await release.wait()
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok")
+            await writer.drain()
+        writer.close()
+
+    async def safe_handle(reader, writer):
+        with contextlib.suppress(asyncio.IncompleteReadError, ConnectionError):
+            await handle(reader, writer)
+
+    return await asyncio.start_server(safe_handle, "127.0.0.1", 0)
+
+async def test_pool_stats_report_connections_in_use_idle_and_waiting():
+    release = asyncio.Event()
+    server = await _serve_keepalive(release)
+    port = server.sockets[0].getsockname()[1]
+    http_client = HttpClient(base_url=f"http://127.0.0.1:{port}/", max_connections=2, max_keepalive_connections=2)
+
+    sends = [asyncio.create_task(http_client.post("slow", json={"n": n})) for n in range(3)]
+    while http_client.pool_stats()["connections"] < 2:
+        await asyncio.sleep(0.01)
+    stats = http_client.pool_stats()
+    assert (stats["connections"], stats["in_use"], stats["idle"], stats["waiting"]) == (2, 2, 0, 1)
+
+    release.set()
+    await asyncio.gather(*sends)
+    stats = http_client.pool_stats()
+    assert (stats["connections"], stats["in_use"], stats["idle"], stats["waiting"]) == (2, 0, 2, 0) # Keep-alive
+    async with http_client.stream("GET", "media") as response:
+        assert await response.aread() == b"ok"
+        assert http_client.pool_stats()["idle"] == 1 # Un stream ocupa su conexión hasta que se cierra
+    assert http_client.pool_stats()["connections_opened"] == 2 and http_client.pool_stats()["requests"] == 4
+
+    await http_client.close()
+    assert http_client.pool_stats()["connections"] == 0
+    server.close()
+    await server.wait_closed()
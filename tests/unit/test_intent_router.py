@@ -0,0 +1,88 @@
+import json
+import os
+import re
+import pytest
+from unittest.mock import AsyncMock
+from app.models.meta import MetaMessage
+from app.services.intent_router import IntentMatcher, IntentRouter, IntentRule, _trie_pattern, parse_rules
+from app.services.meta_service import MetaService
+
+# Marcar todos los tests en este módulo como asyncio
+pytestmark = pytest.mark.asyncio
+
+RULES = [
+    IntentRule(name="saludo", responses=["¡Hola!", "¡Hola de nuevo!"], keywords=["hola", "buenas"], phrases=["buenos días"], max_words=4),
+    IntentRule(name="gracias", responses=["¡De nada!"], keywords=["gracias"]),
+    IntentRule(name="horario", responses=["De 9 a 19."], keywords=["horario"], patterns=[r"\babren\b.*\bsabado\b"], priority=10),
+]
+
+def _write_rules(path, intents, mtime):
+    path.write_text(json.dumps({"intents": intents}), encoding="utf-8")
+    os.utime(path, (mtime, mtime)) # mtime explícito: dos escrituras seguidas pueden compartir el mismo
+
+def _text(body: str) -> MetaMessage:
+    return MetaMessage.model_validate({"from": "5691234", "id": "wamid.1", "timestamp": "1600000000", "type": "text", "text": {"body": body}})
+
+async def test_matcher_answers_frequent_intents_and_lets_the_rest_through():
+    matcher = IntentMatcher(RULES)
+    assert matcher.match("¡Hola!")[1] == "¡Hola!"
+    assert matcher.match("Buenos Días")[1] == "¡Hola de nuevo!" # Variantes alternadas; sin tildes ni mayúsculas
+    assert matcher.match("¿A qué hora abren el sábado?")[0].name == "horario" # Regex
+    assert matcher.match("hola, ¿cuál es el horario?")[0].name == "horario" # Gana la de mayor prioridad
+    assert matcher.match("Saludos desde Holanda") is None # Solo palabras completas
+    assert matcher.match("hola, quiero cambiar la dirección de mi pedido") is None # Más de max_words
+    assert matcher.match("") is None
+
+async def test_anchored_intents_need_the_whole_message():
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    with open(os.path.join(root, "intents.example.json"), encoding="utf-8") as rules_file:
+        matcher = IntentMatcher(parse_rules(json.load(rules_file)))
+    assert matcher.match("¡Muchas gracias!")[0].name == "agradecimiento"
+    assert matcher.match("¿Cuál es el horario?")[0].name == "horario"
+    assert matcher.match("hola, ¿cuál es el horario de atención?")[0].name == "horario"
+    assert matcher.match("¿A qué hora abren hoy?")[0].name == "horario"
+    assert matcher.match("gracias pero no me sirve") is None
+    assert matcher.match("¿Cuál es el horario de devoluciones?") is None
+    assert matcher.match("hola, necesito ayuda") is None
+
+async def test_unanchored_intents_match_anywhere():
+    matcher = IntentMatcher([IntentRule(name="gracias", responses=["¡De nada!"], keywords=["gracias"])])
+    assert matcher.match("gracias pero no me sirve")[0].name == "gracias"
+
+async def test_trie_pattern_matches_exactly_the_literals():
+    literals = ["hola", "holas", "hora", "horario", "buenas", "buenos dias"]
+    pattern = re.compile(fr"(?:{_trie_pattern(literals)})\Z")
+    assert all(pattern.match(literal) for literal in literals)
+    assert not any(pattern.match(text) for text in ("hol", "horari", "buenos", "holass"))
+
+async def test_rules_are_hot_reloaded_and_invalid_files_keep_the_previous_ones(tmp_path):
+    path = tmp_path / "intents.json"
+    _write_rules(path, [{"name": "saludo", "keywords": ["hola"], "response": "¡Hola!"}], 1_000_000)
+    router = IntentRouter(path=str(path), reload_interval=0)
+    assert await router.route("hola") == "¡Hola!"
+    assert await router.route("chao") is None
+
+    _write_rules(path, [{"name": "despedida", "keywords": ["chao"], "response": "¡Chao!"}], 1_000_010)
+    assert await router.route("chao") == "¡Chao!"
+    assert await router.route("hola") is None
+
+    path.write_text("{no es json", encoding="utf-8")
+    os.utime(path, (1_000_020, 1_000_020))
+    assert await router.route("chao") == "¡Chao!"
+    stats = router.stats()
+    assert stats["reloads"] == 1 and stats["reload_errors"] == 1
+    assert stats["hits_despedida"] == 2 and stats["checked"] == 5 and stats["matched"] == 3
+
+async def test_matched_intents_skip_the_llm():
+    llm_service = AsyncMock()
+    llm_service.generate_response = AsyncMock(return_value="Respuesta del LLM")
+    service = MetaService(llm_service=llm_service, outbound=AsyncMock(), intents=IntentRouter(rules=RULES))
+    service.send_whatsapp_message = AsyncMock()
+
+    await service._reply_to_conversation("5691234", [_text("¡Muchas gracias!")])
+    llm_service.generate_response.assert_not_awaited()
+    service.send_whatsapp_message.assert_awaited_once_with("5691234", "¡De nada!")
+
+    await service._reply_to_conversation("5691234", [_text("¿Tienen sucursal en Valparaíso?")])
+    llm_service.generate_response.assert_awaited_once_with("¿Tienen sucursal en Valparaíso?", user_id="5691234")
+    assert service.intents.stats()["hits_gracias"] == 1
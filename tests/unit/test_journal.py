@@ -0,0 +1,168 @@
+import asyncio
+import json
+import pytest
+from unittest.mock import AsyncMock
+from app.core.config import settings
+from app.core.container import ServiceContainer
+from app.models.meta import MetaWebhookRequest
+from app.services.journal import INBOUND, OUTBOUND, Journal, JournaledWebhook, JournalLocked, list_segments, read_journal, segment_path
+
+# Marcar todos los tests en este módulo como asyncio
+pytestmark = pytest.mark.asyncio
+
+WEBHOOK = json.dumps({
+    "object": "whatsapp_business_account",
+    "entry": [{"id": "WABA_ID", "changes": [{"field": "messages", "value": {
+        "messaging_product": "whatsapp",
+        "metadata": {"phone_number_id": "123"},
+        "messages": [{"from": "5691234", "id": "wamid.lost", "timestamp": "1600000000",
+                      "text": {"body": "¿Siguen abiertos?"}, "type": "text"}],
+    }}]}],
+})
+
+async def test_concurrent_appends_share_one_fsync_per_batch(tmp_path):
+    journal = Journal(str(tmp_path), commit_interval=0.01)
+    seqs = await asyncio.gather(*(journal.append(INBOUND, f"payload {i}") for i in range(50)))
+    assert sorted(seqs) == list(range(1, 51))
+    stats = journal.stats()
+    assert stats["batches"] <= 2 and stats["fsyncs"] == stats["batches"] # No un fsync por mensaje
+    await journal.close()
+    assert [entry.data for entry in read_journal(str(tmp_path))] == [f"payload {i}" for i in range(50)]
+
+async def test_unfinished_entries_are_recovered_after_a_crash(tmp_path):
+    journal = Journal(str(tmp_path))
+    done = await journal.append(INBOUND, "respondido")
+    lost = await journal.append(INBOUND, "sin responder")
+    journal.complete(done)
+    await journal.close()
+    # Caída a mitad de una escritura: la última línea queda cortada
+    with open(segment_path(str(tmp_path), list_segments(str(tmp_path))[-1]), "ab") as segment:
+        segment.write(b'{"s":3,"k":"inbound","d":"cor')
+
+    reopened = Journal(str(tmp_path))
+    await reopened.open()
+    assert [(entry.seq, entry.data) for entry in reopened.take_recovered()] == [(lost, "sin responder")]
+    assert await reopened.append(INBOUND, "nuevo") == 3 # El registro cortado nunca se confirmó: su id se reutiliza
+    await reopened.close()
+
+async def test_segments_rotate_and_completed_ones_are_compacted(tmp_path):
+    journal = Journal(str(tmp_path), segment_max_bytes=200, commit_interval=0, retain_segments=1)
+    pinned = await journal.append(INBOUND, "x" * 150) # Sigue abierta: se copia adelante para liberar su segmento
+    for i in range(20):
+        seq = await journal.append(OUTBOUND, {"to": "5691234", "n": i})
+        journal.complete(seq)
+    await journal.close()
+
+    segments = list_segments(str(tmp_path))
+    assert journal.stats()["segments_removed"] > 0
+    assert segments[0] > 1 and len(segments) <= 3 # Una entrada abierta no retiene el log
+    assert journal.stats()["forwarded"] > 0
+    reopened = Journal(str(tmp_path))
+    await reopened.open()
+    assert [entry.seq for entry in reopened.take_recovered()] == [pinned]
+    await reopened.close()
+
+async def test_compaction_keeps_the_closing_records_of_live_entries(tmp_path):
+    journal = Journal(str(tmp_path), segment_max_bytes=300, commit_interval=0, retain_segments=0)
+    pinned, answered = await asyncio.gather(journal.append(INBOUND, "x" * 150), journal.append(INBOUND, "y" * 150))
+    journal.complete(answered) # Su cierre queda en el segmento siguiente, no en el de la entrada
+    for i in range(10):
+        seq = await journal.append(OUTBOUND, {"to": "5691234", "n": i, "pad": "z" * 200})
+        journal.complete(seq)
+    await journal.close()
+    assert journal.stats()["segments_removed"] > 0
+
+    reopened = Journal(str(tmp_path))
+    await reopened.open()
+    assert [entry.seq for entry in reopened.take_recovered()] == [pinned] # `answered` no se reenvía
+    await reopened.close()
+
+async def test_dropped_webhooks_close_their_journal_entry(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "JOURNAL_ENABLED", True)
+    monkeypatch.setattr(settings, "JOURNAL_DIR", str(tmp_path))
+    services = ServiceContainer(settings)
+    entry_id = await services.journal.append(INBOUND, WEBHOOK)
+    services._drop_webhook(JournaledWebhook(MetaWebhookRequest.model_validate_json(WEBHOOK), entry_id))
+    await services.close()
+
+    restarted = Journal(str(tmp_path))
+    await restarted.open()
+    assert restarted.take_recovered() == [] # Descartado por 'drop_oldest': no se responde horas después
+    await restarted.close()
+
+async def test_container_replays_unfinished_webhooks_on_start(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "JOURNAL_ENABLED", True)
+    monkeypatch.setattr(settings, "JOURNAL_DIR", str(tmp_path))
+    previous = Journal(str(tmp_path))
+    await previous.append(INBOUND, WEBHOOK)
+    await previous.close()
+
+    services = ServiceContainer(settings)
+    process = AsyncMock(side_effect=lambda *args, **kwargs: asyncio.gather())
+    services.meta_service.submit_webhook_message = process
+    await services.start(warm_up=False)
+    await services._replay_task
+    await services.webhook_dispatcher.join()
+    await services.close()
+
+    (payload,), options = process.await_args
+    assert payload.entry[0].changes[0].value.messages[0].id == "wamid.lost"
+    assert options == {"skip_dedup": True} # El id quedó marcado por la ejecución que se cayó
+    restarted = Journal(str(tmp_path))
+    await restarted.open()
+    assert restarted.take_recovered() == [] # Respondido: no se vuelve a reenviar
+    await restarted.close()
+
+async def test_slow_conversations_do_not_hold_webhook_workers(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "JOURNAL_ENABLED", True)
+    monkeypatch.setattr(settings, "JOURNAL_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "WEBHOOK_WORKERS", 1)
+    services = ServiceContainer(settings)
+    release = asyncio.Event()
+
+    async def generate_response(text, user_id):
+        if user_id == "5691234":
+            await release.wait() # Conversación lenta (p. ej. un usuario con muchos mensajes)
+        return "respuesta"
+
+    answered = asyncio.Event()
+    services.llm_service.generate_response = generate_response
+    services.meta_service.send_whatsapp_message = AsyncMock(side_effect=lambda to, text: answered.set() if to == "5697777" else None)
+    await services.start(warm_up=False)
+
+    slow = json.loads(WEBHOOK)
+    fast = json.loads(WEBHOOK.replace("5691234", "5697777").replace("wamid.lost", "wamid.fast"))
+    entries = []
+    for raw in (slow, fast):
+        entry_id = await services.journal.append(INBOUND, json.dumps(raw))
+        entries.append(entry_id)
+        assert services.webhook_dispatcher.submit(JournaledWebhook(MetaWebhookRequest.model_validate(raw), entry_id))
+
+    # Con un solo worker, el segundo usuario se responde aunque el primero no haya terminado
+    await asyncio.wait_for(answered.wait(), timeout=1)
+    assert services.webhook_dispatcher.stats()["in_progress"] == 1
+    assert services.journal.stats()["completed"] == 1 # Solo se cerró la entrada de la conversación rápida
+
+    release.set()
+    await services.webhook_dispatcher.join()
+    assert services.journal.stats()["completed"] == 2
+    await services.close()
+
+async def test_each_worker_claims_its_own_journal_directory(tmp_path):
+    first, second = Journal(str(tmp_path), slots=2), Journal(str(tmp_path), slots=2)
+    await first.open()
+    await second.open()
+    assert (first.directory, second.directory) == (str(tmp_path / "worker-0"), str(tmp_path / "worker-1"))
+    pending = await first.append(INBOUND, "sin responder")
+    await second.append(INBOUND, "de otro worker")
+    with pytest.raises(JournalLocked): # Todos los slots tomados
+        await Journal(str(tmp_path), slots=2).open()
+    await first.close()
+
+    # El worker que reemplaza al primero toma su slot y solo reenvía las entradas de ese slot
+    restarted = Journal(str(tmp_path), slots=2)
+    await restarted.open()
+    assert restarted.directory == str(tmp_path / "worker-0")
+    assert [entry.seq for entry in restarted.take_recovered()] == [pending]
+    await restarted.close()
+    await second.close()
@@ -0,0 +1,160 @@
+import asyncio
+import pytest
+from types import SimpleNamespace
+from unittest.mock import patch, AsyncMock
+from app.services.llm_coalescing import CoalescingCompletions, FairLimiter, SingleFlight, completion_key
+from app.services.llm_service import LLMService, FALLBACK_REPLY
+from app.core.config import settings
+
+# Marcar todos los tests en este módulo como asyncio
+pytestmark = pytest.mark.asyncio
+
+class FakeGroqCompletions:
+    """Imita `client.chat.completions` con una latencia fija y registro de concurrencia."""
+    def __init__(self, latency: float = 0.05, fail: bool = False):
+        self.latency = latency
+        self.fail = fail
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def create(self, messages, model, **options):
+        self.calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+            if self.fail:
+                raise RuntimeError("Groq no disponible")
+            answer = f"Respuesta a: {messages[-1]['content']}"
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=answer))])
+        finally:
+            self.in_flight -= 1
+
+def _service(fake: FakeGroqCompletions, **kwargs) -> LLMService:
+    service = LLMService(api_key=settings.GROQ_API_KEY, **kwargs)
+    service.client = SimpleNamespace(chat=SimpleNamespace(completions=fake))
+    return service
+
+async def test_identical_concurrent_prompts_share_one_call():
+    fake = FakeGroqCompletions()
+    service = _service(fake)
+    with patch.object(service.rag_service, 'search_knowledge_base', AsyncMock(return_value=[])):
+        replies = await asyncio.gather(*(
+            service.generate_response(prompt, f"user_{i}")
+            for i, prompt in enumerate(["¿Cuál es el horario?", "cual es el horario", "¿CUÁL ES EL HORARIO?"] * 5)
+        ))
+    assert fake.calls == 1
+    assert len(set(replies)) == 1
+    stats = service.stats()
+    assert stats["issued"] == 1 and stats["coalesced"] == 14
+
+async def test_different_prompts_are_not_coalesced_and_respect_limit():
+    fake = FakeGroqCompletions(latency=0.02)
+    service = _service(fake, max_concurrency=3)
+    with patch.object(service.rag_service, 'search_knowledge_base', AsyncMock(return_value=[])):
+        replies = await asyncio.gather(*(service.generate_response(f"Pregunta {i}", "u") for i in range(10)))
+    assert fake.calls == 10 and fake.max_in_flight == 3
+    assert replies[4] == "Respuesta a: Usuario: Pregunta 4"
+    stats = service.stats()
+    assert stats["issued"] == 10 and stats["coalesced"] == 0 and stats["in_flight"] == 0
+
+async def test_coalesced_callers_all_get_fallback_on_error():
+    fake = FakeGroqCompletions(fail=True)
+    service = _service(fake)
+    with patch.object(service.rag_service, 'search_knowledge_base', AsyncMock(return_value=[])):
+        replies = await asyncio.gather(*(service.generate_response("Hola", f"user_{i}") for i in range(4)))
+    assert replies == [FALLBACK_REPLY] * 4 and fake.calls == 1
+
+async def test_coalescing_can_be_disabled():
+    fake = FakeGroqCompletions(latency=0.01)
+    service = _service(fake, coalesce=False)
+    with patch.object(service.rag_service, 'search_knowledge_base', AsyncMock(return_value=[])):
+        await asyncio.gather(*(service.generate_response("Hola", f"user_{i}") for i in range(4)))
+    assert fake.calls == 4 and service.stats()["issued"] == 4
+
+async def test_fair_limiter_serves_waiters_in_arrival_order():
+    limiter = FairLimiter(1)
+    order = []
+
+    async def worker(name):
+        async with limiter:
+            order.append(name)
+            await asyncio.sleep(0.001)
+
+    await limiter.acquire()
+    tasks = [asyncio.create_task(worker(i)) for i in range(5)]
+    await asyncio.sleep(0)
+    assert limiter.waiting == 5
+    limiter.release()
+    await asyncio.gather(*tasks)
+    assert order == [0, 1, 2, 3, 4]
+    assert limiter.active == 0 and limiter.waiting == 0
+
+async def test_fair_limiter_cancelled_waiter_does_not_leak_slot():
+    limiter = FairLimiter(1)
+    await limiter.acquire()
+    waiter = asyncio.create_task(limiter.acquire())
+    await asyncio.sleep(0)
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+    limiter.release()
+    assert limiter.active == 0 and limiter.waiting == 0
+
+async def test_cancelling_one_caller_does_not_cancel_shared_call():
+    single_flight = SingleFlight()
+    started = asyncio.Event()
+
+    async def slow():
+        started.set()
+        await asyncio.sleep(0.02)
+        return "ok"
+
+    first = asyncio.create_task(single_flight.do("k", slow))
+    await started.wait()
+    second = asyncio.create_task(single_flight.do("k", slow))
+    await asyncio.sleep(0)
+    first.cancel()
+    assert await second == "ok"
+    assert len(single_flight) == 0
+
+async def test_cancelling_the_only_caller_cancels_the_call():
+    single_flight = SingleFlight()
+    cancelled = asyncio.Event()
+
+    async def slow():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    caller = asyncio.create_task(single_flight.do("k", slow))
+    await asyncio.sleep(0)
+    caller.cancel()
+    await asyncio.wait_for(cancelled.wait(), timeout=1)
+    await asyncio.sleep(0)
+    assert len(single_flight) == 0
+
+async def test_completion_key_includes_model_and_options():
+    messages = [{"role": "user", "content": "Hola"}]
+    assert completion_key("a", messages) == completion_key("a", [{"role": "user", "content": "¡hola!"}])
+    assert completion_key("a", messages) != completion_key("b", messages)
+    assert completion_key("a", messages, temperature=0) != completion_key("a", messages, temperature=1)
+
+async def test_streams_hold_a_limiter_slot_until_consumed():
+    completions = CoalescingCompletions(max_concurrency=1)
+
+    async def chunks():
+        yield "a"
+        yield "b"
+
+    async def create_fn(**kwargs):
+        return chunks()
+
+    stream = completions.stream(create_fn, messages=[], model="m")
+    assert await stream.__anext__() == "a"
+    assert completions.limiter.active == 1
+    assert [chunk async for chunk in stream] == ["b"]
+    assert completions.limiter.active == 0
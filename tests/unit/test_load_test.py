@@ -0,0 +1,19 @@
+import pytest
+from benchmarks.load_test import compare_to_baseline, parse_mix, percentiles
+
+def test_percentiles_nearest_rank():
+    stats = percentiles([float(i) for i in range(1, 101)])
+    assert stats["p50"] == 50 and stats["p95"] == 95 and stats["p99"] == 99 and stats["max"] == 100
+    assert percentiles([])["count"] == 0
+
+def test_parse_mix_rejects_unknown_scenarios():
+    assert parse_mix("text=0.7, status=0.3") == {"text": 0.7, "status": 0.3}
+    with pytest.raises(ValueError):
+        parse_mix("audio=1")
+
+def test_compare_to_baseline_flags_only_regressions_beyond_tolerance():
+    baseline = {"throughput": {"replies_per_second": 40.0}, "end_to_end_ms": {"p50": 500.0, "p95": 900.0, "p99": 1000.0}}
+    current = {"throughput": {"replies_per_second": 30.0}, "end_to_end_ms": {"p50": 400.0, "p95": 1000.0, "p99": 1300.0}}
+    regressions = {r["metric"]: r for r in compare_to_baseline(current, baseline, tolerance=0.15)}
+    assert set(regressions) == {"throughput.replies_per_second", "end_to_end_ms.p99"}
+    assert regressions["end_to_end_ms.p99"]["change"] == 0.3
@@ -0,0 +1,83 @@
+import io
+import json
+import logging
+import queue
+import pytest
+from app.core.config import settings
+from app.utils.logging import (
+    JsonFormatter,
+    NonBlockingQueueHandler,
+    SamplingFilter,
+    configure_logging,
+    parse_sample_rates,
+    redact_phone_numbers,
+    sensitive,
+    shutdown_logging,
+)
+
+def _record(msg, *args, level=logging.INFO, **extra):
+    record = logging.LogRecord("test", level, __file__, 1, msg, args, None)
+    record.__dict__.update(extra)
+    return record
+
+def test_redact_phone_numbers_keeps_last_digits():
+    assert redact_phone_numbers("de 56912345678 a +14155550100") == "de *******5678 a ********0100"
+    assert redact_phone_numbers("ID wamid.123456789012 en 1024 ms") == "ID wamid.123456789012 en 1024 ms"
+
+def test_redact_phone_numbers_leaves_timestamps_and_numeric_ids():
+    for text in ("timestamp 1600000000", "ts 1700000000123", "phone_number_id 109876543210001", "media 1098765432100012"):
+        assert redact_phone_numbers(text) == text
+
+def test_json_formatter_redacts_bodies_and_exports_extras():
+    formatter = JsonFormatter(redact=True)
+    record = _record("Mensaje de %s: %s", "56912345678", sensitive("hola, mi RUT es 12.345.678-9"), event="message_received", body="secreto")
+    entry = json.loads(formatter.format(record))
+    assert entry["message"] == "Mensaje de *******5678: <redactado: 28 caracteres>"
+    assert entry["event"] == "message_received"
+    assert entry["body"] == "<redactado: 7 caracteres>"
+    assert entry["level"] == "INFO" and entry["logger"] == "test"
+
+def test_sensitive_follows_the_configured_redaction(monkeypatch):
+    configure_logging(stream=io.StringIO(), settings=settings.model_copy(update={"LOG_REDACT": False}))
+    try:
+        monkeypatch.setattr(settings, "LOG_REDACT", True) # Se usa lo configurado, no las Settings globales
+        assert str(sensitive("hola")) == "hola"
+    finally:
+        configure_logging()
+    assert str(sensitive("hola")) == "<redactado: 4 caracteres>"
+
+def test_sampling_filter_keeps_one_in_n_info_events():
+    sampling = SamplingFilter(parse_sample_rates("message_received=0.25, webhook_enqueued=0"))
+    kept = [sampling.filter(_record("x", event="message_received")) for _ in range(8)]
+    assert kept == [True, False, False, False, True, False, False, False]
+    assert not sampling.filter(_record("x", event="webhook_enqueued"))
+    assert sampling.filter(_record("x", level=logging.WARNING, event="webhook_enqueued")) # WARNING nunca se muestrea
+    assert sampling.filter(_record("x")) # Sin evento: siempre se registra
+
+def test_queue_handler_defers_formatting_to_listener():
+    class Expensive:
+        formatted = False
+        def __str__(self):
+            Expensive.formatted = True
+            return "caro"
+
+    handler = NonBlockingQueueHandler(queue.SimpleQueue(), max_size=1)
+    record = _record("valor: %s", Expensive())
+    handler.handle(record)
+    assert not Expensive.formatted # Nada se interpola en el hilo que loguea
+    handler.handle(_record("otro"))
+    assert handler.dropped == 1 # Cola llena: se descarta sin bloquear
+
+def test_configure_logging_writes_json_once_from_listener_thread():
+    stream = io.StringIO()
+    configure_logging(stream=stream)
+    try:
+        logger = logging.getLogger(settings.APP_NAME)
+        logger.info("Mensaje enviado a %s", "56912345678", extra={"event": "message_sent"})
+    finally:
+        shutdown_logging() # Vacía la cola
+        configure_logging()
+    lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert len(lines) == 1
+    assert lines[0]["message"] == "Mensaje enviado a *******5678"
+    assert lines[0]["event"] == "message_sent"
@@ -0,0 +1,197 @@
+import asyncio
+import hashlib
+import os
+import threading
+import pytest
+import respx
+from unittest.mock import AsyncMock
+from app.models.meta import MetaMedia, MetaWebhookRequest
+from app.services.media import MediaCache, MediaDescription, MediaPipeline, MediaProcessor, MediaTooLarge
+from app.services.meta_service import MetaService
+from app.utils.http_client import HttpClient
+
+# Marcar todos los tests en este módulo como asyncio
+pytestmark = pytest.mark.asyncio
+
+BASE_URL = "https://graph.example.test/v19.0/"
+CONTENT = b"OggS" + bytes(range(256)) * 400 # ~100 KB
+SHA256 = hashlib.sha256(CONTENT).hexdigest()
+
+class RecordingProcessor(MediaProcessor):
+    """Procesador de prueba: registra en qué hilo corre."""
+    name = "recording"
+    mime_prefixes = ("audio/",)
+
+    def __init__(self):
+        self.threads = []
+
+    def process(self, path: str, mime_type: str) -> str:
+        self.threads.append(threading.current_thread().name)
+        with open(path, "rb") as media_file:
+            return f"transcripción de {len(media_file.read())} bytes"
+
+def _mock_media(router, media_id="media.1", content=CONTENT, file_size=None):
+    router.get(f"{BASE_URL}{media_id}").respond(json={
+        "url": f"https://lookaside.example.test/{media_id}",
+        "mime_type": "audio/ogg",
+        "sha256": hashlib.sha256(content).hexdigest(),
+        "file_size": len(content) if file_size is None else file_size,
+        "id": media_id,
+    })
+    return router.get(f"https://lookaside.example.test/{media_id}").respond(content=content)
+
+def _pipeline(tmp_path, **kwargs) -> MediaPipeline:
+    kwargs.setdefault("processors", [RecordingProcessor(), MediaDescription()])
+    return MediaPipeline(HttpClient(base_url=BASE_URL), MediaCache(str(tmp_path / "media")), chunk_size=4096, **kwargs)
+
+async def test_download_is_content_addressed_and_repeated_forwards_skip_work(tmp_path):
+    pipeline = _pipeline(tmp_path)
+    with respx.mock(assert_all_called=False) as router:
+        _mock_media(router)
+        forwarded = _mock_media(router, "media.2")
+        first = await pipeline.handle(MetaMedia(id="media.1", mime_type="audio/ogg"))
+        # El mismo archivo reenviado llega con otro media id pero el mismo sha256 (y el mismo tamaño)
+        second = await pipeline.handle(MetaMedia(id="media.2", mime_type="audio/ogg", sha256=SHA256))
+
+    assert first.sha256 == SHA256 and first.size == len(CONTENT)
+    assert first.text == f"transcripción de {len(CONTENT)} bytes"
+    assert first.downloaded and first.stored and first.processed
+    assert not second.downloaded and not second.processed and second.text == first.text
+    assert not forwarded.called
+    processor = pipeline.processors[0]
+    assert processor.threads and all(name.startswith("media") for name in processor.threads) # Fuera del event loop
+    assert pipeline.stats()["download_skipped"] == 1 and pipeline.stats()["results_cached"] == 1
+    with open(pipeline.cache.path_for(SHA256), "rb") as cached:
+        assert cached.read() == CONTENT
+    await pipeline.close()
+
+async def test_size_ceiling_is_enforced_before_and_during_download(tmp_path):
+    pipeline = _pipeline(tmp_path, max_bytes=10_000)
+    with respx.mock(assert_all_called=False) as router:
+        declared = _mock_media(router, "media.big")
+        with pytest.raises(MediaTooLarge):
+            await pipeline.handle(MetaMedia(id="media.big", mime_type="audio/ogg"))
+        assert not declared.called # Tamaño declarado excesivo: ni se descarga
+
+        _mock_media(router, "media.lies", file_size=100)
+        with pytest.raises(MediaTooLarge):
+            await pipeline.handle(MetaMedia(id="media.lies", mime_type="audio/ogg"))
+
+    assert pipeline.stats()["too_large"] == 2
+    assert [p for p in (tmp_path / "media").rglob("*") if p.is_file()] == [] # Sin temporales huérfanos
+    await pipeline.close()
+
+async def test_declared_sha256_skips_the_download_only_if_metadata_agrees(tmp_path):
+    pipeline = _pipeline(tmp_path)
+    other = b"OggS" + bytes(reversed(range(256))) * 10
+    with respx.mock() as router:
+        _mock_media(router)
+        await pipeline.handle(MetaMedia(id="media.1", mime_type="audio/ogg"))
+        # El webhook informa un hash en caché, pero la Graph API informa otro: se descarga
+        disagrees = _mock_media(router, "media.other", content=other)
+        result = await pipeline.handle(MetaMedia(id="media.other", mime_type="audio/ogg", sha256=SHA256))
+        # Ambos informan el hash en caché, pero el tamaño no coincide con el del archivo guardado
+        router.get(f"{BASE_URL}media.size").respond(json={
+            "url": "https://lookaside.example.test/media.size", "mime_type": "audio/ogg", "sha256": SHA256, "file_size": len(other),
+        })
+        wrong_size = router.get("https://lookaside.example.test/media.size").respond(content=other)
+        sized = await pipeline.handle(MetaMedia(id="media.size", mime_type="audio/ogg", sha256=SHA256))
+
+    assert disagrees.called and wrong_size.called
+    assert result.sha256 == hashlib.sha256(other).hexdigest() and result.downloaded and result.stored
+    assert result.text == f"transcripción de {len(other)} bytes"
+    assert sized.sha256 == result.sha256 and not sized.stored and not sized.processed # Guardado por el hash calculado
+    stats = pipeline.stats()
+    assert (stats["download_skipped"], stats["deduplicated"], stats["sha256_mismatches"]) == (0, 1, 2)
+    await pipeline.close()
+
+async def test_cache_is_bounded_and_evicts_least_recently_used(tmp_path):
+    contents = [bytes([n]) * 4000 for n in range(3)]
+    cache = MediaCache(str(tmp_path / "media"), max_bytes=9000)
+    for n, content in enumerate(contents[:2]):
+        temp = cache.temp_file()
+        temp.write(content)
+        temp.close()
+        cache.commit(temp.name, hashlib.sha256(content).hexdigest())
+        cache.release(hashlib.sha256(content).hexdigest())
+        os.utime(cache.path_for(hashlib.sha256(content).hexdigest()), (1_000_000 + n, 1_000_000 + n))
+    cache.store_result(hashlib.sha256(contents[0]).hexdigest(), "description", "texto")
+
+    # Reabrir la caché recupera el orden de uso desde el mtime
+    cache = MediaCache(str(tmp_path / "media"), max_bytes=9000)
+    temp = cache.temp_file()
+    temp.write(contents[2])
+    temp.close()
+    assert cache.commit(temp.name, hashlib.sha256(contents[2]).hexdigest())
+
+    files = sorted(path.name for path in (tmp_path / "media").rglob("*") if path.is_file())
+    assert files == sorted(hashlib.sha256(content).hexdigest() for content in contents[1:]) # El primero y su resultado
+    assert (cache.total_bytes, cache.evicted) == (8000, 1)
+
+async def test_pinned_files_are_not_evicted_while_processed(tmp_path):
+    cache = MediaCache(str(tmp_path / "media"), max_bytes=1000)
+    digests = []
+    for n in range(2):
+        content = bytes([n]) * 800
+        temp = cache.temp_file()
+        temp.write(content)
+        temp.close()
+        digests.append(hashlib.sha256(content).hexdigest())
+        cache.commit(temp.name, digests[-1]) # Sin `release`: ambos se están procesando
+    assert os.path.exists(cache.path_for(digests[0])) and cache.evicted == 0
+    cache.release(digests[0])
+    cache.release(digests[1])
+
+async def test_close_waits_for_cancelled_downloads(tmp_path):
+    pipeline = _pipeline(tmp_path)
+    started = asyncio.Event()
+
+    async def stalled(request):
+        started.set()
+        await asyncio.Event().wait()
+
+    with respx.mock(assert_all_called=False) as router: # La descarga nunca termina
+        router.get(f"{BASE_URL}media.slow").respond(json={"url": "https://lookaside.example.test/media.slow", "mime_type": "audio/ogg"})
+        router.get("https://lookaside.example.test/media.slow").mock(side_effect=stalled)
+        handling = asyncio.create_task(pipeline.handle(MetaMedia(id="media.slow", mime_type="audio/ogg")))
+        await started.wait()
+        await pipeline.close()
+        # Al volver de `close` la descarga ya terminó de cancelarse y borró su temporal
+        assert handling.done() and pipeline.stats()["in_flight"] == 0
+        assert [p for p in (tmp_path / "media").rglob("*") if p.is_file()] == []
+        with pytest.raises(asyncio.CancelledError):
+            await handling
+
+async def test_identical_media_in_flight_is_downloaded_once(tmp_path):
+    pipeline = _pipeline(tmp_path)
+    with respx.mock() as router:
+        download = _mock_media(router)
+        media = MetaMedia(id="media.1", mime_type="audio/ogg", sha256=SHA256)
+        results = await asyncio.gather(*(pipeline.handle(media) for _ in range(3)))
+    assert download.call_count == 1
+    assert len({result.text for result in results}) == 1
+    assert pipeline.stats()["coalesced"] == 2
+    await pipeline.close()
+
+async def test_media_messages_reach_the_llm_as_text(tmp_path):
+    pipeline = _pipeline(tmp_path)
+    llm_service = AsyncMock()
+    llm_service.generate_response = AsyncMock(return_value="¡Recibido!")
+    service = MetaService(llm_service=llm_service, outbound=AsyncMock(), media=pipeline)
+    service.send_whatsapp_message = AsyncMock()
+    payload = MetaWebhookRequest.model_validate({
+        "object": "whatsapp_business_account",
+        "entry": [{"id": "WABA_ID", "changes": [{"field": "messages", "value": {
+            "messaging_product": "whatsapp",
+            "metadata": {"phone_number_id": "123"},
+            "messages": [{"from": "5691234", "id": "wamid.audio", "timestamp": "1600000000", "type": "audio",
+                          "audio": {"id": "media.1", "mime_type": "audio/ogg", "voice": True}}],
+        }}]}],
+    })
+    with respx.mock() as router:
+        _mock_media(router)
+        await service.process_webhook_message(payload)
+
+    llm_service.generate_response.assert_awaited_once_with(f"transcripción de {len(CONTENT)} bytes", user_id="5691234")
+    service.send_whatsapp_message.assert_awaited_once_with("5691234", "¡Recibido!")
+    await pipeline.close()
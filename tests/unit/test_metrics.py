@@ -0,0 +1,59 @@
+import asyncio
+import pytest
+from types import SimpleNamespace
+from app.core.metrics import MetricsRegistry
+
+# Marcar todos los tests en este módulo como asyncio
+pytestmark = pytest.mark.asyncio
+
+async def test_stage_timer_records_duration_in_flight_and_errors():
+    registry = MetricsRegistry()
+    with registry.stage("groq"):
+        assert registry.stage_in_flight.labels("groq").value == 1
+        await asyncio.sleep(0.01)
+    with pytest.raises(RuntimeError):
+        with registry.stage("groq"):
+            raise RuntimeError("fallo")
+
+    histogram = registry.stage_duration.labels("groq")
+    assert histogram.count == 2 and histogram.sum >= 0.01
+    assert registry.stage_in_flight.labels("groq").value == 0
+    assert registry.stage_errors.labels("groq").value == 1
+
+async def test_histogram_quantiles_interpolate_within_buckets():
+    registry = MetricsRegistry()
+    for _ in range(90):
+        registry.observe_stage("queue_wait", 0.002)
+    for _ in range(10):
+        registry.observe_stage("queue_wait", 0.4)
+    summary = registry.stage_summary()["queue_wait"]
+    assert summary["count"] == 100
+    assert 0.001 <= summary["p50_seconds"] <= 0.0025
+    assert 0.25 <= summary["p99_seconds"] <= 0.5
+
+async def test_token_usage_ignores_missing_values():
+    registry = MetricsRegistry()
+    registry.record_token_usage(SimpleNamespace(prompt_tokens=120, completion_tokens=30))
+    registry.record_token_usage(SimpleNamespace(prompt_tokens=None))
+    registry.record_token_usage(None)
+    assert registry.llm_tokens.labels("prompt").value == 120
+    assert registry.llm_tokens.labels("completion").value == 30
+
+async def test_render_prometheus_text_format():
+    registry = MetricsRegistry()
+    registry.observe_stage("webhook_parse", 0.0004)
+    registry.register_stats("webhook_queue", lambda: {"depth": 3, "wait_avg_seconds": 0.5, "policy": "reject"})
+    text = registry.render()
+    assert "# TYPE chatbot_stage_duration_seconds histogram" in text
+    assert 'chatbot_stage_duration_seconds_bucket{stage="webhook_parse",le="0.001"} 1' in text
+    assert 'chatbot_stage_duration_seconds_bucket{stage="webhook_parse",le="+Inf"} 1' in text
+    assert 'chatbot_stage_duration_seconds_count{stage="webhook_parse"} 1' in text
+    assert 'chatbot_stage_errors_total{stage="groq"} 0' in text
+    assert "chatbot_webhook_queue_depth 3" in text
+    assert "chatbot_webhook_queue_wait_avg_seconds 0.5" in text
+    assert "policy" not in text
+
+async def test_duplicate_metric_names_are_rejected():
+    registry = MetricsRegistry()
+    with pytest.raises(ValueError):
+        registry.counter("stage_errors_total", "duplicada")
@@ -0,0 +1,142 @@
+import asyncio
+import pytest
+from types import SimpleNamespace
+from typing import Dict
+from app.services.llm_service import FALLBACK_REPLY, LLMService
+from app.services.model_router import AllModelsUnavailable, CircuitBreaker, ModelRouter
+
+# Marcar todos los tests en este módulo como asyncio
+pytestmark = pytest.mark.asyncio
+
+class FakeLLMClient:
+    """Imita `AsyncGroq().chat.completions` con latencia y fallos configurables por modelo."""
+    def __init__(self, latency: Dict[str, float], failing: tuple = ()):
+        self.latency = latency
+        self.failing = set(failing)
+        self.calls = []
+        self.chat = SimpleNamespace(completions=self)
+
+    async def create(self, messages, model, stream=False, **options):
+        self.calls.append(model)
+        await asyncio.sleep(self.latency.get(model, 0.0))
+        if model in self.failing:
+            raise RuntimeError(f"{model} no disponible")
+        content = f"{model}: {messages[-1]['content']}"
+        if stream:
+            return self._stream(model, content)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=None)
+
+    async def _stream(self, model, content):
+        for word in content.split(" "):
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=word + " "))], x_groq=None)
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+def _service(client: FakeLLMClient, router: ModelRouter) -> LLMService:
+    service = LLMService(api_key="test", model=router.models[0], router=router)
+    service.client = client
+    return service
+
+async def test_breaker_opens_on_errors_and_probes_when_half_open():
+    clock = FakeClock()
+    breaker = CircuitBreaker("groq/m", failure_rate=0.5, window=4, min_calls=4, open_seconds=10, clock=clock)
+    for ok in (True, False, True, False):
+        assert breaker.allow()
+        breaker.record(ok, 0.1)
+    assert breaker.state == CircuitBreaker.OPEN and not breaker.allow()
+
+    clock.now = 10
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow() and not breaker.allow() # Una sola llamada de prueba
+    breaker.record(True, 0.1)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+async def test_breaker_opens_on_slow_calls():
+    breaker = CircuitBreaker("groq/m", slow_call_seconds=1.0, slow_call_rate=0.5, window=4, min_calls=4)
+    for seconds in (2.0, 2.0, 0.1, 0.1):
+        breaker.record(True, seconds)
+    assert breaker.state == CircuitBreaker.OPEN
+
+async def test_uses_configured_model_and_falls_back_in_order():
+    client = FakeLLMClient({}, failing=("principal",))
+    router = ModelRouter(["principal", "respaldo"], hedge=False)
+    service = _service(client, router)
+    reply = await service.generate_response("Hola", "user_1")
+    assert reply == "respaldo: Usuario: Hola"
+    assert client.calls == ["principal", "respaldo"]
+    assert router.stats()["fallbacks"] == 1
+
+async def test_open_breaker_skips_model_without_waiting():
+    client = FakeLLMClient({"principal": 5.0})
+    router = ModelRouter(["principal", "respaldo"], hedge=False)
+    for _ in range(5):
+        router.breaker("principal").record(False, 0.1)
+    service = _service(client, router)
+    reply = await asyncio.wait_for(service.generate_response("Hola", "user_1"), timeout=1)
+    assert reply.startswith("respaldo:") and client.calls == ["respaldo"]
+
+async def test_timeout_moves_to_next_model_and_all_failing_returns_fallback():
+    client = FakeLLMClient({"lento": 1.0}, failing=("roto",))
+    router = ModelRouter(["lento", "roto"], request_timeout=0.05, hedge=False)
+    service = _service(client, router)
+    reply = await asyncio.wait_for(service.generate_response("Hola", "user_1"), timeout=1)
+    assert reply == FALLBACK_REPLY
+    assert router.stats()["failures"] == 2
+
+    # Con ambos breakers abiertos se rechaza de inmediato
+    for model in ("lento", "roto"):
+        for _ in range(5):
+            router.breaker(model).record(False, 0.1)
+    with pytest.raises(AllModelsUnavailable):
+        await router.complete(lambda model: asyncio.sleep(0))
+    assert router.stats()["rejected"] == 1
+
+async def test_short_messages_go_to_the_fast_model():
+    client = FakeLLMClient({})
+    router = ModelRouter(["grande"], short_message_model="rapido", short_message_max_chars=10, hedge=False)
+    service = _service(client, router)
+    assert (await service.generate_response("Hola", "u1")).startswith("rapido:")
+    assert (await service.generate_response("Una pregunta bastante más larga", "u2")).startswith("grande:")
+    assert router.stats()["short_routed"] == 1
+
+async def test_hedge_fires_after_latency_percentile_and_first_reply_wins():
+    client = FakeLLMClient({"principal": 0.3, "respaldo": 0.01})
+    router = ModelRouter(["principal", "respaldo"], hedge_min_delay=0.0, hedge_initial_delay=0.05)
+    service = _service(client, router)
+    started = asyncio.get_running_loop().time()
+    reply = await service.generate_response("Hola", "user_1")
+    assert reply.startswith("respaldo:")
+    assert asyncio.get_running_loop().time() - started < 0.2 # No esperó a la llamada lenta
+    stats = router.stats()
+    assert stats["hedges"] == 1 and stats["hedge_wins"] == 1
+    await asyncio.sleep(0.01)
+    assert service.completions.limiter.active == 0 # La llamada perdedora se canceló
+
+async def test_local_queueing_does_not_count_against_the_model_timeout():
+    client = FakeLLMClient({"principal": 0.03, "respaldo": 0.0})
+    router = ModelRouter(
+        ["principal", "respaldo"], request_timeout=0.1, hedge_min_delay=0.08, hedge_initial_delay=0.08,
+        breaker_factory=lambda name: CircuitBreaker(name, slow_call_seconds=0.08, window=4, min_calls=4),
+    )
+    service = _service(client, router)
+    service.completions.limiter.limit = 1
+    # Cupo saturado: cada petición espera en la cola local mucho más que el timeout del modelo
+    replies = await asyncio.gather(*(service.generate_response(f"Pregunta {i}", f"u{i}") for i in range(6)))
+    assert all(reply.startswith("principal:") for reply in replies)
+    assert router.breaker_states() == {"groq/principal": CircuitBreaker.CLOSED}
+    stats = router.stats()
+    assert stats["failures"] == 0 and stats["hedges"] == 0
+    assert service.completions.stats()["max_waiting"] == 5
+
+async def test_stream_falls_back_when_first_model_fails():
+    client = FakeLLMClient({}, failing=("principal",))
+    router = ModelRouter(["principal", "respaldo"])
+    service = _service(client, router)
+    parts = [part async for part in service.stream_response("Hola", "user_1")]
+    assert "".join(parts).startswith("respaldo:")
+    assert router.stats()["fallbacks"] == 1
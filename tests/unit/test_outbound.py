@@ -0,0 +1,93 @@
+import time
+import httpx
+import pytest
+import respx
+from app.services.outbound import OutboundSendScheduler, TokenBucket, parse_retry_after
+from app.utils.http_client import HttpClient
+
+# Marcar todos los tests en este módulo como asyncio
+pytestmark = pytest.mark.asyncio
+
+BASE_URL = "https://graph.example.test/v19.0/"
+SEND_URL = f"{BASE_URL}PHONE_ID/messages"
+PAYLOAD = {"messaging_product": "whatsapp", "to": "56911111111", "type": "text", "text": {"body": "hola"}}
+
+def _scheduler(**kwargs) -> OutboundSendScheduler:
+    options = dict(base_backoff=0.001, max_backoff=0.01)
+    options.update(kwargs)
+    return OutboundSendScheduler(http_client=HttpClient(base_url=BASE_URL), **options)
+
+async def test_token_bucket_allows_burst_then_throttles():
+    bucket = TokenBucket(rate=100.0, capacity=2)
+    assert bucket.try_acquire() == 0.0
+    assert bucket.try_acquire() == 0.0
+    assert bucket.try_acquire() > 0.0
+    started = time.monotonic()
+    await bucket.acquire()
+    assert time.monotonic() - started > 0.005
+
+async def test_parse_retry_after():
+    assert parse_retry_after("2") == 2.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("no-es-una-fecha") is None
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0 # Fecha pasada
+
+@respx.mock
+async def test_successful_send():
+    respx.post(SEND_URL).respond(json={"messages": [{"id": "wamid.out"}]})
+    scheduler = _scheduler()
+    result = await scheduler.send("PHONE_ID", "56911111111", PAYLOAD)
+    assert result.ok and result.attempts == 1
+    assert result.response == {"messages": [{"id": "wamid.out"}]}
+    assert scheduler.stats()["sent"] == 1
+
+@respx.mock
+async def test_429_is_retried_honoring_retry_after():
+    route = respx.post(SEND_URL)
+    route.side_effect = [
+        httpx.Response(429, headers={"Retry-After": "0.01"}, json={"error": "rate limit"}),
+        httpx.Response(200, json={"messages": [{"id": "wamid.out"}]}),
+    ]
+    scheduler = _scheduler()
+    result = await scheduler.send("PHONE_ID", "56911111111", PAYLOAD)
+    assert result.ok and result.attempts == 2
+    assert scheduler.stats()["retried"] == 1
+
+@respx.mock
+async def test_transient_errors_exhaust_retries_into_dead_letter():
+    route = respx.post(SEND_URL)
+    route.side_effect = [httpx.Response(503), httpx.ConnectError("sin red"), httpx.Response(502)]
+    scheduler = _scheduler(max_retries=2)
+    result = await scheduler.send("PHONE_ID", "56911111111", PAYLOAD)
+
+    assert result.status == "dropped" and result.attempts == 3
+    assert route.call_count == 3
+    stats = scheduler.stats()
+    assert stats["dropped"] == 1 and stats["retried"] == 2
+    [letter] = scheduler.dead_letter_list()
+    assert letter["to"] == "56911111111" and letter["payload"] == PAYLOAD
+
+@respx.mock
+async def test_client_errors_are_not_retried():
+    route = respx.post(SEND_URL).respond(400, json={"error": {"message": "Invalid parameter"}})
+    scheduler = _scheduler()
+    result = await scheduler.send("PHONE_ID", "56911111111", PAYLOAD)
+    assert result.status == "failed" and route.call_count == 1
+    assert scheduler.stats()["failed"] == 1 and scheduler.stats()["dead_letters"] == 1
+
+@respx.mock
+async def test_per_recipient_bucket_throttles_bursts():
+    respx.post(SEND_URL).respond(json={})
+    scheduler = _scheduler(recipient_rate=10.0, recipient_burst=1)
+    await scheduler.send("PHONE_ID", "56911111111", PAYLOAD)
+    await scheduler.send("PHONE_ID", "56922222222", PAYLOAD) # Otro destinatario: sin espera
+    assert scheduler.stats()["throttled"] == 0
+    await scheduler.send("PHONE_ID", "56911111111", PAYLOAD)
+    assert scheduler.stats()["throttled"] == 1
+
+@respx.mock
+async def test_retry_queue_is_bounded():
+    respx.post(SEND_URL).respond(500)
+    scheduler = _scheduler(max_pending_retries=0)
+    result = await scheduler.send("PHONE_ID", "56911111111", PAYLOAD)
+    assert result.status == "dropped" and result.attempts == 1
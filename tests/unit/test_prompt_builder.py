@@ -0,0 +1,81 @@
+import pytest
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+from app.core.config import settings
+from app.services.llm_service import LLMService
+from app.services.prompt_builder import CONTEXT_INSTRUCTION, PromptBuilder
+from app.utils.tokens import CACHE_MAX_CHARS, TRUNCATION_MARKER, _estimate_cached, estimate_tokens, truncate_to_tokens
+
+# Marcar todos los tests en este módulo como asyncio
+pytestmark = pytest.mark.asyncio
+
+async def test_estimator_counts_words_and_punctuation_and_caches_only_short_texts():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("hola") == 1
+    assert estimate_tokens("¿Cuál es el horario?") == 7 # ¿ Cuál es el hora·rio ?
+    text = "mensaje reenviado " * 50
+    _estimate_cached.cache_clear()
+    estimate_tokens(text)
+    estimate_tokens(text)
+    assert _estimate_cached.cache_info().hits == 1
+
+    long_text = "x" * (CACHE_MAX_CHARS + 1)
+    assert estimate_tokens(long_text) == estimate_tokens("x" * CACHE_MAX_CHARS) + 1
+    assert _estimate_cached.cache_info().currsize == 2 # El texto largo no entra en la caché
+
+async def test_truncation_keeps_start_and_end_of_long_messages():
+    text = "Inicio del reenvío. " + "relleno " * 2000 + "¿Cuál es la pregunta final?"
+    truncated = truncate_to_tokens(text, 100, tail_ratio=0.3)
+    assert estimate_tokens(truncated) <= 100
+    assert truncated.startswith("Inicio del reenvío.")
+    assert truncated.endswith("¿Cuál es la pregunta final?")
+    assert TRUNCATION_MARKER.strip() in truncated
+    assert truncate_to_tokens("corto", 100) == "corto"
+
+async def test_budgets_limit_user_context_and_history():
+    builder = PromptBuilder(context_window=1000, max_input_tokens=400, max_output_tokens=300, max_user_tokens=100, max_context_tokens=120)
+    fragments = ["uno " * 50, "dos " * 50, "tres " * 50] # ~50 tokens cada uno
+    history = [{"role": "user", "content": f"turno {i} " + "x" * 400} for i in range(10)] # ~102 tokens cada uno
+    prompt = builder.build("palabra " * 1000, fragments, history)
+    usage = prompt.usage
+
+    assert usage.user_truncated and usage.user_tokens <= 100 + estimate_tokens(CONTEXT_INSTRUCTION)
+    assert usage.context_fragments == 2 and usage.context_dropped == 1
+    assert "tres" not in prompt.messages[-1]["content"]
+    assert usage.input_tokens <= 400
+    kept = prompt.messages[1:-1]
+    assert kept and kept == history[-len(kept):] # Se conservan los turnos más recientes
+    assert usage.history_dropped == len(history) - len(kept) > 0
+    assert prompt.max_tokens == 300
+
+async def test_max_tokens_shrinks_with_the_remaining_window():
+    builder = PromptBuilder(context_window=600, max_input_tokens=550, max_output_tokens=512, min_output_tokens=50, max_user_tokens=500)
+    assert builder.build("Hola").max_tokens == 512
+    long_prompt = builder.build("palabra " * 400)
+    assert long_prompt.max_tokens == 600 - long_prompt.usage.input_tokens
+    assert long_prompt.max_tokens >= 50
+
+async def test_system_prefix_is_built_once_and_reused():
+    builder = PromptBuilder(system_prompt="Eres el asistente de la tienda.")
+    first, second = builder.build("Hola"), builder.build("Otra pregunta")
+    assert first.messages[0] is second.messages[0]
+    assert first.messages[0] == {"role": "system", "content": "Eres el asistente de la tienda."}
+
+async def test_llm_service_sends_max_tokens_and_records_usage():
+    llm_service_instance = LLMService(api_key=settings.GROQ_API_KEY, prompt_builder=PromptBuilder(max_output_tokens=256))
+    completion = SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content="Respuesta"))],
+        usage=SimpleNamespace(prompt_tokens=42, completion_tokens=7),
+    )
+    mock_groq_client = AsyncMock()
+    mock_groq_client.chat.completions.create = AsyncMock(return_value=completion)
+    with patch.object(llm_service_instance, 'client', mock_groq_client):
+        assert await llm_service_instance.generate_response("Hola", "u1") == "Respuesta"
+
+    assert mock_groq_client.chat.completions.create.call_args[1]["max_tokens"] == 256
+    [record] = llm_service_instance.prompt_builder.recent_usage()
+    assert record["prompt_tokens"] == 42 and record["completion_tokens"] == 7
+    assert record["model"] == llm_service_instance.model
+    stats = llm_service_instance.prompt_stats()
+    assert stats["requests"] == 1 and stats["prompt_tokens"] == 42
+    assert stats["output_budget_used"] == pytest.approx(7 / 256)
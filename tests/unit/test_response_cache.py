@@ -0,0 +1,129 @@
+import asyncio
+import pytest
+from typing import List
+from unittest.mock import AsyncMock, patch
+from app.services.embeddings import EmbeddingInterface, HashingEmbedder
+from app.services.llm_service import LLMService
+from app.services.response_cache import ResponseCache
+from app.core.config import settings
+from app.utils.text import normalize_text
+
+# Marcar todos los tests en este módulo como asyncio
+pytestmark = pytest.mark.asyncio
+
+class FakeEmbedder(EmbeddingInterface):
+    """Embedder offline: mapea cada texto a un vector fijo según palabras clave."""
+    def __init__(self):
+        self.calls = 0
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        vectors = []
+        for text in texts:
+            if "horario" in text or "abren" in text:
+                vectors.append([1.0, 0.0])
+            else:
+                vectors.append([0.0, 1.0])
+        return vectors
+
+async def _cached(cache: ResponseCache, prompt: str, response: str, seconds: float = 0.5) -> None:
+    lookup = await cache.lookup(prompt)
+    await cache.store(lookup, response, seconds)
+
+async def test_normalize_text():
+    assert normalize_text("  ¿Cuál es el HORARIO?  ") == "cual es el horario"
+    assert normalize_text("Dirección!!") == "direccion"
+
+async def test_exact_hit_on_normalized_text():
+    cache = ResponseCache()
+    await _cached(cache, "¿Horario?", "De 9 a 18 hrs.", seconds=1.5)
+
+    lookup = await cache.lookup("horario")
+    assert lookup.response == "De 9 a 18 hrs."
+    stats = cache.stats()
+    assert stats["hits_exact"] == 1 and stats["misses"] == 1
+    assert stats["latency_saved_seconds"] == 1.5
+
+async def test_semantic_hit_with_fake_embedder():
+    embedder = FakeEmbedder()
+    cache = ResponseCache(embedder=embedder, similarity_threshold=0.95)
+    await _cached(cache, "¿Cuál es el horario?", "De 9 a 18 hrs.")
+
+    assert (await cache.lookup("¿A qué hora abren?")).response == "De 9 a 18 hrs."
+    assert (await cache.lookup("¿Cuánto cuesta?")).response is None
+    assert cache.stats()["hits_semantic"] == 1
+
+async def test_semantic_search_skips_expired_entries_and_tracks_evictions():
+    cache = ResponseCache(embedder=FakeEmbedder(), similarity_threshold=0.95, max_entries=2)
+    await _cached(cache, "¿Cuál es el horario?", "De 9 a 18 hrs.")
+    await _cached(cache, "¿Cuánto cuesta el envío?", "$3.000.")
+    cache._entries[normalize_text("¿Cuál es el horario?")].expires_at = 0.0
+    assert (await cache.lookup("¿A qué hora abren?")).response is None
+
+    await _cached(cache, "¿A qué hora abren?", "Abrimos a las 9.") # Desaloja la entrada vencida por LRU
+    assert (await cache.lookup("¿Hasta qué hora abren?")).response == "Abrimos a las 9."
+    assert (await cache.lookup("¿Qué precio tiene el envío?")).response == "$3.000."
+
+async def test_hashing_embedder_is_normalized_and_deterministic():
+    embedder = HashingEmbedder(dimensions=64)
+    first, second = await embedder.embed(["Hola mundo", "hola, mundo"])
+    assert first == second
+    assert sum(value * value for value in first) == pytest.approx(1.0)
+
+async def test_personalized_and_contextual_turns_bypass_cache():
+    cache = ResponseCache()
+    for prompt in ("¿Dónde está mi pedido?", "Mi RUT es 12345678", "¿y eso cuánto cuesta?"):
+        lookup = await cache.lookup(prompt)
+        assert lookup.bypassed
+        await cache.store(lookup, "respuesta", 0.1)
+    assert (await cache.lookup("horario", has_history=True)).bypassed
+    assert cache.stats()["entries"] == 0
+
+async def test_contextual_turn_is_not_served_from_cache():
+    cache = ResponseCache()
+    await _cached(cache, "¿Cuánto cuesta?", "El plan básico cuesta $10.000.")
+    lookup = await cache.lookup("¿Cuánto cuesta?", has_history=True) # Seguimiento dentro de una conversación
+    assert lookup.bypassed and lookup.response is None
+    assert (await cache.lookup("¿Cuánto cuesta?")).response == "El plan básico cuesta $10.000."
+
+async def test_standalone_question_with_history_is_served_from_cache():
+    cache = ResponseCache()
+    await _cached(cache, "¿Cuál es el horario de atención?", "De 9 a 18 hrs.")
+    # Un usuario con conversación previa que hace una pregunta autocontenida también recibe la respuesta cacheada
+    assert (await cache.lookup("¿Cuál es el horario de atención?", has_history=True)).response == "De 9 a 18 hrs."
+    for follow_up in ("¿y el horario de atención?", "¿Cuál es el horario de ese local?"):
+        assert (await cache.lookup(follow_up, has_history=True)).bypassed
+
+async def test_ttl_expiration():
+    cache = ResponseCache(ttl_seconds=0.01)
+    await _cached(cache, "horario", "De 9 a 18 hrs.")
+    await asyncio.sleep(0.02)
+    assert (await cache.lookup("horario")).response is None
+
+async def test_lru_eviction_and_memory_ceiling():
+    cache = ResponseCache(max_entries=2)
+    for prompt in ("horario", "precio", "direccion"):
+        await _cached(cache, prompt, f"respuesta {prompt}")
+    assert (await cache.lookup("horario")).response is None
+    assert cache.stats()["entries"] == 2
+
+    small_cache = ResponseCache(max_bytes=300)
+    await _cached(small_cache, "horario", "x" * 100)
+    await _cached(small_cache, "precio", "y" * 100)
+    assert small_cache.stats()["entries"] == 1
+    assert small_cache.stats()["bytes"] <= 300
+
+async def test_llm_service_serves_repeated_question_from_cache():
+    llm_service_instance = LLMService(api_key=settings.GROQ_API_KEY, response_cache=ResponseCache())
+    mock_groq_client = AsyncMock()
+    mock_chat_completion = AsyncMock()
+    mock_chat_completion.choices = [AsyncMock()]
+    mock_chat_completion.choices[0].message.content = "Atendemos de 9 a 18 hrs."
+    mock_groq_client.chat.completions.create = AsyncMock(return_value=mock_chat_completion)
+
+    with patch.object(llm_service_instance, 'client', mock_groq_client):
+        first = await llm_service_instance.generate_response("¿Horario?", "user_1")
+        second = await llm_service_instance.generate_response("horario", "user_2")
+
+    assert first == second == "Atendemos de 9 a 18 hrs."
+    mock_groq_client.chat.completions.create.assert_called_once()
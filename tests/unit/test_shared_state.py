@@ -0,0 +1,114 @@
+import asyncio
+import os
+import subprocess
+import sys
+import pytest
+from app.core.config import settings
+from app.core.container import ServiceContainer
+from app.core.metrics import metrics
+from app.services.dedup import SharedStateDedupBackend, build_dedup_backend
+from app.services.response_cache import ResponseCache
+from app.services.shared_state import InMemorySharedState, LockNotAcquired, SQLiteSharedState
+
+# Marcar todos los tests en este módulo como asyncio
+pytestmark = pytest.mark.asyncio
+
+@pytest.fixture(params=["memory", "sqlite"])
+def state(request, tmp_path):
+    if request.param == "sqlite":
+        return SQLiteSharedState(path=str(tmp_path / "state.sqlite3"))
+    return InMemorySharedState()
+
+async def test_add_is_set_if_absent_and_expires(state):
+    assert await state.add("k", "a", ttl=0.05)
+    assert not await state.add("k", "b", ttl=0.05)
+    assert await state.get("k") == "a"
+    await asyncio.sleep(0.06)
+    assert await state.get("k") is None
+    assert await state.add("k", "b")
+
+async def test_delete_only_matching_value(state):
+    await state.set("k", "a")
+    assert not await state.delete("k", "otro")
+    assert await state.delete("k", "a")
+    assert await state.get("k") is None
+
+async def test_lock_is_exclusive_and_released(state):
+    async with state.lock("campaign:1"):
+        with pytest.raises(LockNotAcquired):
+            async with state.lock("campaign:1", timeout=0):
+                pass
+    async with state.lock("campaign:1", timeout=0):
+        pass
+
+async def test_sqlite_state_is_shared_between_workers(tmp_path):
+    path = str(tmp_path / "state.sqlite3")
+    worker_a, worker_b = SQLiteSharedState(path=path), SQLiteSharedState(path=path)
+    dedup_a, dedup_b = SharedStateDedupBackend(worker_a), SharedStateDedupBackend(worker_b)
+    assert not await dedup_a.check_and_mark("wamid.1")
+    assert await dedup_b.check_and_mark("wamid.1")
+    await worker_a.close()
+    await worker_b.close()
+
+async def test_response_cache_serves_entries_stored_by_another_worker(tmp_path):
+    path = str(tmp_path / "state.sqlite3")
+    worker_a, worker_b = SQLiteSharedState(path=path), SQLiteSharedState(path=path)
+    cache_a, cache_b = ResponseCache(shared_state=worker_a), ResponseCache(shared_state=worker_b)
+    await cache_a.store(await cache_a.lookup("¿Horario de atención?"), "De 9 a 18 h.", 0.5)
+    lookup = await cache_b.lookup("horario de atencion")
+    assert lookup.response == "De 9 a 18 h."
+    assert cache_b.stats()["hits_shared"] == 1
+    # La segunda consulta ya es local
+    await cache_b.lookup("horario de atencion")
+    assert cache_b.stats()["hits_exact"] == 1
+    await worker_a.close()
+    await worker_b.close()
+
+async def test_dedup_follows_state_backend(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "DEDUP_BACKEND", None)
+    shared = SQLiteSharedState(path=str(tmp_path / "state.sqlite3"))
+    assert isinstance(build_dedup_backend(shared), SharedStateDedupBackend)
+    assert not isinstance(build_dedup_backend(InMemorySharedState()).state, SQLiteSharedState)
+    await shared.close()
+
+async def test_container_splits_global_limits_between_workers(monkeypatch):
+    monkeypatch.setattr(settings, "WORKERS", 4)
+    services = ServiceContainer(settings)
+    assert services.outbound.phone_rate == settings.OUTBOUND_PHONE_RATE / 4
+    assert services.outbound.recipient_rate == settings.OUTBOUND_RECIPIENT_RATE # Una conversación no se reparte entre workers
+    assert services.llm_service.stats()["max_concurrency"] == max(1, settings.LLM_MAX_CONCURRENCY // 4)
+    assert services.meta_service.llm_service is services.llm_service
+
+async def test_container_builds_services_on_first_use():
+    services = ServiceContainer(settings)
+    await services.start(warm_up=False)
+    assert "llm_service" not in vars(services)
+    assert "chatbot_llm_issued" not in metrics.render() # Exportar no fuerza la construcción
+    assert services.meta_service.llm_service is services.llm_service
+    assert services.llm_service._client is None # El cliente de Groq espera a la primera llamada
+    await services.close()
+
+async def test_warm_up_opens_the_meta_connection_pool():
+    services = ServiceContainer(settings)
+    await services.warm_up()
+    assert services.http_client._client is not None # Abierto antes del primer webhook
+    await services.close()
+
+async def test_container_services_use_the_container_settings():
+    custom = settings.model_copy(update={"WHATSAPP_API_VERSION": "v99.0", "WEBHOOK_QUEUE_MAX_SIZE": 7, "RAG_TIMEOUT_SECONDS": 0.25})
+    services = ServiceContainer(custom)
+    assert services.http_client.base_url == "https://graph.facebook.com/v99.0/" # No la versión de las Settings globales
+    assert services.webhook_dispatcher.max_size == 7
+    assert services.meta_service.settings is custom and services.llm_service.settings is custom
+    await services.close()
+
+async def test_importing_the_app_builds_no_settings_nor_logging_thread():
+    code = (
+        "import threading, app.main\n"
+        "from app.core.config import get_settings\n"
+        "from app.utils import logging\n"
+        "assert get_settings.cache_info().currsize == 0\n"
+        "assert logging._listener is None and threading.active_count() == 1\n"
+    )
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    subprocess.run([sys.executable, "-c", code], check=True, cwd=root, env={"PATH": ""}) # Sin variables WHATSAPP_*/GROQ_*
@@ -0,0 +1,117 @@
+import asyncio
+import pytest
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+from app.services.llm_service import FALLBACK_REPLY, LLMService
+from app.services.meta_service import MetaService
+from app.services.streaming import chunk_by_sentences
+from app.core.config import settings
+
+# Marcar todos los tests en este módulo como asyncio
+pytestmark = pytest.mark.asyncio
+
+async def _deltas(*parts):
+    for part in parts:
+        yield part
+
+def _groq_chunk(content):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content))])
+
+class FakeGroqStream:
+    def __init__(self, parts):
+        self.parts = parts
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for part in self.parts:
+            yield _groq_chunk(part)
+
+async def _collect(iterator):
+    return [item async for item in iterator]
+
+async def test_chunks_are_cut_at_sentence_boundaries():
+    deltas = _deltas("Hola, gracias por escribir", ". Nuestro horario es de 9 a 18", " hrs. ¿Te ayudo en algo más?")
+    chunks = await _collect(chunk_by_sentences(deltas, min_chars=20, max_chunks=5))
+    assert chunks == ["Hola, gracias por escribir.", "Nuestro horario es de 9 a 18 hrs.", "¿Te ayudo en algo más?"]
+
+async def test_paragraph_boundary_is_preferred():
+    deltas = _deltas("Primer párrafo. Sigue aquí.\n\nSegundo párrafo.")
+    chunks = await _collect(chunk_by_sentences(deltas, min_chars=5, max_chunks=5))
+    assert chunks[0] == "Primer párrafo. Sigue aquí."
+
+async def test_max_chunks_puts_the_rest_in_the_last_chunk():
+    deltas = _deltas("Uno. ", "Dos. ", "Tres. ", "Cuatro.")
+    chunks = await _collect(chunk_by_sentences(deltas, min_chars=1, max_chunks=2))
+    assert chunks == ["Uno.", "Dos. Tres. Cuatro."]
+
+async def test_whatsapp_length_limit_is_enforced():
+    deltas = _deltas("palabra " * 100)
+    chunks = await _collect(chunk_by_sentences(deltas, min_chars=10, max_chunks=1, max_chars=100))
+    assert all(len(chunk) <= 100 for chunk in chunks)
+    assert " ".join(chunks).split() == ["palabra"] * 100
+
+async def test_stream_response_yields_deltas():
+    llm_service_instance = LLMService(api_key=settings.GROQ_API_KEY)
+    mock_groq_client = AsyncMock()
+    mock_groq_client.chat.completions.create = AsyncMock(return_value=FakeGroqStream(["Hola", None, " mundo."]))
+    with patch.object(llm_service_instance, 'client', mock_groq_client):
+        parts = await _collect(llm_service_instance.stream_response("Hola", "user_1"))
+    assert parts == ["Hola", " mundo."]
+    assert mock_groq_client.chat.completions.create.call_args[1]["stream"] is True
+
+async def test_stream_response_falls_back_on_error():
+    llm_service_instance = LLMService(api_key=settings.GROQ_API_KEY)
+    mock_groq_client = AsyncMock()
+    mock_groq_client.chat.completions.create = AsyncMock(side_effect=Exception("Groq API Error"))
+    with patch.object(llm_service_instance, 'client', mock_groq_client):
+        parts = await _collect(llm_service_instance.stream_response("Hola", "user_1"))
+    assert parts == [FALLBACK_REPLY]
+
+async def test_meta_service_sends_each_chunk():
+    service = MetaService(llm_service=AsyncMock(), outbound=AsyncMock())
+
+    async def fake_stream(text, user_id):
+        for part in ("Primera oración bastante larga. ", "Segunda oración también larga."):
+            yield part
+
+    with patch.object(service.llm_service, 'stream_response', fake_stream), \
+         patch.object(service, 'send_whatsapp_message', AsyncMock()) as mock_send, \
+         patch.object(settings, 'LLM_STREAM_MIN_CHUNK_CHARS', 10):
+        await service._stream_reply("1234567890", "Hola")
+
+    assert [c.args for c in mock_send.call_args_list] == [
+        ("1234567890", "Primera oración bastante larga."),
+        ("1234567890", "Segunda oración también larga."),
+    ]
+
+async def test_stream_releases_the_groq_slot_before_the_consumer_finishes():
+    llm_service_instance = LLMService(api_key=settings.GROQ_API_KEY, max_concurrency=1)
+    mock_groq_client = AsyncMock()
+    mock_groq_client.chat.completions.create = AsyncMock(return_value=FakeGroqStream(["Uno. ", "Dos. ", "Tres."]))
+    with patch.object(llm_service_instance, 'client', mock_groq_client):
+        stream = llm_service_instance.stream_response("Hola", "user_1")
+        assert await stream.__anext__() == "Uno. "
+        for _ in range(10): # El consumidor se demora (p. ej. enviando por WhatsApp) mientras Groq termina
+            await asyncio.sleep(0)
+        assert llm_service_instance.completions.limiter.active == 0
+        assert await _collect(stream) == ["Dos. ", "Tres."]
+
+async def test_closing_the_stream_early_cancels_the_groq_read():
+    llm_service_instance = LLMService(api_key=settings.GROQ_API_KEY, max_concurrency=1)
+    release = asyncio.Event()
+
+    async def endless():
+        yield _groq_chunk("Hola")
+        await release.wait()
+        yield _groq_chunk(" mundo.")
+
+    mock_groq_client = AsyncMock()
+    mock_groq_client.chat.completions.create = AsyncMock(return_value=endless())
+    with patch.object(llm_service_instance, 'client', mock_groq_client):
+        stream = llm_service_instance.stream_response("Hola", "user_1")
+        assert await stream.__anext__() == "Hola"
+        await stream.aclose()
+        await asyncio.sleep(0)
+        assert llm_service_instance.completions.limiter.active == 0
@@ -0,0 +1,146 @@
+import asyncio
+import json
+import os
+import pytest
+from unittest.mock import AsyncMock
+from app.core.config import settings
+from app.core.container import ServiceContainer
+from app.models.meta import MetaWebhookRequest
+from app.services.rag_interface import NoRAGService
+from app.services.tenants import DEFAULT_TENANT, TenantRegistry, parse_tenants, tenant_processing
+
+# Marcar todos los tests en este módulo como asyncio
+pytestmark = pytest.mark.asyncio
+
+TENANTS = [
+    {"id": "tienda", "phone_number_id": "1001", "access_token": "token-tienda", "webhook_workers": 1,
+     "queue_max_size": 1, "conversation_concurrency": 3, "system_prompt": "Eres el asistente de la tienda."},
+    {"id": "clinica", "phone_number_id": "1002", "access_token": "token-clinica", "model": "modelo-clinica"},
+]
+
+def _write_tenants(path, tenants, mtime):
+    path.write_text(json.dumps({"tenants": tenants}), encoding="utf-8")
+    os.utime(path, (mtime, mtime)) # mtime explícito: dos escrituras seguidas pueden compartir el mismo
+
+def _webhook(phone_number_id: str) -> MetaWebhookRequest:
+    return MetaWebhookRequest.model_validate({
+        "object": "whatsapp_business_account",
+        "entry": [{"id": "WABA_ID", "changes": [{"field": "messages", "value": {
+            "messaging_product": "whatsapp",
+            "metadata": {"phone_number_id": phone_number_id},
+            "messages": [{"from": "5691234", "id": f"wamid.{phone_number_id}", "timestamp": "1600000000",
+                          "text": {"body": "Hola"}, "type": "text"}],
+        }}]}],
+    })
+
+async def test_parse_tenants_validates_and_resolves_secrets_from_env(monkeypatch):
+    monkeypatch.setenv("TOKEN_TIENDA", "secreto")
+    (tenant,) = parse_tenants({"tenants": [{"id": "tienda", "phone_number_id": 1001, "access_token": "env:TOKEN_TIENDA"}]})
+    assert (tenant.tenant_id, tenant.phone_number_id, tenant.access_token) == ("tienda", "1001", "secreto")
+    assert "secreto" not in repr(tenant) # Las credenciales no aparecen en los logs
+
+    with pytest.raises(ValueError, match="repetido"):
+        parse_tenants({"tenants": [TENANTS[0], {**TENANTS[1], "phone_number_id": "1001"}]})
+    with pytest.raises(ValueError, match="reservado"):
+        parse_tenants({"tenants": [{**TENANTS[0], "id": DEFAULT_TENANT}]})
+    with pytest.raises(ValueError, match="desconocidos"):
+        parse_tenants({"tenants": [{**TENANTS[0], "max_conexiones": 5}]})
+    with pytest.raises(ValueError, match="no definida"):
+        parse_tenants({"tenants": [{**TENANTS[0], "access_token": "env:NO_EXISTE_TOKEN"}]})
+
+async def test_registry_is_hot_reloaded_and_invalid_files_keep_the_previous_tenants(tmp_path):
+    path = tmp_path / "tenants.json"
+    _write_tenants(path, TENANTS[:1], 1_000_000)
+    registry = TenantRegistry(path=str(path), reload_interval=0)
+    assert registry.get("1001").tenant_id == "tienda" and registry.get("1002") is None
+
+    _write_tenants(path, TENANTS, 1_000_010)
+    assert await registry.reload_if_changed()
+    assert registry.get("1002").model == "modelo-clinica"
+
+    path.write_text("{no es json", encoding="utf-8")
+    os.utime(path, (1_000_020, 1_000_020))
+    assert not await registry.reload_if_changed()
+    assert set(registry.by_phone) == {"1001", "1002"}
+    assert (registry.reloads, registry.reload_errors) == (1, 1)
+
+async def test_container_routes_each_number_to_its_own_services(tmp_path, monkeypatch):
+    path = tmp_path / "tenants.json"
+    _write_tenants(path, TENANTS, 1_000_000)
+    monkeypatch.setattr(settings, "TENANTS_FILE", str(path))
+    services = ServiceContainer(settings)
+
+    tienda, tienda_id = await services.dispatcher_for(_webhook("1001"))
+    clinica, clinica_id = await services.dispatcher_for(_webhook("1002"))
+    default, default_id = await services.dispatcher_for(_webhook(settings.WHATSAPP_PHONE_NUMBER_ID))
+    unknown, _ = await services.dispatcher_for(_webhook("9999"))
+    assert (tienda_id, clinica_id, default_id) == ("tienda", "clinica", DEFAULT_TENANT)
+    assert default is services.webhook_dispatcher and unknown is None
+    assert tienda is not clinica and tienda.max_size == 1 # Cola propia: el límite de un tenant no afecta a otros
+
+    runtimes = services.tenant_router.runtimes
+    meta_service = runtimes["1001"].meta_service
+    assert (meta_service.phone_number_id, meta_service.access_token) == ("1001", "token-tienda")
+    assert meta_service.scheduler.max_concurrency == 3
+    assert runtimes["1001"].http_client is not runtimes["1002"].http_client
+    assert runtimes["1002"].llm_service.model == "modelo-clinica"
+    assert (await services.dispatcher_for(_webhook("1001")))[0] is tienda # Se construye una vez por número
+
+    stats = services.tenant_router.stats()
+    assert (stats["configured"], stats["active"], stats["unknown_numbers"]) == (2, 2, 1)
+    await services.close()
+
+async def test_tenant_webhooks_are_processed_by_the_tenant_service_and_measured(tmp_path, monkeypatch):
+    path = tmp_path / "tenants.json"
+    _write_tenants(path, TENANTS, 1_000_000)
+    monkeypatch.setattr(settings, "TENANTS_FILE", str(path))
+    services = ServiceContainer(settings)
+    observed = tenant_processing.labels("clinica").count
+
+    dispatcher, _ = await services.dispatcher_for(_webhook("1002"))
+    process = AsyncMock(side_effect=lambda *args, **kwargs: asyncio.gather())
+    services.tenant_router.runtimes["1002"].meta_service.submit_webhook_message = process
+    assert dispatcher.submit(_webhook("1002"))
+    await dispatcher.join()
+
+    (payload,), _ = process.await_args
+    assert payload.entry[0].changes[0].value.metadata["phone_number_id"] == "1002"
+    assert tenant_processing.labels("clinica").count == observed + 1
+    await services.close()
+
+async def test_intents_are_per_tenant(tmp_path, monkeypatch):
+    shared = tmp_path / "intents.json"
+    shared.write_text(json.dumps({"intents": [{"name": "horario", "keywords": ["horario"], "response": "De 9 a 18."}]}), encoding="utf-8")
+    own = tmp_path / "intents.tienda.json"
+    own.write_text(json.dumps({"intents": [{"name": "horario", "keywords": ["horario"], "response": "De 10 a 20."}]}), encoding="utf-8")
+    path = tmp_path / "tenants.json"
+    _write_tenants(path, [{**TENANTS[0], "intents_file": str(own)}, TENANTS[1]], 1_000_000)
+    monkeypatch.setattr(settings, "INTENTS_FILE", str(shared))
+    monkeypatch.setattr(settings, "TENANTS_FILE", str(path))
+    services = ServiceContainer(settings)
+
+    await services.dispatcher_for(_webhook("1001"))
+    await services.dispatcher_for(_webhook("1002"))
+    runtimes = services.tenant_router.runtimes
+    assert await runtimes["1001"].meta_service.intents.route("¿horario?") == "De 10 a 20."
+    assert runtimes["1002"].meta_service.intents is None # Sin archivo propio: no usa las respuestas de otro negocio
+    assert await services.meta_service.intents.route("¿horario?") == "De 9 a 18."
+    await services.close()
+
+async def test_knowledge_base_is_per_tenant(tmp_path, monkeypatch):
+    path = tmp_path / "tenants.json"
+    _write_tenants(path, [{**TENANTS[0], "rag_index_dir": str(tmp_path / "rag-tienda")}, TENANTS[1]], 1_000_000)
+    monkeypatch.setattr(settings, "RAG_BACKEND", "local")
+    monkeypatch.setattr(settings, "RAG_INDEX_DIR", str(tmp_path / "rag"))
+    monkeypatch.setattr(settings, "TENANTS_FILE", str(path))
+    services = ServiceContainer(settings)
+
+    await services.dispatcher_for(_webhook("1001"))
+    await services.dispatcher_for(_webhook("1002"))
+    runtimes = services.tenant_router.runtimes
+    own = runtimes["1001"].llm_service.rag_service
+    assert own is not services.rag_service and own.index_dir == str(tmp_path / "rag-tienda")
+    await services.rag_service.add_document("Los despachos de la tienda principal demoran 48 horas.")
+    assert await own.search_knowledge_base("despachos") == []
+    assert isinstance(runtimes["1002"].llm_service.rag_service, NoRAGService) # Sin índice propio: no usa el de otro negocio
+    await services.close()
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+from app.services.embeddings import HashingEmbedder
+from app.services.vector_rag import LocalVectorRAGService
+from app.utils.text import chunk_text
+
+# Marcar todos los tests en este módulo como asyncio
+pytestmark = pytest.mark.asyncio
+
+KNOWLEDGE_BASE = [
+    ("Nuestro horario de atención es de lunes a viernes de 9 a 18 horas.", {"id": "horario"}),
+    ("El plan básico cuesta 10 mil pesos al mes y el plan premium 25 mil pesos.", {"id": "precios"}),
+    ("La oficina está en Avenida Providencia 1234, Santiago.", {"id": "direccion"}),
+]
+
+def _service(**kwargs) -> LocalVectorRAGService:
+    return LocalVectorRAGService(embedder=HashingEmbedder(dimensions=128), **kwargs)
+
+async def test_chunk_text_respects_size_and_overlap():
+    text = " ".join(f"Oración número {i} del documento." for i in range(40))
+    chunks = chunk_text(text, max_chars=120, overlap_chars=30)
+    assert len(chunks) > 1
+    assert all(len(chunk) <= 120 for chunk in chunks)
+    assert chunk_text("corto") == ["corto"]
+    assert chunk_text("   ") == []
+
+async def test_search_returns_most_similar_chunks():
+    service = _service()
+    await service.add_documents(KNOWLEDGE_BASE)
+
+    results = await service.search_knowledge_base("¿cuál es el horario de atención?", top_k=2)
+    assert len(results) == 2
+    assert results[0]["id"] == "horario:0"
+    assert results[0]["score"] >= results[1]["score"]
+    assert "9 a 18" in results[0]["payload"]["text"]
+
+async def test_matrix_is_normalized_float32_and_batched():
+    service = _service(batch_size=2, chunk_size=60)
+    chunk_ids = await service.add_documents(KNOWLEDGE_BASE)
+    assert len(service) == len(chunk_ids) > len(KNOWLEDGE_BASE)
+    assert service.matrix.dtype == np.float32
+    assert np.allclose(np.linalg.norm(service.matrix, axis=1), 1.0, atol=1e-5)
+
+async def test_saved_index_is_memory_mapped(tmp_path):
+    service = _service(index_dir=str(tmp_path))
+    await service.add_documents(KNOWLEDGE_BASE)
+    service.save()
+
+    reloaded = _service(index_dir=str(tmp_path))
+    assert isinstance(reloaded._buffer, np.memmap)
+    assert len(reloaded) == len(service)
+    results = await reloaded.search_knowledge_base("precio del plan premium", top_k=1)
+    assert results[0]["id"] == "precios:0"
+
+    # Añadir a un índice mapeado lo copia a memoria sin perder lo existente
+    await reloaded.add_document("Aceptamos pagos con tarjeta.", {"id": "pagos"})
+    assert len(reloaded) == len(service) + 1
+    assert (await reloaded.search_knowledge_base("pagos con tarjeta", top_k=1))[0]["id"] == "pagos:0"
+
+async def test_empty_index_returns_no_results():
+    assert await _service().search_knowledge_base("hola") == []
@@ -0,0 +1,84 @@
+import asyncio
+import pytest
+from app.services.webhook_dispatcher import WebhookDispatcher
+
+# Marcar todos los tests en este módulo como asyncio
+pytestmark = pytest.mark.asyncio
+
+async def test_payloads_are_processed_by_workers():
+    processed = []
+
+    async def handler(payload):
+        processed.append(payload)
+
+    dispatcher = WebhookDispatcher(handler=handler, workers=2, max_size=10)
+    await dispatcher.start()
+    for i in range(5):
+        assert dispatcher.submit({"n": i})
+    await dispatcher.join()
+
+    assert sorted(p["n"] for p in processed) == [0, 1, 2, 3, 4]
+    stats = dispatcher.stats()
+    assert stats["enqueued"] == 5 and stats["processed"] == 5 and stats["depth"] == 0
+    await dispatcher.stop()
+
+async def test_reject_policy_when_full():
+    release = asyncio.Event()
+
+    async def handler(payload):
+        await release.wait()
+
+    dispatcher = WebhookDispatcher(handler=handler, workers=1, max_size=1, overflow_policy="reject")
+    await dispatcher.start()
+    assert dispatcher.submit("a")
+    await asyncio.sleep(0) # El worker toma "a" y queda bloqueado
+    assert dispatcher.submit("b")
+    assert not dispatcher.submit("c")
+    assert dispatcher.stats()["rejected"] == 1
+
+    release.set()
+    await dispatcher.stop()
+    assert dispatcher.processed == 2
+
+async def test_drop_oldest_policy_when_full():
+    release = asyncio.Event()
+    processed = []
+
+    async def handler(payload):
+        await release.wait()
+        processed.append(payload)
+
+    dropped = []
+    dispatcher = WebhookDispatcher(handler=handler, workers=1, max_size=1, overflow_policy="drop_oldest", on_drop=dropped.append)
+    await dispatcher.start()
+    dispatcher.submit("a")
+    await asyncio.sleep(0)
+    dispatcher.submit("b")
+    assert dispatcher.submit("c") # "b" se descarta en favor de "c"
+
+    release.set()
+    await dispatcher.stop()
+    assert processed == ["a", "c"]
+    assert dropped == ["b"]
+    assert dispatcher.stats()["dropped"] == 1
+
+async def test_stop_drains_queue_and_survives_handler_errors():
+    async def handler(payload):
+        if payload == "boom":
+            raise RuntimeError("fallo")
+        await asyncio.sleep(0.01)
+
+    dispatcher = WebhookDispatcher(handler=handler, workers=1, max_size=10)
+    await dispatcher.start()
+    for payload in ["x", "boom", "y"]:
+        dispatcher.submit(payload)
+    await dispatcher.stop()
+
+    stats = dispatcher.stats()
+    assert stats["processed"] == 2 and stats["failed"] == 1
+    assert stats["wait_max_seconds"] > 0
+    assert not dispatcher.running
+
+async def test_invalid_overflow_policy():
+    with pytest.raises(ValueError):
+        WebhookDispatcher(handler=None, overflow_policy="block")